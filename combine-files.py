@@ -111,8 +111,19 @@ def checkAllFilesUsed(directory: Path):
 
 # append all the individual files in the right order
 addFilteredFile(scriptDir / "colour.py")
+addFilteredFile(scriptDir / "timing.py")
 addFilteredFile(scriptDir / "utils.py")
+addFilteredFile(scriptDir / "jobsizing.py")
+addFilteredFile(scriptDir / "compilationdb.py")
+addFilteredFile(scriptDir / "compilercache.py")
 addFilteredFile(scriptDir / "mtree.py")
+addFilteredFile(scriptDir / "dockercontainer.py")
+addFilteredFile(scriptDir / "remoteworker.py")
+addFilteredFile(scriptDir / "qemuinstances.py")
+addFilteredFile(scriptDir / "hostshares.py")
+addFilteredFile(scriptDir / "statcounters.py")
+addFilteredFile(scriptDir / "testselection.py")
+addFilteredFile(scriptDir / "opamswitchcache.py")
 addFilteredFile(scriptDir / "config/loader.py")
 addFilteredFile(scriptDir / "config/chericonfig.py")
 addFilteredFile(scriptDir / "config/defaultconfig.py")
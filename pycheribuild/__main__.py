@@ -43,6 +43,11 @@ from .config.defaultconfig import DefaultCheriConfig, CheribuildAction
 from .utils import *
 from .utils import have_working_internet_connection
 from .targets import targetManager
+from .compilercache import get_compiler_cache
+from .timing import build_timeline
+from .dockercontainer import PersistentDockerContainer, DockerError, default_persistent_container_name
+from .filesystemutils import background_deleter
+from .remoteworker import REMOTE_WORKER_COMMANDS, remote_worker_main
 from .projects.project import SimpleProject
 # noinspection PyUnresolvedReferences
 from .projects import *  # make sure all projects are loaded so that targetManager gets populated
@@ -148,7 +153,8 @@ def real_main():
         # we can't pass all args
         filtered_cheribuild_args = ["--source-root", "/source", "--build-root", "/build", "--output-root", "/output"]
         skip_next = False
-        blacklisted = ("--source-root", "--build-root", "--output-root", "--docker-container")
+        blacklisted = ("--source-root", "--build-root", "--output-root", "--docker-container",
+                       "--docker-persistent-name")
         for arg in sys.argv[1:]:
             if skip_next:
                 skip_next = False
@@ -158,7 +164,7 @@ def real_main():
                 continue
             if any(arg.startswith(s + "=") for s in blacklisted):
                 continue
-            if arg == "--docker" or arg == "--docker-reuse-container":
+            if arg in ("--docker", "--docker-reuse-container", "--docker-persistent", "--no-docker-persistent"):
                 continue
             filtered_cheribuild_args.append(arg)
         try:
@@ -171,7 +177,22 @@ def real_main():
                 "-v", str(cheriConfig.outputRoot.absolute()) + ":/output",
             ]
             cheribuild_args = ["/cheribuild/cheribuild.py", "--skip-update"] + filtered_cheribuild_args
-            if cheriConfig.docker_reuse_container:
+            if cheriConfig.docker_persistent:
+                container = PersistentDockerContainer(cheriConfig.docker_container,
+                    cheriConfig.docker_persistent_name or default_persistent_container_name(
+                        cheriConfig.docker_container),
+                    mounts=[(cheribuild_dir, "/cheribuild", True),
+                            (str(cheriConfig.sourceRoot.absolute()), "/source", True),
+                            (str(cheriConfig.buildRoot.absolute()), "/build", False),
+                            (str(cheriConfig.outputRoot.absolute()), "/output", False)])
+                try:
+                    sys.exit(container.run(cheribuild_args))
+                except DockerError as e:
+                    statusUpdate("In order to build the default docker image for cheribuild (cheribuild-test) run:")
+                    print(coloured(AnsiColour.blue, "cd", cheribuild_dir + "/docker && docker build --tag cheribuild-test ."))
+                    fatalError("Failed to start persistent docker container:", e)
+                    sys.exit(1)
+            elif cheriConfig.docker_reuse_container:
                 # Use docker restart + docker exec instead of docker run
                 # FIXME: docker restart doesn't work for some reason
                 stop_cmd = ["docker", "stop", cheriConfig.docker_container]
@@ -216,16 +237,33 @@ def real_main():
     if CheribuildAction.PRINT_CHOSEN_TARGETS in cheriConfig.action:
         for target in targetManager.get_all_chosen_targets(cheriConfig):
             print("Would run", target)
-    if CheribuildAction.BUILD in cheriConfig.action:
-        targetManager.run(cheriConfig)
-    if CheribuildAction.TEST in cheriConfig.action:
-        for target in targetManager.get_all_chosen_targets(cheriConfig):
-            target.run_tests(cheriConfig)
-    if CheribuildAction.BENCHMARK in cheriConfig.action:
-        for target in targetManager.get_all_chosen_targets(cheriConfig):
-            target.run_benchmarks(cheriConfig)
+    build_timeline.enabled = bool(cheriConfig.timing_trace or cheriConfig.timing_summary)
+    if cheriConfig.background_delete and not cheriConfig.pretend and CheribuildAction.BUILD in cheriConfig.action:
+        # Continue deleting directories that were moved to the trash by a previous (interrupted) run
+        background_deleter.resume(cheriConfig)
+    try:
+        if CheribuildAction.BUILD in cheriConfig.action:
+            targetManager.run(cheriConfig)
+        if CheribuildAction.TEST in cheriConfig.action:
+            for target in targetManager.get_all_chosen_targets(cheriConfig):
+                target.run_tests(cheriConfig)
+        if CheribuildAction.BENCHMARK in cheriConfig.action:
+            for target in targetManager.get_all_chosen_targets(cheriConfig):
+                target.run_benchmarks(cheriConfig)
+    finally:
+        compiler_cache = get_compiler_cache(cheriConfig)
+        if compiler_cache and not cheriConfig.pretend and CheribuildAction.BUILD in cheriConfig.action:
+            print(compiler_cache.summary())
+        # Also write the timings if the build failed since it can be useful to see how far it got
+        if build_timeline.enabled:
+            print(build_timeline.summary_table())
+            if cheriConfig.timing_trace:
+                statusUpdate("Writing build timeline to", cheriConfig.timing_trace)
+                build_timeline.write_chrome_trace(cheriConfig.timing_trace)
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in REMOTE_WORKER_COMMANDS:
+        sys.exit(remote_worker_main(sys.argv[1:], run_main=main))
     try:
         real_main()
     except KeyboardInterrupt:
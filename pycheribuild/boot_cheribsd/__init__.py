@@ -38,17 +38,24 @@ import atexit
 import datetime
 import os
 import pexpect
+import queue
+import re
+import selectors
 import shlex
 import shutil
 import socket
 import subprocess
 import sys
+import threading
 import time
 import tempfile
 import traceback
 import typing
+from collections import namedtuple
 from pathlib import Path
 from ..utils import find_free_port
+from ..hostshares import (HostShare, HostShareBackend, HostShareDaemonError, AUTO_SHARE_BACKEND_ORDER, SHARE_BACKENDS,
+                          get_share_backend, share_qemu_args)
 
 STARTING_INIT = "start_init: trying /sbin/init"
 BOOT_FAILURE = "Enter full pathname of shell or RETURN for /bin/sh"
@@ -81,20 +88,9 @@ class CheriBSDCommandTimeout(CheriBSDCommandFailed):
 class CheriBSDMatchedErrorOutput(CheriBSDCommandFailed):
     pass
 
-class SmbMount(object):
-    def __init__(self, hostdir: str, readonly: bool, in_target: str):
-        self.readonly = readonly
-        self.hostdir = str(Path(hostdir).absolute())
-        self.in_target = in_target
-
-    @property
-    def qemu_arg(self):
-        if self.readonly:
-            return self.hostdir + "@ro"
-        return self.hostdir
-
-    def __repr__(self):
-        return "<{} ({}) -> {}>".format(self.hostdir, "ro" if self.readonly else "rw", self.in_target)
+class SmbMount(HostShare):
+    # Kept under the old name since this was the only way of sharing directories before 9p/virtio-fs support
+    pass
 
 
 def parse_smb_mount(arg: str):
@@ -111,6 +107,8 @@ def parse_smb_mount(arg: str):
 class CheriBSDInstance(pexpect.spawn):
     EXIT_ON_KERNEL_PANIC = True
     smb_dirs = None  # type: typing.List[SmbMount]
+    share_backends = None  # type: typing.List[HostShareBackend]
+    share_probe_dir = None  # type: typing.Optional[str]
 
     def expect(self, pattern: list, timeout=-1, pretend_result=None, **kwargs):
         assert isinstance(pattern, list), "expected list and not " + str(pattern)
@@ -413,6 +411,115 @@ class FakeSpawn(object):
         checked_run_cheribsd_command(self, cmd, **kwargs)
 
 
+ConsoleEvent = namedtuple("ConsoleEvent", ["kind", "console", "text"])
+# All signatures are checked with a single regex on complete lines
+_CONSOLE_EVENT_REGEX = re.compile("(?P<panic>KDB: enter:|" + PANIC + "|" + STOPPED + ")|(?P<trap>" + CHERI_TRAP + ")")
+
+
+class ConsoleMonitor(object):
+    """
+    Watches the consoles of one or more QEMU instances from a single thread (instead of one polling thread per
+    instance) and reports kernel panics, CHERI traps and QEMU exiting as ConsoleEvent objects.
+
+    While a console is being monitored its output is consumed by the monitor so the test driver must not call
+    expect() on it until the monitor has been stopped.
+    """
+    PANIC = "panic"
+    TRAP = "trap"
+    EOF = "eof"
+    _MAX_PARTIAL_LINE = 4096
+
+    def __init__(self, *, flush_interval: float = 5, on_event: "typing.Callable[[ConsoleEvent], None]" = None):
+        self.flush_interval = flush_interval
+        self.on_event = on_event
+        self.events = queue.Queue()  # type: queue.Queue[ConsoleEvent]
+        self._selector = selectors.DefaultSelector()
+        self._partial_lines = dict()  # type: typing.Dict[str, str]
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ, None)
+        self._consoles = dict()
+        self._stopping = False
+        self._thread = None  # type: typing.Optional[threading.Thread]
+
+    def add(self, name: str, console: pexpect.spawn):
+        if PRETEND or not hasattr(console, "fileno"):
+            return  # FakeSpawn doesn't produce any output
+        self._consoles[name] = console
+        self._partial_lines[name] = ""
+        self._selector.register(console.fileno(), selectors.EVENT_READ, name)
+
+    def start(self) -> "ConsoleMonitor":
+        self._thread = threading.Thread(target=self._run, name="console-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 30) -> bool:
+        self._stopping = True
+        os.write(self._wakeup_write, b"x")
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                return False
+        self._selector.close()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+        return True
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _emit(self, kind: str, name: str, text: str):
+        event = ConsoleEvent(kind, name, text)
+        self.events.put(event)
+        if self.on_event:
+            self.on_event(event)
+
+    def _remove(self, name: str):
+        self._selector.unregister(self._consoles[name].fileno())
+        del self._consoles[name]
+
+    def scan(self, name: str, chunk: str):
+        data = self._partial_lines[name] + chunk
+        end = data.rfind("\n") + 1
+        # Only scan complete lines so that a signature split across two reads is still found
+        for match in _CONSOLE_EVENT_REGEX.finditer(data, 0, end):
+            self._emit(self.PANIC if match.group("panic") else self.TRAP, name, match.group(0))
+        self._partial_lines[name] = data[end:][-self._MAX_PARTIAL_LINE:]
+
+    def _flush_logs(self):
+        for console in self._consoles.values():
+            for f in (console.logfile, console.logfile_read):
+                if f is not None:
+                    f.flush()
+
+    def _run(self):
+        last_flush = time.time()
+        while not self._stopping and self._consoles:
+            for key, _ in self._selector.select(timeout=self.flush_interval):
+                name = key.data
+                if name is None or name not in self._consoles:
+                    continue  # wakeup pipe
+                try:
+                    # read_nonblocking() also writes the output to the pexpect logfiles
+                    chunk = self._consoles[name].read_nonblocking(size=65536, timeout=0)
+                except pexpect.TIMEOUT:
+                    continue
+                except pexpect.EOF:
+                    self.scan(name, "\n")
+                    self._remove(name)
+                    self._emit(self.EOF, name, "")
+                    continue
+                self.scan(name, chunk)
+            # The logfiles are buffered and only flushed periodically
+            if time.time() - last_flush >= self.flush_interval:
+                self._flush_logs()
+                last_flush = time.time()
+        self._flush_logs()
+
+
 def start_dhclient(qemu: CheriBSDInstance):
     success("===> Setting up QEMU networking")
     qemu.sendline("ifconfig le0 up && dhclient le0")
@@ -427,22 +534,72 @@ def start_dhclient(qemu: CheriBSDInstance):
     qemu.expect_exact(PROMPT_SH, timeout=30)
 
 
+def select_share_backends(qemu_cmd: str, share_backend: str, machine: str) -> "typing.List[HostShareBackend]":
+    """Returns the share backends that should be configured for QEMU (all usable ones if share_backend is auto)"""
+    if share_backend != "auto":
+        backend = get_share_backend(share_backend)
+        if not PRETEND and not backend.is_available(qemu_cmd, machine):
+            failure("Share backend ", share_backend, " cannot be used with ", qemu_cmd, " -M ", machine, exit=True)
+        return [backend]
+    if PRETEND:
+        return [get_share_backend("smb")]
+    return [get_share_backend(name) for name in AUTO_SHARE_BACKEND_ORDER
+            if get_share_backend(name).is_available(qemu_cmd, machine)]
+
+
+def _create_share_probe_dir(size_mb=16) -> str:
+    # A directory with a test file that is used to compare the throughput of the available share backends
+    probe_dir = tempfile.mkdtemp(prefix="cheribuild-share-probe-")
+    with open(os.path.join(probe_dir, "probe.bin"), "wb") as f:
+        f.write(os.urandom(size_mb * 1024 * 1024))
+    atexit.register(shutil.rmtree, probe_dir, ignore_errors=True)
+    return probe_dir
+
+
 def boot_cheribsd(qemu_cmd: str, kernel_image: str, disk_image: str, ssh_port: typing.Optional[int], *, smb_dirs: typing.List[SmbMount]=None,
-                  kernel_init_only=False, trap_on_unrepresentable=False, skip_ssh_setup=False) -> CheriBSDInstance:
+                  kernel_init_only=False, trap_on_unrepresentable=False, skip_ssh_setup=False,
+                  share_backend="smb") -> CheriBSDInstance:
     user_network_args = "user,id=net0,ipv6=off"
+    machine = "malta"
     if smb_dirs is None:
         smb_dirs = []
+    share_backends = []
+    share_args = []
+    share_probe_dir = None
     if smb_dirs:
         for d in smb_dirs:
             if not Path(d.hostdir).exists():
-                failure("SMB share directory ", d.hostdir, " doesn't exist!")
-        user_network_args += ",smb=" + ":".join(d.qemu_arg for d in smb_dirs)
+                failure("Shared directory ", d.hostdir, " doesn't exist!")
+        share_backends = select_share_backends(qemu_cmd, share_backend, machine)
+        exported = list(smb_dirs)
+        if len(share_backends) > 1:
+            share_probe_dir = _create_share_probe_dir()
+            # Added last so that the indices (and therefore the SMB share names) of the real shares don't change
+            exported.append(HostShare(share_probe_dir, readonly=True, in_target="/tmp/.share-probe"))
+        runtime_dir = Path(tempfile.mkdtemp(prefix="cheribuild-shares-"))
+        atexit.register(shutil.rmtree, str(runtime_dir), ignore_errors=True)
+        for backend in list(share_backends):
+            if PRETEND:
+                continue
+            try:
+                daemons = backend.start_host_daemons(exported, runtime_dir)
+            except (OSError, HostShareDaemonError) as e:
+                if share_backend != "auto" or len(share_backends) == 1:
+                    failure("Could not start host processes for share backend ", backend, ": ", e, exit=True)
+                failure("Not using share backend ", backend, ": ", e, exit=False)
+                share_backends.remove(backend)
+                continue
+            for daemon in daemons:
+                atexit.register(daemon.kill)
+        network_options, share_args = share_qemu_args(share_backends, exported, memory_size="2048M",
+                                                      runtime_dir=runtime_dir)
+        user_network_args += network_options
     if ssh_port is not None:
         user_network_args += ",hostfwd=tcp::" + str(ssh_port) + "-:22"
-    qemu_args = ["-M", "malta", "-kernel", kernel_image, "-m", "2048", "-nographic",
+    qemu_args = ["-M", machine, "-kernel", kernel_image, "-m", "2048", "-nographic",
                  "-device", "virtio-rng-pci",  # faster entropy gathering
                  #  ssh forwarding:
-                 "-net", "nic", "-net", user_network_args]
+                 "-net", "nic", "-net", user_network_args] + share_args
     if trap_on_unrepresentable:
         qemu_args.append("-cheri-c2e-on-unrepresentable")  # trap on unrepresetable instead of detagging
     if skip_ssh_setup:
@@ -462,6 +619,8 @@ def boot_cheribsd(qemu_cmd: str, kernel_image: str, disk_image: str, ssh_port: t
         child = CheriBSDInstance(qemu_cmd, qemu_args, encoding="utf-8", echo=False, timeout=60)
     # child.logfile=sys.stdout.buffer
     child.smb_dirs = smb_dirs
+    child.share_backends = share_backends
+    child.share_probe_dir = share_probe_dir
     if QEMU_LOGFILE:
         child.logfile = QEMU_LOGFILE.open("w")
     else:
@@ -529,6 +688,54 @@ def boot_cheribsd(qemu_cmd: str, kernel_image: str, disk_image: str, ssh_port: t
     return child
 
 
+def probe_share_backend(qemu: CheriBSDInstance, backend: HostShareBackend) -> typing.Optional[float]:
+    """Returns the time it took to read the probe file using :param backend: or None if it could not be mounted"""
+    probe_index = len(qemu.smb_dirs)
+    probe_share = HostShare(qemu.share_probe_dir, readonly=True, in_target="/tmp/.share-probe-" + backend.name)
+    mount_command = backend.guest_mount_command(probe_index, probe_share)
+    starttime = datetime.datetime.now()
+    try:
+        checked_run_cheribsd_command(qemu, "mkdir -p '{dir}' && {mount} && dd if='{dir}/probe.bin' of=/dev/null bs=1m"
+                                     .format(dir=probe_share.in_target, mount=mount_command), timeout=120)
+    except CheriBSDCommandFailed as e:
+        info("Share backend ", backend.name, " does not work: ", str(e))
+        return None
+    runtime = (datetime.datetime.now() - starttime).total_seconds()
+    run_cheribsd_command(qemu, "umount '{}'".format(probe_share.in_target))
+    info("Share backend ", backend.name, " took ", runtime, "s to read the probe file")
+    return runtime
+
+
+def mount_host_shares(qemu: CheriBSDInstance):
+    if not qemu.smb_dirs:
+        return
+    backend = qemu.share_backends[0]
+    if len(qemu.share_backends) > 1 and not PRETEND:
+        timings = [(probe_share_backend(qemu, b), b) for b in qemu.share_backends]
+        working = [(t, b) for t, b in timings if t is not None]
+        if working:
+            backend = min(working, key=lambda x: x[0])[1]
+        else:
+            backend = get_share_backend("smb")
+    success("===> Mounting shared directories using ", backend.name)
+    for index, d in enumerate(qemu.smb_dirs):
+        run_cheribsd_command(qemu, "mkdir -p '{}'".format(d.in_target))
+        mount_command = backend.guest_mount_command(index, d)
+        if backend.name != "smb":
+            checked_run_cheribsd_command(qemu, mount_command, pretend_result=0)
+            continue
+        try:
+            checked_run_cheribsd_command(qemu, mount_command, error_output="unable to open connection: syserr = Operation timed out", pretend_result=0)
+        except CheriBSDMatchedErrorOutput:
+            failure("QEMU SMBD timed out while mounting ", d.in_target, ". Trying one more time.", exit=False)
+            info("Waiting for 5 seconds before retrying mount_smbfs...")
+            if not PRETEND:
+                time.sleep(5) # wait 5 seconds, hopefully the server is less busy then.
+            # If the smbfs connection timed out try once more. This can happen when multiple libc++ test jobs are running
+            # on the same jenkins slaves so one of them might time out
+            checked_run_cheribsd_command(qemu, mount_command)
+
+
 def runtests(qemu: CheriBSDInstance, args: argparse.Namespace, test_archives: list, test_ld_preload_files: list,
              test_setup_function: "typing.Callable[[CheriBSDInstance, argparse.Namespace], None]" = None,
              test_function: "typing.Callable[[CheriBSDInstance, argparse.Namespace], bool]" = None) -> bool:
@@ -586,19 +793,7 @@ def runtests(qemu: CheriBSDInstance, args: argparse.Namespace, test_archives: li
             do_scp(str(lib), "/tmp/preload/" + lib.name)
             ld_preload_target_paths.append(str(Path("/tmp/preload", lib.name)))
 
-    for index, d in enumerate(smb_dirs):
-        run_cheribsd_command(qemu, "mkdir -p '{}'".format(d.in_target))
-        mount_command = "mount_smbfs -I 10.0.2.4 -N //10.0.2.4/qemu{} '{}'".format(index + 1, d.in_target)
-        try:
-            checked_run_cheribsd_command(qemu, mount_command, error_output="unable to open connection: syserr = Operation timed out", pretend_result=0)
-        except CheriBSDMatchedErrorOutput:
-            failure("QEMU SMBD timed out while mounting ", d.in_target, ". Trying one more time.", exit=False)
-            info("Waiting for 5 seconds before retrying mount_smbfs...")
-            if not PRETEND:
-                time.sleep(5) # wait 5 seconds, hopefully the server is less busy then.
-            # If the smbfs connection timed out try once more. This can happen when multiple libc++ test jobs are running
-            # on the same jenkins slaves so one of them might time out
-            checked_run_cheribsd_command(qemu, mount_command)
+    mount_host_shares(qemu)
 
     if test_archives:
         time.sleep(5)  # wait 5 seconds to make sure the disks have synced
@@ -694,6 +889,10 @@ def get_argument_parser() -> argparse.ArgumentParser:
                              "'<HOST_PATH>:<EXPECTED_PATH_IN_TARGET>'. Appending '@ro' to HOST_PATH will cause the directory "
                              "to be mapped as a read-only smb share", action="append",
                         dest="smb_mount_directories", type=parse_smb_mount, default=[])
+    parser.add_argument("--share-backend", choices=["auto"] + sorted(SHARE_BACKENDS.keys()), default="smb",
+                        help="How to share the --smb-mount-directory directories with the guest. 'auto' configures "
+                             "all backends supported by the QEMU binary and host and uses the fastest one that can be "
+                             "mounted in the guest. virtio-fs is only used for machine types with NUMA support.")
     parser.add_argument("--test-archive", "-t", action="append", nargs=1)
     parser.add_argument("--test-command", "-c")
     parser.add_argument('--test-ld-preload', action="append", nargs=1, metavar='LIB',
@@ -832,7 +1031,7 @@ def main(test_function:"typing.Callable[[CheriBSDInstance, argparse.Namespace],
     boot_starttime = datetime.datetime.now()
     qemu = boot_cheribsd(args.qemu_cmd, kernel, diskimg, args.ssh_port, smb_dirs=args.smb_mount_directories,
                          kernel_init_only=args.test_kernel_init_only, trap_on_unrepresentable=args.trap_on_unrepresentable,
-                         skip_ssh_setup=args.skip_ssh_setup)
+                         skip_ssh_setup=args.skip_ssh_setup, share_backend=args.share_backend)
     success("Booting CheriBSD took: ", datetime.datetime.now() - boot_starttime)
 
     tests_okay = True
@@ -0,0 +1,97 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    import typing
+except ImportError:
+    typing = {}
+
+
+def _compdb_entry_key(entry: dict) -> str:
+    # Entries are keyed by the output file (the same source can be compiled multiple times with different flags).
+    # Old entries (e.g. written by bear) may not have an output entry so fall back to the source file
+    directory = entry.get("directory", "")
+    return os.path.normpath(os.path.join(directory, entry.get("output") or entry.get("file", "")))
+
+
+def load_compilation_db(path: Path) -> "typing.List[dict]":
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return []
+    except ValueError as e:
+        # A broken database will be recreated from the next build
+        print("Ignoring invalid compilation database", path, "-", e)
+        return []
+    return entries if isinstance(entries, list) else []
+
+
+def write_compilation_db(path: Path, entries: "typing.Iterable[dict]"):
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(list(entries), f, indent=1)
+    os.replace(str(tmp), str(path))  # atomic so that IDEs never see a partially written file
+
+
+def merge_compilation_db_fragments(db_path: Path, fragments_dir: Path) -> "typing.Tuple[int, int]":
+    """
+    Merge the JSON fragments written by files/compdb-wrapper.py into db_path. Entries for the same output file are
+    replaced, all others are kept so that an incremental build only updates the files that were recompiled.
+    The fragments are deleted afterwards.
+    :return: a tuple of (number of updated entries, total number of entries)
+    """
+    fragments = []
+    if fragments_dir.is_dir():
+        fragments = [p for p in fragments_dir.iterdir() if p.suffix == ".json"]
+    if not fragments and db_path.exists():
+        return 0, len(load_compilation_db(db_path))
+    merged = OrderedDict((_compdb_entry_key(e), e) for e in load_compilation_db(db_path))
+    updated = set()
+    # process them in the order that they were written so that the last invocation wins
+    for fragment in sorted(fragments, key=lambda p: (p.stat().st_mtime_ns, p.name)):
+        try:
+            with fragment.open("r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except ValueError:
+            entries = []
+        for entry in entries:
+            key = _compdb_entry_key(entry)
+            merged.pop(key, None)  # move updated entries to the end
+            merged[key] = entry
+            updated.add(key)
+    write_compilation_db(db_path, merged.values())
+    for fragment in fragments:
+        fragment.unlink()
+    return len(updated), len(merged)
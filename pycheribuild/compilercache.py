@@ -0,0 +1,197 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+from .utils import *
+
+CompilerCacheStats = namedtuple("CompilerCacheStats", ["hits", "misses"])
+
+
+class CompilerCache(object):
+    """
+    A compiler launcher (ccache or sccache) that is injected into CMake, autotools, QEMU and FreeBSD make builds.
+    The cache is keyed on the content of the compiler binary so that a rebuilt but identical CHERI clang still hits.
+    """
+
+    def __init__(self, kind: str, path: Path, cache_dir: "typing.Optional[Path]" = None,
+                 base_dir: "typing.Optional[Path]" = None):
+        assert kind in ("ccache", "sccache"), kind
+        self.kind = kind
+        self.path = path
+        self.cache_dir = cache_dir
+        self.base_dir = base_dir
+        self.per_target_stats = OrderedDict()  # type: typing.Dict[str, CompilerCacheStats]
+
+    @property
+    def launcher(self) -> "typing.List[str]":
+        return [str(self.path)]
+
+    def environment(self) -> "typing.Dict[str, str]":
+        env = dict()
+        if self.kind == "ccache":
+            # The default (mtime) would cause a full rebuild every time clang is rebuilt
+            env["CCACHE_COMPILERCHECK"] = "content"
+            if self.cache_dir:
+                env["CCACHE_DIR"] = str(self.cache_dir)
+            if self.base_dir:
+                # rewrite absolute paths so that builds in a fresh workspace can use the cached results
+                env["CCACHE_BASEDIR"] = str(self.base_dir)
+        elif self.cache_dir:
+            # sccache always hashes the compiler binary
+            env["SCCACHE_DIR"] = str(self.cache_dir)
+        return env
+
+    def _run_stats_command(self, args: "typing.List[str]") -> "typing.Optional[str]":
+        env = os.environ.copy()
+        env.update(self.environment())
+        try:
+            return subprocess.run([str(self.path)] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  env=env, check=True).stdout.decode("utf-8", errors="replace")
+        except (subprocess.CalledProcessError, OSError):
+            return None
+
+    def stats(self) -> "typing.Optional[CompilerCacheStats]":
+        if self.kind == "sccache":
+            output = self._run_stats_command(["--show-stats", "--stats-format=json"])
+            return parse_sccache_stats(output) if output else None
+        output = self._run_stats_command(["--print-stats"])  # machine-readable output (ccache >= 3.7)
+        if output:
+            return parse_ccache_print_stats(output)
+        output = self._run_stats_command(["--show-stats"])
+        return parse_ccache_show_stats(output) if output else None
+
+    @contextlib.contextmanager
+    def record_target(self, name: str):
+        before = self.stats()
+        try:
+            yield
+        finally:
+            after = self.stats()
+            if before is not None and after is not None:
+                old = self.per_target_stats.get(name, CompilerCacheStats(0, 0))
+                self.per_target_stats[name] = CompilerCacheStats(old.hits + after.hits - before.hits,
+                                                                 old.misses + after.misses - before.misses)
+
+    def summary(self) -> str:
+        if not self.per_target_stats:
+            return "No " + self.kind + " statistics were recorded."
+        lines = [self.kind + " hit rates:"]
+        width = max(len(name) for name in self.per_target_stats)
+        for name, stats in self.per_target_stats.items():
+            total = stats.hits + stats.misses
+            rate = "%5.1f%%" % (100.0 * stats.hits / total) if total else "     -"
+            lines.append("  " + name.ljust(width) + "  " + rate + "  (%d hits, %d misses)" % stats)
+        return "\n".join(lines)
+
+
+def _sum_counts(value) -> int:
+    # sccache reports counters either as plain integers or as {"counts": {"C/C++": N, ...}}
+    if isinstance(value, dict):
+        return sum(value.get("counts", {}).values())
+    return int(value or 0)
+
+
+def parse_sccache_stats(output: str) -> "typing.Optional[CompilerCacheStats]":
+    try:
+        stats = json.loads(output)["stats"]
+        return CompilerCacheStats(_sum_counts(stats.get("cache_hits")), _sum_counts(stats.get("cache_misses")))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def parse_ccache_print_stats(output: str) -> "typing.Optional[CompilerCacheStats]":
+    values = dict()
+    for line in output.splitlines():
+        parts = line.split("\t")
+        if len(parts) == 2 and parts[1].strip().isdigit():
+            values[parts[0].strip()] = int(parts[1])
+    if not values:
+        return None
+    hits = values.get("direct_cache_hit", 0) + values.get("preprocessed_cache_hit", 0)
+    misses = values.get("cache_miss", 0)
+    return CompilerCacheStats(hits, misses)
+
+
+def parse_ccache_show_stats(output: str) -> "typing.Optional[CompilerCacheStats]":
+    # Fallback for old ccache versions that don't support --print-stats
+    hits = 0
+    misses = None
+    for line in output.splitlines():
+        words = line.split()
+        if not words or not words[-1].isdigit():
+            continue
+        if line.startswith("cache hit (direct)") or line.startswith("cache hit (preprocessed)"):
+            hits += int(words[-1])
+        elif line.startswith("cache miss"):
+            misses = int(words[-1])
+    return None if misses is None else CompilerCacheStats(hits, misses)
+
+
+_compiler_cache = None  # type: typing.Optional[CompilerCache]
+_compiler_cache_initialized = False
+
+
+def get_compiler_cache(config: "CheriConfig") -> "typing.Optional[CompilerCache]":
+    global _compiler_cache, _compiler_cache_initialized
+    if _compiler_cache_initialized:
+        return _compiler_cache
+    _compiler_cache_initialized = True
+    kind = config.compiler_cache
+    if not kind or kind == "none":
+        return None
+    path = shutil.which(kind)
+    if not path:
+        warningMessage("--compiler-cache=" + kind, "was set but", kind, "could not be found in $PATH. Building",
+                       "without a compiler cache.")
+        return None
+    roots = [str(p.absolute()) for p in (config.sourceRoot, config.buildRoot, config.outputRoot)]
+    base_dir = os.path.commonpath(roots)
+    _compiler_cache = CompilerCache(kind, Path(path), cache_dir=config.compiler_cache_dir,
+                                    base_dir=Path(base_dir) if base_dir != "/" else None)
+    if not config.pretend:
+        # Make sure that all commands (including the ones started by make/ninja) use the same settings
+        os.environ.update(_compiler_cache.environment())
+    return _compiler_cache
+
+
+@contextlib.contextmanager
+def record_compiler_cache_stats(config: "CheriConfig", target_name: str):
+    cache = get_compiler_cache(config)
+    if cache is None or config.pretend:
+        yield
+        return
+    with cache.record_target(target_name):
+        yield
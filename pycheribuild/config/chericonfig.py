@@ -172,6 +172,36 @@ class CheriConfig(object):
         # Attributes for code completion:
         self.verbose = None  # type: bool
         self.debug_output = loader.addCommandLineOnlyBoolOption("debug-output", "vv", default=False, help="Extremely verbose output")
+        self.compiler_cache = loader.addOption("compiler-cache", default="none", choices=("none", "ccache", "sccache"),
+            help="Use a compiler cache for CMake, autotools, QEMU and FreeBSD builds. The cache is keyed on the "
+                 "contents of the compiler binary so rebuilding an identical clang does not invalidate it.")
+        self.compiler_cache_dir = loader.addPathOption("compiler-cache-dir",
+            help="The directory used by ccache/sccache (default: the $CCACHE_DIR/$SCCACHE_DIR default)")
+        self.opam_switch_cache_dir = loader.addPathOption("opam-switch-cache-dir",
+            help="Restore the opam root used by sail and the other OCaml projects from a snapshot in this directory "
+                 "instead of building the OCaml compiler and packages from scratch (snapshots are saved there once "
+                 "sail-from-opam has installed sail and its dependencies)")
+        self.opam_switch_lockfile = loader.addPathOption("opam-switch-lockfile",
+            help="Install the packages listed in this file (created with `opam switch export`) when creating a new "
+                 "opam switch. The snapshot cache is keyed on the contents of this file.")
+        self.background_delete = loader.addBoolOption("background-delete", default=True,
+            help="When cleaning, move the old build directory to a trash directory and delete it using a low "
+                 "priority background process instead of waiting for the deletion at the end of the target. "
+                 "Deletions that were interrupted are resumed by the next cheribuild run.")
+        self.background_delete_detach = loader.addBoolOption("background-delete-detach",
+            help="Don't wait for pending background deletions when cheribuild exits but let them finish in a "
+                 "detached process")
+        self.adaptive_make_jobs = loader.addBoolOption("adaptive-make-jobs", default=True,
+            help="Reduce the --make-jobs value for each target based on the cgroup CPU quota, the available memory "
+                 "and the expected memory usage of the project's compile and link jobs")
+        self.make_jobs_consider_load = loader.addBoolOption("make-jobs-consider-load",
+            help="Also reduce the number of jobs based on the current load average. Note: the load average lags "
+                 "behind, so it will include the jobs of the previous target.")
+        self.timing_trace = loader.addPathOption("timing-trace", help="Record wall, user and system time as well as"
+            " peak RSS for all targets, build steps and commands and write it to this file in the Chrome trace event "
+            "format (can be viewed in chrome://tracing or ui.perfetto.dev)")
+        self.timing_summary = loader.addBoolOption("timing-summary", help="Print a table with the time spent in each "
+            "target, build step and the slowest commands at exit (implied by --timing-trace)")
         self.quiet = None  # type: bool
         self.clean = None  # type: bool
         self.force = None  # type: bool
@@ -237,11 +267,22 @@ class CheriConfig(object):
                                                  default="cheribuild-test", group=loader.dockerGroup)
         self.docker_reuse_container = loader.addBoolOption("docker-reuse-container", group=loader.dockerGroup,
             help="Attach to the same container again (note: docker-container option must be an id rather than a container name")
+        self.docker_persistent = loader.addBoolOption("docker-persistent", group=loader.dockerGroup,
+            help="Start a long-lived container from the --docker-container image (or reuse the existing one) and run "
+                 "cheribuild inside it using docker exec. The container is recreated automatically if the image or "
+                 "the source/build/output directories change.")
+        self.docker_persistent_name = loader.addOption("docker-persistent-name", group=loader.dockerGroup,
+            help="Name of the persistent container (default: cheribuild-persistent-<image>)")
 
         # compilation db options:
         self.create_compilation_db = loader.addCommandLineOnlyBoolOption(
             "compilation-db", "-cdb", help="Create a compile_commands.json file in the build dir "
                                            "(requires Bear for non-CMake projects)")
+        self.compilation_db_tool = loader.addOption("compilation-db-tool", default="wrapper",
+            choices=("wrapper", "bear", "compiledb"),
+            help="The tool used to create compile_commands.json for non-CMake projects. The default (wrapper) records "
+                 "the commands using a compiler wrapper and incrementally merges them into the existing file. Projects "
+                 "whose build system doesn't allow overriding the compiler fall back to bear.")
         self.copy_compilation_db_to_source_dir = None  # False for jenkins, an option for cheribuild
 
 
@@ -267,6 +308,12 @@ class CheriConfig(object):
             help="Don't actually run the tests. Instead setup a QEMU instance with the right paths set up.")
         self.test_ld_preload = loader.addPathOption("test-ld-preload", group=loader.testsGroup,
                                                     help="Preload the given library before running tests")
+        self.run_affected_tests_only = loader.addBoolOption("run-affected-tests-only", group=loader.testsGroup,
+            help="Only run the tests that are affected by the source changes since the last passing test run "
+                 "(currently supported for libc++ and the CheriBSD kyua tests)")
+        self.full_test_run_interval = loader.addOption("full-test-run-interval", type=int, default=10,
+            group=loader.testsGroup, help="Run the full test suite every N test runs even if "
+                                          "--run-affected-tests-only is set (0 means never)")
 
         self.benchmark_fpga_extra_args = loader.addCommandLineOnlyOption("benchmark-fpga-extra-args", group=loader.benchmarkGroup,
                                                                          type=list, metavar="ARGS",
@@ -291,6 +338,23 @@ class CheriConfig(object):
                                                           "Note: not all benchmarks support this option")
         self.benchmark_with_qemu = loader.addBoolOption("benchmark-with-qemu", group=loader.benchmarkGroup,
                                                          help="Run the benchmarks on QEMU instead of the FPGA (only useful to collect instruction counts or test the benchmarks)")
+        self.benchmark_qemu_instances = loader.addOption("benchmark-qemu-instances", type=int, default=1,
+            group=loader.benchmarkGroup, help="Number of QEMU guests that run the benchmark iterations in parallel "
+                                              "(only used with --benchmark-with-qemu)")
+        self.benchmark_baseline_csv = loader.addPathOption("benchmark-baseline-csv", group=loader.benchmarkGroup,
+            help="Compare the statcounters CSV of the benchmark run against this baseline CSV file")
+        self.benchmark_statcounters = loader.addOption("benchmark-statcounters", group=loader.benchmarkGroup, type=list,
+            metavar="COUNTERS", help="The statcounters values that should be reported (default: cycles, "
+                                     "instructions, cache misses and capability loads/stores)")
+        self.benchmark_regression_threshold = loader.addOption("benchmark-regression-threshold", type=float,
+            group=loader.benchmarkGroup, default=1.0, help="Minimum change of the median (in percent) that is "
+                                                           "reported as a regression")
+        self.benchmark_significance_level = loader.addOption("benchmark-significance-level", type=float,
+            group=loader.benchmarkGroup, default=0.05, help="Significance level for the Mann-Whitney U test used to "
+                                                            "compare against the baseline")
+        self.benchmark_fail_on_regression = loader.addBoolOption("benchmark-fail-on-regression",
+            group=loader.benchmarkGroup, help="Exit with a non-zero status if there is a statistically significant "
+                                              "regression compared to --benchmark-baseline-csv")
         self.shallow_clone = loader.addBoolOption("shallow-clone", default=True,
             help="Perform a shallow `git clone` when cloning new projects. This can save a lot of time for large"
             "repositories such as FreeBSD or LLVM. Use `git fetch --unshallow` to convert to a non-shallow clone")
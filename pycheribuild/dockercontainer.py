@@ -0,0 +1,160 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import hashlib
+import json
+import subprocess
+import sys
+import time
+
+from .utils import *
+
+DOCKER_LABEL_IMAGE_ID = "org.cheribuild.image-id"
+DOCKER_LABEL_CONFIG_HASH = "org.cheribuild.config-hash"
+
+
+class DockerError(Exception):
+    pass
+
+
+class PersistentDockerContainer(object):
+    """
+    A long-lived container that is started once with all bind mounts and then reused for every cheribuild invocation
+    using docker exec. This avoids paying the container startup cost on every run and keeps in-container state
+    (e.g. caches in $HOME) around. The container is recreated if the image or the mounts have changed or if it
+    fails the health check.
+    """
+    # Keep the container alive without depending on the image's CMD (bash exits immediately without a tty)
+    keepalive_command = ["sh", "-c", "trap 'exit 0' TERM; while sleep 3600; do :; done"]
+
+    def __init__(self, image: str, name: str, mounts: "typing.List[typing.Tuple[str, str, bool]]",
+                 docker_command: str = "docker"):
+        self.image = image
+        self.name = name
+        self.mounts = mounts
+        self.docker_command = docker_command
+
+    @property
+    def config_hash(self) -> str:
+        data = json.dumps({"image": self.image, "mounts": self.mounts}, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+    def _docker(self, *args, capture=False, check=True) -> "subprocess.CompletedProcess":
+        cmd = [self.docker_command] + list(args)
+        if not capture:
+            printCommand(cmd, print_verbose_only=True)
+        try:
+            return subprocess.run(cmd, stdout=subprocess.PIPE if capture else None,
+                                  stderr=subprocess.PIPE if capture else None, check=check)
+        except subprocess.CalledProcessError as e:
+            raise DockerError(" ".join(cmd) + " failed with exit code " + str(e.returncode) + ": " +
+                              (e.stderr.decode("utf-8", errors="replace").strip() if e.stderr else "")) from e
+        except OSError as e:
+            raise DockerError("Could not run " + self.docker_command + ": " + str(e)) from e
+
+    def image_id(self) -> str:
+        result = self._docker("image", "inspect", "--format", "{{.Id}}", self.image, capture=True, check=False)
+        if result.returncode != 0:
+            raise DockerError("docker image " + self.image + " was not found")
+        return result.stdout.decode("utf-8").strip()
+
+    def inspect(self) -> "typing.Optional[dict]":
+        result = self._docker("container", "inspect", self.name, capture=True, check=False)
+        if result.returncode != 0:
+            return None
+        info = json.loads(result.stdout.decode("utf-8"))
+        return info[0] if info else None
+
+    def needs_recreate(self, info: dict, image_id: str) -> "typing.Optional[str]":
+        labels = info.get("Config", {}).get("Labels") or {}
+        if labels.get(DOCKER_LABEL_IMAGE_ID) != image_id or info.get("Image") != image_id:
+            return "the image " + self.image + " has changed"
+        if labels.get(DOCKER_LABEL_CONFIG_HASH) != self.config_hash:
+            return "the directory mappings have changed"
+        return None
+
+    def is_healthy(self) -> bool:
+        result = self._docker("exec", self.name, "true", capture=True, check=False)
+        return result.returncode == 0
+
+    def create(self, image_id: str):
+        args = ["run", "--detach", "--init", "--name", self.name,
+                "--label", DOCKER_LABEL_IMAGE_ID + "=" + image_id,
+                "--label", DOCKER_LABEL_CONFIG_HASH + "=" + self.config_hash]
+        for host_path, container_path, read_only in self.mounts:
+            args += ["-v", host_path + ":" + container_path + (":ro" if read_only else "")]
+        self._docker(*(args + [image_id] + self.keepalive_command), capture=True)
+
+    def remove(self):
+        self._docker("rm", "--force", self.name, capture=True, check=False)
+
+    def ensure_running(self):
+        image_id = self.image_id()
+        info = self.inspect()
+        if info is not None:
+            reason = self.needs_recreate(info, image_id)
+            if reason:
+                statusUpdate("Recreating docker container", self.name, "since", reason)
+                self.remove()
+                info = None
+            elif not info.get("State", {}).get("Running"):
+                self._docker("start", self.name, capture=True)
+        if info is None:
+            statusUpdate("Starting persistent docker container", self.name, "using image", self.image)
+            self.create(image_id)
+        # Wait for the container to accept exec requests, if it doesn't recreate it once
+        for attempt in range(2):
+            for _ in range(20):
+                if self.is_healthy():
+                    return
+                time.sleep(0.25)
+            if attempt == 0:
+                warningMessage("Docker container", self.name, "is not responding, recreating it.")
+                self.remove()
+                self.create(image_id)
+        raise DockerError("docker container " + self.name + " failed the health check")
+
+    def exec_command(self, args: "typing.List[str]", workdir: str = None) -> "typing.List[str]":
+        cmd = [self.docker_command, "exec"]
+        if sys.stdin.isatty() and sys.stdout.isatty():
+            cmd.append("--tty")
+        if workdir:
+            cmd += ["--workdir", workdir]
+        return cmd + [self.name] + args
+
+    def run(self, args: "typing.List[str]", workdir: str = None) -> int:
+        self.ensure_running()
+        cmd = self.exec_command(args, workdir)
+        printCommand(cmd)
+        return subprocess.call(cmd)
+
+
+def default_persistent_container_name(image: str) -> str:
+    sanitized = "".join(c if c.isalnum() or c in "_.-" else "-" for c in image)
+    return "cheribuild-persistent-" + sanitized
@@ -0,0 +1,74 @@
+# Compiler wrapper used by cheribuild --compilation-db: records every compile command in $CHERIBUILD_COMPDB_DIR
+# (one JSON file per invocation which are later merged into compile_commands.json) and then runs the compiler.
+# Usage: compdb-wrapper [ccache|sccache] <compiler> <args...>
+# If $CHERIBUILD_COMPDB_LAUNCHER is set (e.g. to ccache) the compiler is run through that launcher.
+import json
+import os
+import sys
+import time
+
+SOURCE_EXTENSIONS = (".c", ".cc", ".cpp", ".cxx", ".c++", ".C", ".m", ".mm", ".S", ".s")
+LAUNCHERS = ("ccache", "sccache")
+
+
+def compile_entries(args):
+    if "-c" not in args:
+        return []  # only compile steps are interesting (not linking or preprocessing)
+    cwd = os.getcwd()
+    output = None
+    sources = []
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        if arg == "-o" and i + 1 < len(args):
+            output = args[i + 1]
+            i += 1
+        elif arg.startswith("-o") and len(arg) > 2:
+            output = arg[2:]
+        elif not arg.startswith("-") and arg.endswith(SOURCE_EXTENSIONS):
+            sources.append(arg)
+        i += 1
+    result = []
+    for source in sources:
+        obj = output if output and len(sources) == 1 else os.path.splitext(os.path.basename(source))[0] + ".o"
+        result.append({"directory": cwd, "arguments": args, "file": os.path.join(cwd, source),
+                       "output": os.path.join(cwd, obj)})
+    return result
+
+
+def record(args, outdir):
+    entries = compile_entries(args)
+    if not entries:
+        return
+    # pids can be reused during a long build so also add a timestamp (and use O_EXCL to be sure)
+    name = os.path.join(outdir, "%d.%d" % (os.getpid(), int(time.time() * 1000000000)))
+    with open(name + ".tmp", "x") as f:
+        json.dump(entries, f)
+    os.rename(name + ".tmp", name + ".json")  # atomic -> the merge never sees partially written files
+
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        sys.exit("usage: " + sys.argv[0] + " [ccache|sccache] <compiler> <args...>")
+    compiler_args = args
+    while len(compiler_args) > 1 and os.path.basename(compiler_args[0]) in LAUNCHERS:
+        compiler_args = compiler_args[1:]
+    outdir = os.getenv("CHERIBUILD_COMPDB_DIR")
+    if outdir:
+        try:
+            record(compiler_args, outdir)
+        except Exception as e:
+            # Never fail the build because of the compilation database
+            print("compdb-wrapper: could not record compile command:", e, file=sys.stderr)
+    launcher = os.getenv("CHERIBUILD_COMPDB_LAUNCHER")
+    if launcher and compiler_args is args:
+        args = [launcher] + args
+    try:
+        os.execvp(args[0], args)
+    except OSError as e:
+        sys.exit("compdb-wrapper: could not run " + args[0] + ": " + str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Linker launcher used for LLVM builds: runs the link command and appends its peak RSS to $CHERIBUILD_LINK_STATS
+# (one JSON object per line) so that the next build can size the ninja link pool based on the available memory.
+# Usage: link-rss-wrapper <linker command...>
+import json
+import os
+import sys
+import time
+
+
+def exit_code(status):
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def output_file(args):
+    for i, arg in enumerate(args):
+        if arg == "-o" and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith("-o") and len(arg) > 2:
+            return arg[2:]
+    return None
+
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        sys.exit("usage: " + sys.argv[0] + " <linker command...>")
+    stats_file = os.getenv("CHERIBUILD_LINK_STATS")
+    if not stats_file:
+        os.execvp(args[0], args)
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execvp(args[0], args)
+        except OSError as e:
+            print("link-rss-wrapper: could not run", args[0] + ":", e, file=sys.stderr)
+        os._exit(127)
+    while True:
+        try:
+            _, status, rusage = os.wait4(pid, 0)
+            break
+        except InterruptedError:
+            continue
+    # ru_maxrss is in KiB on Linux/FreeBSD but in bytes on macOS
+    maxrss_kb = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    output = output_file(args)
+    if output and exit_code(status) == 0:
+        entry = {"output": os.path.abspath(output), "maxrss_kb": maxrss_kb, "seconds": round(time.time() - start, 2)}
+        try:
+            # A single write() with O_APPEND so that parallel links don't interleave
+            fd = os.open(stats_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(entry) + "\n").encode("utf-8"))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print("link-rss-wrapper: could not record link statistics:", e, file=sys.stderr)
+    sys.exit(exit_code(status))
+
+
+if __name__ == "__main__":
+    main()
@@ -28,10 +28,14 @@
 # SUCH DAMAGE.
 #
 
+import atexit
+import errno
 import os
 import threading
 import shutil
 import subprocess
+import sys
+import time
 
 from pathlib import Path
 from .config.chericonfig import CheriConfig
@@ -48,9 +52,47 @@ class FileSystemUtils(object):
             os.makedirs(str(path), exist_ok=True)
 
     def _deleteDirectories(self, *dirs):
-        # http://stackoverflow.com/questions/5470939/why-is-shutil-rmtree-so-slow
-        # shutil.rmtree(path) # this is slooooooooooooooooow for big trees
-        runCmd("rm", "-rf", *dirs)
+        printCommand("rm", "-rf", *dirs)
+        if self.config.pretend:
+            return
+        for d in dirs:
+            self._delete_tree(str(d))
+
+    @staticmethod
+    def _delete_tree(path: str):
+        """
+        In-process equivalent of rm -rf that uses os.scandir() so that we only need one stat() per directory entry
+        (http://stackoverflow.com/questions/5470939/why-is-shutil-rmtree-so-slow). Falls back to rm -rf if
+        anything goes wrong (e.g. directories without write permissions)
+        """
+        try:
+            if os.path.islink(path) or not os.path.isdir(path):
+                os.unlink(path)
+                return
+            pending = [path]
+            to_remove = []
+            while pending:
+                directory = pending.pop()
+                to_remove.append(directory)
+                # scandir() iterators only became context managers in Python 3.6
+                it = os.scandir(directory)
+                try:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        else:
+                            os.unlink(entry.path)
+                finally:
+                    if hasattr(it, "close"):
+                        it.close()
+            # subdirectories are always added after their parent -> remove them in reverse order
+            for directory in reversed(to_remove):
+                os.rmdir(directory)
+        except FileNotFoundError:
+            if os.path.lexists(path):
+                runCmd("rm", "-rf", path, no_print=True)
+        except OSError:
+            runCmd("rm", "-rf", path, no_print=True)
 
     def cleanDirectory(self, path: Path, keepRoot=False, ensure_dir_exists=True) -> None:
         """ After calling this function path will be an empty directory
@@ -88,10 +130,15 @@ class FileSystemUtils(object):
             # foo has been moved to foo.tmp and foo is now and empty dir:
             do_something()
         # now foo.tpt no longer exists
+        With --background-delete (the default) the contents are moved to a trash directory instead and deleted by
+        a low priority background process that is not joined at the end of the scope.
         :param path: the directory to clean
         :param keepRoot: currently not supported
         :return:
         """
+        if self.config.background_delete:
+            self._move_to_trash(path, keepRoot=keepRoot, keep_dirs=keep_dirs)
+            return ThreadJoiner(None)
         deleterThread = None
         tempdir = path.with_suffix(".delete-me-pls")
         if not path.is_dir():
@@ -119,10 +166,15 @@ class FileSystemUtils(object):
                     all_entries = all_entries_new
                 all_entries = list(map(str, all_entries))
                 if all_entries:
-                    runCmd(["mv"] + all_entries + [tempdir], print_verbose_only=True)
+                    printCommand(["mv"] + all_entries + [tempdir], print_verbose_only=True)
+                    if not self.config.pretend:
+                        for entry in all_entries:
+                            os.rename(entry, str(tempdir / os.path.basename(entry)))
             else:
                 # rename the directory, create a new dir and then delete it in a background thread
-                runCmd("mv", path, tempdir)
+                printCommand("mv", path, tempdir)
+                if not self.config.pretend:
+                    os.rename(str(path), str(tempdir))
                 self.makedirs(path)
         if not self.config.pretend:
             assert path.is_dir()
@@ -133,6 +185,47 @@ class FileSystemUtils(object):
             deleterThread = FileSystemUtils.DeleterThread(self, tempdir)
         return ThreadJoiner(deleterThread)
 
+    def _trash_dir(self, path: Path) -> Path:
+        # The trash directory must be on the same filesystem so that moving the directory is just a rename()
+        device = path.stat().st_dev
+        for candidate in (self.config.buildRoot, self.config.outputRoot, self.config.sourceRoot):
+            try:
+                if candidate.stat().st_dev == device and os.access(str(candidate), os.W_OK):
+                    return candidate / TRASH_DIRNAME
+            except OSError:
+                continue
+        return path.parent / TRASH_DIRNAME
+
+    def _move_to_trash(self, path: Path, *, keepRoot: bool, keep_dirs: list = None):
+        if not path.is_dir():
+            self.makedirs(path)
+            return
+        if keepRoot:
+            entries = []
+            for i in path.iterdir():
+                if keep_dirs and i.name in keep_dirs:
+                    statusUpdate("Not deleting", i, "- If you really want it removed, delete it manually.")
+                else:
+                    entries.append(i)
+        else:
+            entries = [path]
+        # Also clean up after older versions of cheribuild:
+        old_tempdir = path.with_suffix(".delete-me-pls")
+        if old_tempdir.is_dir():
+            entries.append(old_tempdir)
+        if not entries or (not keepRoot and not old_tempdir.is_dir() and len(list(path.iterdir())) == 0):
+            statusUpdate("Not cleaning", path, "it is already empty")
+            return
+        trash_entry = self._trash_dir(path) / (path.name + "." + str(time.time()) + "." + str(os.getpid()))
+        self.makedirs(trash_entry)
+        printCommand(["mv"] + [str(e) for e in entries] + [trash_entry], print_verbose_only=not self.config.pretend)
+        if self.config.pretend:
+            return
+        for entry in entries:
+            os.rename(str(entry), str(trash_entry / entry.name))
+        self.makedirs(path)
+        background_deleter.enqueue(trash_entry, detach_at_exit=self.config.background_delete_detach)
+
     def deleteFile(self, file: Path, print_verbose_only=False):
         if not file.is_file():
             return
@@ -191,9 +284,37 @@ class FileSystemUtils(object):
                 src = os.path.relpath(str(src), str(dest.parent if dest.is_absolute() else cwd))
             if cwd is not None and cwd.is_dir():
                 dest = dest.relative_to(cwd)
-            runCmd("ln", "-fsn", src, dest, cwd=cwd, print_verbose_only=print_verbose_only)
-        else:
-            runCmd("ln", "-fsn", src, dest, cwd=cwd, print_verbose_only=print_verbose_only)
+        printCommand("ln", "-fsn", src, dest, cwd=cwd, print_verbose_only=print_verbose_only)
+        if not self.config.pretend:
+            self._create_symlinks(cwd, [(str(src), str(dest))])
+
+    @staticmethod
+    def _create_symlinks(directory: Path, links: "typing.List[typing.Tuple[str, str]]"):
+        """
+        In-process equivalent of running `ln -fsn target name` in directory for every (target, name) in links.
+        Existing files or symlinks are replaced atomically. All links are created relative to a single directory
+        file descriptor to avoid looking up the directory for every link.
+        """
+        use_dir_fd = os.symlink in os.supports_dir_fd and os.rename in os.supports_dir_fd
+        dir_fd = os.open(str(directory), os.O_RDONLY) if use_dir_fd else None
+        try:
+            for target, name in links:
+                full_path = os.path.join(str(directory), name)
+                if os.path.isdir(full_path) and not os.path.islink(full_path):
+                    # ln -fsn creates the link inside an existing directory
+                    name = os.path.join(name, os.path.basename(target))
+                    full_path = os.path.join(full_path, os.path.basename(target))
+                if not use_dir_fd:
+                    name = full_path
+                tmp_name = os.path.join(os.path.dirname(name), ".#" + os.path.basename(name) + "." + str(os.getpid()))
+                if os.path.lexists(os.path.join(str(directory), tmp_name)):
+                    os.unlink(tmp_name, dir_fd=dir_fd)
+                os.symlink(target, tmp_name, dir_fd=dir_fd)
+                # os.rename() atomically replaces name on POSIX (os.replace is not listed in os.supports_dir_fd)
+                os.rename(tmp_name, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
 
     def moveFile(self, src: Path, dest: Path, force=False, createDirs=True):
         if not src.exists():
@@ -201,7 +322,18 @@ class FileSystemUtils(object):
         cmd = ["mv", "-f"] if force else ["mv"]
         if createDirs and not dest.parent.exists():
             self.makedirs(dest.parent)
-        runCmd(cmd + [src, dest])
+        printCommand(cmd + [src, dest])
+        if self.config.pretend:
+            return
+        if dest.is_dir() and not dest.is_symlink():
+            dest = dest / src.name  # mv moves the file into the directory
+        try:
+            os.replace(str(src), str(dest))
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Can't rename across filesystems -> copy and delete
+            shutil.move(str(src), str(dest))
 
     def installFile(self, src: Path, dest: Path, *, force=False, createDirs=True, print_verbose_only=True, mode=None):
         if force:
@@ -221,13 +353,54 @@ class FileSystemUtils(object):
             self.makedirs(dest.parent)
         if dest.is_symlink():
             dest.unlink()
-        # noinspection PyArgumentList
-        shutil.copy(str(src), str(dest), follow_symlinks=False)
+        self._copy_file(src, dest)
         if mode is not None:
             printCommand("chmod", oct(mode), dest, print_verbose_only=print_verbose_only)
             if not self.config.pretend:
                 dest.chmod(mode)
 
+    @staticmethod
+    def try_reflink(src: Path, dest: Path) -> bool:
+        """Create dest as a copy-on-write clone of src (only supported on Linux with btrfs/XFS/etc.)"""
+        if not sys.platform.startswith("linux"):
+            return False
+        import fcntl
+        try:
+            with src.open("rb") as s, dest.open("wb") as d:
+                fcntl.ioctl(d.fileno(), 0x40049409, s.fileno())  # FICLONE
+            return True
+        except OSError:
+            if dest.exists():
+                dest.unlink()
+            return False
+
+    @classmethod
+    def _copy_file(cls, src: Path, dest: Path):
+        """
+        Equivalent to shutil.copy(src, dest, follow_symlinks=False) but tries a reflink first and then
+        copy_file_range() (which can avoid copying the data through userspace)
+        """
+        if src.is_symlink():
+            os.symlink(os.readlink(str(src)), str(dest))
+            return
+        if not cls.try_reflink(src, dest):
+            copied = False
+            if hasattr(os, "copy_file_range"):
+                with src.open("rb") as s, dest.open("wb") as d:
+                    try:
+                        remaining = os.fstat(s.fileno()).st_size
+                        while remaining > 0:
+                            n = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+                            if n == 0:
+                                break
+                            remaining -= n
+                        copied = remaining == 0
+                    except OSError:
+                        pass  # e.g. ENOSYS/EXDEV/EINVAL -> fall back to a normal copy
+            if not copied:
+                shutil.copyfile(str(src), str(dest))
+        shutil.copymode(str(src), str(dest))
+
     @staticmethod
     def createBuildtoolTargetSymlinks(tool: Path, toolName: str = None, createUnprefixedLink: bool = False,
                                       cwd: str = None):
@@ -247,10 +420,11 @@ class FileSystemUtils(object):
         if not tool.is_file():
             fatalError("Attempting to create symlink to non-existent build tool:", tool)
 
+        links = []
         # a prefixed tool was installed -> create link such as mips4-unknown-freebsd-ld -> ld
         if createUnprefixedLink:
             assert tool.name != toolName
-            runCmd("ln", "-fsn", tool.name, toolName, cwd=cwd, print_verbose_only=True)
+            links.append((tool.name, toolName))
 
         for target in ("mips4-unknown-freebsd-", "cheri-unknown-freebsd-", "mips64-unknown-freebsd-"):
             link = tool.parent / (target + toolName)  # type: Path
@@ -258,4 +432,108 @@ class FileSystemUtils(object):
                 # if self.config.verbose:
                 #    print(coloured(AnsiColour.yellow, "Not overwriting", link, "because it is the target"))
                 continue
-            runCmd("ln", "-fsn", tool.name, target + toolName, cwd=cwd, print_verbose_only=True)
+            links.append((tool.name, target + toolName))
+        for src, name in links:
+            printCommand("ln", "-fsn", src, name, cwd=cwd, print_verbose_only=True)
+        if not get_global_config().pretend:
+            FileSystemUtils._create_symlinks(Path(cwd), links)
+
+
+TRASH_DIRNAME = ".cheribuild-trash"
+
+
+class BackgroundDeleter(object):
+    """
+    Deletes the trees that asyncCleanDirectory() moved to the trash directories one at a time using a low priority
+    (nice + idle IO class) rm -rf so that they don't compete with the build for IO bandwidth. By default cheribuild
+    waits for the remaining deletions at exit, with --background-delete-detach they continue after cheribuild exits.
+    Anything left over from a previous run is resumed by resume().
+    """
+
+    def __init__(self):
+        self._queue = []  # type: typing.List[Path]
+        self._lock = threading.Condition()
+        self._thread = None  # type: typing.Optional[threading.Thread]
+        self._current = None  # type: typing.Optional[subprocess.Popen]
+        self._detach_at_exit = False
+        self._atexit_registered = False
+
+    @staticmethod
+    def _rm_command(paths: "typing.List[Path]") -> "typing.List[str]":
+        cmd = ["rm", "-rf"] + [str(p) for p in paths]
+        if shutil.which("ionice"):
+            cmd = ["ionice", "-c", "3"] + cmd
+        return ["nice", "-n", "19"] + cmd
+
+    def enqueue(self, path: Path, *, detach_at_exit=False):
+        with self._lock:
+            if path in self._queue:
+                return
+            self._queue.append(path)
+            self._detach_at_exit = detach_at_exit
+            if not self._atexit_registered:
+                atexit.register(self._at_exit)
+                self._atexit_registered = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="Background deletion", daemon=True)
+                self._thread.start()
+            self._lock.notify()
+
+    def resume(self, config: CheriConfig):
+        """Queue all trash directories that were not deleted by a previous run"""
+        for root in (config.buildRoot, config.outputRoot, config.sourceRoot):
+            trash = root / TRASH_DIRNAME
+            if not trash.is_dir():
+                continue
+            for entry in sorted(trash.iterdir()):
+                if config.verbose:
+                    statusUpdate("Resuming deletion of", entry)
+                self.enqueue(entry, detach_at_exit=config.background_delete_detach)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._current = None
+                    self._lock.notify_all()
+                    return
+                path = self._queue[0]
+                # Use a new session so that Ctrl+C doesn't kill the deletion (it will be resumed next time anyway)
+                self._current = subprocess.Popen(self._rm_command([path]), stdin=subprocess.DEVNULL,
+                                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                                 start_new_session=True)
+            self._current.wait()
+            with self._lock:
+                self._queue.remove(path)
+
+    def pending(self) -> "typing.List[Path]":
+        with self._lock:
+            return list(self._queue)
+
+    def wait(self):
+        with self._lock:
+            while self._queue and self._thread is not None and self._thread.is_alive():
+                self._lock.wait(timeout=1)
+
+    def _at_exit(self):
+        pending = self.pending()
+        if not pending:
+            return
+        if self._detach_at_exit:
+            with self._lock:
+                # the currently running rm continues after we exit, delete the rest with a new detached process
+                remaining = pending[1:] if self._current is not None else pending
+                if remaining:
+                    subprocess.Popen(self._rm_command(remaining), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL, start_new_session=True)
+                self._queue.clear()
+            return
+        statusUpdate("Waiting for background deletion of", len(pending), "director" + ("y" if len(pending) == 1 else
+                                                                                        "ies"), "to complete")
+        try:
+            self.wait()
+        except KeyboardInterrupt:
+            warningMessage("Background deletion interrupted, it will be resumed by the next cheribuild run")
+
+
+background_deleter = BackgroundDeleter()
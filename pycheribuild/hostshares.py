@@ -0,0 +1,247 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+from .utils import *
+
+
+class HostShareDaemonError(Exception):
+    pass
+
+
+class HostShare(object):
+    """A host directory that should be made available inside the QEMU guest"""
+
+    def __init__(self, hostdir: str, readonly: bool, in_target: str, name: str = None):
+        self.readonly = readonly
+        self.hostdir = str(Path(hostdir).absolute())
+        self.in_target = in_target
+        self.name = name  # share name/mount tag, defaults to a backend-specific name based on the index
+
+    def __repr__(self):
+        return "<{} ({}) -> {}>".format(self.hostdir, "ro" if self.readonly else "rw", self.in_target)
+
+
+class HostShareBackend(object):
+    """
+    A way of exporting host directories to the guest. Each backend contributes QEMU arguments (either options for the
+    user mode network or additional devices) and knows how to mount a share inside a CheriBSD guest.
+    """
+    name = None  # type: str
+    qemu_device = None  # type: str
+
+    def share_name(self, index: int, share: HostShare) -> str:
+        raise NotImplementedError()
+
+    def is_available(self, qemu_binary: str, machine: str = None) -> bool:
+        """Check whether this backend can be used on the host side with the given QEMU binary and machine type"""
+        if self.qemu_device is None:
+            return True
+        return self.qemu_device in _qemu_device_list(qemu_binary)
+
+    def user_network_options(self, shares: "typing.List[HostShare]") -> str:
+        return ""
+
+    def qemu_args(self, shares: "typing.List[HostShare]", memory_size: str,
+                  runtime_dir: Path = None) -> "typing.List[str]":
+        return []
+
+    def start_host_daemons(self, shares: "typing.List[HostShare]", runtime_dir: Path) -> "typing.List[subprocess.Popen]":
+        """Start the host processes needed by this backend. Raises HostShareDaemonError if they cannot be started"""
+        return []
+
+    def guest_mount_command(self, index: int, share: HostShare, mountpoint: str = None) -> str:
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return self.name
+
+
+_qemu_devices_cache = dict()  # type: typing.Dict[str, str]
+
+
+def _qemu_device_list(qemu_binary: str) -> str:
+    if qemu_binary not in _qemu_devices_cache:
+        try:
+            _qemu_devices_cache[qemu_binary] = subprocess.run(
+                [qemu_binary, "-M", "none", "-device", "help"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL, timeout=30).stdout.decode("utf-8", errors="replace")
+        except (OSError, subprocess.TimeoutExpired):
+            _qemu_devices_cache[qemu_binary] = ""
+    return _qemu_devices_cache[qemu_binary]
+
+
+class SmbShareBackend(HostShareBackend):
+    """The smbd started by the QEMU user mode network stack (slow but works with any CheriBSD guest)"""
+    name = "smb"
+
+    def share_name(self, index: int, share: HostShare):
+        return share.name or "qemu{}".format(index + 1)
+
+    def is_available(self, qemu_binary: str, machine: str = None) -> bool:
+        return True  # whether smbd exists is checked when building QEMU
+
+    def user_network_options(self, shares: "typing.List[HostShare]"):
+        if not shares:
+            return ""
+        args = []
+        for share in shares:
+            # Named shares use the "<<<" syntax added to CHERI QEMU, otherwise QEMU numbers them qemu1, qemu2, ...
+            arg = share.hostdir + ("<<<" + share.name if share.name else "")
+            args.append(arg + "@ro" if share.readonly else arg)
+        return ",smb=" + ":".join(args)
+
+    def guest_mount_command(self, index: int, share: HostShare, mountpoint: str = None):
+        return "mount_smbfs -I 10.0.2.4 -N //10.0.2.4/{} '{}'".format(self.share_name(index, share),
+                                                                       mountpoint or share.in_target)
+
+
+class Virtio9pShareBackend(HostShareBackend):
+    """virtio-9p (-virtfs) shares. Needs a QEMU built with virtfs support and the p9fs driver in the guest kernel"""
+    name = "9p"
+    qemu_device = "virtio-9p-pci"
+
+    def share_name(self, index: int, share: HostShare):
+        return share.name or "share{}".format(index + 1)
+
+    def qemu_args(self, shares: "typing.List[HostShare]", memory_size: str, runtime_dir: Path = None):
+        result = []
+        for index, share in enumerate(shares):
+            result += ["-virtfs", "local,id=fs{index},path={path},mount_tag={tag},security_model=none{ro}".format(
+                index=index, path=share.hostdir, tag=self.share_name(index, share),
+                ro=",readonly" if share.readonly else "")]
+        return result
+
+    def guest_mount_command(self, index: int, share: HostShare, mountpoint: str = None):
+        return "mount -t p9fs {} '{}'".format(self.share_name(index, share), mountpoint or share.in_target)
+
+
+class VirtioFSShareBackend(HostShareBackend):
+    """
+    virtio-fs shares served by virtiofsd. This requires guest RAM to be shared with virtiofsd which is only possible
+    with a memfd memory backend (i.e. on Linux hosts) that is attached to a NUMA node of the guest.
+    """
+    name = "virtiofs"
+    qemu_device = "vhost-user-fs-pci"
+    # QEMU machine types that support -numa (e.g. malta does not)
+    numa_machine_types = ("virt", "pc", "q35", "pseries")
+    socket_timeout = 10  # seconds
+
+    def __init__(self):
+        self._sockets = dict()  # type: typing.Dict[str, Path]
+
+    def share_name(self, index: int, share: HostShare):
+        return share.name or "share{}".format(index + 1)
+
+    @staticmethod
+    def virtiofsd_binary() -> "typing.Optional[str]":
+        for candidate in ("virtiofsd", "/usr/libexec/virtiofsd", "/usr/lib/qemu/virtiofsd"):
+            found = shutil.which(candidate)
+            if found:
+                return found
+        return None
+
+    def is_available(self, qemu_binary: str, machine: str = None):
+        if machine is not None and machine.split("-")[0] not in self.numa_machine_types:
+            return False
+        return IS_LINUX and self.virtiofsd_binary() is not None and super().is_available(qemu_binary, machine)
+
+    def socket_path(self, index: int, runtime_dir: Path) -> Path:
+        return runtime_dir / "virtiofsd-{}.sock".format(index)
+
+    def start_host_daemons(self, shares: "typing.List[HostShare]", runtime_dir: Path):
+        result = []
+        for index, share in enumerate(shares):
+            cmd = [self.virtiofsd_binary(), "--socket-path=" + str(self.socket_path(index, runtime_dir)),
+                   "--shared-dir=" + share.hostdir, "--sandbox=none"]
+            if share.readonly:
+                cmd.append("--readonly")
+            result.append(subprocess.Popen(cmd, stdin=subprocess.DEVNULL))
+        try:
+            for index, daemon in enumerate(result):
+                self._wait_for_socket(daemon, self.socket_path(index, runtime_dir))
+        except HostShareDaemonError:
+            for daemon in result:
+                daemon.kill()
+                daemon.wait()
+            raise
+        return result
+
+    def _wait_for_socket(self, daemon: subprocess.Popen, socket_path: Path):
+        # QEMU fails to start if the vhost-user socket does not exist yet
+        deadline = time.time() + self.socket_timeout
+        while not socket_path.exists():
+            if daemon.poll() is not None:
+                raise HostShareDaemonError("virtiofsd exited with code {} before creating {}".format(
+                    daemon.returncode, socket_path))
+            if time.time() > deadline:
+                raise HostShareDaemonError("virtiofsd did not create {} within {} seconds".format(
+                    socket_path, self.socket_timeout))
+            time.sleep(0.05)
+
+    def qemu_args(self, shares: "typing.List[HostShare]", memory_size: str, runtime_dir: Path = None):
+        if not shares:
+            return []
+        assert runtime_dir is not None
+        result = ["-object", "memory-backend-memfd,id=mem,size=" + memory_size + ",share=on",
+                  "-numa", "node,memdev=mem"]
+        for index, share in enumerate(shares):
+            result += ["-chardev", "socket,id=vfs{},path={}".format(index, self.socket_path(index, runtime_dir)),
+                       "-device", "vhost-user-fs-pci,chardev=vfs{},tag={}".format(index, self.share_name(index, share))]
+        return result
+
+    def guest_mount_command(self, index: int, share: HostShare, mountpoint: str = None):
+        return "mount -t virtiofs {} '{}'".format(self.share_name(index, share), mountpoint or share.in_target)
+
+
+SHARE_BACKENDS = {b.name: b for b in (SmbShareBackend, Virtio9pShareBackend, VirtioFSShareBackend)}
+# The order in which backends are tried if the share backend is "auto" (fastest first)
+AUTO_SHARE_BACKEND_ORDER = ("virtiofs", "9p", "smb")
+
+
+def get_share_backend(name: str) -> HostShareBackend:
+    return SHARE_BACKENDS[name]()
+
+
+def share_qemu_args(backends: "typing.List[HostShareBackend]", shares: "typing.List[HostShare]", *,
+                    memory_size: str, runtime_dir: Path = None) -> "typing.Tuple[str, typing.List[str]]":
+    """
+    Returns the options that need to be appended to the -net user argument and the additional QEMU arguments that are
+    needed to export :param shares: using all :param backends:
+    """
+    network_options = ""
+    args = []
+    for backend in backends:
+        network_options += backend.user_network_options(shares)
+        args += backend.qemu_args(shares, memory_size, runtime_dir=runtime_dir)
+    return network_options, args
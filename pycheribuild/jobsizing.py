@@ -0,0 +1,311 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import math
+import os
+import re
+from collections import namedtuple
+from pathlib import Path
+
+try:
+    import typing
+except ImportError:
+    typing = {}
+
+MIB = 1024 * 1024
+# Values above this are used by cgroup v1 to mean "no limit" (LONG_MAX rounded down to the page size)
+_CGROUP_V1_UNLIMITED = 1 << 60
+
+
+def _read_first_line(path: Path) -> "typing.Optional[str]":
+    try:
+        with path.open("r") as f:
+            return f.readline().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _read_int(path: Path) -> "typing.Optional[int]":
+    value = _read_first_line(path)
+    if value is None or value == "max":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+class SystemResources(object):
+    """
+    The CPU and memory resources that are available to cheribuild. This takes cgroup (v1 and v2) limits into account
+    since our builders run inside containers where os.cpu_count() and /proc/meminfo report the whole host.
+    """
+
+    def __init__(self, cpu_count: int, cpu_quota: "typing.Optional[float]" = None,
+                 memory_available: "typing.Optional[int]" = None, load_average: float = 0.0):
+        self.cpu_count = cpu_count
+        self.cpu_quota = cpu_quota  # number of CPUs we may use according to the cgroup CFS quota
+        self.memory_available = memory_available  # in bytes
+        self.load_average = load_average
+
+    @property
+    def usable_cpus(self) -> int:
+        if self.cpu_quota is None:
+            return self.cpu_count
+        return max(1, min(self.cpu_count, int(math.ceil(self.cpu_quota))))
+
+    def __repr__(self):
+        mem = "unknown" if self.memory_available is None else "%.1f GiB" % (self.memory_available / (1024 * MIB))
+        return "<SystemResources cpus=%d quota=%s memory=%s load=%.1f>" % (self.cpu_count, self.cpu_quota, mem,
+                                                                              self.load_average)
+
+    @classmethod
+    def detect(cls, proc_root: Path = Path("/proc"), cgroup_root: Path = Path("/sys/fs/cgroup")) -> "SystemResources":
+        if hasattr(os, "sched_getaffinity"):
+            cpu_count = len(os.sched_getaffinity(0))
+        else:
+            cpu_count = os.cpu_count() or 1
+        cgroups = _CgroupInfo(proc_root, cgroup_root)
+        memory_available = _meminfo_available(proc_root)
+        cgroup_memory = cgroups.memory_available()
+        if cgroup_memory is not None:
+            memory_available = cgroup_memory if memory_available is None else min(memory_available, cgroup_memory)
+        try:
+            load_average = os.getloadavg()[0]
+        except OSError:
+            load_average = 0.0
+        return cls(cpu_count, cpu_quota=cgroups.cpu_quota(), memory_available=memory_available,
+                   load_average=load_average)
+
+
+def _meminfo_available(proc_root: Path) -> "typing.Optional[int]":
+    try:
+        with (proc_root / "meminfo").open("r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    # Not Linux: the total amount of physical memory is better than nothing
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class _CgroupInfo(object):
+    def __init__(self, proc_root: Path, cgroup_root: Path):
+        self.cgroup_root = cgroup_root
+        self.v2_path = None  # type: typing.Optional[str]
+        self.v1_paths = dict()  # type: typing.Dict[str, str]
+        try:
+            with (proc_root / "self/cgroup").open("r") as f:
+                for line in f:
+                    parts = line.strip().split(":", 2)
+                    if len(parts) != 3:
+                        continue
+                    hierarchy, controllers, path = parts
+                    if hierarchy == "0" and not controllers:
+                        self.v2_path = path
+                    for controller in controllers.split(","):
+                        if controller:
+                            self.v1_paths[controller] = path
+        except OSError:
+            pass
+
+    def _candidate_dirs(self, mount: Path, path: "typing.Optional[str]") -> "typing.List[Path]":
+        # Limits can be set on any of the parent cgroups. Inside a container the cgroup namespace usually means that
+        # the path is "/" and the files are directly in the mountpoint
+        result = []
+        if path:
+            current = Path(path.lstrip("/"))
+            while str(current) not in (".", ""):
+                result.append(mount / current)
+                current = current.parent
+        result.append(mount)
+        return [d for d in result if d.is_dir()]
+
+    def _v1_dirs(self, controller: str, mount_names: "typing.Iterable[str]") -> "typing.List[Path]":
+        if controller not in self.v1_paths:
+            return []
+        for name in mount_names:
+            if (self.cgroup_root / name).is_dir():
+                return self._candidate_dirs(self.cgroup_root / name, self.v1_paths[controller])
+        return []
+
+    def cpu_quota(self) -> "typing.Optional[float]":
+        quotas = []
+        if self.v2_path is not None:
+            for d in self._candidate_dirs(self.cgroup_root, self.v2_path):
+                values = (_read_first_line(d / "cpu.max") or "").split()
+                if len(values) == 2 and values[0] != "max":
+                    try:
+                        quotas.append(int(values[0]) / int(values[1]))
+                    except (ValueError, ZeroDivisionError):
+                        pass
+        for d in self._v1_dirs("cpu", ("cpu,cpuacct", "cpu", "cpuacct,cpu")):
+            quota = _read_int(d / "cpu.cfs_quota_us")
+            period = _read_int(d / "cpu.cfs_period_us")
+            if quota is not None and quota > 0 and period:
+                quotas.append(quota / period)
+        return min(quotas) if quotas else None
+
+    def memory_available(self) -> "typing.Optional[int]":
+        available = []
+        if self.v2_path is not None:
+            for d in self._candidate_dirs(self.cgroup_root, self.v2_path):
+                limit = _read_int(d / "memory.max")
+                if limit is not None:
+                    available.append(limit - (_read_int(d / "memory.current") or 0))
+        for d in self._v1_dirs("memory", ("memory",)):
+            limit = _read_int(d / "memory.limit_in_bytes")
+            if limit is not None and limit < _CGROUP_V1_UNLIMITED:
+                available.append(limit - (_read_int(d / "memory.usage_in_bytes") or 0))
+        return max(0, min(available)) if available else None
+
+
+JobCounts = namedtuple("JobCounts", ["compile_jobs", "link_jobs", "reason"])
+
+
+def compute_job_counts(requested_jobs: int, resources: SystemResources, *, compile_job_memory_mb: int,
+                       link_job_memory_mb: "typing.Optional[int]" = None, max_link_jobs: "typing.Optional[int]" = None,
+                       consider_load=False) -> JobCounts:
+    """
+    Compute the -j value and the number of parallel link jobs (for projects that have a separate link pool such as
+    LLVM_PARALLEL_LINK_JOBS). The result is never larger than requested_jobs (i.e. the --make-jobs value).
+    :param compile_job_memory_mb: the expected peak memory usage of a single compile job
+    :param link_job_memory_mb: the expected peak memory usage of a single link job in the link pool
+    :param max_link_jobs: upper bound for the link pool size
+    :param consider_load: subtract the current load average from the number of usable CPUs
+    """
+    requested_jobs = max(1, int(requested_jobs))
+    jobs = requested_jobs
+    reasons = []
+    if resources.usable_cpus < jobs:
+        jobs = resources.usable_cpus
+        reasons.append("CPU quota of %.1f CPUs" % resources.cpu_quota if resources.cpu_quota is not None else
+                       "%d usable CPUs" % resources.usable_cpus)
+    if consider_load:
+        idle_cpus = int(resources.usable_cpus - resources.load_average)
+        if idle_cpus < jobs:
+            jobs = max(1, idle_cpus)
+            reasons.append("load average of %.1f" % resources.load_average)
+
+    link_jobs = None
+    if link_job_memory_mb is not None or max_link_jobs is not None:
+        link_jobs = jobs if max_link_jobs is None else max(1, min(jobs, max_link_jobs))
+    memory = resources.memory_available
+    if memory is not None:
+        if link_jobs is not None and link_job_memory_mb:
+            # Keep at most half of the memory for the link pool and use the rest for compile jobs
+            max_links_for_memory = max(1, int(memory / 2 // (link_job_memory_mb * MIB)))
+            if max_links_for_memory < link_jobs:
+                link_jobs = max_links_for_memory
+                reasons.append("%d MiB per link job" % link_job_memory_mb)
+            memory -= link_jobs * link_job_memory_mb * MIB
+        if compile_job_memory_mb:
+            max_jobs_for_memory = max(1, int(max(0, memory) // (compile_job_memory_mb * MIB)))
+            if max_jobs_for_memory < jobs:
+                jobs = max_jobs_for_memory
+                reasons.append("%d MiB per compile job" % compile_job_memory_mb)
+    if link_jobs is not None:
+        link_jobs = min(link_jobs, jobs)
+    if reasons:
+        mem_str = "unknown" if resources.memory_available is None else \
+            "%.1f GiB" % (resources.memory_available / (1024 * MIB))
+        reason = "limited by " + ", ".join(reasons) + " (" + mem_str + " available)"
+    else:
+        reason = "using the requested number of jobs"
+    return JobCounts(compile_jobs=jobs, link_jobs=link_jobs, reason=reason)
+
+
+def load_link_memory_history(path: Path) -> "typing.Dict[str, int]":
+    """
+    Load the peak RSS (in KiB) of the link steps recorded by the link wrapper (one JSON object per line).
+    Only the most recent entry for each output is used. The file is compacted if it contains many stale entries.
+    """
+    result = dict()
+    lines = 0
+    try:
+        with path.open("r") as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                    result[entry["output"]] = int(entry["maxrss_kb"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # e.g. partially written line from an interrupted build
+    except OSError:
+        return result
+    if lines > 2 * len(result) + 100:
+        try:
+            tmp = path.with_suffix(".tmp")
+            with tmp.open("w") as f:
+                for output, maxrss in result.items():
+                    f.write(json.dumps({"output": output, "maxrss_kb": maxrss}) + "\n")
+            os.replace(str(tmp), str(path))
+        except OSError:
+            pass
+    return result
+
+
+def estimate_link_job_memory_mb(history: "typing.Dict[str, int]", min_samples=3,
+                                headroom=1.1) -> "typing.Optional[int]":
+    """
+    Estimate the memory that must be reserved for each job in the link pool from the recorded peak RSS values.
+    The largest link step is used since any of the jobs in the pool could be that one.
+    :return: None if there is not enough data
+    """
+    if len(history) < min_samples:
+        return None
+    return max(64, int(math.ceil(max(history.values()) * headroom / 1024)))
+
+
+def set_ninja_pool_depth(build_ninja: Path, pool: str, depth: int) -> bool:
+    """
+    Update the depth of a pool in an existing build.ninja without having to re-run CMake.
+    The modification time is preserved so that ninja does not consider the file out-of-date.
+    :return: True if the file was changed
+    """
+    try:
+        contents = build_ninja.read_text()
+        stat = build_ninja.stat()
+    except OSError:
+        return False
+    pattern = re.compile(r"^(pool " + re.escape(pool) + r"\n\s+depth\s*=\s*)(\d+)$", re.MULTILINE)
+    match = pattern.search(contents)
+    if not match or int(match.group(2)) == depth:
+        return False
+    new_contents = contents[:match.start(2)] + str(depth) + contents[match.end(2):]
+    tmp = build_ninja.with_name(build_ninja.name + ".tmp")
+    tmp.write_text(new_contents)
+    os.utime(str(tmp), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(str(tmp), str(build_ninja))
+    return True
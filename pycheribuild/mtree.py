@@ -48,6 +48,20 @@ class MtreeEntry(object):
     def is_file(self):
         return self.attributes.get("type") == "file"
 
+    def is_link(self):
+        return self.attributes.get("type") == "link"
+
+    def is_hardlink(self):
+        return self.attributes.get("type") == "hlink"
+
+    def relative_link_target(self) -> str:
+        """Return the link= target rewritten so that absolute targets are relative to the mtree root"""
+        target = self.attributes["link"]
+        if not target.startswith("/"):
+            return target
+        # ./usr/lib/libfoo.so -> /lib/libfoo.so.1 becomes ../../lib/libfoo.so.1
+        return os.path.relpath(target.lstrip("/"), os.path.dirname(self.path[2:]) or ".")
+
     @classmethod
     def parse(cls, line: str, contents_root: Path=None) -> "MtreeEntry":
         elements = shlex.split(line)
@@ -213,6 +227,20 @@ class MtreeFile(object):
             statusUpdate("Adding dir", path, "to mtree", file=sys.stderr)
         self._mtree[mtree_path] = MtreeEntry(mtree_path, attribs)
 
+    def entries_with_prefix(self, *prefixes: str) -> "typing.List[MtreeEntry]":
+        """
+        :param prefixes: path prefixes (e.g. "./usr/include/") that should be included. Prefixes ending with a
+        slash also match the directory itself.
+        :return: the matching entries sorted by path (i.e. parent directories always come before their contents)
+        """
+        result = []
+        for path in sorted(self._mtree.keys()):
+            for prefix in prefixes:
+                if path.startswith(prefix) or (prefix.endswith("/") and path == prefix[:-1]):
+                    result.append(self._mtree[path])
+                    break
+        return result
+
     def __contains__(self, item):
         mtree_path = self._ensure_mtree_path_fmt(str(item))
         return mtree_path in self._mtree
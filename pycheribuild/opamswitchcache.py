@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from .utils import *
+
+# Directories in the opam root that are only needed while building packages and don't need to be archived
+_SNAPSHOT_EXCLUDES = ["download-cache", "*/.opam-switch/build", "*/.opam-switch/sources", "log"]
+
+
+class OpamSwitchSnapshotCache(object):
+    """
+    Archives of a fully built opam root (including the switch for one OCaml version) that can be restored instead of
+    running `opam init` and `opam switch create`. Compiled OCaml packages contain absolute paths, so the snapshots are
+    keyed on the location of the opam root as well as the OCaml version and the package lockfile.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def snapshot_key(opamroot: Path, ocaml_version: str, lockfile: "typing.Optional[Path]") -> str:
+        digest = hashlib.sha256()
+        digest.update(str(opamroot.absolute()).encode("utf-8") + b"\0" + ocaml_version.encode("utf-8") + b"\0")
+        if lockfile is not None:
+            digest.update(lockfile.read_bytes())
+        return ocaml_version + "-" + digest.hexdigest()[:16]
+
+    def snapshot_path(self, key: str) -> Path:
+        return self.cache_dir / (key + ".tar.gz")
+
+    def find(self, opamroot: Path, ocaml_version: str, lockfile: "typing.Optional[Path]") -> "typing.Optional[Path]":
+        snapshot = self.snapshot_path(self.snapshot_key(opamroot, ocaml_version, lockfile))
+        return snapshot if snapshot.is_file() else None
+
+    @staticmethod
+    def restore(snapshot: Path, opamroot: Path):
+        statusUpdate("Restoring opam root", opamroot, "from snapshot", snapshot)
+        runCmd("mkdir", "-p", opamroot.parent)
+        runCmd("tar", "-xzf", snapshot, "-C", opamroot.parent)
+
+    def save(self, opamroot: Path, ocaml_version: str, lockfile: "typing.Optional[Path]") -> Path:
+        key = self.snapshot_key(opamroot, ocaml_version, lockfile)
+        snapshot = self.snapshot_path(key)
+        statusUpdate("Saving snapshot of opam root", opamroot, "to", snapshot)
+        runCmd("mkdir", "-p", self.cache_dir)
+        # Write to a temporary file first so that concurrent builds never see a partial archive
+        tmp = snapshot.with_name(snapshot.name + ".tmp" + str(os.getpid()))
+        excludes = ["--exclude=" + opamroot.name + "/" + pattern for pattern in _SNAPSHOT_EXCLUDES]
+        runCmd(["tar", "-czf", tmp] + excludes + ["-C", opamroot.parent, opamroot.name])
+        runCmd("mv", "-f", tmp, snapshot)
+        metadata = dict(ocaml_version=ocaml_version, opamroot=str(opamroot.absolute()),
+                        lockfile=str(lockfile) if lockfile else None, created=datetime.datetime.utcnow().isoformat())
+        if snapshot.exists():  # not created in pretend mode
+            (self.cache_dir / (key + ".json")).write_text(json.dumps(metadata, indent=2))
+        return snapshot
@@ -218,8 +218,8 @@ class BuildQEMUBase(AutotoolsProject):
             "--disable-werror",
             "--disable-pie",  # no need to build as PIE (this just slows down QEMU)
             "--extra-cflags=" + self._extraCFlags,
-            "--cxx=" + str(self.config.clangPlusPlusPath),
-            "--cc=" + str(self.config.clangPath),
+            "--cxx=" + commandline_to_str(self.compiler_launcher + [str(self.config.clangPlusPlusPath)]),
+            "--cc=" + commandline_to_str(self.compiler_launcher + [str(self.config.clangPath)]),
         ])
         if self._extraLDFlags:
             self.configureArgs.append("--extra-ldflags=" + self._extraLDFlags.strip())
@@ -40,5 +40,5 @@ class BuildCMake(AutotoolsProject):
 
     def __init__(self, config: CheriConfig):
         super().__init__(config, configureScript="bootstrap")
-        self.configureArgs.append("--parallel=" + str(self.config.makeJobs))
+        self.configureArgs.append("--parallel=" + str(self.make_jobs))
         # TODO: do we need to use gmake on FreeBSD?
@@ -141,10 +141,14 @@ class BuildMibench(CrossCompileProject):
             if not (benchmark_dir / "run_jenkins-bluehive.sh").exists():
                 self.fatal("Created invalid benchmark bundle...")
             num_iterations = self.config.benchmark_iterations or 10
+
+            def script_args(iterations):
+                return ["-d1", "-r" + str(iterations), "-s", self.benchmark_size,
+                        "-o", self.default_statcounters_csv_name, self.benchmark_version]
             self.run_fpga_benchmark(benchmark_dir, output_file=self.default_statcounters_csv_name,
-                                    benchmark_script_args=["-d1", "-r" + str(num_iterations), "-s", self.benchmark_size,
-                                                           "-o", self.default_statcounters_csv_name,
-                                                           self.benchmark_version])
+                                    benchmark_script_args=script_args(num_iterations),
+                                    parallel_benchmark_script_args=[script_args(i) for i, _ in
+                                                                    self.split_benchmark_work(num_iterations)])
 
 class BuildOlden(CrossCompileProject):
     repository = GitRepository("git@github.com:CTSRD-CHERI/olden")
@@ -225,9 +229,13 @@ class BuildOlden(CrossCompileProject):
             if not (benchmark_dir / "run_jenkins-bluehive.sh").exists():
                 self.fatal("Created invalid benchmark bundle...")
             num_iterations = self.config.benchmark_iterations or 15
+
+            def script_args(iterations):
+                return ["-d1", "-r" + str(iterations), "-o", self.default_statcounters_csv_name, self.test_arch_suffix]
             self.run_fpga_benchmark(benchmark_dir, output_file=self.default_statcounters_csv_name,
-                                    benchmark_script_args=["-d1", "-r" + str(num_iterations), "-o",
-                                                           self.default_statcounters_csv_name, self.test_arch_suffix])
+                                    benchmark_script_args=script_args(num_iterations),
+                                    parallel_benchmark_script_args=[script_args(i) for i, _ in
+                                                                    self.split_benchmark_work(num_iterations)])
 
 class BuildSpec2006(CrossCompileProject):
     target = "spec2006"
@@ -452,14 +460,18 @@ cd /build/spec-test-dir/benchspec/CPU2006/ && ./run_jenkins-bluehive.sh -b "{ben
         with tempfile.TemporaryDirectory() as td:
             benchmarks_dir = self.create_tests_dir(Path(td))
             num_iterations = self.config.benchmark_iterations or 3
+
+            def script_args(iterations, benchmarks):
+                return ["-d1", "-r" + str(iterations), "-t", self.config_name,
+                        "-o", self.default_statcounters_csv_name, "-b", commandline_to_str(benchmarks),
+                        self.bluehive_benchmark_script_archname]
             self.run_fpga_benchmark(benchmarks_dir, output_file=self.default_statcounters_csv_name,
                                     # The benchmarks take a long time to run -> allow up to a 3 hours per iteration
                                     extra_runbench_args=["--timeout", str(60 * 60 * 3 * num_iterations)],
-                                    benchmark_script_args=["-d1", "-r" + str(num_iterations),
-                                                           "-t", self.config_name,
-                                                           "-o", self.default_statcounters_csv_name,
-                                                           "-b", commandline_to_str(self.benchmark_list),
-                                                           self.bluehive_benchmark_script_archname])
+                                    benchmark_script_args=script_args(num_iterations, self.benchmark_list),
+                                    parallel_benchmark_script_args=[script_args(i, b) for i, b in
+                                                                    self.split_benchmark_work(num_iterations,
+                                                                                              self.benchmark_list)])
 
 
     def __check_valid_benchmark_list(self):
@@ -71,6 +71,8 @@ class BuildBODiagSuite(CrossCompileCMakeProject):
         cls.use_fortify_source = cls.addBoolOption("use-fortify-source", help="Compile tests with _DFORTIFY_SOURCE=2 (no effect on FreeBSD)")
         cls.use_softboundcets = cls.addBoolOption("use-softboundcets", help="Compile tests with SoftBoundCETS (native only)", only_add_for_targets=[CrossCompileTarget.NATIVE])
         cls.use_effectivesan = cls.addBoolOption("use-effectivesan", help="Compile tests with EffectiveSan (native only)", only_add_for_targets=[CrossCompileTarget.NATIVE])
+        cls.junit_xml_only = cls.addBoolOption("junit-xml-only", help="Don't run the tests and only re-score the test "
+                                                                      "output from the previous run in the build directory")
 
 
     @property
@@ -149,11 +151,11 @@ class BuildBODiagSuite(CrossCompileCMakeProject):
             self.fatal("Could not find bmake")
         # Ensure the run directory exists
         self.makedirs(self.buildDir / "run")
-        if self.config.clean:
+        if self.config.clean and not self.junit_xml_only:
             self.cleanDirectory(self.buildDir / "run", keepRoot=False)
         testsuite_prefix = self.build_configuration_suffix()[1:]
         testsuite_prefix = testsuite_prefix.replace("-build", "")
-        extra_args = ["--bmake-path", bmake, "--jobs", str(self.config.makeJobs)] if self.compiling_for_host() else []
+        extra_args = ["--bmake-path", bmake, "--jobs", str(self.make_jobs)] if self.compiling_for_host() else []
         tools = []
         if self.compiling_for_cheri():
             tools.append("cheri")
@@ -173,8 +175,11 @@ class BuildBODiagSuite(CrossCompileCMakeProject):
             tools.append("fortify-source")
         if self.use_stack_protector:
             tools.append("stack-protector")
+        if self.junit_xml_only:
+            extra_args.append("--junit-xml-only")
+        extra_args.extend(["--parse-jobs", str(self.make_jobs)])
         extra_args.append("--tools")
         extra_args.extend(tools)
 
         self.run_cheribsd_test_script("run_bodiagsuite.py", "--junit-testsuite-name", testsuite_prefix, *extra_args,
-                                      mount_sourcedir=False, mount_builddir=True)
+                                      mount_sourcedir=False, mount_builddir=True, host_only=self.junit_xml_only)
@@ -27,13 +27,18 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
+import hashlib
 import inspect
 import os
 import shlex
 import shutil
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
+import time
+from collections import OrderedDict
 
 from pathlib import Path
 from .multiarchmixin import MultiArchBaseMixin
@@ -41,6 +46,7 @@ from ..project import *
 from ..llvm import BuildUpstreamLLVM
 from ...config.loader import ComputedDefaultValue
 from ...config.chericonfig import CrossCompileTarget, MipsFloatAbi
+from ...mtree import MtreeEntry, MtreeFile
 from ...utils import *
 
 
@@ -202,13 +208,13 @@ class BuildFreeBSDBase(Project):
 
     def runMake(self, makeTarget="", *, options: MakeOptions = None, parallel=True, **kwargs):
         # make behaves differently with -j1 and not j flags -> remove the j flag if j1 is requested
-        if parallel and self.config.makeJobs == 1:
+        if parallel and self.make_jobs == 1:
             parallel = False
         super().runMake(makeTarget, options=options, cwd=self.sourceDir, parallel=parallel, **kwargs)
 
     @property
     def jflag(self) -> list:
-        return [self.config.makeJFlag] if self.config.makeJobs > 1 else []
+        return ["-j" + str(self.make_jobs)] if self.make_jobs > 1 else []
 
     # Return the path the a potetial sysroot created from installing this project
     # Currently we only create sysroots for CheriBSD but we might change that in the future
@@ -223,6 +229,7 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
     repository = GitRepository("https://github.com/freebsd/freebsd.git")
     crossbuild = False
     baremetal = True  # We are building the full OS so we don't need a sysroot
+    uses_compiler_launcher = True  # via CCACHE_BIN
     # Only CheriBSD can target CHERI, upstream FreeBSD won't work
     supported_architectures = [CrossCompileTarget.NATIVE, CrossCompileTarget.MIPS]
     default_architecture = CrossCompileTarget.NATIVE
@@ -300,6 +307,9 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
                                                                     " since they can just be read from the host.")
         cls.fastRebuild = cls.addBoolOption("fast",
                                             help="Skip some (usually) unnecessary build steps to speed up rebuilds")
+        cls.parallel_kernel_builds = cls.addBoolOption("parallel-kernel-builds", default=True, showHelp=True,
+            help="When building more than one kernel config run the `make buildkernel` steps concurrently (each in"
+                 " its own object directory) and split the -j value between them")
 
     def _stdoutFilter(self, line: bytes):
         if line.startswith(b">>> "):  # major status update
@@ -543,17 +553,7 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
         else:
             return self.asyncCleanDirectory(builddir)
 
-    def _buildkernel(self, kernconf: str, mfs_root_image: Path = None):
-        kernelMakeArgs = self.kernelMakeArgsForConfig(kernconf)
-        if self.debug_kernel:
-            if "_BENCHMARK" in kernconf:
-                if not self.queryYesNo("Trying to build BENCHMARK kernel without optimization. Continue?"):
-                    return
-            kernelMakeArgs.set(COPTFLAGS="-O0 -DBOOTVERBOSE=2")
-        if mfs_root_image:
-            kernelMakeArgs.set(MFS_IMAGE=mfs_root_image)
-            if "MFS_ROOT" not in kernconf:
-                warningMessage("Attempting to build an MFS_ROOT kernel but kernel config name sounds wrong")
+    def _build_kernel_toolchain_if_needed(self):
         # needKernelToolchain = not self.useExternalToolchainForKernel
         dontNeedKernelToolchain = self.useExternalToolchainForKernel and self.linker_for_kernel == "lld"
         if not dontNeedKernelToolchain and not self.kernelToolchainAlreadyBuilt:
@@ -567,8 +567,83 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
                 kernel_toolchain_opts.set_with_options(AUTO_OBJ=True)
             self.runMake("kernel-toolchain", options=kernel_toolchain_opts)
             self.kernelToolchainAlreadyBuilt = True
-        self.runMake("buildkernel", options=kernelMakeArgs,
-                     compilationDbName="compile_commands_" + self.kernelConfig + ".json")
+
+    def _buildkernel(self, kernconf: str, mfs_root_image: Path = None, make_jobs: int = None):
+        """
+        :param kernconf: the kernel config to build
+        :param mfs_root_image: the MFS_IMAGE to embed in the kernel (or None)
+        :param make_jobs: build with this -j value instead of the global one and write a separate logfile (used when
+        building multiple kernels concurrently)
+        """
+        kernelMakeArgs = self.kernelMakeArgsForConfig(kernconf)
+        if self.debug_kernel:
+            kernelMakeArgs.set(COPTFLAGS="-O0 -DBOOTVERBOSE=2")
+        if mfs_root_image:
+            kernelMakeArgs.set(MFS_IMAGE=mfs_root_image)
+            if "MFS_ROOT" not in kernconf:
+                warningMessage("Attempting to build an MFS_ROOT kernel but kernel config name sounds wrong")
+        self._build_kernel_toolchain_if_needed()
+        if make_jobs is None:
+            self.runMake("buildkernel", options=kernelMakeArgs,
+                         compilationDbName="compile_commands_" + kernconf + ".json")
+        else:
+            if make_jobs > 1:
+                kernelMakeArgs.add_flags("-j" + str(make_jobs))
+            self.runMake("buildkernel", options=kernelMakeArgs, parallel=False, logfileName="buildkernel." + kernconf,
+                         compilationDbName="compile_commands_" + kernconf + ".json")
+
+    def _buildkernels(self, kernels: "typing.List[typing.Tuple[str, typing.Optional[Path]]]"):
+        """
+        Build all kernel configs in kernels (a list of (KERNCONF, MFS_IMAGE) pairs).
+        Every KERNCONF is built in a separate object directory so unless --<target>/parallel-kernel-builds is false
+        we can run all the buildkernel steps at the same time, splitting the -j value between them.
+        We can't just pass KERNCONF="A B C" since that would build the kernels one after the other and apply the same
+        MFS_IMAGE to all of them.
+        """
+        if self.debug_kernel and any("_BENCHMARK" in kernconf for kernconf, _ in kernels):
+            # Ask before starting any of the (possibly concurrent) builds
+            if not self.queryYesNo("Trying to build BENCHMARK kernel without optimization. Continue?"):
+                kernels = [k for k in kernels if "_BENCHMARK" not in k[0]]
+        if not kernels:
+            return
+        make_jobs = self.make_jobs // len(kernels)
+        if len(kernels) == 1 or not self.parallel_kernel_builds or make_jobs < 1 or self.config.pretend:
+            for kernconf, mfs_root_image in kernels:
+                self._buildkernel(kernconf=kernconf, mfs_root_image=mfs_root_image)
+            return
+        # The kernel toolchain is shared by all kernels -> build it before starting the parallel jobs
+        self._build_kernel_toolchain_if_needed()
+        statusUpdate("Building kernels", ", ".join(k for k, _ in kernels), "in parallel with -j" + str(make_jobs),
+                     "each")
+        results = OrderedDict((kernconf, None) for kernconf, _ in kernels)  # type: typing.Dict[str, typing.Any]
+        durations = dict()  # type: typing.Dict[str, float]
+
+        def do_build(kernconf: str, mfs_root_image: "typing.Optional[Path]"):
+            starttime = time.time()
+            try:
+                self._buildkernel(kernconf=kernconf, mfs_root_image=mfs_root_image, make_jobs=make_jobs)
+            except (SystemExit, Exception) as e:
+                # Any exception must be reported here, otherwise the kernel would be treated as built successfully
+                results[kernconf] = e
+            finally:
+                durations[kernconf] = time.time() - starttime
+
+        threads = [threading.Thread(target=do_build, args=(kernconf, image), name="buildkernel " + kernconf)
+                   for kernconf, image in kernels]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        failed = []
+        for kernconf, error in results.items():
+            if error is None:
+                statusUpdate("  Built kernel", kernconf, "in", durations[kernconf], "seconds")
+            else:
+                failed.append(kernconf)
+                warningMessage("  Building kernel", kernconf, "failed after", durations.get(kernconf, 0.0), "seconds:",
+                               error)
+        if failed:
+            self.fatal("Failed to build kernel configs:", " ".join(failed))
 
     def _installkernel(self, kernconf, destdir: str=None):
         # don't use multiple jobs here
@@ -602,13 +677,21 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
                 build_args.set(WORLDFAST=True)
             self.runMake("buildworld", options=build_args)
             self.kernelToolchainAlreadyBuilt = True  # includes the necessary tools for kernel-toolchain
+        kernels = []
         if not self.subdirOverride:
+            kernel_mfs_root_image = mfs_root_image
             for i in ("USBROOT", "NFSROOT", "MDROOT"):
                 if ("_" + i) in self.kernelConfig:
                     self.info("Not embedding MFS_ROOT image in non-MFS root kernel config:", self.kernelConfig)
-                    mfs_root_image = None
+                    kernel_mfs_root_image = None
                     break
-            self._buildkernel(kernconf=self.kernelConfig, mfs_root_image=mfs_root_image)
+            kernels.append((self.kernelConfig, kernel_mfs_root_image))
+        kernels.extend(self._extra_kernels_to_build())
+        self._buildkernels(kernels)
+
+    def _extra_kernels_to_build(self) -> "typing.List[typing.Tuple[str, typing.Optional[Path]]]":
+        """:return: additional (KERNCONF, MFS_IMAGE) pairs that should be built together with the default kernel"""
+        return []
 
     def _removeOldRootfs(self):
         assert self.config.clean or not self.keepOldRootfs
@@ -745,6 +828,13 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
             self.make_args.set_env(CC=self.config.sdkBinDir / "clang", CXX=self.config.sdkBinDir / "clang++")
         else:
             self.make_args.set_env(CC=str(self.config.clangPath), CXX=str(self.config.clangPlusPlusPath))
+        if self.compiler_launcher:
+            # FreeBSD has built-in support for ccache (CCACHE_BIN can also be sccache or the compilation db wrapper)
+            self.make_args.set_with_options(CCACHE_BUILD=True)
+            self.make_args.set_env(CCACHE_BIN=self.compiler_launcher[0])
+            if len(self.compiler_launcher) > 1:
+                # CCACHE_BIN must be a single binary -> let the compilation db wrapper run ccache
+                self.make_args.set_env(CHERIBUILD_COMPDB_LAUNCHER=self.compiler_launcher[1])
 
         # we don't build elftoolchain during buildworld so for the kernel we need to set these variables
         self.make_args.set_env(XOBJDUMP=self.config.sdkBinDir / "llvm-objdump")
@@ -1134,15 +1224,12 @@ class BuildCHERIBSD(BuildFreeBSD):
             if not mipsCC.is_file():
                 self.fatal("MIPS toolchain specified but", mipsCC, "is missing.")
         super().compile(mfs_root_image=self.mfs_root_image, sysroot_only=self.sysroot_only, **kwargs)
-        if self.sysroot_only:
-            return  # Don't attempt to build extra kernels if we are only building a sysroot
 
+    def _extra_kernels_to_build(self):
         # We could also just pass multiple values in KERNCONF to build all those kernels. However, if MFS_ROOT is set
         # that will apply to all those kernels and embed the rootfs even if not needed
-        for i in self.extra_kernels:
-            self._buildkernel(kernconf=i)
-        for i in self.extra_kernels_with_mfs:
-            self._buildkernel(kernconf=i, mfs_root_image=self.mfs_root_image)
+        return [(i, None) for i in self.extra_kernels] + \
+               [(i, self.mfs_root_image) for i in self.extra_kernels_with_mfs]
 
     def install(self, **kwargs):
         all_kernel_configs = self.kernelConfig
@@ -1192,14 +1279,16 @@ class BuildCheriBsdMfsKernel(MultiArchBaseMixin, SimpleProject):
             if kernel_dir:
                 with self.asyncCleanDirectory(kernel_dir):
                     self.verbose_print("Cleaning ", kernel_dir)
-        self._build_and_install_kernel_binary(build_cheribsd_instance, kernconf=kernconf, image=image)
         # also build the benchmark kernel:
-        self._build_and_install_kernel_binary(build_cheribsd_instance, kernconf=kernconf + "_BENCHMARK", image=image)
-
+        kernconfs = [kernconf, kernconf + "_BENCHMARK"]
         if build_cheribsd_instance.buildFpgaKernels:
             prefix = self.fpga_kernconf
-            self._build_and_install_kernel_binary(build_cheribsd_instance, kernconf=prefix, image=image)
-            self._build_and_install_kernel_binary(build_cheribsd_instance, kernconf=prefix + "_BENCHMARK", image=image)
+            kernconfs.extend([prefix, prefix + "_BENCHMARK"])
+        # All kernels use a separate objdir so we can build them concurrently and then install them one by one
+        # noinspection PyProtectedMember
+        build_cheribsd_instance._buildkernels([(k, image) for k in kernconfs])
+        for k in kernconfs:
+            self._install_kernel_binary(build_cheribsd_instance, kernconf=k)
 
     @property
     def fpga_kernconf(self):
@@ -1211,10 +1300,8 @@ class BuildCheriBsdMfsKernel(MultiArchBaseMixin, SimpleProject):
             self.fatal("Invalid ARCH")
             return "INVALID_KERNCONF"
 
-    def _build_and_install_kernel_binary(self, build_cheribsd: BuildCHERIBSD, kernconf: str, image: Path):
+    def _install_kernel_binary(self, build_cheribsd: BuildCHERIBSD, kernconf: str):
         # Install to a temporary directory and then copy the kernel to OUTPUT_ROOT
-        # noinspection PyProtectedMember
-        build_cheribsd._buildkernel(kernconf=kernconf, mfs_root_image=image)
         with tempfile.TemporaryDirectory(prefix="cheribuild-" + self.target + "-") as td:
             # noinspection PyProtectedMember
             build_cheribsd._installkernel(kernconf=kernconf, destdir=td)
@@ -1381,21 +1468,9 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
 
     def __init__(self, config: CheriConfig):
         super().__init__(config)
-        # GNU tar doesn't accept --include (and doesn't handle METALOG). bsdtar appears to be available
-        # on FreeBSD and macOS by default. On Linux it is not always installed by default.
-        self.bsdtar_cmd = "bsdtar"
-        self.addRequiredSystemTool("bsdtar", cheribuild_target="bsdtar", apt="bsdtar")
         if self.compiling_for_cheri() and self.use_cheribsd_purecap_rootfs:
             self.rootfs_source_class = BuildCHERIBSDPurecap
 
-    def fixSymlinks(self):
-        # copied from the build_sdk.sh script
-        # TODO: we could do this in python as well, but this method works
-        # FIXME: should no longer be needed
-        fixlinksSrc = includeLocalFile("files/fixlinks.c")
-        runCmd("cc", "-x", "c", "-", "-o", self.config.sdkDir / "bin/fixlinks", input=fixlinksSrc)
-        runCmd(self.config.sdkDir / "bin/fixlinks", cwd=self.crossSysrootPath / "usr/lib")
-
     def check_system_dependencies(self):
         super().check_system_dependencies()
         if not IS_FREEBSD and not self.remotePath and not self.rootfs_source_class.get_instance(self).crossbuild:
@@ -1420,6 +1495,9 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
         cls.use_cheribsd_purecap_rootfs = cls.addBoolOption("use-cheribsd-purecap-rootfs", default=False,
                                                             help="Use the rootfs built by cheribsd-purecap instead")
         cls.install_dir_override = cls.addPathOption("install-directory", help="Override for the sysroot install directory")
+        cls.create_sysroot_archive = cls.addBoolOption("create-sysroot-archive", default=True,
+                                                       help="Also write a .tar.gz archive of the sysroot (useful for "
+                                                            "copying it to another machine)")
 
     @property
     def crossSysrootPath(self) -> Path:
@@ -1456,20 +1534,11 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
     def sysroot_archive(self):
         return self.crossSysrootPath.parent / self.sysrootArchiveName
 
-    def createSysroot(self):
-        # we need to add include files and libraries to the sysroot directory
-        self.makedirs(self.crossSysrootPath / "usr")
-        # use tar+untar to copy all necessary files listed in metalog to the sysroot dir
-        # Since we are using the metalog argument we need to use BSD tar and not GNU tar!
-        bsdtar_path = shutil.which(str(self.bsdtar_cmd))
-        if not bsdtar_path:
-            bsdtar_path = str(self.bsdtar_cmd)
-        archiveCmd = [bsdtar_path, "cf", "-", "--include=./lib/", "--include=./usr/include/",
-                      "--include=./usr/lib/", "--include=./usr/libdata/"]
-        if self.compiling_for_cheri():
-            archiveCmd.append("--include=./usr/libcheri")
-        # only pack those files that are mentioned in METALOG
-        archiveCmd.append("@METALOG")
+    @property
+    def _manifest_hash_file(self) -> Path:
+        return self.crossSysrootPath / ".cheribuild-manifest-sha256"
+
+    def _rootfs_dir(self) -> Path:
         if self.compiling_for_mips() and self.use_cheri_sysroot_for_mips:
             rootfs_target = self.rootfs_source_class.get_instance_for_cross_target(CrossCompileTarget.CHERI, self.config)
         else:
@@ -1483,20 +1552,117 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
             else:
                 fixit = "Run `cheribuild.py " + rootfs_target.target + "` first"
             self.fatal("Sysroot source directory", rootfs_dir, "does not contain libc.so.7", fixitHint=fixit)
-        printCommand(archiveCmd, cwd=rootfs_dir)
-        if not self.config.pretend:
-            tar_cwd = str(rootfs_dir)
-            with subprocess.Popen(archiveCmd, stdout=subprocess.PIPE, cwd=tar_cwd) as tar:
-                runCmd(["tar", "xf", "-"], stdin=tar.stdout, cwd=self.crossSysrootPath)
-        if not (self.crossSysrootPath / "lib/libc.so.7").is_file():
-            self.fatal(self.crossSysrootPath, "is missing the libc library, install seems to have failed!")
+        return rootfs_dir
 
-        # fix symbolic links in the sysroot:
-        print("Fixing absolute paths in symbolic links inside lib directory...")
-        self.fixSymlinks()
-        # create an archive to make it easier to copy the sysroot to another machine
+    def _sysroot_manifest(self, rootfs_dir: Path) -> "typing.List[MtreeEntry]":
+        # Only the files that are mentioned in METALOG are copied to the sysroot
+        prefixes = ["./lib/", "./usr/include/", "./usr/lib/", "./usr/libdata/"]
+        if self.compiling_for_cheri():
+            prefixes.append("./usr/libcheri")
+        metalog = rootfs_dir / "METALOG"
+        if not metalog.is_file():
+            if self.config.pretend:
+                return []
+            self.fatal("Could not find METALOG file in", rootfs_dir)
+        return MtreeFile(metalog).entries_with_prefix(*prefixes)
+
+    @staticmethod
+    def _manifest_hash(rootfs_dir: Path, entries: "typing.List[MtreeEntry]") -> str:
+        # METALOG doesn't contain timestamps so we also hash the size and mtime of the source files.
+        # Raises FileNotFoundError if a file listed in METALOG is missing from rootfs_dir
+        h = hashlib.sha256()
+        for entry in entries:
+            h.update(str(entry).encode("utf-8"))
+            if entry.is_file() or entry.is_hardlink():
+                st = os.lstat(str(rootfs_dir / entry.path))
+                h.update(" {} {}\n".format(st.st_size, st.st_mtime_ns).encode("utf-8"))
+        return h.hexdigest()
+
+    def sysroot_is_up_to_date(self) -> bool:
+        if self.config.clean or self.config.force or self.config.pretend:
+            return False
+        if not self._manifest_hash_file.is_file() or not (self.crossSysrootPath / "lib/libc.so.7").is_file():
+            return False
+        if self.create_sysroot_archive and not self.sysroot_archive.is_file():
+            return False
+        rootfs_dir = self._rootfs_dir()
+        try:
+            new_hash = self._manifest_hash(rootfs_dir, self._sysroot_manifest(rootfs_dir))
+        except FileNotFoundError as e:
+            # METALOG lists a file that doesn't exist (e.g. a partial installworld) -> let createSysroot() report it
+            self.verbose_print("Sysroot is out of date since a file listed in METALOG is missing:", e)
+            return False
+        return self._manifest_hash_file.read_text(encoding="utf-8").strip() == new_hash
+
+    def _clone_or_link_file(self, src: Path, dest: Path):
+        # Prefer a copy-on-write clone (so that changes to the sysroot don't affect the rootfs), then a hardlink
+        # and only fall back to a full copy if both fail (e.g. when crossing filesystem boundaries)
+        if self.try_reflink(src, dest):
+            shutil.copystat(str(src), str(dest))
+            return
+        try:
+            os.link(str(src), str(dest))
+        except OSError:
+            shutil.copy2(str(src), str(dest))
+
+    def createSysroot(self):
+        rootfs_dir = self._rootfs_dir()
+        entries = self._sysroot_manifest(rootfs_dir)
+        statusUpdate("Populating", self.crossSysrootPath, "with", len(entries), "METALOG entries from", rootfs_dir)
         self.deleteFile(self.sysroot_archive, print_verbose_only=True)
-        runCmd("tar", "-czf", self.sysroot_archive, self.crossSysrootPath.name, cwd=self.crossSysrootPath.parent)
+        if self.config.pretend:
+            return
+        self.makedirs(self.crossSysrootPath / "usr")
+        archive = None
+        if self.create_sysroot_archive:
+            archive = tarfile.open(str(self.sysroot_archive), "w:gz")
+            archive.add(str(self.crossSysrootPath), arcname=self.crossSysrootPath.name, recursive=False)
+        fixed_links = 0
+        try:
+            for entry in entries:
+                relpath = entry.path[2:]
+                src = rootfs_dir / relpath
+                dest = self.crossSysrootPath / relpath
+                if entry.is_dir():
+                    dest.mkdir(parents=True, exist_ok=True)
+                elif entry.is_link():
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    target = entry.relative_link_target()
+                    if target != entry.attributes["link"]:
+                        fixed_links += 1
+                    if dest.is_symlink() or dest.exists():
+                        dest.unlink()
+                    os.symlink(target, str(dest))
+                elif entry.is_file() or entry.is_hardlink():
+                    # The rootfs also contains the type=hlink entries as files (hardlinked to their link= target)
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    if dest.is_symlink() or dest.exists():
+                        dest.unlink()
+                    self._clone_or_link_file(src, dest)
+                else:
+                    warningMessage("Skipping unsupported METALOG entry", entry)
+                    continue
+                if archive is not None:
+                    info = archive.gettarinfo(str(dest), arcname=self.crossSysrootPath.name + "/" + relpath)
+                    # Use the METALOG owner+permissions rather than the ones from the build user
+                    info.uid = info.gid = 0
+                    info.uname = entry.attributes.get("uname", "root")
+                    info.gname = entry.attributes.get("gname", "wheel")
+                    if "mode" in entry.attributes:
+                        info.mode = int(entry.attributes["mode"], 8)
+                    if info.isreg():
+                        with dest.open("rb") as f:
+                            archive.addfile(info, f)
+                    else:
+                        archive.addfile(info)
+        finally:
+            if archive is not None:
+                archive.close()
+        if not (self.crossSysrootPath / "lib/libc.so.7").is_file():
+            self.fatal(self.crossSysrootPath, "is missing the libc library, install seems to have failed!")
+        print("Fixed", fixed_links, "absolute symbolic links")
+        self.writeFile(self._manifest_hash_file, self._manifest_hash(rootfs_dir, entries), overwrite=True,
+                       noCommandPrint=True)
         print("Successfully populated sysroot")
 
     def process(self):
@@ -1504,8 +1670,12 @@ class BuildCheriBsdSysroot(MultiArchBaseMixin, SimpleProject):
             statusUpdate("Not building sysroot because --skip-buildworld was passed")
             return
 
+        building_on_host = IS_FREEBSD or self.rootfs_source_class.get_instance(self).crossbuild
+        if building_on_host and not self.copy_remote_sysroot and self.sysroot_is_up_to_date():
+            statusUpdate("Not recreating", self.crossSysrootPath, "since the METALOG entries are unchanged")
+            return
+
         with self.asyncCleanDirectory(self.crossSysrootPath):
-            building_on_host = IS_FREEBSD or self.rootfs_source_class.get_instance(self).crossbuild
             if self.copy_remote_sysroot or not building_on_host:
                 self.copySysrootFromRemoteMachine()
             else:
@@ -35,6 +35,8 @@ import pprint
 import re
 import shutil
 import shlex
+import subprocess
+import threading
 from builtins import issubclass
 from enum import Enum
 from pathlib import Path
@@ -44,6 +46,7 @@ from ...config.chericonfig import CrossCompileTarget, MipsFloatAbi, Linkage, Bui
 from .multiarchmixin import MultiArchBaseMixin
 from ..llvm import BuildCheriLLVM
 from ..project import *
+from ...statcounters import analyse_statcounters
 from ...utils import *
 
 __all__ = ["CheriConfig", "CrossCompileCMakeProject", "CrossCompileAutotoolsProject", "CrossCompileTarget", "BuildType", # no-combine
@@ -585,7 +588,12 @@ class CrossCompileMixin(MultiArchBaseMixin):
         self.run_cmd("du", "-sh", benchmark_dir)
 
     def run_fpga_benchmark(self, benchmarks_dir: Path, *, output_file: str = None, benchmark_script: str = None,
-                           benchmark_script_args: list = None, extra_runbench_args: list = None):
+                           benchmark_script_args: list = None, extra_runbench_args: list = None,
+                           parallel_benchmark_script_args: "typing.List[list]" = None):
+        """
+        :param parallel_benchmark_script_args: When running on QEMU with --benchmark-qemu-instances > 1, the script
+        arguments for each of the guests (see split_benchmark_work()). If not set, only one instance is used.
+        """
         assert benchmarks_dir is not None
         assert output_file is not None, "output_file must be set to a valid value"
         assert isinstance(self, Project) and isinstance(self, CrossCompileMixin)
@@ -672,12 +680,119 @@ export PATH="$PATH:{cherilibs_dir}/tools:{cherilibs_dir}/tools/debug"
 exec {cheribuild_path}/beri-fpga-bsd-boot.py {basic_args} -vvvvv runbench {runbench_args}
         """.format(cheri_dir=cheri_dir, cherilibs_dir=cherilibs_dir, runbench_args=commandline_to_str(runbench_args),
                    basic_args=commandline_to_str(basic_args), cheribuild_path=cheribuild_path)
-        if self.config.benchmark_with_qemu:
+        if self.config.benchmark_with_qemu and parallel_benchmark_script_args and \
+                len(parallel_benchmark_script_args) > 1:
+            qemu_ssh_socket.socket.close()
+            basic_args = [a for a in basic_args if not a.startswith("--qemu-ssh-port=")]
+            runbench_args = [a for a in runbench_args if not str(a).startswith("--script-args=")]
+            self._run_parallel_qemu_benchmark(cheribuild_path / "beri-fpga-bsd-boot.py", basic_args, runbench_args,
+                                              parallel_benchmark_script_args, output_file)
+        elif self.config.benchmark_with_qemu:
             # Free the port that we reserved for QEMU before starting beri-fpga-bsd-boot.py
             qemu_ssh_socket.socket.close()
             self.run_cmd([cheribuild_path / "beri-fpga-bsd-boot.py"] + basic_args + ["-vvvvv", "runbench"] + runbench_args)
         else:
             self.runShellScript(beri_fpga_bsd_boot_script, shell="bash")  # the setup script needs bash not sh
+        self.analyse_statcounters_csv(Path(output_file))
+
+    def split_benchmark_work(self, num_iterations: int, benchmarks: list = None) -> "typing.List[typing.Tuple[int, list]]":
+        """
+        Distribute the benchmark iterations (and if there are enough of them, the individual benchmarks) across the
+        --benchmark-qemu-instances QEMU guests.
+        :return: a list of (iterations, benchmarks) tuples, one per guest
+        """
+        num_guests = self.config.benchmark_qemu_instances if self.config.benchmark_with_qemu else 1
+        num_guests = max(1, num_guests)
+        if benchmarks and len(benchmarks) >= num_guests:
+            # Enough benchmarks to keep all guests busy -> run all iterations of a subset of the benchmarks
+            shards = [(num_iterations, benchmarks[i::num_guests]) for i in range(num_guests)]
+        else:
+            num_guests = min(num_guests, num_iterations)
+            shards = [(num_iterations // num_guests + (1 if i < num_iterations % num_guests else 0), benchmarks)
+                      for i in range(num_guests)]
+        return [s for s in shards if s[0] > 0 and (s[1] is None or len(s[1]) > 0)]
+
+    def _run_parallel_qemu_benchmark(self, script: Path, basic_args: list, runbench_args: list,
+                                     script_args_per_guest: "typing.List[list]", output_file: str):
+        assert isinstance(self, Project)
+        statusUpdate("Running benchmark", self.target, "on", len(script_args_per_guest), "QEMU instances")
+        output_dir = self.buildDir / "qemu-benchmark-results"
+        self.makedirs(output_dir)
+        guests = []
+        reserved_ports = []
+        for i, guest_script_args in enumerate(script_args_per_guest):
+            guest_dir = output_dir / ("guest-" + str(i))
+            self.cleanDirectory(guest_dir)
+            # Keep all ports bound until every guest has one, otherwise the same port could be returned twice
+            port = find_free_port()
+            reserved_ports.append(port)
+            cmd = [script] + basic_args + ["--qemu-ssh-port=" + str(port.port), "-vvvvv", "runbench"] + \
+                  runbench_args + ["--script-args=" + commandline_to_str(guest_script_args)]
+            guests.append((guest_dir, cmd))
+        # The ports are released just before starting the guests (same as the single instance case)
+        for port in reserved_ports:
+            port.socket.close()
+        errors = []
+
+        def run_guest(guest_dir: Path, cmd: list):
+            try:
+                with (guest_dir / "beri-fpga-bsd-boot.log").open("w") as logfile:
+                    runCmd(cmd, cwd=guest_dir, stdout=logfile, stderr=subprocess.STDOUT)
+            except (subprocess.CalledProcessError, OSError) as e:
+                errors.append((guest_dir, e))
+
+        if self.config.pretend:
+            for guest_dir, cmd in guests:
+                printCommand(cmd, cwd=guest_dir)
+        else:
+            threads = [threading.Thread(target=run_guest, args=g, name="qemu-benchmark-" + g[0].name) for g in guests]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        for guest_dir, e in errors:
+            self.warning("Benchmark run in", guest_dir, "failed:", e, "-- see", guest_dir / "beri-fpga-bsd-boot.log")
+        if errors:
+            self.fatal(len(errors), "of", len(guests), "QEMU benchmark instances failed")
+        self.merge_statcounters_csvs([g[0] / Path(output_file).name for g in guests], Path(output_file))
+
+    def merge_statcounters_csvs(self, inputs: "typing.List[Path]", output: Path):
+        """Concatenate the per-iteration rows of the statcounters CSV files (keeping only the first header)"""
+        assert isinstance(self, Project)
+        self.info("Merging", len(inputs), "statcounters CSV files into", output)
+        if self.config.pretend:
+            return
+        header = None
+        with output.open("w", encoding="utf-8") as out:
+            for csv_file in inputs:
+                if not csv_file.is_file():
+                    self.fatal("Missing benchmark result file", csv_file)
+                    continue
+                with csv_file.open("r", encoding="utf-8") as f:
+                    first_line = f.readline()
+                    if header is None:
+                        header = first_line
+                        out.write(header)
+                    elif first_line != header:
+                        self.fatal("CSV header of", csv_file, "does not match the header of", inputs[0])
+                    for line in f:
+                        if line.strip():
+                            out.write(line)
+
+    def analyse_statcounters_csv(self, csv_file: Path):
+        assert isinstance(self, Project)
+        if self.config.pretend:
+            return
+        if not csv_file.is_file():
+            self.warning("Cannot analyse statcounters CSV", csv_file, "since it does not exist")
+            return
+        regression = analyse_statcounters(csv_file, baseline_csv=self.config.benchmark_baseline_csv,
+                                          counters=self.config.benchmark_statcounters,
+                                          alpha=self.config.benchmark_significance_level,
+                                          threshold=self.config.benchmark_regression_threshold / 100)
+        if regression and self.config.benchmark_fail_on_regression:
+            self.fatal("Benchmark", self.target, "has a statistically significant regression compared to",
+                       self.config.benchmark_baseline_csv)
 
     def process(self):
         if self.use_asan and self.compiling_for_mips():
@@ -872,6 +987,8 @@ class CrossCompileAutotoolsProject(CrossCompileMixin, AutotoolsProject):
 
     def set_prog_with_args(self, prog: str, path: Path, args: list):
         fullpath = str(path)
+        if prog in ("CC", "CXX") and self.compiler_launcher:
+            fullpath = commandline_to_str(self.compiler_launcher) + " " + fullpath
         if args:
             fullpath += " " + commandline_to_str(args)
         self.configureEnvironment[prog] = fullpath
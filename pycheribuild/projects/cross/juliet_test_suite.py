@@ -73,6 +73,8 @@ class BuildJulietCWESubdir(CrossCompileCMakeProject):
         super().setupConfigOptions(**kwargs)
         cls.testcase_timeout = cls.addConfigOption("testcase-timeout", kind=str)
         cls.ld_preload_path = cls.addConfigOption("ld-preload-path", kind=str)
+        cls.junit_xml_only = cls.addBoolOption("junit-xml-only", help="Don't run the tests and only re-score the test "
+                                                                      "output from the previous run in the build directory")
 
     def configure(self, **kwargs):
         self.add_cmake_options(PLACE_OUTPUT_IN_TOPLEVEL_DIR=False)
@@ -91,8 +93,12 @@ class BuildJulietCWESubdir(CrossCompileCMakeProject):
         if self.ld_preload_path:
             args.append("--ld-preload-path")
             args.append(self.ld_preload_path)
+        if self.junit_xml_only:
+            args.append("--junit-xml-only")
+        args.extend(["--parse-jobs", str(self.make_jobs)])
 
-        self.run_cheribsd_test_script("run_juliet_tests.py", *args, mount_sourcedir=True, mount_sysroot=True, mount_builddir=True)
+        self.run_cheribsd_test_script("run_juliet_tests.py", *args, mount_sourcedir=True, mount_sysroot=True,
+                                      mount_builddir=True, host_only=self.junit_xml_only)
 
 class BuildJulietCWE121(BuildJulietCWESubdir):
     projectName = "juliet-cwe-121"
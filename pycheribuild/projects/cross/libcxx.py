@@ -37,6 +37,7 @@ from ..run_qemu import LaunchCheriBSD
 from ...config.loader import ComputedDefaultValue
 from ...utils import OSInfo, setEnv, runCmd, warningMessage, commandline_to_str, IS_MAC
 from ..project import ReuseOtherProjectRepository
+from ...testselection import lit_test_dependencies, parse_lit_show_tests
 import os
 
 
@@ -346,14 +347,41 @@ class BuildLibCXX(CrossCompileCMakeProject):
         # add the config options required for running tests:
         self.add_cmake_options(LIBCXX_EXECUTOR=executor, LIBCXX_TARGET_INFO=target_info, LIBCXX_RUN_LONG_TESTS=False)
 
+    def _lit_test_dependencies(self):
+        lit = self.buildDir / "bin/llvm-lit"
+        if not lit.exists():
+            return dict()
+        result = runCmd([sys.executable, lit, "--show-tests", "test"], cwd=self.buildDir, captureOutput=True,
+                        runInPretendMode=True, print_verbose_only=True)
+        return lit_test_dependencies(parse_lit_show_tests(result.stdout.decode("utf-8")))
+
     def run_tests(self):
         if self.compiling_for_host():
             runCmd("ninja", "check-cxx", "-v", cwd=self.buildDir)
-        else:
-            #  "--lit-debug-output"?
-            self.run_cheribsd_test_script("run_libcxx_tests.py", "--parallel-jobs", self.test_jobs,
-                                          # long running test -> speed up by using a kernel without invariants
-                                          use_benchmark_kernel_by_default=True)
+            return
+        test_jobs = self.test_jobs
+        extra_args = []
+        plan = None
+        if self.config.run_affected_tests_only:
+            plan = self.plan_affected_tests(self.sourceDir, self._lit_test_dependencies())
+            if not plan.run_all:
+                if not plan.tests:
+                    statusUpdate("No libc++ tests are affected by the changes since the last passing run")
+                    plan.record_success(pretend=self.config.pretend)
+                    return
+                tests_file = self.buildDir / "affected-tests.txt"
+                self.writeFile(tests_file, "\n".join("test/" + t for t in plan.tests) + "\n", overwrite=True)
+                extra_args.append("--only-tests-file=" + str(tests_file))
+                test_jobs = max(1, min(int(test_jobs), len(plan.tests)))
+            # Write the results to a known location so that we can check that all selected tests passed
+            self.deleteFile(self.buildDir / "qemu-libcxx-test-results.xml")
+            extra_args.append("--xunit-output=" + str(self.buildDir / "qemu-libcxx-test-results.xml"))
+        #  "--lit-debug-output"?
+        self.run_cheribsd_test_script("run_libcxx_tests.py", "--parallel-jobs", test_jobs, *extra_args,
+                                      # long running test -> speed up by using a kernel without invariants
+                                      use_benchmark_kernel_by_default=True)
+        if plan is not None:
+            plan.record_success(self.buildDir / "qemu-libcxx-test-results.xml", pretend=self.config.pretend)
 
 class BuildCompilerRt(CrossCompileCMakeProject):
     # TODO: add an option to allow upstream llvm?
@@ -102,7 +102,7 @@ class BuildPython(CrossCompileAutotoolsProject):
         suffix = "" if is_case_sensitive_dir(self.buildDir) else ".exe"
         if self.compiling_for_host():
             self.run_cmd(self.buildDir / ("python" + suffix), "-m", "test", "-w", "--junit-xml=python-tests.xml",
-                         self.config.makeJFlag, cwd=self.buildDir)
+                         "-j" + str(self.make_jobs), cwd=self.buildDir)
         else:
             # Python executes tons of system calls, hopefully using the benchmark kernel helps
             self.run_cheribsd_test_script("run_python_tests.py", "--buildexe-suffix=" + suffix, mount_installdir=True,
@@ -67,6 +67,10 @@ class BuildSimpleCheriBenchmarks(CrossCompileCMakeProject):
     def run_benchmarks(self):
         with tempfile.TemporaryDirectory() as td:
             benchmarks_dir = self.create_test_dir(Path(td))
+            def script_args(iterations):
+                return ["-d1", "-r" + str(iterations), "-o", self.default_statcounters_csv_name,
+                        "-a", self.archname_column]
             self.run_fpga_benchmark(benchmarks_dir, output_file=self.default_statcounters_csv_name,
-                                    benchmark_script_args=["-d1", "-r10", "-o", self.default_statcounters_csv_name,
-                                                           "-a", self.archname_column])
+                                    benchmark_script_args=script_args(10),
+                                    parallel_benchmark_script_args=[script_args(i) for i, _ in
+                                                                    self.split_benchmark_work(10)])
@@ -70,8 +70,8 @@ class BuildGnuStep_Make(AutotoolsProject):
             "--with-layout=fhs",  # more traditional file system layout
             "--with-library-combo=ng-gnu-gnu",  # use the new libobjc2 that supports ARC
             "--enable-objc-nonfragile-abi",  # not sure if required but given in install guide
-            "CC=" + str(self.config.clangPath),
-            "CXX=" + str(self.config.clangPlusPlusPath),
+            "CC=" + commandline_to_str(self.compiler_launcher + [str(self.config.clangPath)]),
+            "CXX=" + commandline_to_str(self.compiler_launcher + [str(self.config.clangPlusPlusPath)]),
             "LDFLAGS=-Wl,-rpath," + str(self.installDir / "lib")  # add rpath, otherwise everything breaks
         ])
 
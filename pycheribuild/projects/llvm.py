@@ -28,7 +28,9 @@
 # SUCH DAMAGE.
 #
 from pathlib import Path
+import hashlib
 import shutil
+import subprocess
 
 import os
 import sys
@@ -36,6 +38,7 @@ import sys
 from .project import *
 from ..utils import *
 from ..config.loader import ComputedDefaultValue
+from ..jobsizing import estimate_link_job_memory_mb, load_link_memory_history, set_ninja_pool_depth
 
 
 class BuildLLVMBase(CMakeProject):
@@ -60,7 +63,8 @@ class BuildLLVMBase(CMakeProject):
             cls.add_default_sysroot = False
 
         cls.enable_assertions = cls.addBoolOption("assertions", help="build with assertions enabled", default=True)
-        cls.enable_lto = cls.addBoolOption("enable-lto", help="build with LTO enabled (experimental)")
+        if "enable_lto" not in cls.__dict__:
+            cls.enable_lto = cls.addBoolOption("enable-lto", help="build with LTO enabled (experimental)")
         if "skip_static_analyzer" not in cls.__dict__:
             cls.skip_static_analyzer = cls.addBoolOption("skip-static-analyzer", default=True,
                                                          help="Don't build the clang static analyzer")
@@ -69,22 +73,68 @@ class BuildLLVMBase(CMakeProject):
                 help="Don't build some of the LLVM tools that should not be needed by default (e.g. llvm-mca, llvm-pdbutil)")
         cls.build_everything = cls.addBoolOption("build-everything", default=False,
                                                  help="Also build documentation,examples and bindings")
+        cls.use_cached_tablegen = cls.addBoolOption("cached-tablegen", default=True,
+            help="Use release builds of llvm-tblgen and clang-tblgen that are shared between all LLVM build "
+                 "directories (and only rebuilt when the TableGen sources change) instead of building them as part "
+                 "of each build. This speeds up debug and ASAN builds significantly.")
+
+    @property
+    def _static_debug_build(self):
+        return self.cmakeBuildType.lower() in ("debug", "relwithdebinfo") and \
+               "-DBUILD_SHARED_LIBS=ON" not in self.cmakeOptions
+
+    @property
+    def compile_job_memory_mb(self):
+        return 1536 if self.cmakeBuildType.lower() in ("debug", "relwithdebinfo") else 1024
+
+    @property
+    def _link_stats_file(self) -> Path:
+        return self.buildDir / ".cheribuild-link-stats.jsonl"
+
+    @property
+    def _recorded_link_job_memory_mb(self) -> "typing.Optional[int]":
+        """The memory needed per link job based on the peak RSS of the links in the previous build (if recorded)"""
+        if self._cached_recorded_link_memory is None:
+            history = load_link_memory_history(self._link_stats_file)
+            self._cached_recorded_link_memory = (estimate_link_job_memory_mb(history), len(history))
+        return self._cached_recorded_link_memory[0]
+
+    _cached_recorded_link_memory = None
+
+    @property
+    def link_job_memory_mb(self):
+        recorded = self._recorded_link_job_memory_mb
+        if recorded is not None:
+            if self.config.verbose:
+                self.info("Using", recorded, "MiB per link job based on", self._cached_recorded_link_memory[1],
+                          "link steps recorded in", self._link_stats_file)
+            return recorded
+        # Linking clang with debug info or LTO can take more than 10GB of RAM
+        if self._static_debug_build:
+            return 12 * 1024
+        return 8 * 1024 if self.enable_lto else 2 * 1024
+
+    @property
+    def max_link_jobs(self):
+        if self.config.adaptive_make_jobs and self._recorded_link_job_memory_mb is not None:
+            return None  # We know how much memory the links need -> only limit the pool by the available memory
+        # Without adaptive job sizing this is the only limit on the link pool -> always use the heuristic cap
+        link_jobs = 2 if self.enable_lto else 4
+        if os.cpu_count() >= 24:
+            link_jobs *= 2  # Increase number of link jobs for powerful servers
+        # non-shared debug builds take lots of ram -> use only one parallel job
+        if self._static_debug_build:
+            link_jobs = 1
+        return link_jobs
 
     def __init__(self, config: CheriConfig):
         super().__init__(config)
         self.cCompiler = config.clangPath
         self.cppCompiler = config.clangPlusPlusPath
         # this must be added after check_system_dependencies
-        link_jobs = 2 if self.enable_lto else 4
-        if os.cpu_count() >= 24:
-            link_jobs *= 2  # Increase number of link jobs for powerful servers
-        # non-shared debug builds take lots of ram -> use only one parallel job
-        if self.cmakeBuildType.lower() in ("debug", "relwithdebinfo") and "-DBUILD_SHARED_LIBS=ON" not in self.cmakeOptions:
-            link_jobs = 1
         self.add_cmake_options(
             CMAKE_CXX_COMPILER=self.cppCompiler,
             CMAKE_C_COMPILER=self.cCompiler,
-            LLVM_PARALLEL_LINK_JOBS=link_jobs,  # anything more causes too much I/O
         )
         if self.use_asan:
             # Use asan+ubsan
@@ -129,6 +179,7 @@ class BuildLLVMBase(CMakeProject):
                                    LLVM_DEFAULT_TARGET_TRIPLE="mips64c" + self.config.cheriBitsStr + "hybrid-unknown-freebsd")
         # when making a debug or asserts build speed it up by building a release tablegen
         # Actually it seems like the time spent in CMake is longer than that spent running tablegen, disable for now
+        # Instead we use a shared release build of tablegen (see --<target>/cached-tablegen)
         self.add_cmake_options(LLVM_OPTIMIZED_TABLEGEN=False)
         # This should speed up building debug builds
         self.add_cmake_options(LLVM_USE_SPLIT_DWARF=True)
@@ -140,12 +191,15 @@ class BuildLLVMBase(CMakeProject):
 
         if self.enable_lto:
             ccinfo = getCompilerInfo(self.cCompiler)
-            llvm_ar = ccinfo.get_matching_binutil("llvm-ar")
-            llvm_ranlib = ccinfo.get_matching_binutil("llvm-ranlib")
-            lld = ccinfo.get_matching_binutil("ld.lld")
+            if ccinfo.is_clang and ccinfo.compiler != "apple-clang":
+                llvm_ar = ccinfo.get_matching_binutil("llvm-ar")
+                llvm_ranlib = ccinfo.get_matching_binutil("llvm-ranlib")
+                lld = ccinfo.get_matching_binutil("ld.lld")
+            else:
+                llvm_ar = llvm_ranlib = lld = None
             if not llvm_ar or not llvm_ranlib or not lld:
                 self.warning("Could not find all required binutils to enable LTO")
-            elif ccinfo.is_clang and ccinfo.compiler != "apple-clang":
+            else:
                 self.add_cmake_options(CMAKE_AR=llvm_ar, CMAKE_RANLIB=llvm_ranlib, LLVM_USE_LINKER=lld)
                 # we are passing an explicit linker path -> cannot use LLVM_ENABLE_LLD
                 self.add_cmake_options(LLVM_ENABLE_LLD=False)
@@ -222,6 +276,131 @@ class BuildLLVMBase(CMakeProject):
             self.createBuildtoolTargetSymlinks(self.installDir / "bin/ld.lld", toolName="ld",
                                                createUnprefixedLink=not IS_MAC)
 
+    @property
+    def llvm_source_dir(self) -> Path:
+        return self.sourceDir
+
+    @property
+    def clang_source_dir(self) -> Path:
+        return self.sourceDir / "tools/clang"
+
+    def _tablegen_build_options(self) -> "typing.List[str]":
+        return ["-DLLVM_TOOL_CLANG_BUILD=" + ("ON" if "clang" in self.included_projects else "OFF")]
+
+    def _tablegen_cache_key(self) -> "typing.Optional[str]":
+        # Use the git tree hashes of everything that the tablegen binaries are built from so that all build variants
+        # of the same sources (and other checkouts with identical TableGen sources) share the binaries.
+        # LLVMSupport depends on LLVMDemangle and includes the llvm-c headers and the generated config headers.
+        source_dirs = [self.llvm_source_dir / d for d in ("cmake", "utils/TableGen", "lib/TableGen", "lib/Support",
+                                                          "lib/Demangle", "include/llvm/TableGen",
+                                                          "include/llvm/Support", "include/llvm/ADT",
+                                                          "include/llvm/Demangle", "include/llvm/Config",
+                                                          "include/llvm-c")]
+        if "clang" in self.included_projects:
+            source_dirs.append(self.clang_source_dir / "utils/TableGen")
+        tree_hashes = []
+        for d in source_dirs:
+            if not d.is_dir():
+                return None
+            try:
+                tree_hash = runCmd("git", "rev-parse", "HEAD:./", cwd=d, captureOutput=True, captureError=True,
+                                   runInPretendMode=True, print_verbose_only=True).stdout.strip()
+                local_changes = runCmd("git", "status", "--porcelain", "--untracked-files=no", "--", ".", cwd=d,
+                                       captureOutput=True, captureError=True, runInPretendMode=True,
+                                       print_verbose_only=True).stdout
+            except subprocess.CalledProcessError:
+                return None
+            if local_changes.strip():
+                self.info("Not using cached tablegen since", d, "has uncommitted changes")
+                return None
+            tree_hashes.append(tree_hash)
+        return hashlib.sha256(b"\n".join(tree_hashes)).hexdigest()[:16]
+
+    def _get_cached_tablegen(self) -> "typing.Dict[str, Path]":
+        """
+        :return: the CMake variables (LLVM_TABLEGEN/CLANG_TABLEGEN) that point to the shared release tablegen binaries
+        """
+        key = self._tablegen_cache_key()
+        if key is None:
+            return dict()
+        cache_dir = self.config.buildRoot / "llvm-tablegen-cache" / key
+        tools = {"LLVM_TABLEGEN": cache_dir / "bin/llvm-tblgen"}
+        if "clang" in self.included_projects:
+            tools["CLANG_TABLEGEN"] = cache_dir / "bin/clang-tblgen"
+        if all(p.exists() for p in tools.values()):
+            self.verbose_print("Using cached tablegen binaries from", cache_dir)
+            return tools
+        statusUpdate("Building release tablegen binaries for", self.target, "in", cache_dir)
+        build_dir = cache_dir / "build"
+        self.makedirs(build_dir)
+        args = [str(self.llvm_source_dir), "-G", "Ninja", "-DCMAKE_BUILD_TYPE=Release",
+                "-DCMAKE_C_COMPILER=" + str(self.cCompiler), "-DCMAKE_CXX_COMPILER=" + str(self.cppCompiler),
+                "-DLLVM_TARGETS_TO_BUILD=Mips", "-DLLVM_ENABLE_ASSERTIONS=OFF", "-DLLVM_INCLUDE_TESTS=OFF",
+                "-DLLVM_INCLUDE_EXAMPLES=OFF", "-DLLVM_INCLUDE_BENCHMARKS=OFF", "-DLLVM_INCLUDE_DOCS=OFF"]
+        self.runWithLogfile([self.configureCommand] + args + self._tablegen_build_options(),
+                            logfileName="tablegen-cmake", cwd=build_dir)
+        for tool in tools.values():
+            self.runMake(tool.name, cwd=build_dir, logfileName="tablegen-build", appendToLogfile=True)
+            self.installFile(build_dir / "bin" / tool.name, tool, force=True, print_verbose_only=True)
+        # Only the binaries are needed
+        self._deleteDirectories(build_dir)
+        return tools
+
+    _cached_can_record_link_stats = None
+
+    @property
+    def _can_record_link_stats(self) -> bool:
+        """
+        Whether the peak RSS of each link step can be recorded (to size the link pool for the next build). This
+        uses CMAKE_<LANG>_LINKER_LAUNCHER which is ignored by CMake versions older than 3.21.
+        """
+        if self._cached_can_record_link_stats is None:
+            cmake = Path(self.configureCommand)
+            cmake_version = (0, 0, 0)
+            if cmake.is_absolute() and cmake.exists():
+                cmake_version = get_program_version(cmake, program_name=b"cmake")
+            self._cached_can_record_link_stats = cmake_version >= (3, 21, 0)
+            if not self._cached_can_record_link_stats:
+                self.info("Cannot collect link statistics for", self.target, "since CMake",
+                          ".".join(map(str, cmake_version)), "does not support CMAKE_CXX_LINKER_LAUNCHER (3.21+ is "
+                          "needed). The link pool size will be based on estimates instead.")
+        return self._cached_can_record_link_stats
+
+    @property
+    def _link_wrapper_path(self) -> Path:
+        return self.config.buildRoot / "cheribuild-link-rss-wrapper.py"
+
+    def _ensure_link_wrapper_exists(self):
+        if self.config.pretend:
+            return
+        contents = "#!" + sys.executable + " -SE\n" + includeLocalFile("files/link-rss-wrapper.py")
+        wrapper = self._link_wrapper_path
+        if not wrapper.exists() or self.readFile(wrapper) != contents:
+            self.writeFile(wrapper, contents, overwrite=True, mode=0o755, noCommandPrint=True)
+
+    def configure(self, **kwargs):
+        if self._can_record_link_stats:
+            self._ensure_link_wrapper_exists()
+            self.add_cmake_options(CMAKE_C_LINKER_LAUNCHER=self._link_wrapper_path,
+                                   CMAKE_CXX_LINKER_LAUNCHER=self._link_wrapper_path)
+        if self.use_cached_tablegen:
+            self.add_cmake_options(**self._get_cached_tablegen())
+        # The link pool size depends on the available memory so it is only computed when configuring
+        self.add_cmake_options(LLVM_PARALLEL_LINK_JOBS=self.link_jobs)  # anything more causes too much I/O
+        super().configure(**kwargs)
+
+    def compile(self, **kwargs):
+        if self._can_record_link_stats:
+            self._ensure_link_wrapper_exists()
+            # Only set for this build: the tablegen and PGO-instrumented builds in configure() don't use the wrapper
+            self.make_args.set_env(CHERIBUILD_LINK_STATS=self._link_stats_file)
+        # LLVM_PARALLEL_LINK_JOBS is only applied when CMake runs. Update the pool depth in build.ninja directly
+        # so that the value is based on the currently available memory and the latest link statistics.
+        if not self.config.pretend and set_ninja_pool_depth(self.buildDir / "build.ninja", "link_job_pool",
+                                                            self.link_jobs):
+            self.verbose_print("Set ninja link_job_pool depth to", self.link_jobs)
+        super().compile(**kwargs)
+
 
 class BuildLLVMMonoRepoBase(BuildLLVMBase):
     doNotAddToTargets = True
@@ -231,6 +410,17 @@ class BuildLLVMMonoRepoBase(BuildLLVMBase):
     def setupConfigOptions(cls, **kwargs):
         super().setupConfigOptions(useDefaultSysroot=False)
 
+    @property
+    def llvm_source_dir(self) -> Path:
+        return self.sourceDir / self.llvm_subdir
+
+    @property
+    def clang_source_dir(self) -> Path:
+        return self.sourceDir / "clang"
+
+    def _tablegen_build_options(self) -> "typing.List[str]":
+        return ["-DLLVM_ENABLE_PROJECTS=clang"] if "clang" in self.included_projects else []
+
     def configure(self, **kwargs):
         if (self.sourceDir / "tools/clang/.git").exists():
             self.fatal("Attempting to build LLVM Monorepo but the checkout is from the split repos!")
@@ -273,6 +463,158 @@ class BuildCheriLLVM(BuildLLVMMonoRepoBase):
                 self.createSymlink(self.installDir / "bin/clang-cpp", self.installDir / "bin" / (prefix + "-clang-cpp"))
 
 
+class BuildCheriLLVMWithPGO(BuildCheriLLVM):
+    """
+    A profile-guided ThinLTO build of CHERI LLVM. This first builds an instrumented clang, uses it to compile a
+    representative workload (libc++ and, if available, parts of the CheriBSD libc for the host and CHERI targets),
+    merges the profile and then uses it for the final build which is installed to the SDK instead of the
+    normal llvm target.
+    """
+    projectName = "llvm-project"  # use the same source directory as the llvm target
+    target = "llvm-pgo"
+    build_dir_suffix = "-pgo"
+
+    @classmethod
+    def setupConfigOptions(cls, **kwargs):
+        cls.enable_lto = cls.addBoolOption("enable-lto", default=True, help="Build with ThinLTO in addition to PGO")
+        super().setupConfigOptions(**kwargs)
+        cls.pgo_profile = cls.addPathOption("profile", help="Use this .profdata file instead of generating one "
+                                                            "with an instrumented build")
+        cls.regenerate_profile = cls.addBoolOption("regenerate-profile", help="Rebuild the instrumented clang and "
+            "generate a new profile even if a cached profile exists (the cached profile is also discarded by --clean)")
+        cls.pgo_training_sources = cls.addConfigOption("training-sources", kind=list, default=[], metavar="DIRS",
+            help="Additional directories containing C/C++ sources that are compiled for the host with the "
+                 "instrumented clang to generate the profile")
+
+    def __init__(self, config: CheriConfig):
+        super().__init__(config)
+        self.pgo_dir = config.buildRoot / (self.projectName.lower() + "-pgo-profile")
+        self.instrumented_build_dir = self.pgo_dir / "instrumented-build"
+        self.cached_profile = self.pgo_dir / "clang.profdata"
+
+    def _host_toolchain_id(self) -> str:
+        # The .profdata format depends on the host compiler that built the instrumented clang
+        info = getCompilerInfo(self.cCompiler)
+        return "{} {} {}".format(self.cCompiler, info.compiler, ".".join(map(str, info.version)))
+
+    def _pgo_profile_id(self) -> str:
+        # The profile also needs to be regenerated when the sources change since it is matched to functions by name
+        # and control flow hash (stale profiles result in lots of mismatch warnings and a less well optimized build)
+        try:
+            revision = runCmd("git", "rev-parse", "HEAD", cwd=self.sourceDir, captureOutput=True, captureError=True,
+                              runInPretendMode=True, raiseInPretendMode=True,
+                              print_verbose_only=True).stdout.decode("utf-8").strip()
+        except (subprocess.CalledProcessError, OSError):
+            revision = "unknown revision"
+        return self._host_toolchain_id() + "\n" + revision
+
+    def _pgo_training_commands(self, clang: Path) -> "typing.List[typing.List[str]]":
+        common_flags = ["-O2", "-c", "-o", "/dev/null", "-w"]
+        libcxx_flags = ["-std=c++17", "-nostdinc++", "-I", str(self.sourceDir / "libcxx/include"),
+                        "-D_LIBCPP_BUILDING_LIBRARY", "-D_LIBCPP_HAS_NO_PRAGMA_SYSTEM_HEADER"]
+        cheri_flags = ["-target", "mips64-unknown-freebsd13", "-integrated-as", "-G0", "-msoft-float",
+                       "-cheri=" + self.config.cheriBitsStr, "-mcpu=cheri" + self.config.cheriBitsStr,
+                       "-mabi=purecap", "--sysroot=" + str(self.config.cheriSysrootDir)]
+        have_cheri_sysroot = (self.config.cheriSysrootDir / "usr/include").is_dir()
+        clangxx = clang.with_name("clang++")
+        commands = []
+        for src in sorted((self.sourceDir / "libcxx/src").glob("*.cpp")):
+            commands.append([str(clangxx)] + common_flags + libcxx_flags + [str(src)])
+            if have_cheri_sysroot:
+                commands.append([str(clangxx)] + cheri_flags + common_flags + libcxx_flags + [str(src)])
+        if have_cheri_sysroot:
+            from .cross.cheribsd import BuildCHERIBSD
+            libc_dir = BuildCHERIBSD.getSourceDir(self, self.config, cross_target=CrossCompileTarget.CHERI) / "lib/libc"
+            libc_flags = ["-I" + str(libc_dir / d) for d in ("include", "", "mips", "locale", "stdio", "stdtime")]
+            for subdir in ("string", "stdlib", "stdio", "gen", "locale", "stdtime"):
+                for src in sorted((libc_dir / subdir).glob("*.c")):
+                    commands.append([str(clang)] + cheri_flags + common_flags + libc_flags + [str(src)])
+        for directory in self.pgo_training_sources:
+            for pattern in ("**/*.c", "**/*.cpp"):
+                for src in sorted(Path(directory).glob(pattern)):
+                    compiler = clangxx if src.suffix == ".cpp" else clang
+                    commands.append([str(compiler)] + common_flags + [str(src)])
+        return commands
+
+    def _build_instrumented_clang(self):
+        self.makedirs(self.instrumented_build_dir)
+        args = [str(self.sourceDir / self.llvm_subdir), "-G", "Ninja", "-DCMAKE_BUILD_TYPE=Release",
+                "-DCMAKE_C_COMPILER=" + str(self.cCompiler), "-DCMAKE_CXX_COMPILER=" + str(self.cppCompiler),
+                "-DLLVM_ENABLE_PROJECTS=clang", "-DLLVM_BUILD_INSTRUMENTED=IR", "-DLLVM_BUILD_RUNTIME=OFF",
+                "-DLLVM_ENABLE_ASSERTIONS=OFF", "-DLLVM_INCLUDE_TESTS=OFF", "-DLLVM_INCLUDE_EXAMPLES=OFF",
+                "-DLLVM_INCLUDE_BENCHMARKS=OFF", "-DLLVM_INCLUDE_DOCS=OFF", "-DCLANG_ENABLE_STATIC_ANALYZER=OFF",
+                "-DCLANG_ENABLE_ARCMT=OFF", "-DLLVM_PARALLEL_LINK_JOBS=" + str(self.link_jobs)]
+        if self.canUseLLd(self.cCompiler):
+            args.append("-DLLVM_ENABLE_LLD=ON")
+        if self.use_cached_tablegen:
+            args.extend("-D" + k + "=" + str(v) for k, v in self._get_cached_tablegen().items())
+        if not (self.instrumented_build_dir / "build.ninja").exists():
+            self.runWithLogfile([self.configureCommand] + args, logfileName="pgo-instrumented-cmake",
+                                cwd=self.instrumented_build_dir)
+        self.runMake("clang", cwd=self.instrumented_build_dir, logfileName="pgo-instrumented-build")
+
+    def _run_pgo_training(self, profraw_dir: Path):
+        clang = self.instrumented_build_dir / "bin/clang"
+        commands = self._pgo_training_commands(clang)
+        statusUpdate("Generating PGO profile by running", len(commands), "compile jobs with the instrumented clang")
+        if self.config.pretend:
+            for cmd in commands[:5]:
+                printCommand(cmd, print_verbose_only=True)
+            return
+        self.cleanDirectory(profraw_dir)
+        env = os.environ.copy()
+        # Merge the profiles online into a small pool of files instead of writing one file per clang process
+        env["LLVM_PROFILE_FILE"] = str(profraw_dir / "clang-%4m.profraw")
+
+        def run_training_job(cmd):
+            # Not all files compile cleanly (e.g. missing defines) but they still exercise the compiler
+            return subprocess.call(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.make_jobs) as executor:
+            failed = sum(1 for result in executor.map(run_training_job, commands) if result != 0)
+        if failed:
+            self.info(failed, "of", len(commands), "training compile jobs failed (this is expected)")
+
+    def _ensure_pgo_profile(self) -> Path:
+        if self.pgo_profile:
+            if not self.pgo_profile.exists() and not self.config.pretend:
+                self.fatal("Profile", self.pgo_profile, "does not exist")
+            return self.pgo_profile
+        stamp = self.cached_profile.with_suffix(".toolchain")
+        profile_id = self._pgo_profile_id()
+        if self.cached_profile.exists() and stamp.exists() and not self.regenerate_profile and not self.config.clean:
+            if self.readFile(stamp) == profile_id:
+                statusUpdate("Using cached PGO profile", self.cached_profile)
+                return self.cached_profile
+            self.info("Host compiler or", self.projectName, "revision changed since", self.cached_profile,
+                      "was generated, regenerating it.")
+        ccinfo = getCompilerInfo(self.cCompiler)
+        llvm_profdata = ccinfo.get_matching_binutil("llvm-profdata") if ccinfo.is_clang else None
+        if not llvm_profdata:
+            self.dependencyError("Could not find llvm-profdata matching", self.cCompiler,
+                                 installInstructions="A PGO build requires clang and llvm-profdata on the host")
+            llvm_profdata = "llvm-profdata"
+        profraw_dir = self.pgo_dir / "profraw"
+        self._build_instrumented_clang()
+        self._run_pgo_training(profraw_dir)
+        runCmd(llvm_profdata, "merge", "-output=" + str(self.cached_profile),
+               *sorted(str(p) for p in profraw_dir.glob("*.profraw")))
+        self.writeFile(stamp, profile_id, overwrite=True)
+        return self.cached_profile
+
+    def check_system_dependencies(self):
+        super().check_system_dependencies()
+        if getCompilerInfo(self.cCompiler).compiler != "clang":
+            self.dependencyError("A PGO build of LLVM requires a (non-Apple) clang host compiler")
+
+    def configure(self, **kwargs):
+        with self._timed_phase("pgo-profile"):
+            profile = self._ensure_pgo_profile()
+        self.add_cmake_options(LLVM_PROFDATA_FILE=profile)
+        super().configure(**kwargs)
+
+
 # Add an alias target clang that builds llvm
 class BuildClang(TargetAlias):
     target = "clang"
@@ -49,6 +49,11 @@ from ..config.loader import ConfigLoaderBase, ComputedDefaultValue, ConfigOption
 from ..config.chericonfig import CheriConfig, CrossCompileTarget, MipsFloatAbi
 from ..targets import Target, MultiArchTarget, MultiArchTargetAlias, targetManager
 from ..filesystemutils import FileSystemUtils
+from ..compilationdb import merge_compilation_db_fragments
+from ..compilercache import get_compiler_cache
+from ..jobsizing import JobCounts, SystemResources, compute_job_counts
+from ..testselection import TestRunPlan, TestSelectionState, plan_test_run
+from ..timing import build_timeline
 from ..utils import *
 
 __all__ = ["Project", "CMakeProject", "AutotoolsProject", "TargetAlias", "TargetAliasWithDependencies", # no-combine
@@ -504,29 +509,33 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
         args = list(map(str, args))  # make sure all arguments are strings
         cmdStr = commandline_to_str(args)
 
-        if not self.config.write_logfile:
-            if stdoutFilter is None:
-                # just run the process connected to the current stdout/stdin
-                check_call_handle_noexec(args, cwd=str(cwd), env=newEnv)
-            else:
-                make = popen_handle_noexec(args, cwd=str(cwd), stdout=subprocess.PIPE, env=newEnv)
-                self.__runProcessWithFilteredOutput(make, None, stdoutFilter, cmdStr)
-            return
-
-        # open file in append mode
-        with logfilePath.open("ab") as logfile:
-            # print the command and then the logfile
-            if appendToLogfile:
-                logfile.write(b"\n\n")
-            if cwd:
-                logfile.write(("cd " + shlex.quote(str(cwd)) + " && ").encode("utf-8"))
-            logfile.write(cmdStr.encode("utf-8") + b"\n\n")
-            if self.config.quiet:
-                # a lot more efficient than filtering every line
-                check_call_handle_noexec(args, cwd=str(cwd), stdout=logfile, stderr=logfile, env=newEnv)
+        with build_timeline.measure_subprocess(args, cwd=cwd) as timing_info:
+            if not self.config.write_logfile:
+                if stdoutFilter is None:
+                    # just run the process connected to the current stdout/stdin
+                    check_call_handle_noexec(args, cwd=str(cwd), env=newEnv)
+                else:
+                    make = popen_handle_noexec(args, cwd=str(cwd), stdout=subprocess.PIPE, env=newEnv)
+                    timing_info["process"] = make
+                    self.__runProcessWithFilteredOutput(make, None, stdoutFilter, cmdStr)
                 return
-            make = popen_handle_noexec(args, cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=newEnv)
-            self.__runProcessWithFilteredOutput(make, logfile, stdoutFilter, cmdStr)
+
+            # open file in append mode
+            with logfilePath.open("ab") as logfile:
+                # print the command and then the logfile
+                if appendToLogfile:
+                    logfile.write(b"\n\n")
+                if cwd:
+                    logfile.write(("cd " + shlex.quote(str(cwd)) + " && ").encode("utf-8"))
+                logfile.write(cmdStr.encode("utf-8") + b"\n\n")
+                if self.config.quiet:
+                    # a lot more efficient than filtering every line
+                    check_call_handle_noexec(args, cwd=str(cwd), stdout=logfile, stderr=logfile, env=newEnv)
+                    return
+                make = popen_handle_noexec(args, cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                           env=newEnv)
+                timing_info["process"] = make
+                self.__runProcessWithFilteredOutput(make, logfile, stdoutFilter, cmdStr)
 
     def __runProcessWithFilteredOutput(self, proc: subprocess.Popen, logfile: "typing.Optional[typing.IO]",
                                        stdoutFilter: "typing.Callable[[bytes], None]", cmdStr: str):
@@ -602,6 +611,10 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
     def process(self):
         raise NotImplementedError()
 
+    def _timed_phase(self, phase: str):
+        # Record the time spent in one step of process() for --timing-trace/--timing-summary
+        return build_timeline.measure(phase, build_timeline.PHASE, target=self.target)
+
     def run_tests(self):
         # for the --test option
         statusUpdate("No tests defined for target", self.target)
@@ -610,17 +623,34 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
         # for the --benchmark option
         statusUpdate("No benchmarks defined for target", self.target)
 
+    def plan_affected_tests(self, source_dir: Path, dependencies: "typing.Dict[str, typing.List[str]]") -> TestRunPlan:
+        """
+        Select the tests affected by the changes in source_dir since the last passing run (for
+        --run-affected-tests-only). Call record_success() on the result once the selected tests have passed.
+        """
+        state = TestSelectionState(self.config.buildRoot / "test-selection" / (self.target + ".json"))
+        plan = plan_test_run(state, source_dir, dependencies, self.config.full_test_run_interval)
+        if plan.run_all:
+            statusUpdate("Running all tests for", self.target + ":", plan.reason)
+        else:
+            statusUpdate("Running", len(plan.tests), "of", len(state.dependencies), "tests for", self.target + ":",
+                         plan.reason)
+        return plan
+
     def run_cheribsd_test_script(self, script_name, *script_args, kernel_path=None, disk_image_path=None,
                                  mount_builddir=True, mount_sourcedir=False, mount_sysroot=False, mount_installdir=False,
-                                 use_benchmark_kernel_by_default=False):
+                                 use_benchmark_kernel_by_default=False, host_only=False):
         # mount_sysroot may be needed for projects such as QtWebkit where the minimal image doesn't contain all the
         # necessary libraries
+        # host_only should be set if the script will not boot QEMU (e.g. when only re-creating the JUnit XML from the
+        # output of a previous run), in that case the kernel, disk image and QEMU binary are not needed.
         from .build_qemu import BuildQEMU
         # noinspection PyUnusedLocal
         script_dir = Path("/this/will/not/work/when/using/remote-cheribuild.py")
         xtarget = self.crosscompile_target
         test_native = xtarget in (CrossCompileTarget.NATIVE, CrossCompileTarget.I386)
-        if kernel_path is None and not test_native and "--kernel" not in self.config.test_extra_args:
+        needs_qemu = not test_native and not host_only
+        if kernel_path is None and needs_qemu and "--kernel" not in self.config.test_extra_args:
             from .cross.cheribsd import BuildCheriBsdMfsKernel
             # Use the benchmark kernel by default if the parameter is set and the user didn't pass
             # --no-use-minimal-benchmark-kernel on the command line or in the config JSON
@@ -656,6 +686,8 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
             self.fatal("Could not find test script", script)
         if test_native:
             cmd = [script, "--test-native"]
+        elif host_only:
+            cmd = [script]
         else:
             cmd = [script, "--ssh-key", self.config.test_ssh_key]
             if "--kernel" not in self.config.test_extra_args:
@@ -676,7 +708,7 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
                 cmd.extend(["--install-destdir", self.destdir])
             if "--install-prefix" not in self.config.test_extra_args:
                 cmd.extend(["--install-prefix", self.installPrefix])
-        if disk_image_path and not test_native and "--disk-image" not in self.config.test_extra_args:
+        if disk_image_path and needs_qemu and "--disk-image" not in self.config.test_extra_args:
             cmd.extend(["--disk-image", disk_image_path])
         if self.config.tests_interact:
             cmd.append("--interact")
@@ -1050,6 +1082,11 @@ class Project(SimpleProject):
     gitBranch = ""
     skipGitSubmodules = False
     compileDBRequiresBear = True
+    uses_compiler_launcher = False
+    """
+    Whether compiler_launcher is prepended to the compiler used by the build (e.g. via CC/CXX). If not,
+    --compilation-db-tool=wrapper falls back to bear since the wrapper would never be invoked.
+    """
     doNotAddToTargets = True
     build_dir_suffix = ""   # add a suffix to the build dir (e.g. for freebsd-with-bootstrap-clang)
 
@@ -1078,6 +1115,69 @@ class Project(SimpleProject):
     Set this to MakeCommandKind.GnuMake if the build system needs GNU make features or BsdMake if it needs bmake
     """
 
+    # Hints for --adaptive-make-jobs: the expected peak memory usage of a single compile job and (for projects with a
+    # separate link job pool such as LLVM_PARALLEL_LINK_JOBS) of a single link job and the maximum link pool size
+    compile_job_memory_mb = 512
+    _compiledb_tool = None  # type: typing.Optional[str]
+    link_job_memory_mb = None  # type: typing.Optional[int]
+    max_link_jobs = None  # type: typing.Optional[int]
+    _cached_job_counts = None  # type: JobCounts
+
+    def _job_counts(self) -> JobCounts:
+        if self._cached_job_counts is None:
+            requested = int(self.config.makeJobs)
+            if not self.config.adaptive_make_jobs:
+                result = JobCounts(requested, self.max_link_jobs, "--adaptive-make-jobs is disabled")
+            else:
+                resources = SystemResources.detect()
+                if self.config.verbose:
+                    print("Available resources:", resources)
+                result = compute_job_counts(requested, resources, compile_job_memory_mb=self.compile_job_memory_mb,
+                                            link_job_memory_mb=self.link_job_memory_mb, max_link_jobs=self.max_link_jobs,
+                                            consider_load=self.config.make_jobs_consider_load)
+                if result.compile_jobs != requested or self.config.verbose:
+                    link_str = "" if result.link_jobs is None else " and " + str(result.link_jobs) + " link jobs"
+                    statusUpdate("Using -j" + str(result.compile_jobs) + link_str, "for", self.target + ":",
+                                 result.reason)
+            self._cached_job_counts = result
+        return self._cached_job_counts
+
+    @property
+    def compiler_launcher(self) -> "typing.List[str]":
+        """
+        The command that should be prepended to the compiler: ccache/sccache (--compiler-cache) and/or the wrapper
+        that records compile commands for --compilation-db. Empty if neither is used.
+        """
+        cache = get_compiler_cache(self.config)
+        result = cache.launcher if cache else []
+        if self._compiledb_tool == "wrapper":
+            result = [str(self._compdb_wrapper_path)] + result
+        return result
+
+    @property
+    def _compdb_wrapper_path(self) -> Path:
+        # Not in the build directory since that could be deleted by --clean after we configured
+        return self.config.buildRoot / "cheribuild-compdb-wrapper.py"
+
+    def _ensure_compdb_wrapper_exists(self):
+        if self._compiledb_tool != "wrapper" or self.config.pretend:
+            return
+        contents = "#!" + sys.executable + " -SE\n" + includeLocalFile("files/compdb-wrapper.py")
+        wrapper = self._compdb_wrapper_path
+        if not wrapper.exists() or self.readFile(wrapper) != contents:
+            self.writeFile(wrapper, contents, overwrite=True, mode=0o755, noCommandPrint=True)
+
+    @property
+    def make_jobs(self) -> int:
+        """The -j value for this project (--make-jobs adjusted for available resources)"""
+        return self._job_counts().compile_jobs
+
+    @property
+    def link_jobs(self) -> int:
+        """The size of the link job pool (only meaningful if link_job_memory_mb or max_link_jobs is set)"""
+        result = self._job_counts().link_jobs
+        return self.make_jobs if result is None else result
+
     # A per-project config option to generate a CMakeLists.txt that just has a custom taget that calls cheribuild.py
     generate_cmakelists = None
 
@@ -1252,15 +1352,18 @@ class Project(SimpleProject):
         self._lastStdoutLineCanBeOverwritten = False
         self.make_args = MakeOptions(self.make_kind, self)
         if self.config.create_compilation_db and self.compileDBRequiresBear:
-            # CompileDB seems to generate broken compile_commands,json
-            if self.make_args.is_gnu_make and False:
-                # use compiledb instead of bear for gnu make
+            if self.config.compilation_db_tool == "compiledb":
+                # CompileDB seems to generate broken compile_commands,json
                 # https://blog.jetbrains.com/clion/2018/08/working-with-makefiles-in-clion-using-compilation-db/
                 self.addRequiredSystemTool("compiledb", installInstructions="Run `pip2 install --user compiledb``")
                 self._compiledb_tool = "compiledb"
-            else:
+            elif self.config.compilation_db_tool == "bear" or not self.uses_compiler_launcher:
                 self.addRequiredSystemTool("bear", installInstructions="Run `cheribuild.py bear`")
                 self._compiledb_tool = "bear"
+            else:
+                # Use our own compiler wrapper (see compiler_launcher) that records the commands and merge them after
+                # every make invocation. Unlike bear this only updates the entries for the files that were recompiled
+                self._compiledb_tool = "wrapper"
         self._force_clean = False
         self._preventAssign = True
 
@@ -1290,13 +1393,13 @@ class Project(SimpleProject):
         else:
             allArgs = options.all_commandline_args
         if parallel and options.can_pass_jflag:
-            allArgs.append(self.config.makeJFlag)
+            allArgs.append("-j" + str(self.make_jobs))
         allArgs = [make_command] + allArgs
         # TODO: use compdb instead for GNU make projects?
         if self.config.create_compilation_db and self.compileDBRequiresBear:
             if self._compiledb_tool == "bear":
                 allArgs = [shutil.which("bear"), "--cdb", self.buildDir / compilationDbName, "--append"] + allArgs
-            else:
+            elif self._compiledb_tool == "compiledb":
                 allArgs = [shutil.which("compiledb"), "--output", self.buildDir / compilationDbName] + allArgs
         if not self.config.makeWithoutNice:
             allArgs = ["nice"] + allArgs
@@ -1342,8 +1445,18 @@ class Project(SimpleProject):
         if stdoutFilter is _default_stdout_filter:
             stdoutFilter = self._stdoutFilter
         env = options.env_vars
+        compdb_fragments = None
+        if self.config.create_compilation_db and self._compiledb_tool == "wrapper":
+            self._ensure_compdb_wrapper_exists()
+            compdb_fragments = self.buildDir / (".cheribuild-" + compilationDbName + ".d")
+            if not self.config.pretend:
+                self.makedirs(compdb_fragments)
+            env = dict(env, CHERIBUILD_COMPDB_DIR=compdb_fragments)
         self.runWithLogfile(allArgs, logfileName=logfileName, stdoutFilter=stdoutFilter, cwd=cwd, env=env,
                             appendToLogfile=appendToLogfile)
+        if compdb_fragments is not None and not self.config.pretend:
+            updated, total = merge_compilation_db_fragments(self.buildDir / compilationDbName, compdb_fragments)
+            self.verbose_print("Updated", updated, "of", total, "entries in", self.buildDir / compilationDbName)
         # if we create a compilation db, copy it to the source dir:
         if self.config.copy_compilation_db_to_source_dir and (self.buildDir / compilationDbName).exists():
             self.installFile(self.buildDir / compilationDbName, self.sourceDir / compilationDbName, force=True)
@@ -1400,6 +1513,8 @@ class Project(SimpleProject):
             cwd = self.buildDir
         if not self.should_run_configure():
             return
+        # CC/CXX may point to the compilation database wrapper
+        self._ensure_compdb_wrapper_exists()
 
         _configure_path = self.configureCommand
         if configure_path:
@@ -1504,7 +1619,8 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
             print(self.projectName, "directories: source=%s, build=%s, install=%s" %
                   (self.sourceDir, self.buildDir, self.installDir))
         if not self.config.skipUpdate:
-            self.update()
+            with self._timed_phase("update"):
+                self.update()
         if not self._systemDepsChecked:
             self.check_system_dependencies()
         assert self._systemDepsChecked, "self._systemDepsChecked must be set by now!"
@@ -1524,7 +1640,11 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
                     self._force_clean = True
 
         # run the rm -rf <build dir> in the background
-        cleaningTask = self.clean() if (self._force_clean or self.config.clean) else ThreadJoiner(None)
+        if self._force_clean or self.config.clean:
+            with self._timed_phase("clean"):
+                cleaningTask = self.clean()
+        else:
+            cleaningTask = ThreadJoiner(None)
         if cleaningTask is None:
             cleaningTask = ThreadJoiner(None)
         assert isinstance(cleaningTask, ThreadJoiner), ""
@@ -1536,7 +1656,8 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
             if not self.config.skipConfigure or self.config.configureOnly:
                 if self.should_run_configure():
                     statusUpdate("Configuring", self.display_name, "... ")
-                    self.configure()
+                    with self._timed_phase("configure"):
+                        self.configure()
             if self.config.configureOnly:
                 return
             if not self.config.skipBuild:
@@ -1545,10 +1666,12 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
                                   force=True)
                     # move any csetbounds stats from configuration (since they are not useful)
                 statusUpdate("Building", self.display_name, "... ")
-                self.compile()
+                with self._timed_phase("compile"):
+                    self.compile()
             if not self.config.skipInstall:
                 statusUpdate("Installing", self.display_name, "... ")
-                self.install()
+                with self._timed_phase("install"):
+                    self.install()
 
 
 class CMakeProject(Project):
@@ -1641,6 +1764,9 @@ class CMakeProject(Project):
             self.add_cmake_options(CMAKE_INSTALL_PREFIX=self.installPrefix)
         else:
             self.add_cmake_options(CMAKE_INSTALL_PREFIX=self.installDir)
+        if self.compiler_launcher:
+            self.add_cmake_options(CMAKE_C_COMPILER_LAUNCHER=";".join(self.compiler_launcher),
+                                   CMAKE_CXX_COMPILER_LAUNCHER=";".join(self.compiler_launcher))
         self.configureArgs.extend(self.cmakeOptions)
         # make sure we get a completely fresh cache when --reconfigure is passed:
         cmakeCache = self.buildDir / "CMakeCache.txt"
@@ -1695,6 +1821,7 @@ class CMakeProject(Project):
 class AutotoolsProject(Project):
     doNotAddToTargets = True
     _configure_supports_prefix = True
+    uses_compiler_launcher = True  # configure picks up CC/CXX (see configure())
 
     @classmethod
     def setupConfigOptions(cls, **kwargs):
@@ -1720,6 +1847,12 @@ class AutotoolsProject(Project):
                 self.configureArgs.append("--prefix=" + str(self.installDir))
         if self.extraConfigureFlags:
             self.configureArgs.extend(self.extraConfigureFlags)
+        if self.compiler_launcher and self.crosscompile_target is None:
+            # The cross-compile projects add the launcher to their own CC/CXX (see set_prog_with_args())
+            for prog, default in (("CC", "cc"), ("CXX", "c++")):
+                if prog not in self.configureEnvironment:
+                    compiler = os.getenv(prog, default)
+                    self.configureEnvironment[prog] = commandline_to_str(self.compiler_launcher) + " " + compiler
         super().configure(**kwargs)
 
     def needsConfigure(self):
@@ -39,7 +39,10 @@ from .disk_image import BuildFreeBSDImage
 from .disk_image import *
 from .project import *
 from pathlib import Path
-from ..utils import IS_FREEBSD
+from ..utils import IS_FREEBSD, find_free_port
+from ..qemuinstances import QEMUInstanceManager, QMPError
+from ..hostshares import HostShare, get_share_backend, share_qemu_args
+from ..testselection import kyua_test_dependencies
 
 
 def defaultSshForwardingPort():
@@ -73,6 +76,11 @@ class LaunchQEMUBase(SimpleProject):
                                                       help="If set QEMU will provide this directory over smb with the "
                                                             "name //10.0.2.4/qemu for use with mount_smbfs")
         cls.cvtrace = cls.addBoolOption("cvtrace", help="Use binary trace output instead of textual")
+        # virtio-fs is not offered here since virtiofsd would have to outlive cheribuild for --background instances
+        cls.share_backend = cls.addConfigOption("share-backend", kind=str, default="smb", choices=("smb", "9p"),
+                                                help="How to share the source/build/output directories with the guest. "
+                                                     "9p is faster but requires a QEMU built with virtfs support and "
+                                                     "the p9fs driver in the guest kernel.")
         # TODO: -s will no longer work, not sure anyone uses it though
         if cls._forwardSSHPort:
             cls.sshForwardingPort = cls.addConfigOption("ssh-forwarding-port", shortname=sshPortShortname, kind=int,
@@ -80,6 +88,20 @@ class LaunchQEMUBase(SimpleProject):
                                                         help="The port on localhost to forward to the QEMU ssh port. "
                                                              "You can then use `ssh root@localhost -p $PORT` connect "
                                                              "to the VM")
+        cls.background = cls.addBoolOption("background", showHelp=True,
+                                           help="Start QEMU in the background as a managed instance (with a QMP "
+                                                "control socket) instead of blocking the terminal. If the instance is "
+                                                "already running it will be reused instead of booted again.")
+        cls.instance_name = cls.addConfigOption("instance-name", kind=str, default=ComputedDefaultValue(
+            function=lambda config, proj: proj.target, asString="the target name"), metavar="NAME",
+                                                help="The name of the managed QEMU instance")
+        cls.attach = cls.addBoolOption("attach", help="Connect to the serial console of the managed instance "
+                                                      "(press CTRL+] to detach)")
+        cls.stop_instance = cls.addBoolOption("stop", help="Shut down the managed QEMU instance")
+        cls.reload_kernel = cls.addBoolOption("reload-kernel", help="Restart the managed QEMU instance with the same "
+                                                                    "command line and ports to boot the current kernel")
+        cls.reset_instance = cls.addBoolOption("reset", help="Reset the managed QEMU instance via QMP")
+        cls.list_instances = cls.addBoolOption("list-instances", help="List all running managed QEMU instances")
 
     def __init__(self, config: CheriConfig):
         super().__init__(config)
@@ -97,7 +119,71 @@ class LaunchQEMUBase(SimpleProject):
         self.rootfs_path = None  # type: Path
         self._after_disk_options = []
 
+    @property
+    def instance_manager(self) -> QEMUInstanceManager:
+        return QEMUInstanceManager(self.config.buildRoot / "qemu-instances")
+
+    def _handle_instance_commands(self) -> bool:
+        """Handle --list-instances/--stop/--attach/etc. Returns True if QEMU should not be launched."""
+        manager = self.instance_manager
+        if self.list_instances:
+            print(manager.format_table(manager.list()))
+            return True
+        if not (self.stop_instance or self.attach or self.reload_kernel or self.reset_instance):
+            return False
+        instance = manager.get(self.instance_name)
+        if instance is None:
+            if self.config.pretend:
+                statusUpdate("Would act on managed QEMU instance", self.instance_name)
+                return True
+            self.fatal("No managed QEMU instance named", self.instance_name, "is running.",
+                       fixitHint="Start one with `cheribuild.py " + self.target + " --" + self.target + "/background`")
+            return True
+        try:
+            if self.stop_instance:
+                statusUpdate("Stopping QEMU instance", instance.name, "(pid", str(instance.pid) + ")")
+                manager.stop(instance)
+                return True
+            if self.reload_kernel:
+                statusUpdate("Restarting QEMU instance", instance.name, "to load the kernel", instance.kernel)
+                instance = manager.restart(instance)
+            elif self.reset_instance:
+                statusUpdate("Resetting QEMU instance", instance.name)
+                manager.reset(instance)
+        except QMPError as e:
+            self.fatal("Failed to control QEMU instance", instance.name + ":", e)
+            return True
+        if self.attach:
+            statusUpdate("Attaching to the serial console of", instance.name, "(press CTRL+] to detach)")
+            manager.attach(instance)
+        return True
+
+    def _launch_in_background(self, qemuCommand: list):
+        manager = self.instance_manager
+        existing = manager.get(self.instance_name)
+        if existing is not None:
+            statusUpdate("Reusing running QEMU instance", existing.name, "(pid", str(existing.pid) + ")")
+            if existing.ssh_port:
+                print(coloured(AnsiColour.green, "SSH is available on localhost:", existing.ssh_port, sep=""))
+            print("Use --" + self.target + "/attach to connect to the console or --" + self.target +
+                  "/reload-kernel to boot a new kernel.")
+            return
+        printCommand(qemuCommand)
+        if self.config.pretend:
+            return
+        try:
+            instance = manager.start(self.instance_name, qemuCommand,
+                                     ssh_port=self.sshForwardingPort if self._forwardSSHPort else None,
+                                     kernel=self.currentKernel, disk_image=self.diskImage)
+        except QMPError as e:
+            self.fatal("Failed to start QEMU instance", self.instance_name + ":", e)
+            return
+        statusUpdate("Started QEMU instance", instance.name, "(pid", str(instance.pid) + "). Console output is "
+                     "logged to", instance.logfile, "and QEMU errors to", instance.stderr_logfile)
+
     def process(self):
+        if self._handle_instance_commands():
+            return
         if not self.qemuBinary.exists():
             self.dependencyError("QEMU is missing:", self.qemuBinary,
                                  installInstructions="Run `cheribuild.py qemu` or `cheribuild.py run -d`.")
@@ -115,7 +201,14 @@ class LaunchQEMUBase(SimpleProject):
             if not self.diskImage.exists():
                 self.dependencyError("Disk image is missing:", self.diskImage,
                                      installInstructions="Run `cheribuild.py disk-image` or `cheribuild.py run -d`.")
-        if self._forwardSSHPort and not self.isPortAvailable(self.sshForwardingPort):
+        if self.background and self._forwardSSHPort and not self.isPortAvailable(self.sshForwardingPort) and \
+                self.instance_manager.get(self.instance_name) is None:
+            # Managed instances can use any port since it is recorded in the state file
+            free_port = find_free_port()
+            free_port.socket.close()
+            self.sshForwardingPort = free_port.port
+            warningMessage("SSH forwarding port is in use, using port", self.sshForwardingPort, "instead")
+        if self._forwardSSHPort and not self.isPortAvailable(self.sshForwardingPort) and not self.background:
             self.printPortUsage(self.sshForwardingPort)
             self.fatal("SSH forwarding port", self.sshForwardingPort, "is already in use! Make sure you don't ",
                        "already have a QEMU instance running or change the chosen port by setting the config option",
@@ -153,41 +246,36 @@ class LaunchQEMUBase(SimpleProject):
         kernelFlags = ["-kernel", self.currentKernel] if self.currentKernel else []
         qemuCommand = [self.qemuBinary] + self.machineFlags + kernelFlags + [
             "-m", "2048",  # 2GB memory
-            "-nographic",  # no GPU
-        ] + self._projectSpecificOptions + diskOptions + self._after_disk_options + monitorOptions + logfileOptions + self.extraOptions
+        ] + ([] if self.background else ["-nographic"])  # no GPU
+        qemuCommand += self._projectSpecificOptions + diskOptions + self._after_disk_options + monitorOptions + logfileOptions + self.extraOptions
         statusUpdate("About to run QEMU with image", self.diskImage, "and kernel", self.currentKernel)
-        user_network_options = ""
-        smb_dir_count = 0
+        shares = []
 
-        def add_smb_dir(directory, target, share_name=None, readonly=False):
+        def add_shared_dir(directory, target, share_name=None, readonly=False):
             if not directory:
                 return
-            nonlocal user_network_options
-            nonlocal smb_dir_count
-            if smb_dir_count:
-                user_network_options += ":"
-            else:
-                user_network_options += ",smb="
-            smb_dir_count += 1
-            share_name_option = ""
-            if share_name is not None:
-                share_name_option = "<<<" + share_name
-            else:
-                share_name = "qemu{}".format(smb_dir_count)
-            user_network_options += str(directory) + share_name_option + ("@ro" if readonly else "")
-            guest_cmd = coloured(AnsiColour.yellow, "mkdir -p {target} && mount_smbfs -I 10.0.2.4 -N "
-                                 "//10.0.2.4/{share_name} {target}".format(target=target, share_name=share_name))
-            statusUpdate("Providing ", coloured(AnsiColour.green, str(directory)),
-                         coloured(AnsiColour.cyan, " over SMB to the guest. Use `"), guest_cmd,
-                         coloured(AnsiColour.cyan, "` to mount it"), sep="")
+            shares.append(HostShare(str(directory), readonly=readonly, in_target=target, name=share_name))
 
+        share_backend = get_share_backend(self.share_backend)
         # Only default to providing the smb mount if smbd exists
-        if self._provide_src_via_smb and shutil.which("smbd"):  # for running CheriBSD + FreeBSD
-            add_smb_dir(self.custom_qemu_smb_mount, "/mnt")
-            add_smb_dir(self.config.sourceRoot, "/srcroot", share_name="source_root", readonly=True)
-            add_smb_dir(self.config.buildRoot, "/buildroot", share_name="build_root", readonly=False)
-            add_smb_dir(self.config.outputRoot, "/outputroot", share_name="output_root", readonly=True)
-            add_smb_dir(self.rootfs_path, "/rootfs", share_name="rootfs", readonly=False)
+        if self._provide_src_via_smb and (share_backend.name != "smb" or shutil.which("smbd")):
+            # for running CheriBSD + FreeBSD
+            add_shared_dir(self.custom_qemu_smb_mount, "/mnt")
+            add_shared_dir(self.config.sourceRoot, "/srcroot", share_name="source_root", readonly=True)
+            add_shared_dir(self.config.buildRoot, "/buildroot", share_name="build_root", readonly=False)
+            add_shared_dir(self.config.outputRoot, "/outputroot", share_name="output_root", readonly=True)
+            add_shared_dir(self.rootfs_path, "/rootfs", share_name="rootfs", readonly=False)
+        if shares and not self.config.pretend and not share_backend.is_available(str(self.qemuBinary)):
+            self.fatal("QEMU binary", self.qemuBinary, "does not support the", share_backend.name, "share backend",
+                       fixitHint="Rebuild QEMU with virtfs support or use --" + self.target + "/share-backend=smb")
+        for index, share in enumerate(shares):
+            guest_cmd = coloured(AnsiColour.yellow, "mkdir -p {} && {}".format(
+                share.in_target, share_backend.guest_mount_command(index, share)))
+            statusUpdate("Providing ", coloured(AnsiColour.green, share.hostdir),
+                         coloured(AnsiColour.cyan, " over ", share_backend.name, " to the guest. Use `"), guest_cmd,
+                         coloured(AnsiColour.cyan, "` to mount it"), sep="")
+        user_network_options, share_args = share_qemu_args([share_backend], shares, memory_size="2048M")
+        qemuCommand += share_args
 
         if self._forwardSSHPort:
             user_network_options += ",hostfwd=tcp::" + str(self.sshForwardingPort) + "-:22"
@@ -202,6 +290,9 @@ class LaunchQEMUBase(SimpleProject):
         if self._hasPCI:
             qemuCommand += ["-device", "virtio-rng-pci"]
 
+        if self.background:
+            self._launch_in_background(qemuCommand)
+            return
         runCmd(qemuCommand, stdout=sys.stdout, stderr=sys.stderr)  # even with --quiet we want stdout here
 
     @staticmethod
@@ -273,8 +364,34 @@ class AbstractLaunchFreeBSD(LaunchQEMUBase):
         super().process()
 
     def run_tests(self):
+        if self.config.run_affected_tests_only and self.rootfs_path is not None:
+            self._run_affected_kyua_tests()
+            return
         self.run_cheribsd_test_script("run_cheribsd_tests.py", disk_image_path=self.diskImage, kernel_path=self.currentKernel)
 
+    def _run_affected_kyua_tests(self):
+        source_dir = self.source_class.getSourceDir(self, self.config)
+        readelf = self.config.sdkBinDir / "llvm-readelf"
+        dependencies = kyua_test_dependencies(self.rootfs_path / "usr/tests", source_dir,
+                                              readelf=readelf if readelf.exists() else "readelf")
+        plan = self.plan_affected_tests(source_dir, dependencies)
+        if not plan.run_all and not plan.tests:
+            statusUpdate("No kyua tests are affected by the changes since the last passing run")
+            plan.record_success(pretend=self.config.pretend)
+            return
+        output_dir = self.config.buildRoot / "test-selection" / (self.target + "-kyua-results")
+        self.makedirs(output_dir)
+        # Don't let the results of a previous run count as a successful run
+        self.deleteFile(output_dir / "test-results.db")
+        self.deleteFile(output_dir / "test-results.xml")
+        args = ["--kyua-tests-files", "/usr/tests/Kyuafile", "--kyua-tests-output", output_dir,
+                "--kyua-tests-output-no-timestamped-subdir"]
+        if not plan.run_all:
+            args += ["--kyua-test-filters"] + plan.tests
+        self.run_cheribsd_test_script("run_cheribsd_tests.py", *args, disk_image_path=self.diskImage,
+                                      kernel_path=self.currentKernel)
+        plan.record_success(output_dir / "test-results.xml", pretend=self.config.pretend)
+
 
 class _RunMultiArchFreeBSDImage(MultiArchBaseMixin, AbstractLaunchFreeBSD):
     doNotAddToTargets = True
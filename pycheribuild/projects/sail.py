@@ -27,18 +27,24 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
+import json
 import os
 import shlex
 import shutil
+import sys
 from subprocess import CalledProcessError
 from typing import Tuple, Dict, Any, Union
 
 from .project import *
+from ..opamswitchcache import OpamSwitchSnapshotCache
 from ..utils import runCmd, setEnv, coloured, AnsiColour, commandline_to_str, get_program_version, IS_LINUX
 
 
 class OpamMixin(object):
     config = None
+    # The variables that opam adds to the environment for each (opamroot, switch). These are computed once per
+    # invocation instead of running `eval $(opam config env)`/`opam exec` for every command.
+    _opam_env_cache = dict()  # type: typing.Dict[typing.Tuple[str, str], typing.Dict[str, str]]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -47,6 +53,7 @@ class OpamMixin(object):
         self.required_ocaml_version = "4.06.1"
         self.__using_correct_switch = False
         self.__ignore_switch_version = False
+        self.__created_switch = False
 
     @property
     def opamroot(self):
@@ -68,6 +75,12 @@ class OpamMixin(object):
     def opam_binary(self):
         return shutil.which("opam") or "opam"
 
+    @property
+    def _switch_snapshot_cache(self) -> "typing.Optional[OpamSwitchSnapshotCache]":
+        if not self.config.opam_switch_cache_dir:
+            return None
+        return OpamSwitchSnapshotCache(self.config.opam_switch_cache_dir)
+
     def _opam_cmd(self, command, *args, _add_switch=True):
         cmdline = [self.opam_binary, command, "--root=" + str(self.opamroot)]
         if _add_switch:
@@ -85,12 +98,33 @@ class OpamMixin(object):
                 self.run_opam_cmd("switch", self.required_ocaml_version, _add_switch=False)
             except CalledProcessError:
                 # create the switch if it doesn't exist
-                self.run_opam_cmd("switch", "--verbose", "--debug", "create", self.required_ocaml_version,
-                                  _add_switch=False)
+                self._create_switch()
             finally:
                 self.__ignore_switch_version = False
             self.__using_correct_switch = True
 
+    def _create_switch(self):
+        self.run_opam_cmd("switch", "--verbose", "--debug", "create", self.required_ocaml_version, _add_switch=False)
+        lockfile = self.config.opam_switch_lockfile
+        if lockfile:
+            self.run_opam_cmd("switch", "import", lockfile, "--yes")
+        self._opam_env_cache.pop((str(self.opamroot), self.required_ocaml_version), None)
+        # The snapshot is saved by _save_switch_snapshot() once all packages have been installed
+        self.__created_switch = True
+
+    def _save_switch_snapshot(self):
+        """
+        Save the opam root to --opam-switch-cache-dir. This should be called after the packages have been installed
+        since a snapshot of the new switch that only contains the compiler would not avoid rebuilding them.
+        """
+        cache = self._switch_snapshot_cache
+        if cache is None:
+            return
+        lockfile = self.config.opam_switch_lockfile
+        if self.__created_switch or cache.find(self.opamroot, self.required_ocaml_version, lockfile) is None:
+            cache.save(self.opamroot, self.required_ocaml_version, lockfile)
+            self.__created_switch = False
+
     def run_opam_cmd(self, command, *args, ignoreErrors=False, _add_switch=True, **kwargs):
         self._ensure_correct_switch()
         command_list = self._opam_cmd(command, *args, _add_switch=_add_switch)
@@ -116,12 +150,43 @@ class OpamMixin(object):
         if Path(self.opam_binary).is_absolute():
             opam_env["OPAM_USER_PATH_RO"] = Path(self.opam_binary).parent
         if not (self.opamroot / "opam-init").exists():
-            runCmd(self.opam_binary, "init", "--root=" + str(self.opamroot), "--no-setup", cwd="/", env=opam_env)
+            cache = self._switch_snapshot_cache
+            snapshot = cache.find(self.opamroot, self.required_ocaml_version,
+                                  self.config.opam_switch_lockfile) if cache else None
+            if snapshot is not None:
+                OpamSwitchSnapshotCache.restore(snapshot, self.opamroot)
+            else:
+                runCmd(self.opam_binary, "init", "--root=" + str(self.opamroot), "--no-setup", cwd="/", env=opam_env)
         return opam_env, cwd
 
+    def _opam_switch_env(self, opam_env: dict) -> "typing.Optional[typing.Dict[str, str]]":
+        if self.config.pretend:
+            return None
+        key = (str(self.opamroot), self.required_ocaml_version)
+        if key not in self._opam_env_cache:
+            # Start python once inside the switch and record the variables that opam changed
+            dump_env = [sys.executable, "-c", "import json, os; print(json.dumps(dict(os.environ)))"]
+            try:
+                output = runCmd(self._opam_cmd("exec", "--") + dump_env, env=opam_env, cwd="/", captureOutput=True,
+                                print_verbose_only=True).stdout
+                switch_env = json.loads(output.decode("utf-8"))
+            except (CalledProcessError, ValueError) as e:
+                # noinspection PyUnresolvedReferences
+                self.warning("Could not determine opam environment, will evaluate it for every command:", e)
+                return None
+            base_env = os.environ.copy()
+            base_env.update((k, str(v)) for k, v in opam_env.items())
+            self._opam_env_cache[key] = {k: v for k, v in switch_env.items() if base_env.get(k) != v}
+        return self._opam_env_cache[key]
+
     def run_in_ocaml_env(self, command: str, cwd=None, print_verbose_only=False, **kwargs):
         opam_env, cwd = self._run_in_ocaml_env_prepare(cwd=cwd)
-        script = "eval `opam config env`\n" + command + "\n"
+        switch_env = self._opam_switch_env(opam_env)
+        if switch_env is None:
+            script = "eval `opam config env`\n" + command + "\n"
+        else:
+            script = command + "\n"
+            opam_env.update(switch_env)
         assert isinstance(self, Project)
         return self.runShellScript(script, cwd=cwd, print_verbose_only=print_verbose_only, env=opam_env, **kwargs)
 
@@ -130,7 +195,11 @@ class OpamMixin(object):
         opam_env, cwd = self._run_in_ocaml_env_prepare(cwd=cwd)
         # for opam commands we don't need to prepend opam exec --
         if command[0] != self.opam_binary:
-            command = [self.opam_binary, "exec", "--root=" + str(self.opamroot), "--"] + command
+            switch_env = self._opam_switch_env(opam_env)
+            if switch_env is None:
+                command = [self.opam_binary, "exec", "--root=" + str(self.opamroot), "--"] + command
+            else:
+                opam_env.update(switch_env)
         return runCmd(command, cwd=cwd, print_verbose_only=print_verbose_only, env=opam_env, **kwargs)
 
 
@@ -221,6 +290,8 @@ class BuildSailFromOpam(OpamMixin, SimpleProject):
         finally:
             # reset the pin status even if the pinning failed
             self.run_opam_cmd("pin", "remove", "sail", "--no-action")
+        # sail and all its dependencies are now installed in the switch
+        self._save_switch_snapshot()
 
         if False:
             self.run_opam_cmd("install", "-y", "--verbose", "sail")
@@ -262,7 +333,7 @@ class BuildSailCheriMips(ProjectUsingOpam):
         # self.make_args.set(SAIL_DIR=self.config.sdkDir / "share/sail", SAIL=self.config.sdkBinDir / "sail")
         if self.with_trace_support:
             self.make_args.set(TRACE="yes")
-        cmd = [self.make_args.command, self.config.makeJFlag, "all"] + self.make_args.all_commandline_args
+        cmd = [self.make_args.command, "-j" + str(self.make_jobs), "all"] + self.make_args.all_commandline_args
         self.run_command_in_ocaml_env(cmd, cwd=self.sourceDir)
 
     def install(self, **kwargs):
@@ -296,7 +367,7 @@ class BuildSailRISCV(ProjectUsingOpam):
         # self.make_args.set(SAIL_DIR=self.config.sdkDir / "share/sail", SAIL=self.config.sdkBinDir / "sail")
         if self.with_trace_support:
             self.make_args.set(TRACE="yes")
-        cmd = [self.make_args.command, self.config.makeJFlag, "opam-build"] + self.make_args.all_commandline_args
+        cmd = [self.make_args.command, "-j" + str(self.make_jobs), "opam-build"] + self.make_args.all_commandline_args
         self.run_command_in_ocaml_env(cmd, cwd=self.sourceDir)
 
     def install(self, **kwargs):
@@ -331,7 +402,7 @@ class BuildSailCheriRISCV(ProjectUsingOpam):
         # self.make_args.set(SAIL_DIR=self.config.sdkDir / "share/sail", SAIL=self.config.sdkBinDir / "sail")
         if self.with_trace_support:
             self.make_args.set(TRACE="yes")
-        cmd = [self.make_args.command, self.config.makeJFlag, "opam-build"] + self.make_args.all_commandline_args
+        cmd = [self.make_args.command, "-j" + str(self.make_jobs), "opam-build"] + self.make_args.all_commandline_args
         self.run_command_in_ocaml_env(cmd, cwd=self.sourceDir)
 
     def install(self, **kwargs):
@@ -0,0 +1,305 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .utils import *
+
+
+class QMPError(Exception):
+    pass
+
+
+class QMPClient(object):
+    """A minimal client for the QEMU Machine Protocol (QMP) over a unix socket"""
+
+    def __init__(self, socket_path: Path, timeout: float = 10):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.connect(str(socket_path))
+        except OSError as e:
+            self._sock.close()
+            raise QMPError("Could not connect to QMP socket " + str(socket_path) + ": " + str(e)) from e
+        self._reader = self._sock.makefile("r", encoding="utf-8")
+        greeting = self._read_message()
+        if "QMP" not in greeting:
+            raise QMPError("Unexpected QMP greeting: " + str(greeting))
+        self.execute("qmp_capabilities")
+
+    def _read_message(self) -> dict:
+        line = self._reader.readline()
+        if not line:
+            raise QMPError("QMP connection closed")
+        return json.loads(line)
+
+    def execute(self, command: str, **arguments):
+        request = {"execute": command}
+        if arguments:
+            request["arguments"] = arguments
+        self._sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        while True:
+            try:
+                response = self._read_message()
+            except QMPError:
+                if command == "quit":
+                    return None  # QEMU may exit before sending the response
+                raise
+            if "event" in response:
+                continue  # asynchronous events (e.g. SHUTDOWN) are not interesting here
+            if "error" in response:
+                raise QMPError(command + " failed: " + response["error"].get("desc", str(response["error"])))
+            return response.get("return")
+
+    def close(self):
+        self._reader.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class QEMUInstance(object):
+    """A QEMU process that was started in the background and is managed by cheribuild"""
+    fields = ("name", "pid", "command", "qmp_socket", "serial_socket", "logfile", "stderr_logfile", "ssh_port",
+              "kernel", "disk_image", "started")
+
+    def __init__(self, **kwargs):
+        for field in self.fields:
+            setattr(self, field, kwargs.get(field))
+
+    def to_json(self) -> dict:
+        return {field: getattr(self, field) for field in self.fields}
+
+    @property
+    def is_running(self) -> bool:
+        try:
+            if os.waitpid(self.pid, os.WNOHANG)[0] == self.pid:
+                return False  # we started it in this process and it has exited (zombie)
+        except ChildProcessError:
+            pass
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        # Make sure the pid hasn't been reused by an unrelated process
+        cmdline = Path("/proc", str(self.pid), "cmdline")
+        if cmdline.exists():
+            try:
+                args = cmdline.read_bytes().decode("utf-8", errors="replace").split("\0")
+                return any(arg.endswith(os.path.basename(self.command[0])) for arg in args)
+            except OSError:
+                return False
+        return True
+
+
+class QEMUInstanceManager(object):
+    """
+    Keeps track of the QEMU instances started with --<target>/background. The state is stored as one JSON file per
+    instance so that later invocations can list, attach to, restart or stop them.
+    """
+
+    def __init__(self, state_dir: Path, socket_dir: Path = None):
+        self.state_dir = state_dir
+        # unix socket paths are limited to ~100 characters so they are not created in the (deep) build directory
+        self.socket_dir = socket_dir or Path(tempfile.gettempdir(), "cheribuild-qemu-" + str(os.getuid()))
+
+    def _state_file(self, name: str) -> Path:
+        return self.state_dir / (name + ".json")
+
+    def _cleanup(self, instance: QEMUInstance):
+        for path in (self._state_file(instance.name), instance.qmp_socket, instance.serial_socket):
+            if path and Path(path).exists():
+                Path(path).unlink()
+
+    def get(self, name: str) -> "typing.Optional[QEMUInstance]":
+        try:
+            with self._state_file(name).open("r") as f:
+                instance = QEMUInstance(**json.load(f))
+        except (OSError, ValueError):
+            return None
+        if not instance.is_running:
+            self._cleanup(instance)  # QEMU exited (or the machine was rebooted) -> remove stale state
+            return None
+        return instance
+
+    def list(self) -> "typing.List[QEMUInstance]":
+        if not self.state_dir.is_dir():
+            return []
+        result = [self.get(f.stem) for f in sorted(self.state_dir.glob("*.json"))]
+        return [i for i in result if i is not None]
+
+    def start(self, name: str, qemu_command: "typing.List[str]", *, ssh_port: int = None, kernel: Path = None,
+              disk_image: Path = None) -> QEMUInstance:
+        assert self.get(name) is None, "instance " + name + " is already running"
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.socket_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        qmp_socket = self.socket_dir / (name + ".qmp")
+        serial_socket = self.socket_dir / (name + ".serial")
+        logfile = self.state_dir / (name + ".console.log")
+        # QEMU keeps running after cheribuild exits so its warnings and errors must go to a file and not a pipe
+        stderr_logfile = self.state_dir / (name + ".stderr.log")
+        for stale in (qmp_socket, serial_socket):
+            if stale.exists():
+                stale.unlink()
+        command = [str(x) for x in qemu_command] + ["-display", "none"]
+        if "-monitor" not in command:
+            command += ["-monitor", "none"]
+        command += [
+            "-qmp", "unix:" + str(qmp_socket) + ",server,nowait",
+            "-chardev", "socket,id=cheribuild-serial,path=" + str(serial_socket) + ",server,nowait,logfile=" +
+            str(logfile) + ",logappend=on",
+            "-serial", "chardev:cheribuild-serial"]
+        # Don't leave an unmanaged QEMU behind if cheribuild is killed before the state file has been written
+        old_handler = signal.signal(signal.SIGTERM, signal.default_int_handler)
+        process = None
+        try:
+            with open(os.devnull, "r+b") as devnull, stderr_logfile.open("ab") as stderr:
+                stderr_offset = stderr.tell()  # only the output of this run should be included in errors
+                process = subprocess.Popen(command, stdin=devnull, stdout=devnull, stderr=stderr,
+                                           start_new_session=True)
+            instance = QEMUInstance(name=name, pid=process.pid, command=command, qmp_socket=str(qmp_socket),
+                                    serial_socket=str(serial_socket), logfile=str(logfile),
+                                    stderr_logfile=str(stderr_logfile), ssh_port=ssh_port,
+                                    kernel=str(kernel) if kernel else None,
+                                    disk_image=str(disk_image) if disk_image else None, started=time.time())
+            self._wait_for_qmp(process, qmp_socket, stderr_logfile, stderr_offset)
+            tmp = self._state_file(name).with_suffix(".tmp")
+            with tmp.open("w") as f:
+                json.dump(instance.to_json(), f, indent=2)
+            os.replace(str(tmp), str(self._state_file(name)))
+            return instance
+        except BaseException:
+            if process is not None and process.poll() is None:
+                process.terminate()
+                process.wait()
+            raise
+        finally:
+            signal.signal(signal.SIGTERM, old_handler)
+
+    @staticmethod
+    def _wait_for_qmp(process: subprocess.Popen, qmp_socket: Path, stderr_logfile: Path, stderr_offset: int,
+                      timeout: float = 30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if process.poll() is not None:
+                with stderr_logfile.open("rb") as f:
+                    f.seek(stderr_offset)
+                    stderr = f.read().decode("utf-8", errors="replace").strip()
+                raise QMPError("QEMU exited with code " + str(process.returncode) + ": " + stderr)
+            if qmp_socket.exists():
+                try:
+                    with QMPClient(qmp_socket):
+                        return
+                except QMPError:
+                    pass
+            time.sleep(0.1)
+        raise QMPError("Timed out waiting for the QMP socket " + str(qmp_socket))
+
+    def stop(self, instance: QEMUInstance, timeout: float = 10):
+        try:
+            with QMPClient(Path(instance.qmp_socket)) as qmp:
+                qmp.execute("quit")
+        except QMPError:
+            os.kill(instance.pid, signal.SIGTERM)  # QEMU also shuts down cleanly on SIGTERM
+        deadline = time.time() + timeout
+        while instance.is_running and time.time() < deadline:
+            time.sleep(0.1)
+        if instance.is_running:
+            os.kill(instance.pid, signal.SIGKILL)
+        self._cleanup(instance)
+
+    def restart(self, instance: QEMUInstance) -> QEMUInstance:
+        """Restart the instance with the same command line (and therefore the same ports) to pick up a new kernel"""
+        self.stop(instance)
+        # Strip the options that start() adds
+        base_command = instance.command[:instance.command.index("-display")]
+        return self.start(instance.name, base_command, ssh_port=instance.ssh_port,
+                          kernel=Path(instance.kernel) if instance.kernel else None,
+                          disk_image=Path(instance.disk_image) if instance.disk_image else None)
+
+    @staticmethod
+    def reset(instance: QEMUInstance):
+        with QMPClient(Path(instance.qmp_socket)) as qmp:
+            qmp.execute("system_reset")
+
+    @staticmethod
+    def attach(instance: QEMUInstance, escape_char=b"\x1d"):
+        """Connect the terminal to the serial console of the instance until the escape character (CTRL+]) is typed"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(instance.serial_socket)
+        stdin_fd = sys.stdin.fileno()
+        old_attrs = None
+        if sys.stdin.isatty():
+            import termios
+            import tty
+            old_attrs = termios.tcgetattr(stdin_fd)
+            tty.setraw(stdin_fd)
+        try:
+            while True:
+                readable, _, _ = select.select([sock, stdin_fd], [], [])
+                if sock in readable:
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                    os.write(sys.stdout.fileno(), data)
+                if stdin_fd in readable:
+                    data = os.read(stdin_fd, 1024)
+                    if not data or escape_char in data:
+                        sock.sendall(data.split(escape_char)[0])
+                        break
+                    sock.sendall(data)
+        finally:
+            if old_attrs is not None:
+                import termios
+                termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_attrs)
+            sock.close()
+
+    @staticmethod
+    def format_table(instances: "typing.List[QEMUInstance]") -> str:
+        if not instances:
+            return "No QEMU instances are running."
+        lines = ["%-24s %8s %8s  %s" % ("NAME", "PID", "SSH", "KERNEL")]
+        for i in instances:
+            lines.append("%-24s %8d %8s  %s" % (i.name, i.pid, i.ssh_port or "-", i.kernel or "-"))
+        return "\n".join(lines)
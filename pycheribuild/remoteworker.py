@@ -0,0 +1,241 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import array
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from .utils import *
+
+# Used by remote-cheribuild.py --persistent-worker: the single-file script is started once as a resident server on
+# the remote host (with all projects already loaded) and each invocation forks a new cheribuild process from it.
+# The requesting process passes its stdin/stdout/stderr file descriptors to the server so that the output is
+# streamed back over the existing ssh connection without any copying.
+
+REMOTE_WORKER_SERVE = "--remote-worker-serve"
+REMOTE_WORKER_REQUEST = "--remote-worker-request"
+REMOTE_WORKER_COMMANDS = (REMOTE_WORKER_SERVE, REMOTE_WORKER_REQUEST)
+
+_REMOTE_WORKER_HEADER = struct.Struct("!Q")
+
+
+def _send_fds(sock: socket.socket, data: bytes, fds: "typing.List[int]"):
+    sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+
+
+def _recv_fds(sock: socket.socket, msglen: int, maxfds: int) -> "typing.Tuple[bytes, typing.List[int]]":
+    fds = array.array("i")
+    msg, ancdata, flags, addr = sock.recvmsg(msglen, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    return msg, list(fds)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    result = b""
+    while len(result) < size:
+        chunk = sock.recv(size - len(result))
+        if not chunk:
+            raise EOFError("Connection closed while reading request")
+        result += chunk
+    return result
+
+
+def _run_request(request: dict, fds: "typing.List[int]", run_main: "typing.Callable[[], None]"):
+    # This runs in the forked cheribuild process: make it look like a normal invocation from the client
+    for i, fd in enumerate(fds[:3]):
+        os.dup2(fd, i)
+    for fd in fds:
+        if fd > 2:
+            os.close(fd)
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", buffering=1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    os.environ.clear()
+    os.environ.update(request["env"])
+    os.chdir(request["cwd"])
+    sys.argv = request["argv"]
+    exit_code = 0
+    try:
+        run_main()
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            exit_code = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(exit_code)
+
+
+def _handle_connection(conn: socket.socket, run_main: "typing.Callable[[], None]"):
+    header, fds = _recv_fds(conn, _REMOTE_WORKER_HEADER.size, 3)
+    if len(header) != _REMOTE_WORKER_HEADER.size or len(fds) != 3:
+        raise EOFError("Invalid request header")
+    length = _REMOTE_WORKER_HEADER.unpack(header)[0]
+    request = json.loads(_recv_exactly(conn, length).decode("utf-8"))
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        _run_request(request, fds, run_main)
+    for fd in fds:
+        os.close(fd)
+    conn.sendall(("pid " + str(pid) + "\n").encode("utf-8"))
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        exit_code = 128 + os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+    conn.sendall(("exit " + str(exit_code) + "\n").encode("utf-8"))
+
+
+def remote_worker_serve(socket_path: Path, run_main: "typing.Callable[[], None]", idle_timeout: float = 30 * 60):
+    """Accept build requests on socket_path until no request has been received for idle_timeout seconds"""
+    if socket_path.exists():
+        socket_path.unlink()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)  # only allow the current user to connect
+    try:
+        listener.bind(str(socket_path))
+    finally:
+        os.umask(old_umask)
+    listener.listen(8)
+    listener.settimeout(min(60.0, idle_timeout))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    children = set()
+    last_activity = time.time()
+    try:
+        while True:
+            for pid in list(children):
+                if os.waitpid(pid, os.WNOHANG)[0] != 0:
+                    children.remove(pid)
+            if children:
+                last_activity = time.time()
+            elif time.time() - last_activity > idle_timeout:
+                break
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            last_activity = time.time()
+            pid = os.fork()
+            if pid == 0:
+                listener.close()
+                exit_code = 0
+                try:
+                    _handle_connection(conn, run_main)
+                except (OSError, EOFError, ValueError) as e:
+                    print("Failed to handle request:", e, file=sys.stderr)
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+            conn.close()
+            children.add(pid)
+    finally:
+        listener.close()
+        if socket_path.exists():
+            socket_path.unlink()
+
+
+def remote_worker_connect(socket_path: Path) -> "typing.Optional[socket.socket]":
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def ensure_remote_worker_running(socket_path: Path, script: Path, timeout: float = 30) -> socket.socket:
+    sock = remote_worker_connect(socket_path)
+    if sock is not None:
+        return sock
+    with open(os.devnull, "r+b") as devnull:
+        subprocess.Popen([sys.executable, str(script), REMOTE_WORKER_SERVE, str(socket_path)], stdin=devnull,
+                         stdout=devnull, stderr=devnull, start_new_session=True, close_fds=True)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        sock = remote_worker_connect(socket_path)
+        if sock is not None:
+            return sock
+        time.sleep(0.05)
+    raise OSError("Could not start the cheribuild worker at " + str(socket_path))
+
+
+def remote_worker_request(sock: socket.socket, argv: "typing.List[str]", fds=(0, 1, 2), cwd: str = None,
+            env: "typing.Dict[str, str]" = None) -> int:
+    """Run cheribuild with argv in the worker connected to sock and return the exit code"""
+    data = json.dumps({"argv": list(argv), "cwd": cwd or os.getcwd(),
+                       "env": dict(os.environ if env is None else env)}).encode("utf-8")
+    _send_fds(sock, _REMOTE_WORKER_HEADER.pack(len(data)), list(fds))
+    sock.sendall(data)
+    reader = sock.makefile("r", encoding="utf-8")
+    pid = None
+    while True:
+        try:
+            line = reader.readline()
+        except KeyboardInterrupt:
+            # The worker process is not in our process group so forward the Ctrl+C explicitly
+            if pid is not None:
+                os.kill(pid, signal.SIGINT)
+            continue
+        if not line:
+            return 1  # worker died without reporting an exit status
+        kind, _, value = line.strip().partition(" ")
+        if kind == "pid":
+            pid = int(value)
+        elif kind == "exit":
+            return int(value)
+
+
+def remote_worker_main(args: "typing.List[str]", run_main: "typing.Callable[[], None]") -> int:
+    script = Path(sys.argv[0]).absolute()
+    if args[0] == REMOTE_WORKER_SERVE:
+        remote_worker_serve(Path(args[1]), run_main)
+        return 0
+    assert args[0] == REMOTE_WORKER_REQUEST
+    # The script is uploaded to a file named after the hash of its contents so a new version gets a new worker
+    sock = ensure_remote_worker_running(script.with_suffix(".sock"), script)
+    with sock:
+        return remote_worker_request(sock, [str(script)] + args[1:])
@@ -0,0 +1,282 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+#
+import argparse
+import csv
+import math
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+from .utils import *
+
+# The counters that are reported by default (if they exist in the CSV file)
+DEFAULT_COUNTERS = ("cycles", "instructions", "inst_user", "inst_kernel", "icache_read_miss", "dcache_read_miss",
+                    "dcache_write_miss", "l2cache_read_miss", "l2cache_write_miss", "mipsmem_cap_read",
+                    "mipsmem_cap_write")
+# Columns that identify the benchmark rather than contain a counter value
+_NAME_COLUMNS = ("progname", "archname")
+
+
+def _percentile(sorted_values: "typing.Sequence[float]", p: float) -> float:
+    """Percentile with linear interpolation between the closest ranks (same as numpy's default)"""
+    assert sorted_values, "Cannot compute percentile of an empty list"
+    k = (len(sorted_values) - 1) * p
+    lower = math.floor(k)
+    upper = math.ceil(k)
+    if lower == upper:
+        return sorted_values[int(k)]
+    return sorted_values[lower] * (upper - k) + sorted_values[upper] * (k - lower)
+
+
+def _normal_cdf(x: float) -> float:
+    return 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+
+
+class CounterSummary(object):
+    def __init__(self, values: "typing.Iterable[float]", confidence: float = 0.95):
+        self.values = sorted(values)
+        self.n = len(self.values)
+        self.median = _percentile(self.values, 0.5)
+        self.q1 = _percentile(self.values, 0.25)
+        self.q3 = _percentile(self.values, 0.75)
+        # Distribution-free confidence interval for the median based on order statistics (normal approximation
+        # of the binomial distribution). For very small samples this degenerates to [min, max].
+        z = 1.959963984540054 if confidence == 0.95 else math.sqrt(2) * _inverse_erf(confidence)
+        offset = z * math.sqrt(self.n) / 2
+        low_rank = max(int(math.floor(self.n / 2 - offset)), 1)
+        high_rank = min(int(math.ceil(1 + self.n / 2 + offset)), self.n)
+        self.ci_low = self.values[low_rank - 1]
+        self.ci_high = self.values[high_rank - 1]
+
+    @property
+    def iqr(self) -> float:
+        return self.q3 - self.q1
+
+    def __repr__(self):
+        return "<median={} IQR={} CI=[{}, {}] n={}>".format(self.median, self.iqr, self.ci_low, self.ci_high, self.n)
+
+
+def _inverse_erf(y: float) -> float:
+    # Newton iterations are good enough for the few confidence levels that we need
+    x = 0.0
+    for _ in range(100):
+        err = math.erf(x) - y
+        if abs(err) < 1e-12:
+            break
+        x -= err / (2 / math.sqrt(math.pi) * math.exp(-x * x))
+    return x
+
+
+def mann_whitney_u_test(a: "typing.Sequence[float]", b: "typing.Sequence[float]") -> float:
+    """
+    Two-sided Mann-Whitney U test (normal approximation with tie and continuity correction).
+    This does not assume normally distributed samples which is usually not the case for benchmark results.
+    :return: the p-value
+    """
+    n1 = len(a)
+    n2 = len(b)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    combined = sorted([(v, 0) for v in a] + [(v, 1) for v in b], key=lambda x: x[0])
+    rank_sum_a = 0.0
+    tie_correction = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        avg_rank = (i + j) / 2 + 1  # ranks are 1-based
+        ties = j - i + 1
+        tie_correction += ties ** 3 - ties
+        rank_sum_a += avg_rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 0)
+        i = j + 1
+    u = rank_sum_a - n1 * (n1 + 1) / 2
+    mean_u = n1 * n2 / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_correction / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0  # all values are identical
+    z = (abs(u - mean_u) - 0.5) / math.sqrt(variance)
+    return min(1.0, 2 * (1 - _normal_cdf(max(z, 0.0))))
+
+
+class CounterComparison(object):
+    def __init__(self, benchmark: str, counter: str, baseline: CounterSummary, current: CounterSummary):
+        self.benchmark = benchmark
+        self.counter = counter
+        self.baseline = baseline
+        self.current = current
+        self.p_value = mann_whitney_u_test(baseline.values, current.values)
+
+    @property
+    def relative_change(self) -> float:
+        if self.baseline.median == 0:
+            return 0.0 if self.current.median == 0 else math.inf
+        return (self.current.median - self.baseline.median) / abs(self.baseline.median)
+
+    def is_significant(self, alpha: float) -> bool:
+        return self.p_value < alpha
+
+    def is_regression(self, alpha: float, threshold: float) -> bool:
+        # All statcounters values (cycles, instructions, cache misses, ...) are lower-is-better
+        return self.is_significant(alpha) and self.relative_change > threshold
+
+
+# benchmark name -> counter name -> values (one per iteration)
+StatcountersData = "typing.Dict[str, typing.Dict[str, typing.List[float]]]"
+
+
+def load_statcounters_csv(csv_file: "typing.Union[Path, typing.IO]") -> StatcountersData:
+    if isinstance(csv_file, Path):
+        with csv_file.open("r", newline="") as f:
+            return load_statcounters_csv(f)
+    result = OrderedDict()
+    reader = csv.DictReader(csv_file)
+    for row in reader:
+        benchmark = row.get("progname") or "<unknown>"
+        counters = result.setdefault(benchmark, OrderedDict())
+        for key, value in row.items():
+            if key is None or key in _NAME_COLUMNS:
+                continue
+            try:
+                counters.setdefault(key.strip(), []).append(float(value))
+            except (TypeError, ValueError):
+                continue  # not a numeric column
+    return result
+
+
+def _selected_counters(data: StatcountersData, counters: "typing.Optional[typing.Iterable[str]]"):
+    all_counters = OrderedDict()
+    for benchmark_counters in data.values():
+        for name in benchmark_counters:
+            all_counters[name] = True
+    if counters:
+        return [c for c in counters if c in all_counters]
+    return [c for c in DEFAULT_COUNTERS if c in all_counters]
+
+
+def summarize_statcounters(data: StatcountersData, counters: "typing.Iterable[str]" = None
+                           ) -> "typing.Dict[str, typing.Dict[str, CounterSummary]]":
+    result = OrderedDict()
+    counter_names = _selected_counters(data, counters)
+    for benchmark, values in data.items():
+        result[benchmark] = OrderedDict((c, CounterSummary(values[c])) for c in counter_names if values.get(c))
+    return result
+
+
+def compare_statcounters(baseline: StatcountersData, current: StatcountersData,
+                         counters: "typing.Iterable[str]" = None) -> "typing.List[CounterComparison]":
+    result = []
+    counter_names = _selected_counters(current, counters)
+    for benchmark, values in current.items():
+        if benchmark not in baseline:
+            warningMessage("Benchmark", benchmark, "does not exist in the baseline CSV")
+            continue
+        for counter in counter_names:
+            if values.get(counter) and baseline[benchmark].get(counter):
+                result.append(CounterComparison(benchmark, counter, CounterSummary(baseline[benchmark][counter]),
+                                                CounterSummary(values[counter])))
+    return result
+
+
+def _format_table(header: "typing.List[str]", rows: "typing.List[typing.List[str]]") -> str:
+    widths = [max(len(r[i]) for r in [header] + rows) for i in range(len(header))]
+    lines = ["  ".join(cell.ljust(w) if i < 2 else cell.rjust(w) for i, (cell, w) in enumerate(zip(row, widths)))
+             for row in [header] + rows]
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def _fmt(value: float) -> str:
+    return "{:.6g}".format(value)
+
+
+def format_summary_table(summaries: "typing.Dict[str, typing.Dict[str, CounterSummary]]") -> str:
+    rows = []
+    for benchmark, counters in summaries.items():
+        for counter, s in counters.items():
+            rows.append([benchmark, counter, _fmt(s.median), _fmt(s.iqr), "[{}, {}]".format(_fmt(s.ci_low),
+                                                                                              _fmt(s.ci_high)),
+                         str(s.n)])
+    return _format_table(["benchmark", "counter", "median", "IQR", "95% CI", "n"], rows)
+
+
+def format_comparison_table(comparisons: "typing.List[CounterComparison]", alpha: float, threshold: float) -> str:
+    rows = []
+    for c in comparisons:
+        if c.is_regression(alpha, threshold):
+            verdict = "REGRESSION"
+        elif c.is_significant(alpha) and c.relative_change < -threshold:
+            verdict = "improvement"
+        else:
+            verdict = ""
+        rows.append([c.benchmark, c.counter, _fmt(c.baseline.median), _fmt(c.current.median),
+                     "{:+.2f}%".format(c.relative_change * 100), "{:.4f}".format(c.p_value), verdict])
+    return _format_table(["benchmark", "counter", "baseline", "current", "change", "p-value", ""], rows)
+
+
+def analyse_statcounters(csv_file: Path, baseline_csv: Path = None, counters: "typing.Iterable[str]" = None,
+                         alpha: float = 0.05, threshold: float = 0.01) -> bool:
+    """
+    Print a summary of csv_file and (if baseline_csv is set) compare it against the baseline.
+    :return: True if there was a statistically significant regression
+    """
+    current = load_statcounters_csv(csv_file)
+    statusUpdate("Statcounters summary for", csv_file)
+    print(format_summary_table(summarize_statcounters(current, counters)))
+    if baseline_csv is None:
+        return False
+    comparisons = compare_statcounters(load_statcounters_csv(baseline_csv), current, counters)
+    statusUpdate("Comparison against baseline", baseline_csv, "(alpha={}, threshold={:.2f}%)".format(
+        alpha, threshold * 100))
+    print(format_comparison_table(comparisons, alpha, threshold))
+    regressions = [c for c in comparisons if c.is_regression(alpha, threshold)]
+    if regressions:
+        warningMessage("Found", len(regressions), "statistically significant regression(s):",
+                       ", ".join(c.benchmark + "/" + c.counter for c in regressions))
+    return bool(regressions)
+
+
+def statcounters_main(argv: "typing.List[str]" = None) -> int:
+    parser = argparse.ArgumentParser(description="Summarize statcounters CSV files and compare against a baseline")
+    parser.add_argument("csv", type=Path, help="The statcounters CSV file")
+    parser.add_argument("--baseline", type=Path, help="Baseline CSV file to compare against")
+    parser.add_argument("--counters", nargs="+", help="The counters to analyse (default: " +
+                                                      ", ".join(DEFAULT_COUNTERS) + ")")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Significance level (default: 0.05)")
+    parser.add_argument("--threshold", type=float, default=1.0,
+                        help="Minimum change in percent for a regression (default: 1.0)")
+    args = parser.parse_args(argv)
+    regression = analyse_statcounters(args.csv, args.baseline, args.counters, args.alpha, args.threshold / 100)
+    return 1 if regression else 0
+
+
+if __name__ == "__main__":  # no-combine
+    sys.exit(statcounters_main())  # no-combine
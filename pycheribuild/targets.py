@@ -33,6 +33,8 @@ import time
 
 from collections import OrderedDict
 from .config.chericonfig import CheriConfig, CrossCompileTarget
+from .compilercache import record_compiler_cache_stats
+from .timing import build_timeline
 from .utils import *
 
 
@@ -89,8 +91,9 @@ class Target(object):
         new_env = {"PATH": project.config.dollarPathWithOtherTools}
         if project.config.clang_colour_diags:
             new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
-        with setEnv(**new_env):
-            project.process()
+        with setEnv(**new_env), build_timeline.measure(self.name, build_timeline.TARGET, action="build"):
+            with record_compiler_cache_stats(config, self.name):
+                project.process()
         statusUpdate("Built target '" + self.name + "' in", time.time() - starttime, "seconds")
         self._completed = True
 
@@ -105,7 +108,7 @@ class Target(object):
         new_env = {"PATH": project.config.dollarPathWithOtherTools}
         if project.config.clang_colour_diags:
             new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
-        with setEnv(**new_env):
+        with setEnv(**new_env), build_timeline.measure(self.name, build_timeline.TARGET, action="test"):
             project.run_tests()
         statusUpdate("Ran tests for target '" + self.name + "' in", time.time() - starttime, "seconds")
         self._tests_have_run = True
@@ -121,7 +124,7 @@ class Target(object):
         new_env = {"PATH": project.config.dollarPathWithOtherTools}
         if project.config.clang_colour_diags:
             new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
-        with setEnv(**new_env):
+        with setEnv(**new_env), build_timeline.measure(self.name, build_timeline.TARGET, action="benchmark"):
             project.run_benchmarks()
         statusUpdate("Ran benchmarks for target '" + self.name + "' in", time.time() - starttime, "seconds")
         self._benchmarks_have_run = True
@@ -0,0 +1,282 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import datetime
+import json
+import os
+import posixpath
+import re
+import subprocess
+import typing
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from .utils import *
+
+# A test is identified by a string (the lit path in the suite or the kyua test directory relative to /usr/tests) and
+# depends on a list of directories (or files) relative to the root of the source tree
+TestDependencies = typing.Dict[str, typing.List[str]]
+
+
+def git_head_revision(src_dir: Path) -> "typing.Optional[str]":
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(src_dir),
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def git_subdirectory_prefix(src_dir: Path) -> "typing.Optional[str]":
+    """Returns the path of :param src_dir: relative to the root of its git repository (e.g. "libcxx/")"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--show-prefix"], cwd=str(src_dir),
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def git_changed_files(src_dir: Path, since_revision: str) -> "typing.Optional[typing.List[str]]":
+    """
+    Returns all files in the whole repository containing :param src_dir: (relative to the repository root) that
+    differ between :param since_revision: and the working tree (including uncommitted and untracked files) or None
+    if the diff could not be computed. Projects such as libc++ live in a subdirectory of a larger repository, so
+    changes outside of src_dir (e.g. to the compiler) must be included as well.
+    """
+    try:
+        toplevel = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=str(src_dir),
+                                           stderr=subprocess.DEVNULL).decode("utf-8").strip()
+        changed = subprocess.check_output(["git", "diff", "--name-only", since_revision, "--"],
+                                          cwd=toplevel, stderr=subprocess.DEVNULL).decode("utf-8").splitlines()
+        changed += subprocess.check_output(["git", "ls-files", "--others", "--exclude-standard"],
+                                           cwd=toplevel, stderr=subprocess.DEVNULL).decode("utf-8").splitlines()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return sorted(set(f for f in changed if f))
+
+
+def _path_is_under(path: str, dependency: str) -> bool:
+    dependency = dependency.rstrip("/")
+    return dependency in ("", ".") or path == dependency or path.startswith(dependency + "/")
+
+
+def select_affected_tests(dependencies: TestDependencies,
+                          changed_files: "typing.Iterable[str]") -> "typing.Optional[typing.List[str]]":
+    """
+    Returns the tests that depend on any of the :param changed_files: or None if one of the changed files is not a
+    dependency of any test. Such files (e.g. headers, build system files or the kernel) could affect every test so
+    all tests must be run in that case.
+    """
+    affected = set()
+    for changed in changed_files:
+        matching = [test for test, deps in dependencies.items() if any(_path_is_under(changed, d) for d in deps)]
+        if not matching:
+            return None
+        affected.update(matching)
+    return sorted(affected)
+
+
+def parse_lit_show_tests(output: str) -> "typing.List[str]":
+    """Returns the test paths (relative to the test suite root) from the output of `llvm-lit --show-tests`"""
+    result = []
+    for line in output.splitlines():
+        match = re.match(r"^\s+(.+?) :: (.+)$", line)
+        if match:
+            result.append(match.group(2))
+    return result
+
+
+def lit_test_dependencies(test_paths: "typing.Iterable[str]", test_dir: str = "test") -> TestDependencies:
+    """Each lit test depends on the directory that contains it (:param test_dir: is the lit suite root)"""
+    return {path: [posixpath.join(test_dir, posixpath.dirname(path))] for path in test_paths}
+
+
+def elf_needed_libraries(binaries: "typing.List[Path]", readelf="readelf") -> "typing.Dict[Path, typing.List[str]]":
+    """Returns the DT_NEEDED entries for each of the ELF files in :param binaries:"""
+    result = dict((b, []) for b in binaries)
+    if not binaries:
+        return result
+    try:
+        output = subprocess.run([str(readelf), "-d"] + [str(b) for b in binaries], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout.decode("utf-8", errors="replace")
+    except OSError as e:
+        warningMessage("Could not run", readelf, "to find shared library dependencies:", e)
+        return result
+    current = binaries[0]
+    for line in output.splitlines():
+        if line.startswith("File: "):
+            current = Path(line[len("File: "):].strip())
+            continue
+        match = re.search(r"NEEDED\)?\s+Shared library: \[(.+)\]", line)
+        if match and current in result:
+            result[current].append(match.group(1))
+    return result
+
+
+def library_source_dirs(library: str, source_root: Path) -> "typing.List[str]":
+    """Guess the source directories in a FreeBSD-style tree that a shared library such as libc.so.7 is built from"""
+    name = library.split(".so")[0]
+    result = [d for d in ("lib/" + name, "cheri/lib/" + name, "libexec/" + name) if (source_root / d).is_dir()]
+    # Dynamically linked programs also depend on the runtime linker
+    if (source_root / "libexec/rtld-elf").is_dir():
+        result.append("libexec/rtld-elf")
+    return result
+
+
+def kyua_test_source_dirs(test_dir: str, source_root: Path) -> "typing.List[str]":
+    """
+    Returns the source directories for the tests installed to /usr/tests/:param test_dir:. FreeBSD installs the tests
+    from e.g. lib/libc/tests/string to /usr/tests/lib/libc/string and tests/sys/kern to /usr/tests/sys/kern.
+    """
+    components = test_dir.split("/")
+    candidates = [posixpath.join("tests", test_dir)]
+    for i in range(len(components), 0, -1):
+        candidates.append("/".join(components[:i] + ["tests"] + components[i:]))
+    result = [c for c in candidates if (source_root / c).is_dir()]
+    if result:
+        # The program being tested usually lives in the parent directory of the tests directory
+        parent = result[0].rpartition("/tests")[0]
+        if parent and parent != "tests" and (source_root / parent).is_dir():
+            result.append(parent)
+    return result
+
+
+def kyua_test_dependencies(tests_root: Path, source_root: Path, readelf="readelf") -> TestDependencies:
+    """
+    Returns the source dependencies of each directory with a Kyuafile below :param tests_root: (the host path of
+    /usr/tests in the rootfs). This includes the test sources as well as the sources of the shared libraries listed
+    as DT_NEEDED in the test programs.
+    """
+    result = dict()
+    if not tests_root.is_dir():
+        return result
+    for kyuafile in sorted(tests_root.glob("**/Kyuafile")):
+        test_dir = kyuafile.parent
+        programs = [p for p in sorted(test_dir.iterdir()) if p.is_file() and p.name != "Kyuafile" and
+                    os.access(str(p), os.X_OK)]
+        if not programs:
+            continue  # only includes other Kyuafiles
+        relpath = str(test_dir.relative_to(tests_root))
+        deps = kyua_test_source_dirs(relpath, source_root)
+        for needed in elf_needed_libraries(programs, readelf=readelf).values():
+            for lib in needed:
+                deps.extend(d for d in library_source_dirs(lib, source_root) if d not in deps)
+        result[relpath] = deps
+    return result
+
+
+def junit_xml_all_passed(path: Path) -> bool:
+    """Returns True if the JUnit XML file exists and does not contain any failed tests"""
+    try:
+        root = ET.parse(str(path)).getroot()
+    except (OSError, ET.ParseError):
+        return False
+    return not any(child.tag in ("failure", "error") for testcase in root.iter("testcase") for child in testcase)
+
+
+class TestSelectionState(object):
+    """The information about previous test runs of one target that is needed for --run-affected-tests-only"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.last_green_revision = None  # type: typing.Optional[str]
+        self.last_green_time = None  # type: typing.Optional[str]
+        self.runs_since_full_run = 0
+        self.dependencies = dict()  # type: TestDependencies
+        if path.is_file():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+                self.last_green_revision = data.get("last_green_revision")
+                self.last_green_time = data.get("last_green_time")
+                self.runs_since_full_run = int(data.get("runs_since_full_run", 0))
+                self.dependencies = data.get("dependencies", dict())
+            except (ValueError, TypeError) as e:
+                warningMessage("Ignoring invalid test selection state", path, ":", e)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = dict(last_green_revision=self.last_green_revision, last_green_time=self.last_green_time,
+                    runs_since_full_run=self.runs_since_full_run, dependencies=self.dependencies)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2, sort_keys=True), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+class TestRunPlan(object):
+    """The tests selected for one run. :attr tests: is None if the whole test suite should be run"""
+
+    def __init__(self, state: TestSelectionState, source_dir: Path, tests: "typing.Optional[typing.List[str]]",
+                 reason: str):
+        self.state = state
+        self.revision = git_head_revision(source_dir)
+        self.tests = tests
+        self.reason = reason
+
+    @property
+    def run_all(self):
+        return self.tests is None
+
+    def record_success(self, junit_xml: Path = None, pretend: bool = False):
+        """
+        Remember the tested revision as the base for the next run. This should only be called if all tests passed
+        and is ignored if :param junit_xml: is given and contains failures.
+        """
+        if self.revision is None or pretend:
+            return
+        if junit_xml is not None and not junit_xml_all_passed(junit_xml):
+            statusUpdate("Not updating the last passing revision since", junit_xml, "contains failures")
+            return
+        self.state.last_green_revision = self.revision
+        self.state.last_green_time = datetime.datetime.utcnow().isoformat()
+        self.state.runs_since_full_run = 0 if self.run_all else self.state.runs_since_full_run + 1
+        self.state.save()
+
+
+def plan_test_run(state: TestSelectionState, source_dir: Path, dependencies: TestDependencies,
+                  full_run_interval: int) -> TestRunPlan:
+    """Decide which tests need to run based on the changes in :param source_dir: since the last passing run"""
+    if dependencies:
+        state.dependencies = dependencies
+    if not state.last_green_revision:
+        return TestRunPlan(state, source_dir, None, "no previous passing test run")
+    if full_run_interval > 0 and state.runs_since_full_run + 1 >= full_run_interval:
+        return TestRunPlan(state, source_dir, None, "periodic full run (every " + str(full_run_interval) + " runs)")
+    if not state.dependencies:
+        return TestRunPlan(state, source_dir, None, "no test dependency information")
+    changed = git_changed_files(source_dir, state.last_green_revision)
+    prefix = git_subdirectory_prefix(source_dir)
+    if changed is None or prefix is None:
+        return TestRunPlan(state, source_dir, None, "could not compute changes since " + state.last_green_revision)
+    # The dependencies are relative to source_dir but the changed files are relative to the repository root
+    repo_dependencies = dict((test, [posixpath.normpath(posixpath.join(prefix, d)) for d in deps])
+                             for test, deps in state.dependencies.items())
+    tests = select_affected_tests(repo_dependencies, changed)
+    since = state.last_green_revision[:12]
+    if tests is None:
+        return TestRunPlan(state, source_dir, None, "changes since " + since + " are not limited to test dependencies")
+    return TestRunPlan(state, source_dir, tests, str(len(changed)) + " files changed since " + since)
@@ -0,0 +1,253 @@
+#
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+try:
+    import typing
+except ImportError:
+    typing = {}
+
+
+class RusagePopen(subprocess.Popen):
+    """
+    subprocess.Popen that reaps the child using os.wait4() in wait() so that its resource usage can be recorded.
+    Only used for --timing-trace/--timing-summary (see popen_handle_noexec()). If the child has already been reaped
+    by poll() or wait() was called with a timeout, rusage remains None and the caller has to fall back to the
+    RUSAGE_CHILDREN delta.
+    """
+    rusage = None
+
+    def wait(self, timeout=None):
+        if self.returncode is None and timeout is None:
+            try:
+                (pid, sts, rusage) = os.wait4(self.pid, 0)
+            except ChildProcessError:
+                pass  # already reaped (e.g. SIGCHLD is ignored) -> let Popen.wait() handle it
+            else:
+                if pid == self.pid:
+                    self.rusage = rusage
+                    self.returncode = -os.WTERMSIG(sts) if os.WIFSIGNALED(sts) else os.WEXITSTATUS(sts)
+        return super().wait(timeout=timeout)
+
+
+def _maxrss_kib(ru_maxrss: int) -> int:
+    # ru_maxrss is reported in bytes on macOS but in KiB on Linux and FreeBSD
+    if sys.platform.startswith("darwin"):
+        return ru_maxrss // 1024
+    return ru_maxrss
+
+
+def _format_rss(kib: "typing.Optional[int]") -> str:
+    if kib is None:
+        return "-"
+    if kib >= 1024 * 1024:
+        return "%.1f GiB" % (kib / (1024 * 1024))
+    return "%.1f MiB" % (kib / 1024)
+
+
+class TimelineEvent(object):
+    def __init__(self, name: str, category: str, start: float, end: float, user: float, sys: float,
+                 max_rss: "typing.Optional[int]" = None, thread_id: int = 0, args: dict = None):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = end
+        self.user = user
+        self.sys = sys
+        self.max_rss = max_rss  # in KiB
+        self.thread_id = thread_id
+        self.args = args or {}
+
+    @property
+    def wall(self) -> float:
+        return self.end - self.start
+
+    def contains(self, other: "TimelineEvent") -> bool:
+        return self.start <= other.start and other.end <= self.end
+
+    def __repr__(self):
+        return "<TimelineEvent %s:%s %.3fs>" % (self.category, self.name, self.wall)
+
+
+class BuildTimeline(object):
+    """
+    Records wall/user/sys time and peak RSS for targets, build phases and subprocesses.
+    Nothing is recorded unless enabled is set (--timing-trace or --timing-summary).
+    """
+    TARGET = "target"
+    PHASE = "phase"
+    SUBPROCESS = "subprocess"
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []  # type: typing.List[TimelineEvent]
+        self._lock = threading.Lock()
+        self._origin = time.time()
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+            self._origin = time.time()
+
+    def _add(self, event: TimelineEvent):
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def measure(self, name: str, category: str, **args):
+        """Record a span for a target or a build phase. User/sys time includes all subprocesses that finished."""
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            self_after = resource.getrusage(resource.RUSAGE_SELF)
+            children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            user = (self_after.ru_utime - self_before.ru_utime) + (children_after.ru_utime - children_before.ru_utime)
+            sys_time = (self_after.ru_stime - self_before.ru_stime) + (children_after.ru_stime - children_before.ru_stime)
+            self._add(TimelineEvent(name, category, start, time.time(), user, sys_time,
+                                    max_rss=_maxrss_kib(self_after.ru_maxrss),
+                                    thread_id=threading.get_ident(), args=args))
+
+    @contextlib.contextmanager
+    def measure_subprocess(self, cmdline: "typing.Sequence[str]", cwd=None):
+        """
+        Record a single subprocess. The caller should store the Popen object in the yielded dict under the
+        "process" key: if it was created as a RusagePopen we get exact numbers, otherwise the RUSAGE_CHILDREN
+        delta is used (which will include other children that finished concurrently) and the peak RSS is unknown.
+        """
+        result = dict()
+        if not self.enabled:
+            yield result
+            return
+        start = time.time()
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield result
+        finally:
+            end = time.time()
+            process = result.get("process")
+            rusage = getattr(process, "rusage", None)
+            if rusage is not None:
+                user, sys_time, max_rss = rusage.ru_utime, rusage.ru_stime, _maxrss_kib(rusage.ru_maxrss)
+            else:
+                children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                user = children_after.ru_utime - children_before.ru_utime
+                sys_time = children_after.ru_stime - children_before.ru_stime
+                max_rss = None
+            cmdline = [str(s) for s in cmdline]
+            args = {"cmdline": " ".join(cmdline)}
+            if cwd is not None:
+                args["cwd"] = str(cwd)
+            if process is not None and process.returncode is not None:
+                args["returncode"] = process.returncode
+            self._add(TimelineEvent(os.path.basename(cmdline[0]) if cmdline else "<unknown>", self.SUBPROCESS,
+                                    start, end, user, sys_time, max_rss=max_rss, thread_id=threading.get_ident(),
+                                    args=args))
+
+    def _peak_rss(self, span: TimelineEvent) -> "typing.Optional[int]":
+        # The peak RSS of a span is the largest subprocess (or cheribuild itself) that ran inside it
+        values = [e.max_rss for e in self.events if e.category == self.SUBPROCESS and e.max_rss is not None and
+                  span.contains(e)]
+        if span.max_rss is not None:
+            values.append(span.max_rss)
+        return max(values) if values else None
+
+    def chrome_trace(self) -> dict:
+        """Return the events in the Chrome trace event format (load it in chrome://tracing or ui.perfetto.dev)"""
+        pid = os.getpid()
+        trace_events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "cheribuild"}}]
+        with self._lock:
+            events = sorted(self.events, key=lambda e: (e.start, -e.end))
+        for e in events:
+            args = dict(e.args)
+            args.update({"wall": round(e.wall, 6), "user": round(e.user, 6), "sys": round(e.sys, 6)})
+            peak_rss = e.max_rss if e.category == self.SUBPROCESS else self._peak_rss(e)
+            if peak_rss is not None:
+                args["max_rss_kib"] = peak_rss
+            trace_events.append({"name": e.name, "cat": e.category, "ph": "X", "pid": pid, "tid": e.thread_id,
+                                 "ts": int((e.start - self._origin) * 1000000), "dur": int(e.wall * 1000000),
+                                 "args": args})
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: Path):
+        path = Path(path)
+        if not path.parent.is_dir():
+            path.parent.mkdir(parents=True)
+        with path.open("w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, indent=1)
+
+    def summary_table(self, num_subprocesses=10) -> str:
+        with self._lock:
+            events = list(self.events)
+        rows = []
+        for e in events:
+            if e.category == self.TARGET:
+                action = e.args.get("action", "build")
+                rows.append((e, e.name if action == "build" else e.name + " (" + action + ")"))
+            elif e.category == self.PHASE:
+                rows.append((e, "  " + e.args.get("target", "?") + " " + e.name))
+        rows.sort(key=lambda row: row[0].start)
+        slowest = sorted((e for e in events if e.category == self.SUBPROCESS), key=lambda e: e.wall, reverse=True)
+        if not rows and not slowest:
+            return "No timing information was recorded."
+        table = [("Name", "Wall", "User", "Sys", "Peak RSS")]
+        if slowest:
+            rows.append((None, "Slowest commands:"))
+            rows.extend((e, "  " + e.args["cmdline"]) for e in slowest[:num_subprocesses])
+        for e, label in rows:
+            if len(label) > 70:
+                label = label[:67] + "..."
+            if e is None:
+                table.append((label, "", "", "", ""))
+                continue
+            peak_rss = e.max_rss if e.category == self.SUBPROCESS else self._peak_rss(e)
+            table.append((label, "%.1fs" % e.wall, "%.1fs" % e.user, "%.1fs" % e.sys, _format_rss(peak_rss)))
+        widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+        lines = []
+        for row in table:
+            lines.append(row[0].ljust(widths[0]) + "  " +
+                         "  ".join(col.rjust(widths[i + 1]) for i, col in enumerate(row[1:])))
+        return "\n".join(lines)
+
+
+build_timeline = BuildTimeline()
@@ -40,6 +40,7 @@ import tempfile
 import threading
 import traceback
 from .colour import coloured, AnsiColour, statusUpdate, warningMessage
+from .timing import build_timeline, RusagePopen
 from collections import namedtuple
 from pathlib import Path
 
@@ -196,12 +197,14 @@ def check_call_handle_noexec(cmdline: "typing.List[str]", **kwargs):
 
 
 def popen_handle_noexec(cmdline: "typing.List[str]", **kwargs) -> subprocess.Popen:
+    # When recording build timings reap the child with wait4() to get the CPU time and peak RSS
+    popen_cls = RusagePopen if build_timeline.enabled else subprocess.Popen
     try:
-        return subprocess.Popen(cmdline, **kwargs)
+        return popen_cls(cmdline, **kwargs)
     except PermissionError as e:
         interpreter = getInterpreter(cmdline)
         if interpreter:
-            return subprocess.Popen(interpreter + cmdline, **kwargs)
+            return popen_cls(interpreter + cmdline, **kwargs)
         raise _make_called_process_error(e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8"))
     except FileNotFoundError as e:
         raise _make_called_process_error(e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8"))
@@ -251,32 +254,34 @@ def runCmd(*args, captureOutput=False, captureError=False, input: "typing.Union[
             kwargs["env"] = new_env
         else:
             kwargs["env"] = dict((k, str(v)) for k, v in kwargs["env"].items())
-    with popen_handle_noexec(cmdline, **kwargs) as process:
-        try:
-            stdout, stderr = process.communicate(input, timeout=timeout)
-        except subprocess.TimeoutExpired:
-            process.kill()
-            stdout, stderr = process.communicate()
-            # TODO py35: pass stderr=stderr as well
-            raise subprocess.TimeoutExpired(process.args, timeout, output=stdout)
-        except BrokenPipeError:
-            # just return the exit code
-            process.kill()
-            retcode = process.wait()
-            raise _make_called_process_error(retcode, process.args, stdout=b"", cwd=kwargs["cwd"])
-        except Exception:
-            process.kill()
-            process.wait()
-            raise
-        retcode = process.poll()
-        if retcode:
-            if _cheriConfig and _cheriConfig.pretend and not raiseInPretendMode:
-                cwd = (". Working directory was ", kwargs["cwd"]) if "cwd" in kwargs else ()
-                fatalError("Command ", "`" + commandline_to_str(process.args) +
-                           "` failed with non-zero exit code ", retcode, *cwd, sep="")
-            else:
-                raise _make_called_process_error(retcode, process.args, stdout=stdout, cwd=kwargs["cwd"])
-        return CompletedProcess(process.args, retcode, stdout, stderr)
+    with build_timeline.measure_subprocess(cmdline, cwd=kwargs["cwd"]) as timing_info:
+        with popen_handle_noexec(cmdline, **kwargs) as process:
+            timing_info["process"] = process
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                stdout, stderr = process.communicate()
+                # TODO py35: pass stderr=stderr as well
+                raise subprocess.TimeoutExpired(process.args, timeout, output=stdout)
+            except BrokenPipeError:
+                # just return the exit code
+                process.kill()
+                retcode = process.wait()
+                raise _make_called_process_error(retcode, process.args, stdout=b"", cwd=kwargs["cwd"])
+            except Exception:
+                process.kill()
+                process.wait()
+                raise
+            retcode = process.poll()
+            if retcode:
+                if _cheriConfig and _cheriConfig.pretend and not raiseInPretendMode:
+                    cwd = (". Working directory was ", kwargs["cwd"]) if "cwd" in kwargs else ()
+                    fatalError("Command ", "`" + commandline_to_str(process.args) +
+                               "` failed with non-zero exit code ", retcode, *cwd, sep="")
+                else:
+                    raise _make_called_process_error(retcode, process.args, stdout=stdout, cwd=kwargs["cwd"])
+            return CompletedProcess(process.args, retcode, stdout, stderr)
 
 
 def commandline_to_str(args: "typing.Iterable[str]") -> str:
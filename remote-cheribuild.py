@@ -28,6 +28,7 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
+import hashlib
 import os
 import subprocess
 import sys
@@ -36,14 +37,50 @@ import shlex
 from pathlib import Path
 
 scriptDir = Path(__file__).resolve().parent  # type: Path
+persistentWorker = False
+if len(sys.argv) > 1 and sys.argv[1] == "--persistent-worker":
+    # Reuse a single ssh connection, only upload the script if it changed and run it in a resident worker process
+    persistentWorker = True
+    del sys.argv[1]
+if len(sys.argv) < 2:
+    sys.exit("usage: " + sys.argv[0] + " [--persistent-worker] host [cheribuild-args...]")
 host = sys.argv[1]
 cheribuildArgs = sys.argv[2:]
 cheribuildArgs = list(map(shlex.quote, cheribuildArgs))
+# Keep the ssh connection open for a while so that later invocations don't need a new handshake
+sshOptions = ["-o", "ControlMaster=auto", "-o", "ControlPath=~/.ssh/cheribuild-%r@%h:%p",
+              "-o", "ControlPersist=30m"] if persistentWorker else []
+
+
+def runPersistentWorker(script: Path):
+    digest = hashlib.sha256(script.read_bytes()).hexdigest()[:16]
+    remoteDir = ".cache/cheribuild-remote"
+    remoteModule = "cheribuild_" + digest
+    remoteFile = remoteDir + "/" + remoteModule + ".py"
+    # Upload the script if the remote copy is missing (the file name is based on the content hash). This only
+    # needs one round trip over the existing connection if the file is already there.
+    uploadCmd = "test -f {file} && exit 0; mkdir -p {dir} && cat > {file}.tmp && mv {file}.tmp {file} && echo uploaded"
+    with script.open("rb") as f:
+        output = subprocess.check_output(["ssh"] + sshOptions + [host, "--", "sh", "-c", shlex.quote(
+            uploadCmd.format(file=remoteFile, dir=remoteDir))], stdin=f)
+    if output.strip() == b"uploaded":
+        print("Uploaded new cheribuild version to", host + ":~/" + remoteFile)
+    # Import the script as a module instead of running it so that python caches the bytecode. Compiling the
+    # combined script takes longer than the actual request when the worker is already running.
+    clientCode = "import sys; sys.path.insert(0, sys.argv.pop(1)); import {m}; sys.argv[0] = {m}.__file__; " \
+                 "{m}.main()".format(m=remoteModule)
+    tty_option = ["-tt"] if sys.__stdin__.isatty() else []
+    os.execvp("ssh", ["ssh"] + sshOptions + tty_option + [host, "--", "python3", "-c", shlex.quote(clientCode),
+                                                           remoteDir, "--remote-worker-request"] + cheribuildArgs)
+
 
 with tempfile.NamedTemporaryFile(prefix="cheribuild-", suffix=".py") as tmp:
     combineScript = scriptDir / "combine-files.py"
     assert combineScript.is_file()
     subprocess.check_call([sys.executable, str(combineScript)], stdout=tmp)
+    tmp.flush()
+    if persistentWorker:
+        runPersistentWorker(Path(tmp.name))
     print("About to run cheribuild on host '" + host + "' with the following arguments:", cheribuildArgs)
     print("Note: file that will be run is located at", tmp.name)
     tty_option = ["-tt"] if sys.__stdin__.isatty() else []
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# PYTHON_ARGCOMPLETE_OK
+# -
+# Copyright (c) 2020 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# Streaming merge of JUnit XML files: The inputs are read with iterparse() one <testsuite> at a time and written
+# directly to the output file. Unlike junitparser this never holds more than one testsuite in memory, so it can be
+# used to merge thousands of per-test result files (e.g. from Juliet or BODiagSuite).
+import argparse
+import sys
+import typing
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from xml.sax.saxutils import quoteattr
+
+__all__ = ["JUnitXmlMerger", "merge_junit_xml_files"]
+
+
+class JUnitXmlMerger(object):
+    # Space reserved for the statistics attributes of the <testsuites> element. These are only known once all
+    # inputs have been processed, so we pad the start tag with whitespace and overwrite it in close().
+    _HEADER_SIZE = 256
+
+    def __init__(self, output: Path, name: str = None):
+        self.output = output
+        # Only use ASCII in the header so that the reserved space is the same in characters and bytes
+        self._name_attr = " name=" + quoteattr(name.encode("ascii", "xmlcharrefreplace").decode("ascii")) if name else ""
+        self._header_size = self._HEADER_SIZE + len(self._name_attr)
+        self.tests = 0
+        self.failures = 0
+        self.errors = 0
+        self.skipped = 0
+        self.time = 0.0
+        self._out = output.open("w", encoding="utf-8")
+        self._out.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        self._header_offset = self._out.tell()
+        self._out.write(" " * (self._header_size + 1) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _suite_statistics(suite: ET.Element) -> "typing.Tuple[int, int, int, int, float]":
+        # Same logic as junitparser.TestSuite.update_statistics()
+        tests = failures = errors = skipped = 0
+        time = 0.0
+        for case in suite.iterfind("testcase"):
+            tests += 1
+            for result in case:
+                if result.tag == "failure":
+                    failures += 1
+                elif result.tag == "error":
+                    errors += 1
+                elif result.tag == "skipped":
+                    skipped += 1
+                else:
+                    continue
+                break
+            try:
+                time += float(case.get("time", 0))
+            except ValueError:
+                pass
+        return tests, failures, errors, skipped, time
+
+    def add_suite(self, suite: ET.Element):
+        tests, failures, errors, skipped, time = self._suite_statistics(suite)
+        suite.set("tests", str(tests))
+        suite.set("failures", str(failures))
+        suite.set("errors", str(errors))
+        suite.set("skipped", str(skipped))
+        suite.set("time", "{:.3f}".format(time))
+        self.tests += tests
+        self.failures += failures
+        self.errors += errors
+        self.skipped += skipped
+        self.time += time
+        suite.tail = "\n"
+        self._out.write(ET.tostring(suite, encoding="unicode"))
+
+    def add_error_suite(self, suite_name: str, case_name: str, message: str):
+        suite = ET.Element("testsuite", name=suite_name)
+        case = ET.SubElement(suite, "testcase", name=case_name, classname=suite_name)
+        ET.SubElement(case, "error", message=message)
+        self.add_suite(suite)
+
+    def add_file(self, file: Path):
+        """Add all testsuites from file (which can have either <testsuites> or <testsuite> as the root element)"""
+        stack = []  # type: typing.List[ET.Element]
+        for event, elem in ET.iterparse(str(file), events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag != "testsuite":
+                continue
+            parent = stack[-1] if stack else None
+            if parent is not None and parent.tag == "testsuite":
+                continue  # nested suites are written as part of the outer one
+            self.add_suite(elem)
+            if parent is not None:
+                parent.remove(elem)  # free the memory
+
+    def close(self):
+        if self._out.closed:
+            return
+        self._out.write("</testsuites>\n")
+        header = '<testsuites{} tests="{}" failures="{}" errors="{}" skipped="{}" time="{:.3f}"'.format(
+            self._name_attr, self.tests, self.failures, self.errors, self.skipped, self.time)
+        assert len(header) < self._header_size
+        self._out.seek(self._header_offset)
+        self._out.write(header.ljust(self._header_size) + ">")
+        self._out.close()
+
+
+def merge_junit_xml_files(inputs: "typing.Iterable[Path]", output: Path) -> JUnitXmlMerger:
+    with JUnitXmlMerger(output) as merger:
+        for file in inputs:
+            merger.add_file(file)
+    return merger
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge JUnit XML files")
+    parser.add_argument("inputs", nargs="+", type=Path, help="The files to merge")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="The output file")
+    args = parser.parse_args()
+    result = merge_junit_xml_files(args.inputs, args.output)
+    print("Tests:", result.tests, "Failures:", result.failures, "Errors:", result.errors, "Skipped:", result.skipped,
+          file=sys.stderr)
@@ -28,25 +28,101 @@
 # LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
+import os
+import re
+import sqlite3
+import sys
 import tempfile
+import typing
+import urllib.parse
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
-from run_tests_common import boot_cheribsd, junitparser
+from junit_merge import JUnitXmlMerger
+from run_tests_common import boot_cheribsd
+
+
+# Characters that are not allowed in XML 1.0 (even as character references)
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+
+def _sanitize(text: str) -> str:
+    return _INVALID_XML_CHARS.sub(lambda m: "\\x" + format(ord(m.group(0)), '02x') + ";", text)
+
+
+def _add_kyua_test_case(suite: ET.Element, classname: str, name: str, result_type: str, result_reason: str,
+                        start_time: int, end_time: int, outputs: "typing.Dict[str, str]"):
+    # This produces the same output as `kyua report-junit` (see kyua/drivers/report_junit.cpp)
+    case = ET.SubElement(suite, "testcase", classname=classname, name=_sanitize(name))
+    if start_time is not None and end_time is not None:
+        case.set("time", "{:.3f}".format((end_time - start_time) / 1000000.0))
+    reason = _sanitize(result_reason or "")
+    if result_type == "failed":
+        ET.SubElement(case, "failure", message=reason)
+    elif result_type == "broken" or result_type is None:
+        ET.SubElement(case, "error", message=reason or "Test case has no result")
+    elif result_type == "skipped":
+        ET.SubElement(case, "skipped")
+    stderr_prefix = ""
+    if result_type == "expected_failure":
+        stderr_prefix = "Expected failure result details\n-------------------------------\n\n" + reason + "\n\n"
+    ET.SubElement(case, "system-out").text = outputs.get("__STDOUT__", "")
+    ET.SubElement(case, "system-err").text = stderr_prefix + outputs.get("__STDERR__", "")
 
 
 def convert_kyua_db_to_junit_xml(db_file: Path, output_file: Path):
     assert output_file.resolve() != db_file.resolve()
-    with output_file.open("w") as output_stream:
-        command = ["kyua", "report-junit", "--results-file=" + str(db_file)]
-        boot_cheribsd.run_host_command(command, stdout=output_stream)
-        # TODO: xml escape the file?
-        if not boot_cheribsd.PRETEND:
-            fixup_kyua_generated_junit_xml(output_file)
+    boot_cheribsd.info("Converting kyua database ", db_file, " to JUnit XML file ", output_file)
+    if boot_cheribsd.PRETEND:
+        return
+    # Read the sqlite results store directly instead of requiring a kyua binary. Each test program is written as a
+    # separate <testsuite> so that we never need to keep all results in memory.
+    db = sqlite3.connect("file:" + urllib.parse.quote(str(db_file.absolute())) + "?mode=ro", uri=True)
+    try:
+        with JUnitXmlMerger(output_file) as merger:
+            suite = None
+            current_program = None
+            current_case = None  # type: typing.Optional[list]
+            # A single query for all results: test cases with stdout and stderr files are returned as multiple rows
+            for row in db.execute(
+                    "SELECT test_programs.test_program_id, test_programs.relative_path, test_cases.test_case_id, "
+                    "test_cases.name, test_results.result_type, test_results.result_reason, "
+                    "test_results.start_time, test_results.end_time, test_case_files.file_name, files.contents "
+                    "FROM test_programs "
+                    "JOIN test_cases ON test_cases.test_program_id = test_programs.test_program_id "
+                    "LEFT JOIN test_results ON test_results.test_case_id = test_cases.test_case_id "
+                    "LEFT JOIN test_case_files ON test_case_files.test_case_id = test_cases.test_case_id "
+                    "LEFT JOIN files ON files.file_id = test_case_files.file_id "
+                    "ORDER BY test_programs.test_program_id, test_cases.test_case_id"):
+                program_id, relative_path, test_case_id = row[0:3]
+                file_name, contents = row[8:10]
+                if current_case is None or test_case_id != current_case[0]:
+                    if current_case is not None:
+                        _add_kyua_test_case(suite, *current_case[1:])
+                    if program_id != current_program:
+                        if suite is not None:
+                            merger.add_suite(suite)
+                        suite = ET.Element("testsuite", name=_sanitize(relative_path))
+                        current_program = program_id
+                    classname = _sanitize(relative_path).replace("/", ".")
+                    current_case = [test_case_id, classname] + list(row[3:8]) + [dict()]
+                if file_name is not None:
+                    if isinstance(contents, bytes):
+                        contents = contents.decode("utf-8", errors="backslashreplace")
+                    current_case[-1][file_name] = _sanitize(contents or "")
+            if current_case is not None:
+                _add_kyua_test_case(suite, *current_case[1:])
+            if suite is not None:
+                merger.add_suite(suite)
+        boot_cheribsd.info("Converted ", merger.tests, " tests: ", merger.failures, " failures, ", merger.errors,
+                           " errors, ", merger.skipped, " skipped")
+    finally:
+        db.close()
 
 
 def fixup_kyua_generated_junit_xml(xml_file: Path):
     boot_cheribsd.info("Updating statistics in JUnit file ", xml_file)
-    # Process junit xml file with junitparser to update the number of tests, failures, total time, etc.
+    # Process junit xml file to update the number of tests, failures, total time, etc.
     orig_xml_bytes = xml_file.read_bytes()
     orig_xml_str = xml_file.read_text("utf-8", errors='backslashreplace')
     xml_str = orig_xml_str
@@ -59,10 +135,11 @@ def fixup_kyua_generated_junit_xml(xml_file: Path):
         # create a temporary file first to avoid clobbering the original one if we fail to parse it
         tf.write(xml_str.encode("ascii", errors="xmlcharrefreplace"))
         tf.flush()
-        xml = junitparser.JUnitXml.fromfile(tf.name)
-        xml.update_statistics()
+        tmp_output = xml_file.with_name(xml_file.name + ".tmp")
+        with JUnitXmlMerger(tmp_output) as merger:
+            merger.add_file(Path(tf.name))
         # Now we can overwrite the input file
-        xml.write(str(xml_file))
+        os.replace(str(tmp_output), str(xml_file))
         boot_cheribsd.run_host_command(["grep", "<testsuite", str(xml_file)])
 
 
@@ -75,13 +152,14 @@ if __name__ == "__main__":
                         help="The output file (or - for stdout). Defaults to the db file with suffix .xml")
     parser.add_argument("--update-stats", action="store_true", help="Only update stats instead of parsing a kyua db")
     args = parser.parse_args()
-    if not args.xml:
-        output = Path(args.db).with_suffix(".xml")
-    elif args.xml == "-":
-        output = Path("/dev/stdout")
-    else:
-        output = Path(args.xml)
     if args.update_stats:
         fixup_kyua_generated_junit_xml(Path(args.db))
+    elif args.xml == "-":
+        # The output file must be seekable, so write to a temporary file first
+        with tempfile.TemporaryDirectory() as td:
+            output = Path(td, "results.xml")
+            convert_kyua_db_to_junit_xml(Path(args.db), output)
+            sys.stdout.write(output.read_text(encoding="utf-8"))
     else:
+        output = Path(args.xml) if args.xml else Path(args.db).with_suffix(".xml")
         convert_kyua_db_to_junit_xml(Path(args.db), output)
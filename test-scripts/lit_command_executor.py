@@ -0,0 +1,179 @@
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# lit_command_executor.py - a libcxx/libunwind lit executor that runs tests using lit_command_server.py
+#
+# This module is loaded by lit (using -Dexecutor=__import__("lit_command_executor").CommandServerExecutor(...)) so it
+# must only depend on the python standard library.
+#
+import itertools
+import json
+import os
+import shutil
+import socket
+import tempfile
+import typing
+import threading
+import time
+
+
+class CommandResult(object):
+    def __init__(self):
+        self.stdout = []
+        self.stderr = []
+        self.exit_code = None  # type: int
+        self.timed_out = False
+        self.error = None  # type: str
+        self.done = threading.Event()
+
+
+class CommandServerClient(object):
+    """Sends requests to a lit_command_server.py instance. Multiple threads can share one client (and connection)."""
+
+    def __init__(self, host: str, port: int, connect_timeout: float = 30):
+        deadline = time.time() + connect_timeout
+        while True:
+            try:
+                self._sock = socket.create_connection((host, port), timeout=10)
+                break
+            except OSError:
+                # The server (or the SSH port forwarding) might not be ready yet
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._ids = itertools.count(1)
+        self._pending = dict()  # type: typing.Dict[int, CommandResult]
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_responses, name="lit-command-client", daemon=True)
+        self._reader.start()
+
+    def _read_responses(self):
+        try:
+            with self._sock.makefile("rb") as f:
+                for line in f:
+                    msg = json.loads(line.decode("utf-8"))
+                    with self._lock:
+                        result = self._pending.get(msg["id"])
+                    if result is None:
+                        continue
+                    if "stream" in msg:
+                        (result.stdout if msg["stream"] == "stdout" else result.stderr).append(msg["data"])
+                    elif "exit" in msg:
+                        result.exit_code = msg["exit"]
+                        result.timed_out = msg.get("timed_out", False)
+                        result.error = msg.get("error")
+                        with self._lock:
+                            del self._pending[msg["id"]]
+                        result.done.set()
+        except (OSError, ValueError, KeyError):
+            # ValueError/KeyError: a truncated or garbled line (e.g. the guest panicked or the SSH tunnel was closed)
+            pass
+        # Connection lost -> fail all outstanding requests
+        with self._lock:
+            self._closed = True
+            for result in self._pending.values():
+                result.error = "connection to command server lost"
+                result.done.set()
+            self._pending.clear()
+
+    def run(self, argv: "typing.List[str]", cwd: str = None, env: dict = None,
+            timeout: float = None) -> CommandResult:
+        result = CommandResult()
+        with self._lock:
+            if self._closed:
+                raise ConnectionError("connection to command server lost")
+            request_id = next(self._ids)
+            self._pending[request_id] = result
+            request = {"id": request_id, "argv": [str(a) for a in argv], "cwd": cwd, "env": env or {},
+                       "timeout": timeout}
+            self._sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        result.done.wait()
+        return result
+
+    def close(self):
+        self._sock.close()
+
+
+class CommandServerExecutor(object):
+    """
+    Runs tests by copying them to a directory that is shared with the guest and asking the command server in the
+    guest to execute them. Unlike the SSH executors this allows running lit with -jN against a single guest.
+    """
+    target_info = None
+
+    def __init__(self, host: str, port: int, nfs_dir: str, path_in_target: str, timeout: float = 120, config=None):
+        self.host = host
+        self.port = port
+        self.nfs_dir = nfs_dir
+        self.path_in_target = path_in_target
+        self.timeout = timeout
+        self.config = config
+        self._client = None  # type: CommandServerClient
+        self._client_pid = None
+        self._client_lock = threading.Lock()
+
+    def client(self) -> CommandServerClient:
+        with self._client_lock:
+            # lit may fork worker processes after creating the executor -> one connection per process
+            if self._client is None or self._client_pid != os.getpid():
+                self._client = CommandServerClient(self.host, self.port)
+                self._client_pid = os.getpid()
+            return self._client
+
+    def run(self, exe_path, cmd=None, work_dir=".", file_deps=None, env=None):
+        local_dir = tempfile.mkdtemp(dir=self.nfs_dir, prefix="lit-")
+        target_dir = os.path.join(self.path_in_target, os.path.basename(local_dir))
+        try:
+            for dep in [exe_path] + list(file_deps or []):
+                if os.path.isdir(dep):
+                    shutil.copytree(dep, os.path.join(local_dir, os.path.basename(dep)), symlinks=True)
+                else:
+                    shutil.copy2(dep, local_dir)
+            target_exe_path = os.path.join(target_dir, os.path.basename(exe_path))
+            if cmd:
+                cmd = [target_exe_path if c == exe_path else c for c in cmd]
+            else:
+                cmd = [target_exe_path]
+            try:
+                result = self.client().run(cmd, cwd=target_dir, env=env, timeout=self.timeout)
+            except (OSError, ConnectionError) as e:
+                return cmd, "", "Could not run test using command server: " + str(e), 1
+            out = "".join(result.stdout)
+            err = "".join(result.stderr)
+            if result.error:
+                err += "\nCommand server error: " + result.error
+                return cmd, out, err, result.exit_code if result.exit_code is not None else 1
+            if result.timed_out:
+                err += "\nTest was killed after " + str(self.timeout) + " seconds"
+            return cmd, out, err, result.exit_code
+        finally:
+            shutil.rmtree(local_dir, ignore_errors=True)
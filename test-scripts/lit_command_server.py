@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# lit_command_server.py - a small command server that is started inside the CheriBSD guest so that lit can run
+# multiple tests concurrently over a single TCP connection instead of using one SSH exec per test.
+#
+# This file must not depend on anything but the python standard library since it is copied to the guest.
+#
+# Protocol (one JSON object per line in both directions):
+#  request:  {"id": 1, "argv": ["./test.exe"], "cwd": "/build/tmp/x", "env": {"FOO": "1"}, "timeout": 120}
+#  response: {"id": 1, "stream": "stdout"|"stderr", "data": "..."} (zero or more times, as output arrives)
+#            {"id": 1, "exit": 0, "timed_out": false} (exactly once, "error" is set if the command could not be run)
+#
+import argparse
+import codecs
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+
+class CommandServer(object):
+    def __init__(self, jobs: int):
+        self.slots = threading.BoundedSemaphore(jobs)
+
+    def handle_connection(self, conn: socket.socket):
+        send_lock = threading.Lock()
+
+        def send(msg: dict):
+            with send_lock:
+                try:
+                    conn.sendall((json.dumps(msg) + "\n").encode("utf-8"))
+                except OSError:
+                    pass  # client went away, the command will still be reaped
+
+        with conn, conn.makefile("rb") as reader:
+            for line in reader:
+                request = json.loads(line.decode("utf-8"))
+                threading.Thread(target=self.run_request, args=(request, send), daemon=True).start()
+
+    @staticmethod
+    def _forward_output(request_id, stream_name: str, fd: int, send):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = os.read(fd, 65536)
+            text = decoder.decode(data, final=not data)
+            if text:
+                send({"id": request_id, "stream": stream_name, "data": text})
+            if not data:
+                break
+
+    def run_request(self, request: dict, send):
+        request_id = request["id"]
+        with self.slots:
+            env = os.environ.copy()
+            env.update(request.get("env") or {})
+            try:
+                # Start a new session so that a timeout also kills all children of the test
+                proc = subprocess.Popen(request["argv"], cwd=request.get("cwd"), env=env, stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+            except OSError as e:
+                send({"id": request_id, "exit": 127, "timed_out": False, "error": str(e)})
+                return
+            readers = [threading.Thread(target=self._forward_output, daemon=True,
+                                        args=(request_id, name, f.fileno(), send))
+                       for name, f in (("stdout", proc.stdout), ("stderr", proc.stderr))]
+            for t in readers:
+                t.start()
+            timed_out = False
+            try:
+                proc.wait(timeout=request.get("timeout"))
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                proc.wait()
+            for t in readers:
+                t.join()
+            proc.stdout.close()
+            proc.stderr.close()
+            send({"id": request_id, "exit": proc.returncode, "timed_out": timed_out})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run commands on behalf of a lit executor")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: any free port)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="Maximum number of commands that are run concurrently")
+    args = parser.parse_args()
+    server = CommandServer(args.jobs)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(16)
+    print("LISTENING", sock.getsockname()[1], flush=True)
+    while True:
+        conn, _ = sock.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=server.handle_connection, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
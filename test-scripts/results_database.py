@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# results_database.py - keep the JUnit results of all test runs in a sqlite database so that later runs can use the
+# recorded durations (for scheduling) and outcomes (to find flaky tests).
+#
+import argparse
+import datetime
+import heapq
+import os
+import sqlite3
+import sys
+import typing
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+PASSED = "passed"
+FAILED = "failed"
+ERROR = "error"
+SKIPPED = "skipped"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    suite TEXT NOT NULL,
+    source TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    test TEXT NOT NULL,
+    duration REAL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_test ON results (test, run_id);
+"""
+
+
+def default_database_path() -> Path:
+    if os.getenv("CHERIBUILD_TEST_RESULTS_DB"):
+        return Path(os.getenv("CHERIBUILD_TEST_RESULTS_DB"))
+    return Path(os.path.expanduser("~/.cache/cheribuild/test-results.sqlite3"))
+
+
+def junit_test_key(classname: str, name: str) -> str:
+    return classname + "::" + name if classname else name
+
+
+def lit_test_key(lit_suite_name: str, path_in_suite: str) -> str:
+    """Returns the key for a test from `lit --show-tests` that matches the one stored from lit's JUnit XML output"""
+    components = path_in_suite.split("/")
+    # Same as lit's Test.getJUnitXML(): the classname is the suite name (with '.' replaced by '-') followed by the
+    # directories (with '.' replaced by '_') joined with '/'. Tests in the suite root use the suite name twice.
+    safe_suite_name = lit_suite_name.replace(".", "-")
+    safe_test_path = [c.replace(".", "_") for c in components[:-1]]
+    classname = safe_suite_name + "." + ("/".join(safe_test_path) if safe_test_path else safe_suite_name)
+    return junit_test_key(classname, components[-1])
+
+
+def _testcase_outcome(testcase: ET.Element) -> str:
+    for child in testcase:
+        if child.tag == "failure":
+            return FAILED
+        if child.tag == "error":
+            return ERROR
+        if child.tag == "skipped":
+            return SKIPPED
+    return PASSED
+
+
+class TestResultsDatabase(object):
+    def __init__(self, path: Path):
+        self.path = path
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Parallel test jobs may write at the same time -> wait for the lock instead of failing immediately
+        self._db = sqlite3.connect(str(path), timeout=60)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ingest_junit(self, xml_path: Path, suite: str) -> int:
+        """Add all testcases from the JUnit XML file as a new run of :param suite: and return the run id"""
+        root = ET.parse(str(xml_path)).getroot()
+        with self._db:
+            cursor = self._db.execute("INSERT INTO runs (suite, source, timestamp) VALUES (?, ?, ?)",
+                                      (suite, str(xml_path), datetime.datetime.utcnow().isoformat()))
+            run_id = cursor.lastrowid
+            rows = []
+            for testcase in root.iter("testcase"):
+                duration = testcase.get("time")
+                rows.append((run_id, junit_test_key(testcase.get("classname", ""), testcase.get("name", "")),
+                             float(duration) if duration else None, _testcase_outcome(testcase)))
+            self._db.executemany("INSERT INTO results (run_id, test, duration, outcome) VALUES (?, ?, ?, ?)", rows)
+        return run_id
+
+    def _recent_run_ids(self, suite: str, last_runs: int) -> "typing.List[int]":
+        return [r[0] for r in self._db.execute("SELECT id FROM runs WHERE suite = ? ORDER BY id DESC LIMIT ?",
+                                               (suite, last_runs))]
+
+    def predicted_durations(self, suite: str, last_runs: int = 5) -> "typing.Dict[str, float]":
+        """The average duration of each test in the last :param last_runs: runs of :param suite:"""
+        run_ids = self._recent_run_ids(suite, last_runs)
+        if not run_ids:
+            return dict()
+        query = "SELECT test, AVG(duration) FROM results WHERE run_id IN ({}) AND duration IS NOT NULL " \
+                "AND outcome != ? GROUP BY test".format(",".join("?" * len(run_ids)))
+        return {test: duration for test, duration in self._db.execute(query, run_ids + [SKIPPED])}
+
+    def flaky_tests(self, suite: str, last_runs: int = 10) -> "typing.List[typing.Tuple[str, int, int]]":
+        """Tests that both passed and failed in the last :param last_runs: runs as (test, passes, failures) tuples"""
+        run_ids = self._recent_run_ids(suite, last_runs)
+        if not run_ids:
+            return []
+        query = "SELECT test, SUM(outcome = ?), SUM(outcome IN (?, ?)) FROM results WHERE run_id IN ({}) " \
+                "GROUP BY test HAVING SUM(outcome = ?) > 0 AND SUM(outcome IN (?, ?)) > 0 " \
+                "ORDER BY test".format(",".join("?" * len(run_ids)))
+        params = [PASSED, FAILED, ERROR] + run_ids + [PASSED, FAILED, ERROR]
+        return [(test, passes, failures) for test, passes, failures in self._db.execute(query, params)]
+
+
+def order_longest_first(tests: "typing.Iterable[str]", durations: "typing.Dict[str, float]",
+                        default_duration: float = None) -> "typing.List[str]":
+    """Sort tests by predicted duration (tests without history use the median duration)"""
+    if default_duration is None:
+        default_duration = median_duration(durations.values())
+    return sorted(tests, key=lambda t: (-durations.get(t, default_duration), t))
+
+
+def balance_shards(tests: "typing.Iterable[str]", num_shards: int, durations: "typing.Dict[str, float]",
+                   default_duration: float = None) -> "typing.List[typing.List[str]]":
+    """
+    Split tests into :param num_shards: shards with roughly equal predicted total duration by assigning the longest
+    remaining test to the shard that currently has the least work (longest processing time first).
+    """
+    if default_duration is None:
+        default_duration = median_duration(durations.values())
+    shards = [[] for _ in range(num_shards)]
+    heap = [(0.0, i) for i in range(num_shards)]
+    for test in order_longest_first(tests, durations, default_duration):
+        total, index = heapq.heappop(heap)
+        shards[index].append(test)
+        heapq.heappush(heap, (total + durations.get(test, default_duration), index))
+    return shards
+
+
+def median_duration(durations: "typing.Iterable[float]") -> float:
+    values = sorted(durations)
+    if not values:
+        return 1.0
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or update the database of test results")
+    parser.add_argument("--database", type=Path, default=default_database_path())
+    subparsers = parser.add_subparsers(dest="command")
+    ingest = subparsers.add_parser("ingest", help="Add a JUnit XML file to the database")
+    ingest.add_argument("suite")
+    ingest.add_argument("junit_xml", type=Path, nargs="+")
+    flaky = subparsers.add_parser("flaky", help="List tests that both passed and failed recently")
+    flaky.add_argument("suite")
+    flaky.add_argument("--last-runs", type=int, default=10)
+    slowest = subparsers.add_parser("slowest", help="List the tests with the longest predicted duration")
+    slowest.add_argument("suite")
+    slowest.add_argument("-n", type=int, default=20)
+    args = parser.parse_args()
+    with TestResultsDatabase(args.database) as db:
+        if args.command == "ingest":
+            for xml_file in args.junit_xml:
+                db.ingest_junit(xml_file, args.suite)
+        elif args.command == "flaky":
+            for test, passes, failures in db.flaky_tests(args.suite, args.last_runs):
+                print(test, "passed", passes, "times, failed", failures, "times")
+        elif args.command == "slowest":
+            durations = db.predicted_durations(args.suite)
+            for test in order_longest_first(durations.keys(), durations)[:args.n]:
+                print("{:10.2f}s {}".format(durations[test], test))
+        else:
+            parser.print_help()
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
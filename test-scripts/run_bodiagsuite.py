@@ -30,88 +30,111 @@
 # SUCH DAMAGE.
 #
 import argparse
+import concurrent.futures
 import os
 import sys
+import typing
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
-from run_tests_common import junitparser, run_tests_main, boot_cheribsd
+from junit_merge import JUnitXmlMerger
+from run_tests_common import run_tests_main, boot_cheribsd, record_junit_results
 
 LONG_NAME_FOR_BUILDDIR = "/build-dir-with-long-name-to-ensure-cwd-causes-buffer-overflow"
 
 
+def _junit_result(testcase: ET.Element, tag: str, message: str):
+    # Like junitparser a testcase only has one result, so replace any previous one
+    for old in [e for e in testcase if e.tag in ("failure", "error", "skipped")]:
+        testcase.remove(old)
+    # The result element must come before system-out/system-err
+    testcase.insert(0, ET.Element(tag, message=message))
+
+
+def _set_output(testcase: ET.Element, tag: str, text: str):
+    elem = testcase.find(tag)
+    if elem is None:
+        elem = ET.SubElement(testcase, tag)
+    elem.text = text
+
+
+def _read_test_output(o: Path) -> "typing.Tuple[Path, str, typing.Optional[str]]":
+    # This is run on the worker pool since reading ~1000 small files is mostly waiting for I/O
+    exit_code_str = o.read_text(encoding="utf-8", errors="replace").rstrip()
+    stderr_path = o.with_suffix(".stderr")
+    stderr = None
+    if stderr_path.exists():
+        stderr_bytes = stderr_path.read_bytes().rstrip()  # type: bytes
+        stderr = stderr_bytes.replace(b"\x00", b"\\0").decode("utf-8", errors="replace")
+    return o, exit_code_str, stderr
+
+
 class BODiagTestsuite(object):
-    def __init__(self, name: str, xml: "junitparser.JUnitXml"):
+    def __init__(self, name: str):
         self.test_prefix = name
-        self.min_suite = junitparser.TestSuite(name=name + "-min-overflow")
-        xml.add_testsuite(self.min_suite)
-        self.med_suite = junitparser.TestSuite(name=name + "-med-overflow")
-        xml.add_testsuite(self.med_suite)
-        self.large_suite = junitparser.TestSuite(name=name + "-large-overflow")
-        xml.add_testsuite(self.large_suite)
-        self.ok_suite = junitparser.TestSuite(name=name + "-in-bounds")
-        xml.add_testsuite(self.ok_suite)
-        self.error_suite = junitparser.TestSuite(name=name + "-test-broken")
-        xml.add_testsuite(self.error_suite)
+        self.min_suite = ET.Element("testsuite", name=name + "-min-overflow")
+        self.med_suite = ET.Element("testsuite", name=name + "-med-overflow")
+        self.large_suite = ET.Element("testsuite", name=name + "-large-overflow")
+        self.ok_suite = ET.Element("testsuite", name=name + "-in-bounds")
+        self.error_suite = ET.Element("testsuite", name=name + "-test-broken")
 
         # There are 291 tests, we want to check that all of them were run
-        self.expected_test_names = []
+        self.expected_test_names = set()  # type: typing.Set[str]
         assert name in ("basic", "basic-heap")
         for i in range(291, 0, -1):
             prefix = "{}-{:0>5}".format(name, i)
-            self.expected_test_names.append(prefix + "-min")
-            self.expected_test_names.append(prefix + "-med")
-            self.expected_test_names.append(prefix + "-large")
-            self.expected_test_names.append(prefix + "-ok")
+            self.expected_test_names.add(prefix + "-min")
+            self.expected_test_names.add(prefix + "-med")
+            self.expected_test_names.add(prefix + "-large")
+            self.expected_test_names.add(prefix + "-ok")
+
+    @property
+    def suites(self) -> "typing.List[ET.Element]":
+        return [self.min_suite, self.med_suite, self.large_suite, self.ok_suite, self.error_suite]
 
     def check_all_cases_parsed(self):
-        for missing_test in self.expected_test_names:
+        for missing_test in sorted(self.expected_test_names, reverse=True):
             self.error("Could not find output file for test: ", missing_test)
-            testcase = junitparser.TestCase(name=missing_test)
-            testcase.result = junitparser.Error(message="Could not find output for test " + missing_test)
-            self.error_suite.add_testcase(testcase)
+            testcase = ET.SubElement(self.error_suite, "testcase", name=missing_test)
+            _junit_result(testcase, "error", "Could not find output for test " + missing_test)
 
     def error(self, *args):
         print(self.test_prefix, "ERROR:", *args, file=sys.stderr)
 
-    def handle_testcase(self, o: Path, tools: list):
+    def handle_testcase(self, o: Path, exit_code_str: str, stderr: "typing.Optional[str]", tools: list):
         stem = o.stem
         assert stem.startswith(self.test_prefix), stem
-        exit_code_str = o.read_text(encoding="utf-8", errors="replace").rstrip()
-        testcase = junitparser.TestCase(name=stem)
-        try:
-            index = self.expected_test_names.index(stem)
-        except ValueError:
+        testcase = ET.Element("testcase", name=stem)
+        if stem not in self.expected_test_names:
             self.error("Found output for unknown test: ", o)
-            testcase.result = junitparser.Error(message="UNEXPECTED TEST NAME: " + o.name)
-            testcase.system_out = exit_code_str
-            self.error_suite.add_testcase(testcase)
+            _junit_result(testcase, "error", "UNEXPECTED TEST NAME: " + o.name)
+            _set_output(testcase, "system-out", exit_code_str)
+            self.error_suite.append(testcase)
             return
         # test has been handled -> remove from expected list
-        del self.expected_test_names[index]
-        if o.with_suffix(".stderr").exists():
-            stderr = o.with_suffix(".stderr").read_bytes().rstrip()  # type: bytes
-            stderr = stderr.replace(b"\x00", b"\\0")
-            testcase.system_err = stderr.decode("utf-8", errors="replace")
+        self.expected_test_names.remove(stem)
+        if stderr is not None:
+            _set_output(testcase, "system-err", stderr)
         try:
             exit_code = int(exit_code_str)
         except ValueError:
             self.error("Malformed output for test: ", o)
-            testcase.result = junitparser.Error(message="INVALID OUTPUT FILE CONTENTS: " + o.name)
-            testcase.system_out = exit_code_str
-            self.error_suite.add_testcase(testcase)
+            _junit_result(testcase, "error", "INVALID OUTPUT FILE CONTENTS: " + o.name)
+            _set_output(testcase, "system-out", exit_code_str)
+            self.error_suite.append(testcase)
             return
 
         signaled = os.WIFSIGNALED(exit_code)
         exited = os.WIFEXITED(exit_code)
-        testcase.system_out = "WIFSIGNALED={} WIFEXITED={}, WTERMSIG={}, WEXITSTATUS={} WCOREDUMP={}".format(signaled,
-            exited, os.WTERMSIG(exit_code), os.WEXITSTATUS(exit_code), os.WCOREDUMP(exit_code))
+        _set_output(testcase, "system-out", "WIFSIGNALED={} WIFEXITED={}, WTERMSIG={}, WEXITSTATUS={} WCOREDUMP={}".format(
+            signaled, exited, os.WTERMSIG(exit_code), os.WEXITSTATUS(exit_code), os.WCOREDUMP(exit_code)))
         # -ok testcases are expected to run succesfully -> exit code zero
         if stem.endswith("-ok"):
             if not exited or os.WEXITSTATUS(exit_code) != 0:
                 # This is not just a failure, it means something is seriously wrong if the good case fails
                 self.error("One of the good test cases failed: ", o)
-                testcase.result = junitparser.Error(message="Expected exit code 0 but got " + exit_code_str)
-            self.ok_suite.add_testcase(testcase)
+                _junit_result(testcase, "error", "Expected exit code 0 but got " + exit_code_str)
+            self.ok_suite.append(testcase)
         else:
             # all others should crash
             if stem.endswith("-min"):
@@ -122,73 +145,55 @@ class BODiagTestsuite(object):
                 suite = self.large_suite
             else:
                 self.error("Malformed output for test: ", o)
-                testcase.result = junitparser.Error(message="INVALID OUTPUT FILE FOUND: " + o.name)
-                self.error_suite.add_testcase(testcase)
+                _junit_result(testcase, "error", "INVALID OUTPUT FILE FOUND: " + o.name)
+                self.error_suite.append(testcase)
                 return
-            if exit_code == 1 and testcase.system_err and testcase.system_err.startswith(
-                    "This test needs a CWD with length"):
-                testcase.result = junitparser.Skipped(message="This test needs a large working directory")
+            stderr = stderr or ""
+            if exit_code == 1 and stderr.startswith("This test needs a CWD with length"):
+                _junit_result(testcase, "skipped", "This test needs a large working directory")
 
             # Handle tool-specific exit codes:
             if "effectivesan" in tools:
                 # We do not instruct EffectiveSan to terminate on first error:
-                if "BOUNDS ERROR:\n" not in testcase.system_err:
-                    testcase.result = junitparser.Failure(
-                        message="EffectiveSan did not detect a bounds error. Exit code " + exit_code_str)
+                if "BOUNDS ERROR:\n" not in stderr:
+                    _junit_result(testcase, "failure",
+                                  "EffectiveSan did not detect a bounds error. Exit code " + exit_code_str)
             elif "softboundcets" in tools:
                 # We do not instruct EffectiveSan to terminate on first error:
-                if "Softboundcets: Memory safety violation detected" not in testcase.system_err:
-                    testcase.result = junitparser.Failure(
-                        message="SoftBoundCETS did not detect a bounds error. Exit code " + exit_code_str)
+                if "Softboundcets: Memory safety violation detected" not in stderr:
+                    _junit_result(testcase, "failure",
+                                  "SoftBoundCETS did not detect a bounds error. Exit code " + exit_code_str)
             else:
                 # Otherwise we assume that the test must be killed by a signal
                 if not signaled:
                     # test should fail with a signal: (162 for CHERI)
                     # TODO: for CHERI check that it was signal 34?
-                    testcase.result = junitparser.Failure(
-                        message="Expected test to be killed by a SIGNAL but got exit code " + exit_code_str)
-            suite.add_testcase(testcase)
-
-
-def _create_junit_xml(builddir: Path, name, tools):
-    xml = junitparser.JUnitXml(name)
-
-    # TODO: check that all cases exist (otherwise add an error)
-    output_files = builddir.glob("run/*.out")
-    sorted_files = []
-    for o in output_files:
-        sorted_files.append(str(o))
-    sorted_files.sort()
-
-    expected_test_names = []
-    testsuite_basic = BODiagTestsuite("basic", xml)
-    testsuite_heap = BODiagTestsuite("basic-heap", xml)
-    # There are 291 tests, we want to check that all of them were run
-    for base_prefix in ("basic", "basic-heap"):
-        for i in range(291, 0, -1):
-            prefix = "{}-{:0>5}".format(base_prefix, i)
-            expected_test_names.append(prefix + "-min")
-            expected_test_names.append(prefix + "-med")
-            expected_test_names.append(prefix + "-large")
-            expected_test_names.append(prefix + "-ok")
-
-    for fullpath in sorted_files:
-        o = Path(fullpath)
-        if "-heap-" in o.stem:
-            testsuite_heap.handle_testcase(o, tools)
-        else:
-            testsuite_basic.handle_testcase(o, tools)
+                    _junit_result(testcase, "failure",
+                                  "Expected test to be killed by a SIGNAL but got exit code " + exit_code_str)
+            suite.append(testcase)
+
+
+def _create_junit_xml(builddir: Path, name, tools, parse_jobs=None):
+    sorted_files = sorted(builddir.glob("run/*.out"))
+    testsuite_basic = BODiagTestsuite("basic")
+    testsuite_heap = BODiagTestsuite("basic-heap")
+    # Read the per-test output files in parallel (map() returns the results in order of sorted_files)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parse_jobs) as executor:
+        for o, exit_code_str, stderr in executor.map(_read_test_output, sorted_files):
+            if "-heap-" in o.stem:
+                testsuite_heap.handle_testcase(o, exit_code_str, stderr, tools)
+            else:
+                testsuite_basic.handle_testcase(o, exit_code_str, stderr, tools)
 
     testsuite_basic.check_all_cases_parsed()
     testsuite_heap.check_all_cases_parsed()
-
-    xml.update_statistics()
-    # Older version of python only support str and not Path
-    xml.write(str(builddir / "test-results.xml"), pretty=True)
+    with JUnitXmlMerger(builddir / "test-results.xml", name=name) as xml:
+        for suite in testsuite_basic.suites + testsuite_heap.suites:
+            xml.add_suite(suite)
 
 
-def create_junit_xml(builddir, name, tools):
-    _create_junit_xml(builddir, name, tools)
+def create_junit_xml(builddir, name, tools, parse_jobs=None):
+    _create_junit_xml(builddir, name, tools, parse_jobs)
     test_output = Path(builddir, "test-results.xml")
     if not test_output.exists():
         boot_cheribsd.failure("Failed to create the JUnit XML file")
@@ -213,8 +218,9 @@ def run_bodiagsuite(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespa
         # restore old behaviour
         boot_cheribsd.run_cheribsd_command(qemu, "sysctl machdep.log_cheri_exceptions=1 || true")
 
-    if not create_junit_xml(Path(args.build_dir), args.junit_testsuite_name, args.tools):
+    if not create_junit_xml(Path(args.build_dir), args.junit_testsuite_name, args.tools, args.parse_jobs):
         return False
+    record_junit_results(args, Path(args.build_dir, "test-results.xml"), "bodiagsuite-" + args.junit_testsuite_name)
     return True
 
 
@@ -225,6 +231,8 @@ def add_args(parser: argparse.ArgumentParser):
     parser.add_argument("--use-valgrind", action="store_true")
     parser.add_argument("--tools", nargs=argparse.ZERO_OR_MORE, default=[])
     parser.add_argument("--jobs", "-j", help="make jobs", type=int, default=1)
+    parser.add_argument("--parse-jobs", type=int, default=None,
+                        help="Number of threads used to read the test output files (default: based on CPU count)")
 
 
 def main():
@@ -241,7 +249,7 @@ def main():
             if args.use_valgrind:
                 cmd.append("-DUSE_VALGRIND")
             boot_cheribsd.run_host_command(cmd, cwd=args.build_dir)
-        if not create_junit_xml(Path(args.build_dir), args.junit_testsuite_name, args.tools):
+        if not create_junit_xml(Path(args.build_dir), args.junit_testsuite_name, args.tools, args.parse_jobs):
             sys.exit("Failed to create JUnit xml")
         sys.exit()
 
@@ -35,13 +35,12 @@ import functools
 import operator
 import os
 import shlex
-import shutil
 import sys
 import time
 from pathlib import Path
 
-from kyua_db_to_junit_xml import convert_kyua_db_to_junit_xml, fixup_kyua_generated_junit_xml
-from run_tests_common import boot_cheribsd, run_tests_main, pexpect
+from kyua_db_to_junit_xml import convert_kyua_db_to_junit_xml
+from run_tests_common import boot_cheribsd, run_tests_main, pexpect, record_junit_results
 
 
 def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespace):
@@ -53,7 +52,6 @@ def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Names
     qemu.run("/libexec/ld-cheri-elf.so.1 -h", cheri_trap_fatal=True)
 
     tests_successful = True
-    host_has_kyua = shutil.which("kyua") is not None
 
     try:
         # potentially bootstrap kyua for later testing
@@ -67,33 +65,21 @@ def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Names
             # Allow up to 24 hours to run the full testsuite
             # Not a checked run since it might return false if some tests fail
             test_start = datetime.datetime.now()
-            qemu.run("kyua test --results-file=/tmp/results.db -k {}".format(shlex.quote(tests_file)),
-                     ignore_cheri_trap=True, cheri_trap_fatal=False, timeout=24 * 60 * 60)
+            kyua_cmd = "kyua test --results-file=/tmp/results.db -k {}".format(shlex.quote(tests_file))
+            if args.kyua_test_filters:
+                kyua_cmd += " " + " ".join(shlex.quote(f) for f in args.kyua_test_filters)
+            qemu.run(kyua_cmd, ignore_cheri_trap=True, cheri_trap_fatal=False, timeout=24 * 60 * 60)
             if i == 0:
                 results_db = Path("/kyua-results/test-results.db")
             else:
                 results_db = Path("/kyua-results/test-results-{}.db".format(i))
-            results_xml = results_db.with_suffix(".xml")
             assert shlex.quote(str(results_db)) == str(results_db), "Should not contain any special chars"
             qemu.checked_run("cp -v /tmp/results.db {}".format(results_db))
             qemu.checked_run("fsync " + str(results_db))
             boot_cheribsd.success("Running tests for ", tests_file, " took: ", datetime.datetime.now() - test_start)
 
-            # run: kyua report-junit --results-file=test-results.db | vis -os > ${CPU}-${TEST_NAME}-test-results.xml
-            # Not sure how much we gain by running it on the host instead.
-            # Converting the full test suite to xml can take over an hour (probably a lot faster without the vis -os
-            # pipe)
-            # TODO: should escape the XML file but that's probably faster on the host
-            if host_has_kyua:
-                boot_cheribsd.info("KYUA installed on the host, no need to do slow conversion in QEMU")
-            else:
-                xml_conversion_start = datetime.datetime.now()
-                qemu.checked_run("kyua report-junit --results-file=/tmp/results.db > /tmp/results.xml",
-                                 timeout=200 * 60)
-                qemu.checked_run("cp -v /tmp/results.xml {}".format(results_xml))
-                qemu.checked_run("fsync " + str(results_xml))
-                boot_cheribsd.success("Creating JUnit XML ", results_xml, " took: ",
-                                      datetime.datetime.now() - xml_conversion_start)
+            # The JUnit XML is generated on the host from the .db file since running `kyua report-junit` in QEMU
+            # can take over an hour for the full test suite.
     except boot_cheribsd.CheriBSDCommandTimeout as e:
         boot_cheribsd.failure("Timeout running tests: " + str(e), exit=False)
         qemu.sendintr()
@@ -107,22 +93,18 @@ def run_cheribsd_test(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Names
         boot_cheribsd.info("Trying to shut down cleanly")
         tests_successful = False
 
-    # Update the JUnit stats in the XML file
+    # Convert the kyua databases to JUnit XML
     if args.kyua_tests_files:
         if not boot_cheribsd.PRETEND:
             time.sleep(2)  # sleep two seconds to ensure the files exist
         junit_dir = Path(args.kyua_tests_output)
         try:
-            if host_has_kyua:
-                boot_cheribsd.info("Converting kyua databases to JUNitXML in output directory ", junit_dir)
-                for host_kyua_db_path in junit_dir.glob("*.db"):
-                    convert_kyua_db_to_junit_xml(host_kyua_db_path, host_kyua_db_path.with_suffix(".xml"))
-            else:
-                boot_cheribsd.info("Updating statistics in JUnit output directory ", junit_dir)
-                for host_xml_path in junit_dir.glob("*.xml"):
-                    fixup_kyua_generated_junit_xml(host_xml_path)
+            boot_cheribsd.info("Converting kyua databases to JUnit XML in output directory ", junit_dir)
+            for host_kyua_db_path in junit_dir.glob("*.db"):
+                convert_kyua_db_to_junit_xml(host_kyua_db_path, host_kyua_db_path.with_suffix(".xml"))
+                record_junit_results(args, host_kyua_db_path.with_suffix(".xml"), "kyua-" + host_kyua_db_path.stem)
         except Exception as e:
-            boot_cheribsd.failure("Could not update stats in ", junit_dir, ": ", e, exit=False)
+            boot_cheribsd.failure("Could not convert kyua databases in ", junit_dir, ": ", e, exit=False)
             tests_successful = False
 
     if args.interact or args.skip_poweroff:
@@ -181,6 +163,8 @@ def add_args(parser: argparse.ArgumentParser):
                              "image!")
     parser.add_argument("--kyua-tests-files", action="append", nargs=argparse.ZERO_OR_MORE, default=[],
                         help="Run tests for the given following Kyuafile(s)")
+    parser.add_argument("--kyua-test-filters", nargs=argparse.ZERO_OR_MORE, default=[], metavar="FILTER",
+                        help="Only run the given test programs/directories (relative to the Kyuafile directory)")
     parser.add_argument("--kyua-tests-output", default=str(Path(".").resolve() / "kyua-results"),
                         help="Copy the kyua results.db to the following directory (it will be mounted with SMB)")
     parser.add_argument("--kyua-tests-output-no-timestamped-subdir", action="store_true",
@@ -30,43 +30,68 @@
 # SUCH DAMAGE.
 #
 import argparse
+import concurrent.futures
 import shutil
+import sys
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
-from run_tests_common import junitparser, run_tests_main, boot_cheribsd
+from junit_merge import JUnitXmlMerger
+from run_tests_common import run_tests_main, boot_cheribsd, record_junit_results
 
 
-def output_to_junit_suite(xml, output_path, suite_name, good=True):
-    suite = junitparser.TestSuite(suite_name)
+def output_to_junit_suite(output_path: Path, suite_name: str, good=True) -> ET.Element:
+    suite = ET.Element("testsuite", name=suite_name)
 
-    with open(output_path, "r") as output_file:
+    with output_path.open("r") as output_file:
         next(output_file)  # skip first header
         for line in output_file:
             if line[0] == "=":  # stop on next header
                 break
 
             split = line.split()
-            case = junitparser.TestCase(split[0])
+            case = ET.SubElement(suite, "testcase", name=split[0])
             exit_code = int(split[1])
 
             if exit_code == 124:
                 # timeout
-                case.result = junitparser.Error(split[1])  # TODO error on timeout?
+                ET.SubElement(case, "error", message=split[1])  # TODO error on timeout?
             elif good and exit_code != 0:
                 # good run had bad exit code
-                case.result = junitparser.Failure(split[1])
+                ET.SubElement(case, "failure", message=split[1])
             elif not good and exit_code == 0:  # TODO we usually? expect a cheri exception
                 # bad run had good exit code
-                case.result = junitparser.Failure(split[1])
-
-            suite.add_testcase(case)
-
-    xml.add_testsuite(suite)
+                ET.SubElement(case, "failure", message=split[1])
+    return suite
+
+
+def create_junit_xml(build_dir: Path, parse_jobs: int = None) -> bool:
+    success = True
+    runs = [(build_dir / "bin" / "good.run", "good", True), (build_dir / "bin" / "bad.run", "bad", False)]
+    max_workers = len(runs) if parse_jobs is None else max(1, min(parse_jobs, len(runs)))
+    with JUnitXmlMerger(build_dir / "results.xml") as xml:
+        # Parse the good and bad outputs in parallel and stream them to the XML file in the same order
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(output_to_junit_suite, *run) for run in runs]
+            for (output_path, suite_name, _), future in zip(runs, futures):
+                try:
+                    xml.add_suite(future.result())
+                except (OSError, ValueError, IndexError, StopIteration) as e:
+                    boot_cheribsd.failure("Could not parse ", output_path, ": ", e, exit=False)
+                    xml.add_error_suite(suite_name, "parse-output", "Could not parse " + str(output_path))
+                    success = False
+    boot_cheribsd.info("Juliet results: ", xml.tests, " tests, ", xml.failures, " failures, ", xml.errors,
+                       " errors")
+    return success
 
 
 def add_args(parser: argparse.ArgumentParser):
     parser.add_argument("--testcase-timeout", required=False, default="1s")
     parser.add_argument("--ld-preload-path", required=False, default=None)
+    parser.add_argument("--junit-xml-only", action="store_true",
+                        help="Only re-create the JUnit XML from the output of a previous run (does not boot QEMU)")
+    parser.add_argument("--parse-jobs", type=int, default=None,
+                        help="Number of threads used to parse the test output files (default: one per output file)")
 
 
 def setup_juliet_test_environment(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespace):
@@ -94,15 +119,21 @@ def run_juliet_tests(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namesp
 
     build_dir = Path(args.build_dir)
     boot_cheribsd.checked_run_cheribsd_command(qemu, run_command, ignore_cheri_trap=True, timeout=60000)
-    xml = junitparser.JUnitXml()
-    output_to_junit_suite(xml, build_dir / "bin" / "good.run", "good", True)
-    output_to_junit_suite(xml, build_dir / "bin" / "bad.run", "bad", False)
-    xml.write(build_dir / "results.xml")
-
+    if not create_junit_xml(build_dir, args.parse_jobs):
+        return False
+    record_junit_results(args, build_dir / "results.xml", "juliet")
     return True
 
 
 if __name__ == '__main__':
+    if "--junit-xml-only" in sys.argv:
+        host_parser = argparse.ArgumentParser()
+        add_args(host_parser)
+        host_parser.add_argument("--build-dir", required=True)
+        host_args, _ = host_parser.parse_known_args()
+        if not create_junit_xml(Path(host_args.build_dir), host_args.parse_jobs):
+            sys.exit("Failed to create JUnit xml")
+        sys.exit()
     # we don't need ssh running to execute the tests, but we need both host and source dir mounted
     run_tests_main(test_function=run_juliet_tests, test_setup_function=setup_juliet_test_environment,
                    argparse_setup_callback=add_args, need_ssh=False, should_mount_builddir=True,
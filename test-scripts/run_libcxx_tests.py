@@ -33,11 +33,14 @@ import argparse
 import atexit
 import datetime
 import os
+import re
 import signal
+import subprocess
 import sys
 import tempfile
 import time
 import traceback
+import xml.etree.ElementTree as ET
 from multiprocessing import Process, Queue, Barrier
 from pathlib import Path
 from queue import Empty
@@ -45,22 +48,31 @@ from queue import Empty
 import run_remote_lit_test
 from run_remote_lit_test import mp_debug
 # To combine the test result xmls
-from run_tests_common import junitparser, run_tests_main, boot_cheribsd
+from junit_merge import JUnitXmlMerger
+from run_tests_common import run_tests_main, boot_cheribsd, add_test_results_db_args, record_junit_results
+import results_database
 
 
 def add_cmdline_args(parser: argparse.ArgumentParser):
     parser.add_argument("--lit-debug-output", action="store_true")
+    run_remote_lit_test.add_lit_executor_args(parser)
     parser.add_argument("--multiprocessing-debug", action="store_true")
     parser.add_argument("--xunit-output", default="qemu-libcxx-test-results.xml")
     parser.add_argument("--parallel-jobs", metavar="N", type=int, help="Split up the testsuite into N parallel jobs")
     # For the parallel jobs
     parser.add_argument("--internal-num-shards", type=int, help=argparse.SUPPRESS)
     parser.add_argument("--internal-shard", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--internal-shard-tests-file", help=argparse.SUPPRESS)
+    parser.add_argument("--only-tests-file", help="Only run the tests listed in this file (one path per line, "
+                                                  "relative to the build directory)")
 
 
-def run_shard(q: Queue, barrier: Barrier, num, total, ssh_port_queue, kernel, disk_image, build_dir):
+def run_shard(q: Queue, barrier: Barrier, num, total, ssh_port_queue, kernel, disk_image, build_dir,
+              shard_tests_file=None):
     sys.argv.append("--internal-num-shards=" + str(total))
     sys.argv.append("--internal-shard=" + str(num))
+    if shard_tests_file is not None:
+        sys.argv.append("--internal-shard-tests-file=" + str(shard_tests_file))
     if kernel is not None:
         sys.argv.append("--internal-kernel-override=" + str(kernel))
     if disk_image is not None:
@@ -114,6 +126,48 @@ def libcxx_main(barrier: Barrier = None, mp_queue: Queue = None, ssh_port_queue:
         boot_cheribsd.info("Finished running ", " ".join(sys.argv))
 
 
+def plan_balanced_shards(args: argparse.Namespace) -> "typing.Optional[typing.List[Path]]":
+    """
+    Use the test durations from previous runs to give each shard roughly the same amount of work instead of letting
+    lit split the tests by count. Returns one file with test paths per shard or None if there is no history.
+    """
+    db_path = getattr(args, "test_results_db", None)
+    if not db_path or args.pretend or not Path(db_path).exists():
+        return None
+    with results_database.TestResultsDatabase(Path(db_path)) as db:
+        durations = db.predicted_durations("libcxx")
+    if not durations:
+        boot_cheribsd.info("No recorded libcxx test durations, using lit's static sharding")
+        return None
+    build_dir = Path(args.build_dir)
+    try:
+        output = subprocess.check_output(["python3", str(build_dir / "bin/llvm-lit"), "--show-tests", "test"],
+                                         cwd=str(build_dir)).decode("utf-8")
+    except (OSError, subprocess.CalledProcessError) as e:
+        boot_cheribsd.failure("Could not list libcxx tests, using lit's static sharding: ", e, exit=False)
+        return None
+    only_tests = None
+    if args.only_tests_file:
+        only_tests = set(Path(args.only_tests_file).read_text().splitlines())
+    test_paths = dict()
+    for line in output.splitlines():
+        match = re.match(r"^\s+(.+?) :: (.+)$", line)
+        if match and (only_tests is None or "test/" + match.group(2) in only_tests):
+            test_paths[results_database.lit_test_key(match.group(1), match.group(2))] = "test/" + match.group(2)
+    if len(test_paths) < args.parallel_jobs:
+        return None
+    default_duration = results_database.median_duration(durations.values())
+    shards = results_database.balance_shards(test_paths.keys(), args.parallel_jobs, durations, default_duration)
+    result = []
+    for i, shard in enumerate(shards):
+        shard_file = build_dir / ("shard-" + str(i + 1) + "-tests.txt")
+        shard_file.write_text("\n".join(test_paths[t] for t in shard) + "\n")
+        result.append(shard_file)
+        boot_cheribsd.info("Shard ", i + 1, ": ", len(shard), " tests, predicted duration ",
+                           int(sum(durations.get(t, default_duration) for t in shard)), "s")
+    return result
+
+
 def run_parallel(args: argparse.Namespace):
     if args.pretend:
         boot_cheribsd.PRETEND = True
@@ -130,11 +184,13 @@ def run_parallel(args: argparse.Namespace):
     kernel_path = boot_cheribsd.maybe_decompress(Path(args.kernel), True, True, args) if args.kernel else None
     disk_image_path = boot_cheribsd.maybe_decompress(Path(args.disk_image), True, True,
                                                      args) if args.disk_image else None
+    shard_test_files = plan_balanced_shards(args)
     for i in range(args.parallel_jobs):
         shard_num = i + 1
         boot_cheribsd.info(args)
         p = Process(target=run_shard, args=(
-        mp_q, mp_barrier, shard_num, args.parallel_jobs, ssh_port_queue, kernel_path, disk_image_path, args.build_dir))
+        mp_q, mp_barrier, shard_num, args.parallel_jobs, ssh_port_queue, kernel_path, disk_image_path, args.build_dir,
+        shard_test_files[i] if shard_test_files else None))
         p.stage = run_remote_lit_test.MultiprocessStages.FINDING_SSH_PORT
         p.daemon = True  # kill process on parent exit
         p.name = "<LIBCXX test shard " + str(shard_num) + ">"
@@ -152,40 +208,35 @@ def run_parallel(args: argparse.Namespace):
         # merge junit xml files
         if args.xunit_output:
             boot_cheribsd.success("Merging JUnit XML outputs")
-            result = junitparser.JUnitXml()
             xunit_file = Path(args.xunit_output).absolute()
             dump_processes(processes)
-            for i in range(args.parallel_jobs):
-                shard_num = i + 1
-                shard_file = xunit_file.with_name("shard-" + str(shard_num) + "-" + xunit_file.name)
-                mp_debug(args, processes[i], processes[i].stage)
-                if shard_file.exists():
-                    result += junitparser.JUnitXml.fromfile(str(shard_file))
-                else:
-                    error_msg = "ERROR: could not find JUnit XML " + str(shard_file) + " for shard " + str(shard_num)
-                    boot_cheribsd.failure(error_msg, exit=False)
-                    error_suite = junitparser.TestSuite(name="failed-shard-" + str(shard_num))
-                    error_case = junitparser.TestCase(name="cannot-find-file")
-                    error_case.classname = "failed-shard-" + str(shard_num)
-                    error_case.result = junitparser.Error(message=error_msg)
-                    error_suite.add_testcase(error_case)
-                    result.add_testsuite(error_suite)
-                if processes[i].stage != run_remote_lit_test.MultiprocessStages.EXITED:
-                    error_msg = "ERROR: shard " + str(shard_num) + " did not exit cleanly! Was in stage: " + processes[
-                        i].stage.value
-                    if hasattr(processes[i], "error_message"):
-                        error_msg += "\nError message:\n" + processes[i].error_message
-                    error_suite = junitparser.TestSuite(name="bad-exit-shard-" + str(shard_num))
-                    error_case = junitparser.TestCase(name="bad-exit-status")
-                    error_case.result = junitparser.Error(message=error_msg)
-                    error_suite.add_testcase(error_case)
-                    result.add_testsuite(error_suite)
-
-            result.update_statistics()
-            result.write(str(xunit_file))
+            with JUnitXmlMerger(xunit_file) as result:
+                for i in range(args.parallel_jobs):
+                    shard_num = i + 1
+                    shard_file = xunit_file.with_name("shard-" + str(shard_num) + "-" + xunit_file.name)
+                    mp_debug(args, processes[i], processes[i].stage)
+                    if shard_file.exists():
+                        try:
+                            result.add_file(shard_file)
+                        except ET.ParseError as e:
+                            error_msg = "ERROR: could not parse JUnit XML " + str(shard_file) + ": " + str(e)
+                            boot_cheribsd.failure(error_msg, exit=False)
+                            result.add_error_suite("failed-shard-" + str(shard_num), "cannot-parse-file", error_msg)
+                    else:
+                        error_msg = "ERROR: could not find JUnit XML " + str(shard_file) + " for shard " + str(
+                            shard_num)
+                        boot_cheribsd.failure(error_msg, exit=False)
+                        result.add_error_suite("failed-shard-" + str(shard_num), "cannot-find-file", error_msg)
+                    if processes[i].stage != run_remote_lit_test.MultiprocessStages.EXITED:
+                        error_msg = "ERROR: shard " + str(shard_num) + " did not exit cleanly! Was in stage: " + \
+                                    processes[i].stage.value
+                        if hasattr(processes[i], "error_message"):
+                            error_msg += "\nError message:\n" + processes[i].error_message
+                        result.add_error_suite("bad-exit-shard-" + str(shard_num), "bad-exit-status", error_msg)
             if args.pretend:
                 print(xunit_file.read_text())
             boot_cheribsd.success("Done merging JUnit XML outputs into ", xunit_file)
+            record_junit_results(args, xunit_file, "libcxx")
             print("Duration: ", result.time)
             print("Tests: ", result.tests)
             print("Failures: ", result.failures)
@@ -369,6 +420,7 @@ def main():
     parser = boot_cheribsd.get_argument_parser()
     parser.add_argument("--build-dir")  # needed later
     add_cmdline_args(parser)
+    add_test_results_db_args(parser)
     # Don't let this parser capture --help
     args, remainder = parser.parse_known_args(filter(lambda x: x != "-h" and x != "--help", sys.argv))
     # If parallel is set spawn N processes and use the lit --num-shards + --run-shard flags to split the work
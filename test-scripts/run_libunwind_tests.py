@@ -76,6 +76,7 @@ def run_libunwind_tests(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Nam
 
 def add_cmdline_args(parser: argparse.ArgumentParser):
     parser.add_argument("--lit-debug-output", action="store_true")
+    run_remote_lit_test.add_lit_executor_args(parser)
     parser.add_argument("--llvm-lit-path")
     parser.add_argument("--xunit-output", default="qemu-libunwind-test-results.xml")
 
@@ -33,9 +33,10 @@ import argparse
 import datetime
 import multiprocessing
 import os
+import queue
+import signal
 import subprocess
 import sys
-import threading
 import time
 import typing
 from enum import Enum
@@ -43,8 +44,9 @@ from pathlib import Path
 
 from run_tests_common import *
 
-KERNEL_PANIC = False
 COMPLETED = "COMPLETED"
+LIT_TEST_TIMEOUT = 120
+COMMAND_SERVER_GUEST_PORT = 7777
 NEXT_STAGE = "NEXT_STAGE"
 FAILURE = "FAILURE"
 
@@ -82,28 +84,70 @@ def notify_main_process(cmdline_args: argparse.Namespace, stage: MultiprocessSta
         time.sleep(1)
 
 
-def flush_thread(f, qemu: pexpect.spawn, should_exit_event: threading.Event):
-    while not should_exit_event.wait(timeout=0.1):
-        if f:
-            f.flush()
-        if should_exit_event.is_set():
-            break
-        # keep reading line-by-line to output any QEMU trap messages:
-        i = qemu.expect([pexpect.TIMEOUT, "KDB: enter:", pexpect.EOF, qemu.crlf], timeout=qemu.flush_interval)
-        if boot_cheribsd.PRETEND:
-            time.sleep(1)
-        elif i == 1:
-            boot_cheribsd.failure("GOT KERNEL PANIC!", exit=False)
-            boot_cheribsd.debug_kernel_panic(qemu)
-            global KERNEL_PANIC
-            KERNEL_PANIC = True  # TODO: tell lit to abort now....
-        elif i == 2:
-            boot_cheribsd.failure("GOT QEMU EOF!", exit=False)
-            # QEMU exited?
-            break
-    # One final expect to flush the buffer:
-    qemu.expect([pexpect.TIMEOUT, pexpect.EOF], timeout=1)
-    boot_cheribsd.success("QEMU output flushing thread terminated.")
+def add_lit_executor_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--lit-executor", choices=["command-server", "ssh"], default="command-server",
+                        help="How lit runs tests in the guest: 'command-server' starts lit_command_server.py in the "
+                             "guest and can run multiple tests concurrently, 'ssh' uses one SSH command per test and "
+                             "only runs one test at a time. Falls back to 'ssh' if the guest doesn't have python3.")
+    parser.add_argument("--lit-jobs-per-guest", metavar="N", type=int, default=4,
+                        help="Number of tests that are run concurrently in each guest when using the command server")
+
+
+class CommandServerTunnel(object):
+    def __init__(self, local_port: int, ssh_process: "typing.Optional[subprocess.Popen]"):
+        self.local_port = local_port
+        self.ssh_process = ssh_process
+
+    def stop(self, qemu: "typing.Optional[boot_cheribsd.CheriBSDInstance]"):
+        if self.ssh_process is not None:
+            self.ssh_process.terminate()
+            self.ssh_process.wait()
+        # Stop the server so that the next lit invocation on this guest can reuse the port
+        if qemu is not None:
+            boot_cheribsd.run_cheribsd_command(qemu, "kill $(cat /tmp/lit-command-server.pid)")
+
+
+def start_command_server(qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespace, tempdir: str,
+                         test_build_dir: Path) -> "typing.Optional[CommandServerTunnel]":
+    try:
+        boot_cheribsd.checked_run_cheribsd_command(qemu, "command -v python3", timeout=20)
+    except boot_cheribsd.CheriBSDCommandFailed:
+        boot_cheribsd.failure("python3 is not available in the guest, falling back to the SSH executor", exit=False)
+        return None
+    server_script = test_build_dir / "tmp" / "lit_command_server.py"
+    boot_cheribsd.run_host_command(["cp", "-f", str(Path(__file__).parent / "lit_command_server.py"),
+                                    str(server_script)])
+    boot_cheribsd.checked_run_cheribsd_command(
+        qemu, "python3 /build/tmp/lit_command_server.py --port {port} --jobs {jobs} > /tmp/lit-command-server.log "
+              "2>&1 & echo $! > /tmp/lit-command-server.pid".format(port=COMMAND_SERVER_GUEST_PORT,
+                                                                     jobs=args.lit_jobs_per_guest), timeout=20)
+    free_port = boot_cheribsd.find_free_port()
+    free_port.socket.close()
+    # Forward a local port to the server using the existing SSH config (and controlmaster if it is running)
+    forward_cmd = ["ssh", "-F", str(Path(tempdir, "config")), "-N", "-L",
+                   "{}:127.0.0.1:{}".format(free_port.port, COMMAND_SERVER_GUEST_PORT), "cheribsd-test-instance"]
+    boot_cheribsd.info("\033[0;33mRunning ", " ".join(forward_cmd), "\033[0m")
+    if args.pretend:
+        return CommandServerTunnel(free_port.port, None)
+    tunnel = CommandServerTunnel(free_port.port, subprocess.Popen(forward_cmd, stdin=subprocess.DEVNULL))
+    import lit_command_executor
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        # The local forwarding port accepts connections before the server has started -> check that commands work
+        try:
+            client = lit_command_executor.CommandServerClient("127.0.0.1", free_port.port)
+            try:
+                if client.run(["true"], timeout=20).exit_code == 0:
+                    boot_cheribsd.success("Command server is running in the guest")
+                    return tunnel
+            finally:
+                client.close()
+        except (OSError, ConnectionError):
+            pass
+        time.sleep(1)
+    boot_cheribsd.failure("Could not connect to the command server, falling back to the SSH executor", exit=False)
+    tunnel.stop(qemu)
+    return None
 
 
 def run_remote_lit_tests(testsuite: str, qemu: boot_cheribsd.CheriBSDInstance, args: argparse.Namespace, tempdir: str,
@@ -202,29 +246,42 @@ Host cheribsd-test-instance
     if args.pretend:
         time.sleep(2.5)
 
-    if False:
-        # slow executor using scp:
-        executor = 'SSHExecutor("localhost", username="{user}", port={port})'.format(user=user, port=port)
-    executor = 'SSHExecutorWithNFSMount("cheribsd-test-instance", username="{user}", port={port}, nfs_dir="{' \
-               'host_dir}", ' \
-               'path_in_target="/build/tmp", extra_ssh_flags=["-F", "{tempdir}/config", "-n", "-4"], ' \
-               'extra_scp_flags=["-F", "{tempdir}/config"])'.format(user=user, port=port,
-                                                                    host_dir=str(test_build_dir / "tmp"),
-                                                                    tempdir=tempdir)
+    ssh_executor = 'SSHExecutorWithNFSMount("cheribsd-test-instance", username="{user}", port={port}, nfs_dir="{' \
+                   'host_dir}", ' \
+                   'path_in_target="/build/tmp", extra_ssh_flags=["-F", "{tempdir}/config", "-n", "-4"], ' \
+                   'extra_scp_flags=["-F", "{tempdir}/config"])'.format(user=user, port=port,
+                                                                        host_dir=str(test_build_dir / "tmp"),
+                                                                        tempdir=tempdir)
+    lit_jobs = 1  # have to use -j1 with the SSH executor since otherwise CheriBSD might wedge
+    lit_env = None
+    command_server = None
+    if getattr(args, "lit_executor", "ssh") == "command-server":
+        command_server = start_command_server(qemu, args, tempdir, test_build_dir)
+    if command_server is not None:
+        lit_jobs = args.lit_jobs_per_guest
+        executor = '__import__("lit_command_executor").CommandServerExecutor("127.0.0.1", {local_port}, ' \
+                   'nfs_dir="{host_dir}", path_in_target="/build/tmp", timeout={timeout}, config=self)'.format(
+                       local_port=command_server.local_port, host_dir=str(test_build_dir / "tmp"),
+                       timeout=LIT_TEST_TIMEOUT)
+        # lit needs to be able to import lit_command_executor
+        lit_env = os.environ.copy()
+        lit_env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).parent),
+                                                              os.getenv("PYTHONPATH")]))
+    else:
+        executor = ssh_executor
     # TODO: I was previously passing -t -t to ssh. Is this actually needed?
     boot_cheribsd.success("Running", testsuite, "tests with executor", executor)
     notify_main_process(args, MultiprocessStages.RUNNING_TESTS, mp_q)
-    # have to use -j1 since otherwise CheriBSD might wedge
     if llvm_lit_path is None:
         llvm_lit_path = str(test_build_dir / "bin/llvm-lit")
     # Note: we require python 3 since otherwise it seems to deadlock in Jenkins
-    lit_cmd = ["python3", llvm_lit_path, "-j1", "-vv", "-Dexecutor=" + executor, "test"]
+    lit_cmd = ["python3", llvm_lit_path, "-j" + str(lit_jobs), "-vv", "-Dexecutor=" + executor]
     if lit_extra_args:
         lit_cmd.extend(lit_extra_args)
     if args.lit_debug_output:
         lit_cmd.append("--debug")
     # This does not work since it doesn't handle running ssh commands....
-    lit_cmd.append("--timeout=120")  # 2 minutes max per test (in case there is an infinite loop)
+    lit_cmd.append("--timeout=" + str(LIT_TEST_TIMEOUT))  # 2 minutes max per test (in case there is an infinite loop)
     xunit_file = None  # type: Path
     if args.xunit_output:
         lit_cmd.append("--xunit-xml-output")
@@ -233,42 +290,61 @@ Host cheribsd-test-instance
             xunit_file = xunit_file.with_name("shard-" + str(args.internal_shard) + "-" + xunit_file.name)
         lit_cmd.append(str(xunit_file))
     qemu_logfile = qemu.logfile
+    lit_targets = ["test"]
+    if getattr(args, "only_tests_file", None):
+        lit_targets = Path(args.only_tests_file).read_text().splitlines()
     if args.internal_shard:
         assert args.internal_num_shards, "Invalid call!"
-        lit_cmd.append("--num-shards=" + str(args.internal_num_shards))
-        lit_cmd.append("--run-shard=" + str(args.internal_shard))
+        shard_tests_file = getattr(args, "internal_shard_tests_file", None)
+        if shard_tests_file:
+            # The main process has assigned tests to shards based on their recorded durations
+            lit_targets = Path(shard_tests_file).read_text().splitlines()
+            boot_cheribsd.info("Running ", len(lit_targets), " tests assigned to this shard")
+        else:
+            lit_cmd.append("--num-shards=" + str(args.internal_num_shards))
+            lit_cmd.append("--run-shard=" + str(args.internal_shard))
         if xunit_file:
             assert qemu_logfile is not None, "Should have a valid logfile when running multiple shards"
             boot_cheribsd.success("Writing QEMU output to ", qemu_logfile)
-    # Fixme starting lit at the same time does not work!
-    # TODO: add the polling to the main thread instead of having another thread?
-    # start the qemu output flushing thread so that we can see the kernel panic
-    qemu.flush_interval = 15  # flush the logfile every 15 seconds
-    should_exit_event = threading.Event()
-    t = threading.Thread(target=flush_thread, args=(qemu_logfile, qemu, should_exit_event))
-    t.daemon = True
-    t.start()
+    lit_cmd.extend(lit_targets)
+    # Watch the QEMU console while lit is running so that we can abort as soon as the kernel panics
+    console_monitor = boot_cheribsd.ConsoleMonitor(flush_interval=15)
+    console_monitor.add("qemu", qemu)
+    console_monitor.start()
     shard_prefix = "SHARD" + str(args.internal_shard) + ": " if args.internal_shard else ""
+    kernel_panic = False
+    lit_proc = None
     try:
-        boot_cheribsd.success("Starting llvm-lit: cd ", test_build_dir, " && ", " ".join(lit_cmd))
-        boot_cheribsd.run_host_command(lit_cmd, cwd=str(test_build_dir))
-        # lit_proc = pexpect.spawnu(lit_cmd[0], lit_cmd[1:], echo=True, timeout=60, cwd=str(test_build_dir))
-        # TODO: get stderr!!
-        # while lit_proc.isalive():
-        lit_proc = None
-        while False:
-            line = lit_proc.readline()
-            if shard_prefix:
-                line = shard_prefix + line
-            print(line)
-            global KERNEL_PANIC
-            # Abort once we detect a kernel panic
-            if KERNEL_PANIC:
-                lit_proc.sendintr()
-            print(shard_prefix + lit_proc.read())
+        printed_cmd = lit_cmd if len(lit_targets) == 1 else lit_cmd[:-len(lit_targets)] + [
+            "<" + str(len(lit_targets)) + " tests>"]
+        boot_cheribsd.success("Starting llvm-lit: cd ", test_build_dir, " && ", " ".join(printed_cmd))
+        if args.pretend:
+            lit_proc = None
+        else:
+            lit_proc = subprocess.Popen(lit_cmd, cwd=str(test_build_dir), env=lit_env)
+        while lit_proc is not None and lit_proc.poll() is None:
+            try:
+                event = console_monitor.events.get(timeout=1)
+            except queue.Empty:
+                continue
+            if event.kind == boot_cheribsd.ConsoleMonitor.PANIC:
+                boot_cheribsd.failure(shard_prefix + "GOT KERNEL PANIC (", event.text, ")! Aborting lit.", exit=False)
+                kernel_panic = True
+            elif event.kind == boot_cheribsd.ConsoleMonitor.EOF:
+                boot_cheribsd.failure(shard_prefix + "GOT QEMU EOF!", exit=False)
+            else:
+                continue  # CHERI traps are expected for some tests
+            lit_proc.send_signal(signal.SIGINT)
+            try:
+                lit_proc.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                lit_proc.kill()
+                lit_proc.wait()
         print("Lit finished.")
-        if lit_proc and lit_proc.exitstatus == 1:
-            boot_cheribsd.failure(shard_prefix + "SOME TESTS FAILED", exit=False)
+        if kernel_panic:
+            return False
+        if lit_proc is not None and lit_proc.returncode != 0:
+            raise subprocess.CalledProcessError(lit_proc.returncode, lit_cmd)
     except subprocess.CalledProcessError as e:
         boot_cheribsd.failure(shard_prefix + "SOME TESTS FAILED: ", e, exit=False)
         # Should only ever return 1 (otherwise something else went wrong!)
@@ -279,6 +355,9 @@ Host cheribsd-test-instance
     finally:
         if qemu_logfile:
             qemu_logfile.flush()
+        # Sharded runs are recorded by the main process once the shard results have been merged
+        if lit_proc is not None and xunit_file and xunit_file.exists() and not args.internal_shard:
+            record_junit_results(args, xunit_file, testsuite)
         if controlmaster_running:
             boot_cheribsd.info("Terminating SSH controlmaster")
             try:
@@ -287,12 +366,16 @@ Host cheribsd-test-instance
                      "exit"], cwd=str(test_build_dir))
             except subprocess.CalledProcessError:
                 boot_cheribsd.failure("Could not close SSH controlmaster connection.", exit=False)
-        qemu.flush_interval = 0.1
-        should_exit_event.set()
-        t.join(timeout=30)
-        if t.is_alive():
-            boot_cheribsd.failure("Failed to kill flush thread. Interacting with CheriBSD will not work!", exit=True)
+        if not console_monitor.stop():
+            boot_cheribsd.failure("Failed to stop console monitor. Interacting with CheriBSD will not work!", exit=True)
             return False
+        if command_server is not None:
+            # Don't try to run commands if the kernel is sitting in the debugger
+            command_server.stop(None if kernel_panic else qemu)
+        if kernel_panic:
+            # The db> prompt has already been consumed by the monitor so request the backtrace directly
+            qemu.sendline("bt")
+            qemu.expect([pexpect.TIMEOUT, "db> "], timeout=30)
         if not qemu.isalive():
             boot_cheribsd.failure("QEMU died while running tests! ", qemu, exit=True)
     return True
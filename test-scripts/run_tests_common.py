@@ -43,8 +43,33 @@ sys.path.insert(1, str(_cheribuild_root))
 import junitparser
 import pexpect
 from pycheribuild import boot_cheribsd
+import results_database
 
-__all__ = ["run_tests_main", "boot_cheribsd", "junitparser", "pexpect"]
+__all__ = ["run_tests_main", "boot_cheribsd", "junitparser", "pexpect", "add_test_results_db_args",
+           "record_junit_results"]
+
+
+def add_test_results_db_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--test-results-db", default=str(results_database.default_database_path()), metavar="DB",
+                        help="sqlite database that the JUnit results are added to (used to schedule long running "
+                             "tests first and to detect flaky tests). Pass an empty string to disable.")
+
+
+def record_junit_results(args: argparse.Namespace, xml_path: Path, suite: str):
+    db_path = getattr(args, "test_results_db", None)
+    if not db_path or boot_cheribsd.PRETEND:
+        return
+    try:
+        with results_database.TestResultsDatabase(Path(db_path)) as db:
+            db.ingest_junit(xml_path, suite)
+            flaky = db.flaky_tests(suite)
+    except Exception as e:  # Don't fail the test run just because the database could not be updated
+        boot_cheribsd.failure("Could not add ", xml_path, " to test results database ", db_path, ": ", e, exit=False)
+        return
+    boot_cheribsd.info("Added ", xml_path, " to test results database ", db_path)
+    if flaky:
+        boot_cheribsd.info("The following ", suite, " tests were flaky in recent runs: ",
+                           ", ".join(test for test, _, _ in flaky))
 
 
 def run_tests_main(test_function: Callable[[boot_cheribsd.CheriBSDInstance, argparse.Namespace], bool] = None,
@@ -59,6 +84,7 @@ def run_tests_main(test_function: Callable[[boot_cheribsd.CheriBSDInstance, argp
         parser.add_argument("--sysroot-dir", required=should_mount_sysroot)
         parser.add_argument("--install-destdir", required=should_mount_installdir)
         parser.add_argument("--install-prefix", required=should_mount_installdir)
+        add_test_results_db_args(parser)
         if argparse_setup_callback:
             argparse_setup_callback(parser)
         if not need_ssh:
@@ -46,6 +46,7 @@ class MockConfig(CheriConfig):
         self.force_update = False
         self.force = True
         self.write_logfile = True
+        self.background_delete = False
         self.test_extra_args = []
         self.load()
 
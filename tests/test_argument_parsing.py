@@ -486,3 +486,59 @@ def test_default_arch(target: str, args: list, expected: str):
     builddir = target.get_or_create_project(None, config).buildDir
     assert isinstance(builddir, Path)
     assert builddir.name == expected
+
+
+def test_llvm_pgo_pretend(monkeypatch):
+    import subprocess
+    import pycheribuild.projects.llvm as llvm_module
+    import pycheribuild.utils
+
+    class FakeClangInfo(object):
+        compiler = "clang"
+        is_clang = True
+        version = (9, 0, 0)
+
+        @staticmethod
+        def get_matching_binutil(name):
+            return Path("/fake/bin", name)
+
+    monkeypatch.setattr(llvm_module, "getCompilerInfo", lambda compiler: FakeClangInfo())
+    with tempfile.TemporaryDirectory() as tmp:
+        source_root = Path(tmp, "src")
+        config = _parse_arguments(["--pretend", "--source-root=" + str(source_root),
+                                   "--output-root=" + str(Path(tmp, "output"))])
+        monkeypatch.setattr(pycheribuild.utils, "_cheriConfig", config)  # runCmd() checks the global pretend flag
+        project = targetManager.get_target_raw("llvm-pgo").get_or_create_project(None, config)
+        for f in ("libcxx/src/string.cpp", "libcxx/src/vector.cpp"):
+            Path(project.sourceDir, f).parent.mkdir(parents=True, exist_ok=True)
+            Path(project.sourceDir, f).write_text("")
+        clang = Path("/instrumented/bin/clang")
+        # Without a CHERI sysroot only the host libc++ sources are compiled
+        commands = project._pgo_training_commands(clang)
+        assert [(c[0], c[-1]) for c in commands] == [
+            ("/instrumented/bin/clang++", str(project.sourceDir / "libcxx/src/string.cpp")),
+            ("/instrumented/bin/clang++", str(project.sourceDir / "libcxx/src/vector.cpp"))]
+        assert "-nostdinc++" in commands[0] and "-target" not in commands[0]
+        # With a sysroot the sources are also compiled for CHERI, as is the CheriBSD libc
+        (config.cheriSysrootDir / "usr/include").mkdir(parents=True)
+        libc_source = source_root / "cheribsd/lib/libc/string/strlen.c"
+        libc_source.parent.mkdir(parents=True)
+        libc_source.write_text("")
+        commands = project._pgo_training_commands(clang)
+        assert len(commands) == 5
+        assert commands[1][1:3] == ["-target", "mips64-unknown-freebsd13"]
+        assert commands[-1][0] == str(clang) and commands[-1][-1] == str(libc_source)
+        assert "-mabi=purecap" in commands[-1]
+
+        # The profile and ThinLTO options are passed to CMake
+        project.configure()
+        assert "-DLLVM_PROFDATA_FILE=" + str(project.cached_profile) in project.configureArgs
+        assert "-DLLVM_ENABLE_LTO=Thin" in project.configureArgs
+        assert "-DCMAKE_AR=/fake/bin/llvm-ar" in project.configureArgs
+
+        # The cached profile is invalidated when the llvm-project revision changes
+        subprocess.check_call(["git", "init", "-q", str(project.sourceDir)])
+        subprocess.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q",
+                               "--allow-empty", "-m", "initial"], cwd=str(project.sourceDir))
+        head = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(project.sourceDir)).decode().strip()
+        assert project._pgo_profile_id() == project._host_toolchain_id() + "\n" + head
@@ -201,6 +201,29 @@ class TestAsyncDelete(TestCase):
         self._assertDirEmpty(self.project.buildDir)  # dir should still be empty
         self.assertFalse(moved_builddir.exists())  # tempdir should be deleted now
 
+    def test_background_delete(self):
+        from pycheribuild.filesystemutils import background_deleter, TRASH_DIRNAME
+        self.config.background_delete = True
+        self.config.background_delete_detach = False
+        trash = self.config.buildRoot / TRASH_DIRNAME
+        os.makedirs(str(self.project.buildDir / "subdir" / "nested"))
+        (self.project.buildDir / "keep").mkdir()
+        with self.project.asyncCleanDirectory(self.project.buildDir, keepRoot=True, keep_dirs=["keep"]):
+            # The contents should have been moved to the trash directory immediately
+            self._assertNumFiles(self.project.buildDir, 1)
+            self.assertTrue((self.project.buildDir / "keep").is_dir())
+            self._assertNumFiles(trash, 1)
+        background_deleter.wait()
+        self._assertDirEmpty(trash)
+        self.assertEqual(background_deleter.pending(), [])
+
+        # without keepRoot the directory should be moved and recreated
+        (self.project.buildDir / "subdir").mkdir()
+        with self.project.asyncCleanDirectory(self.project.buildDir):
+            self._assertDirEmpty(self.project.buildDir)
+        background_deleter.wait()
+        self._assertDirEmpty(trash)
+        self._assertDirEmpty(self.project.buildDir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.cross.crosscompileproject import CrossCompileMixin
+from pycheribuild.projects.project import Project, SourceRepository
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+
+# noinspection PyTypeChecker
+class MockBenchmarkProject(Project):
+    doNotAddToTargets = True
+    projectName = "fake-benchmark"
+    target = "fake-benchmark"
+    split_benchmark_work = CrossCompileMixin.split_benchmark_work
+    merge_statcounters_csvs = CrossCompileMixin.merge_statcounters_csvs
+
+    def __init__(self, config):
+        self.sourceDir = config.sourceRoot / "fake-benchmark"
+        self.buildDir = config.buildRoot / "fake-benchmark-build"
+        self.installDir = config.outputRoot / "fake-benchmark"
+        self.repository = SourceRepository()
+        super().__init__(config)
+
+
+@pytest.fixture
+def project():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = setup_mock_chericonfig(Path(tmp))
+        config.pretend = False
+        config.benchmark_with_qemu = True
+        MockBenchmarkProject.setupConfigOptions()
+        yield MockBenchmarkProject(config)
+
+
+def test_split_benchmark_iterations(project):
+    project.config.benchmark_qemu_instances = 3
+    assert project.split_benchmark_work(10) == [(4, None), (3, None), (3, None)]
+    # Never more guests than iterations
+    assert project.split_benchmark_work(2) == [(1, None), (1, None)]
+    # Not enough benchmarks to keep all guests busy -> split the iterations
+    assert project.split_benchmark_work(4, ["a", "b"]) == [(2, ["a", "b"]), (1, ["a", "b"]), (1, ["a", "b"])]
+    project.config.benchmark_qemu_instances = 1
+    assert project.split_benchmark_work(10) == [(10, None)]
+    # Only one instance unless we are running on QEMU
+    project.config.benchmark_qemu_instances = 4
+    project.config.benchmark_with_qemu = False
+    assert project.split_benchmark_work(10, ["a", "b", "c"]) == [(10, ["a", "b", "c"])]
+
+
+def test_split_benchmarks(project):
+    project.config.benchmark_qemu_instances = 2
+    assert project.split_benchmark_work(5, ["a", "b", "c"]) == [(5, ["a", "c"]), (5, ["b"])]
+    project.config.benchmark_qemu_instances = 3
+    assert project.split_benchmark_work(5, ["a", "b", "c"]) == [(5, ["a"]), (5, ["b"]), (5, ["c"])]
+
+
+def test_merge_statcounters_csvs(project):
+    tmp = project.config.sourceRoot
+    Path(tmp, "guest-0.csv").write_text("progname,cycles\nfoo,10\nfoo,11\n")
+    Path(tmp, "guest-1.csv").write_text("progname,cycles\nfoo,12\n\n")
+    output = Path(tmp, "merged.csv")
+    project.merge_statcounters_csvs([Path(tmp, "guest-0.csv"), Path(tmp, "guest-1.csv")], output)
+    assert output.read_text() == "progname,cycles\nfoo,10\nfoo,11\nfoo,12\n"
+    # The columns of all files must match
+    Path(tmp, "guest-2.csv").write_text("progname,instructions\nfoo,5\n")
+    with pytest.raises(SystemExit):
+        project.merge_statcounters_csvs([Path(tmp, "guest-0.csv"), Path(tmp, "guest-2.csv")], output)
+    with pytest.raises(SystemExit):
+        project.merge_statcounters_csvs([Path(tmp, "guest-0.csv"), Path(tmp, "missing.csv")], output)
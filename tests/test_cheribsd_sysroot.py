@@ -0,0 +1,97 @@
+import os
+import sys
+import tarfile
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.config.chericonfig import CrossCompileTarget
+from pycheribuild.projects.cross.cheribsd import BuildCheriBsdSysroot
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+METALOG = """#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/sh type=file uname=root gname=wheel mode=0555
+./lib type=dir uname=root gname=wheel mode=0755
+./lib/libc.so.7 type=file uname=root gname=wheel mode=0444
+./usr type=dir uname=root gname=wheel mode=0755
+./usr/include type=dir uname=root gname=wheel mode=0755
+./usr/include/stdio.h type=file uname=root gname=wheel mode=0444
+./usr/lib type=dir uname=root gname=wheel mode=0755
+./usr/lib/libc.so type=link uname=root gname=wheel mode=0755 link=/lib/libc.so.7
+./usr/lib/libfoo.a type=file uname=root gname=wheel mode=0444
+./usr/lib/libfoo_p.a type=hlink uname=root gname=wheel mode=0444 link=/usr/lib/libfoo.a
+"""
+
+
+# noinspection PyTypeChecker
+class MockSysroot(BuildCheriBsdSysroot):
+    doNotAddToTargets = True
+    projectName = "fake-sysroot"
+    target = "fake-sysroot"
+    _crossCompileTarget = CrossCompileTarget.CHERI
+    _should_not_be_instantiated = False
+
+    def _rootfs_dir(self) -> Path:
+        return self.config.sourceRoot / "rootfs"
+
+
+@pytest.fixture
+def sysroot_project():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = setup_mock_chericonfig(Path(tmp))
+        config.pretend = False
+        config.clean = False
+        config.force = False
+        rootfs = Path(tmp, "rootfs")
+        for d in ("bin", "lib", "usr/include", "usr/lib"):
+            (rootfs / d).mkdir(parents=True)
+        (rootfs / "METALOG").write_text(METALOG)
+        (rootfs / "bin/sh").write_text("sh")
+        (rootfs / "lib/libc.so.7").write_text("libc")
+        (rootfs / "usr/include/stdio.h").write_text("stdio")
+        (rootfs / "usr/lib/libc.so").symlink_to("/lib/libc.so.7")
+        (rootfs / "usr/lib/libfoo.a").write_text("libfoo")
+        os.link(str(rootfs / "usr/lib/libfoo.a"), str(rootfs / "usr/lib/libfoo_p.a"))
+        MockSysroot.setupConfigOptions()
+        yield MockSysroot(config)
+
+
+def test_create_sysroot_from_metalog(sysroot_project):
+    sysroot = sysroot_project.crossSysrootPath
+    assert not sysroot_project.sysroot_is_up_to_date()
+    sysroot_project.createSysroot()
+    assert (sysroot / "lib/libc.so.7").read_text() == "libc"
+    assert (sysroot / "usr/include/stdio.h").read_text() == "stdio"
+    # Only the sysroot directories are copied
+    assert not (sysroot / "bin").exists()
+    # Absolute symlinks are made relative to the sysroot
+    assert os.readlink(str(sysroot / "usr/lib/libc.so")) == "../../lib/libc.so.7"
+    # type=hlink entries are installed as well
+    assert (sysroot / "usr/lib/libfoo_p.a").read_text() == "libfoo"
+    with tarfile.open(str(sysroot_project.sysroot_archive)) as archive:
+        members = {m.name: m for m in archive.getmembers()}
+    prefix = sysroot.name + "/"
+    assert sorted(members) == sorted([sysroot.name] + [prefix + p for p in (
+        "lib", "lib/libc.so.7", "usr/include", "usr/include/stdio.h", "usr/lib", "usr/lib/libc.so",
+        "usr/lib/libfoo.a", "usr/lib/libfoo_p.a")])
+    assert members[prefix + "usr/lib/libc.so"].issym()
+    assert members[prefix + "lib/libc.so.7"].mode == 0o444
+    assert sysroot_project.sysroot_is_up_to_date()
+
+
+def test_sysroot_out_of_date_if_metalog_file_missing(sysroot_project):
+    sysroot_project.createSysroot()
+    assert sysroot_project.sysroot_is_up_to_date()
+    # Changes to the source files are detected
+    (sysroot_project._rootfs_dir() / "usr/include/stdio.h").write_text("stdio changed")
+    assert not sysroot_project.sysroot_is_up_to_date()
+    sysroot_project.createSysroot()
+    assert sysroot_project.sysroot_is_up_to_date()
+    # A file listed in METALOG that doesn't exist makes the sysroot out of date instead of raising an error
+    (sysroot_project._rootfs_dir() / "usr/lib/libfoo_p.a").unlink()
+    assert not sysroot_project.sysroot_is_up_to_date()
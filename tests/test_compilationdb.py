@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.compilationdb import load_compilation_db, merge_compilation_db_fragments
+from pycheribuild.projects.project import AutotoolsProject, Project, SourceRepository
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+WRAPPER = Path(__file__).parent.parent / "pycheribuild/files/compdb-wrapper.py"
+
+
+def _compile(fragments: Path, cwd: Path, *args):
+    fake_ccache = cwd / "bin/ccache"
+    if not fake_ccache.exists():
+        fake_ccache.parent.mkdir()
+        fake_ccache.write_text("#!/bin/sh\nexec \"$@\"\n")
+        fake_ccache.chmod(0o755)
+    env = dict(os.environ, CHERIBUILD_COMPDB_DIR=str(fragments), PATH=str(fake_ccache.parent) + ":" + os.getenv("PATH"))
+    # use true as the compiler so that we don't need a working C compiler
+    subprocess.check_call([sys.executable, str(WRAPPER), "ccache", "true"] + list(args), cwd=str(cwd), env=env)
+
+
+def test_incremental_merge():
+    with tempfile.TemporaryDirectory() as td:
+        build = Path(td)
+        fragments = build / ".fragments"
+        fragments.mkdir()
+        db = build / "compile_commands.json"
+        _compile(fragments, build, "-c", "a.c", "-o", "a.o")
+        _compile(fragments, build, "-c", "b.c", "-o", "b.o", "-DFOO")
+        _compile(fragments, build, "a.o", "b.o", "-o", "prog")  # link steps are ignored
+        assert merge_compilation_db_fragments(db, fragments) == (2, 2)
+        assert list(fragments.iterdir()) == []
+        entries = load_compilation_db(db)
+        assert [e["output"] for e in entries] == [str(build / "a.o"), str(build / "b.o")]
+        # ccache is not part of the recorded command
+        assert entries[1]["arguments"] == ["true", "-c", "b.c", "-o", "b.o", "-DFOO"]
+        assert entries[1]["file"] == str(build / "b.c")
+
+        # Recompiling b.c only updates that entry and compiling b.c to a different object file adds a new one
+        _compile(fragments, build, "-c", "b.c", "-o", "b.o", "-DBAR")
+        _compile(fragments, build, "-c", "b.c", "-o", "lib32/b.o")
+        assert merge_compilation_db_fragments(db, fragments) == (2, 3)
+        entries = {e["output"]: e for e in load_compilation_db(db)}
+        assert entries[str(build / "a.o")]["arguments"][-1] == "a.o"
+        assert entries[str(build / "b.o")]["arguments"][-1] == "-DBAR"
+        assert str(build / "lib32/b.o") in entries
+        # nothing changed -> the file is not rewritten
+        mtime = db.stat().st_mtime_ns
+        assert merge_compilation_db_fragments(db, fragments) == (0, 3)
+        assert db.stat().st_mtime_ns == mtime
+        assert isinstance(json.loads(db.read_text()), list)
+
+
+# A minimal configure script that (like autoconf) stores $CC in the generated Makefile
+FAKE_CONFIGURE = """#!/bin/sh
+printf 'all:\\n\\t%s -c $(SRCDIR)/foo.c -o foo.o\\n' "$CC" > Makefile
+echo "SRCDIR=$(dirname "$0")" >> Makefile
+"""
+
+
+class MockAutotoolsProject(AutotoolsProject):
+    doNotAddToTargets = True
+    projectName = "fake-autotools"
+    target = "fake-autotools"
+    defaultInstallDir = AutotoolsProject._installToBootstrapTools
+
+    def __init__(self, config):
+        self.sourceDir = config.sourceRoot / "fake-autotools"
+        self.buildDir = config.buildRoot / "fake-autotools-build"
+        self.repository = SourceRepository()
+        super().__init__(config)
+
+
+class MockMakeProject(Project):
+    doNotAddToTargets = True
+    projectName = "fake-make"
+    target = "fake-make"
+
+    def __init__(self, config):
+        self.sourceDir = config.sourceRoot / "fake-make"
+        self.buildDir = config.buildRoot / "fake-make-build"
+        self.installDir = config.outputRoot / "fake-make"
+        self.repository = SourceRepository()
+        super().__init__(config)
+
+
+@pytest.fixture
+def compdb_config():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = setup_mock_chericonfig(Path(tmp))
+        config.pretend = False
+        config.create_compilation_db = True
+        config.compilation_db_tool = "wrapper"
+        config.passDashKToMake = False
+        yield config
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="requires a C compiler")
+def test_native_autotools_compilation_db(compdb_config):
+    MockAutotoolsProject.setupConfigOptions()
+    project = MockAutotoolsProject(compdb_config)
+    assert project._compiledb_tool == "wrapper"
+    project.sourceDir.mkdir(parents=True)
+    project.buildDir.mkdir(parents=True)
+    (project.sourceDir / "foo.c").write_text("int foo(void) { return 1; }\n")
+    (project.sourceDir / "configure").write_text(FAKE_CONFIGURE)
+    (project.sourceDir / "configure").chmod(0o755)
+    project.configure()
+    assert project.configureEnvironment["CC"].startswith(str(project._compdb_wrapper_path) + " ")
+    project.compile()
+    assert (project.buildDir / "foo.o").exists()
+    entries = load_compilation_db(project.buildDir / "compile_commands.json")
+    assert len(entries) == 1
+    assert entries[0]["file"] == str(project.sourceDir / "foo.c")
+    assert entries[0]["output"] == str(project.buildDir / "foo.o")
+    assert entries[0]["arguments"][0] == os.getenv("CC", "cc")
+
+
+def test_make_project_falls_back_to_bear(compdb_config):
+    # The compiler used by plain make projects can't be overridden -> the wrapper would never be called
+    MockMakeProject.setupConfigOptions()
+    project = MockMakeProject(compdb_config)
+    assert project._compiledb_tool == "bear"
+    assert project.compiler_launcher == []
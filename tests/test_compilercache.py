@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.compilercache import (CompilerCacheStats, parse_ccache_print_stats, parse_ccache_show_stats,
+                                        parse_sccache_stats)
+
+
+def test_parse_ccache_stats():
+    print_stats = "stats_updated_timestamp\t1580000000\ndirect_cache_hit\t10\npreprocessed_cache_hit\t5\n" \
+                  "cache_miss\t7\ncalled_for_link\t3\n"
+    assert parse_ccache_print_stats(print_stats) == CompilerCacheStats(15, 7)
+    assert parse_ccache_print_stats("ccache: invalid option -- '-print-stats'") is None
+    show_stats = """cache directory                     /home/user/.ccache
+primary config                      /home/user/.ccache/ccache.conf
+cache hit (direct)                    12
+cache hit (preprocessed)               3
+cache miss                             4
+cache hit rate                     78.95 %
+"""
+    assert parse_ccache_show_stats(show_stats) == CompilerCacheStats(15, 4)
+
+
+def test_parse_sccache_stats():
+    output = '{"stats": {"compile_requests": 20, "cache_hits": {"counts": {"C/C++": 9, "Rust": 1}},' \
+             ' "cache_misses": {"counts": {"C/C++": 4}}}}'
+    assert parse_sccache_stats(output) == CompilerCacheStats(10, 4)
+    assert parse_sccache_stats('{"stats": {"cache_hits": 3, "cache_misses": 2}}') == CompilerCacheStats(3, 2)
+    assert parse_sccache_stats("not json") is None
@@ -0,0 +1,59 @@
+import io
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+import pexpect
+from pycheribuild.boot_cheribsd import ConsoleMonitor
+
+
+class FakeConsole(object):
+    """Behaves like the pexpect.spawn object for a QEMU console but reads from a pipe"""
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        self.logfile = io.StringIO()
+        self.logfile_read = None
+
+    def fileno(self):
+        return self._read_fd
+
+    def read_nonblocking(self, size, timeout):
+        data = os.read(self._read_fd, size)
+        if not data:
+            raise pexpect.EOF("EOF")
+        self.logfile.write(data.decode("utf-8"))
+        return data.decode("utf-8")
+
+    def write(self, text: str):
+        os.write(self._write_fd, text.encode("utf-8"))
+
+    def close(self):
+        os.close(self._write_fd)
+
+
+def _next_event(monitor: ConsoleMonitor):
+    return monitor.events.get(timeout=5)
+
+
+def test_console_monitor_events():
+    a = FakeConsole()
+    b = FakeConsole()
+    monitor = ConsoleMonitor(flush_interval=0.1)
+    monitor.add("a", a)
+    monitor.add("b", b)
+    with monitor:
+        a.write("booting...\nUSER_CHERI_EXCEPTION: pid 12 tid 100123 (test)\n")
+        event = _next_event(monitor)
+        assert event.kind == ConsoleMonitor.TRAP and event.console == "a"
+        # signatures split across two reads must still be detected
+        b.write("some output\npanic: tr")
+        b.write("ap (non-fatal)\n")
+        event = _next_event(monitor)
+        assert event == (ConsoleMonitor.PANIC, "b", "panic: trap")
+        a.close()
+        assert _next_event(monitor) == (ConsoleMonitor.EOF, "a", "")
+        b.close()
+        assert _next_event(monitor) == (ConsoleMonitor.EOF, "b", "")
+    assert monitor.events.empty()
+    assert "panic: trap (non-fatal)" in b.logfile.getvalue()
@@ -0,0 +1,81 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.dockercontainer import (PersistentDockerContainer, DOCKER_LABEL_CONFIG_HASH, DOCKER_LABEL_IMAGE_ID,
+                                          default_persistent_container_name)
+
+
+class FakeDockerContainer(PersistentDockerContainer):
+    """Simulates the docker CLI for a single container"""
+    def __init__(self, image_id="sha256:1234", **kwargs):
+        super().__init__("cheribuild-test", "cheribuild-persistent-test",
+                         mounts=[("/src", "/source", True), ("/b", "/build", False)], **kwargs)
+        self.current_image_id = image_id
+        self.container = None
+        self.commands = []
+
+    def _docker(self, *args, capture=False, check=True):
+        self.commands.append(args[0])
+        stdout = b""
+        returncode = 0
+        if args[:2] == ("image", "inspect"):
+            stdout = self.current_image_id.encode("utf-8")
+        elif args[:2] == ("container", "inspect"):
+            if self.container is None:
+                returncode = 1
+            else:
+                stdout = json.dumps([self.container]).encode("utf-8")
+        elif args[0] == "run":
+            labels = dict(args[i + 1].split("=", 1) for i, a in enumerate(args) if a == "--label")
+            self.container = {"Image": self.current_image_id, "Config": {"Labels": labels},
+                              "State": {"Running": True}}
+        elif args[0] == "rm":
+            self.container = None
+        elif args[0] == "start":
+            self.container["State"]["Running"] = True
+        elif args[0] == "exec":
+            returncode = 0 if self.container and self.container["State"]["Running"] else 1
+        return subprocess.CompletedProcess(list(args), returncode, stdout, b"")
+
+
+def test_create_and_reuse():
+    docker = FakeDockerContainer()
+    docker.ensure_running()
+    assert docker.commands.count("run") == 1
+    assert docker.container["Config"]["Labels"] == {DOCKER_LABEL_IMAGE_ID: "sha256:1234",
+                                                    DOCKER_LABEL_CONFIG_HASH: docker.config_hash}
+    # Second invocation should only perform the health check
+    docker.commands.clear()
+    docker.ensure_running()
+    assert "run" not in docker.commands and "rm" not in docker.commands
+    # A stopped container is restarted rather than recreated
+    docker.container["State"]["Running"] = False
+    docker.commands.clear()
+    docker.ensure_running()
+    assert "start" in docker.commands and "run" not in docker.commands
+
+
+def test_recreate_on_change():
+    docker = FakeDockerContainer()
+    docker.ensure_running()
+    docker.current_image_id = "sha256:5678"
+    assert docker.needs_recreate(docker.container, docker.current_image_id) is not None
+    docker.commands.clear()
+    docker.ensure_running()
+    assert docker.commands.count("rm") == 1 and docker.commands.count("run") == 1
+    assert docker.container["Image"] == "sha256:5678"
+    # changing the mounts must also create a new container
+    docker.mounts = docker.mounts + [("/out", "/output", False)]
+    assert docker.needs_recreate(docker.container, docker.current_image_id) == "the directory mappings have changed"
+
+
+def test_exec_command():
+    docker = FakeDockerContainer()
+    cmd = docker.exec_command(["/cheribuild/cheribuild.py", "qemu"], workdir="/build")
+    assert cmd[:2] == ["docker", "exec"]
+    assert cmd[-3:] == ["cheribuild-persistent-test", "/cheribuild/cheribuild.py", "qemu"]
+    assert default_persistent_container_name("ctsrd/cheribuild:latest") == "cheribuild-persistent-ctsrd-cheribuild-latest"
@@ -0,0 +1,111 @@
+import os
+import stat
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.filesystemutils import FileSystemUtils
+
+
+def test_delete_tree():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp, "tree")
+        (root / "a/b/c").mkdir(parents=True)
+        (root / "a/file").write_text("x")
+        (root / "a/b/c/file").write_text("y")
+        outside = Path(tmp, "outside")
+        outside.mkdir()
+        (outside / "keep").write_text("z")
+        # Symlinks to directories must be removed and not followed
+        (root / "a/b/link").symlink_to(outside)
+        FileSystemUtils._delete_tree(str(root))
+        assert not root.exists()
+        assert (outside / "keep").exists()
+        # Single files and symlinks can also be deleted
+        FileSystemUtils._delete_tree(str(outside / "keep"))
+        assert not (outside / "keep").exists()
+        # Deleting something that doesn't exist is not an error
+        FileSystemUtils._delete_tree(str(root))
+
+
+class _Python35ScandirIterator(object):
+    """os.scandir() iterators are not context managers before Python 3.6"""
+    def __init__(self, path):
+        self._entries = list(_real_scandir(path))
+
+    def __iter__(self):
+        return iter(self._entries)
+
+
+_real_scandir = os.scandir
+
+
+def test_delete_tree_python35_scandir(monkeypatch):
+    monkeypatch.setattr(os, "scandir", _Python35ScandirIterator)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp, "tree")
+        (root / "a/b").mkdir(parents=True)
+        (root / "a/b/file").write_text("x")
+        FileSystemUtils._delete_tree(str(root))
+        # shutil.rmtree() (used by TemporaryDirectory) requires the real os.scandir()
+        monkeypatch.undo()
+        assert not root.exists()
+
+
+def test_create_symlinks():
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        (directory / "existing_file").write_text("x")
+        (directory / "subdir").mkdir()
+        Path(tmp, "old_link").symlink_to("old_target")
+        FileSystemUtils._create_symlinks(directory, [("target1", "new_link"), ("target2", "existing_file"),
+                                                     ("target3", "old_link"), ("/abs/target4", "subdir")])
+        assert os.readlink(str(directory / "new_link")) == "target1"
+        assert os.readlink(str(directory / "existing_file")) == "target2"
+        assert os.readlink(str(directory / "old_link")) == "target3"
+        # Like ln -fsn, an existing directory gets the link inside it
+        assert os.readlink(str(directory / "subdir/target4")) == "/abs/target4"
+        # No temporary files are left behind
+        assert sorted(os.listdir(tmp)) == ["existing_file", "new_link", "old_link", "subdir"]
+
+
+def _raise_oserror(*args, **kwargs):
+    raise OSError("operation not supported")
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reflinks are only attempted on Linux")
+def test_try_reflink_failure(monkeypatch):
+    import fcntl
+    monkeypatch.setattr(fcntl, "ioctl", _raise_oserror)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp, "src")
+        src.write_text("contents")
+        dest = Path(tmp, "dest")
+        assert not FileSystemUtils.try_reflink(src, dest)
+        # The partially created destination is removed
+        assert not dest.exists()
+
+
+@pytest.mark.parametrize("copy_file_range", ["unavailable", "failing", "working"])
+def test_copy_file_fallback(monkeypatch, copy_file_range):
+    monkeypatch.setattr(FileSystemUtils, "try_reflink", staticmethod(lambda src, dest: False))
+    if copy_file_range == "unavailable":
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+    elif copy_file_range == "failing":
+        monkeypatch.setattr(os, "copy_file_range", _raise_oserror, raising=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp, "src")
+        src.write_bytes(os.urandom(256 * 1024))
+        src.chmod(0o750)
+        dest = Path(tmp, "dest")
+        FileSystemUtils._copy_file(src, dest)
+        assert dest.read_bytes() == src.read_bytes()
+        assert stat.S_IMODE(dest.stat().st_mode) == 0o750
+        # Symlinks are copied as symlinks
+        Path(tmp, "link").symlink_to("src")
+        FileSystemUtils._copy_file(Path(tmp, "link"), Path(tmp, "link-copy"))
+        assert os.readlink(str(Path(tmp, "link-copy"))) == "src"
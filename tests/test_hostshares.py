@@ -0,0 +1,66 @@
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.hostshares import (HostShare, HostShareDaemonError, VirtioFSShareBackend, get_share_backend,
+                                     share_qemu_args)
+
+SHARES = [HostShare("/build", readonly=False, in_target="/build"),
+          HostShare("/src", readonly=True, in_target="/source", name="source_root")]
+
+
+def test_smb_share_args():
+    smb = get_share_backend("smb")
+    network, args = share_qemu_args([smb], SHARES, memory_size="2048M")
+    assert network == ",smb=/build:/src<<<source_root@ro"
+    assert args == []
+    assert smb.guest_mount_command(0, SHARES[0]) == "mount_smbfs -I 10.0.2.4 -N //10.0.2.4/qemu1 '/build'"
+    assert smb.guest_mount_command(1, SHARES[1]) == "mount_smbfs -I 10.0.2.4 -N //10.0.2.4/source_root '/source'"
+
+
+def test_9p_share_args():
+    p9 = get_share_backend("9p")
+    network, args = share_qemu_args([p9], SHARES, memory_size="2048M")
+    assert network == ""
+    assert args == ["-virtfs", "local,id=fs0,path=/build,mount_tag=share1,security_model=none",
+                    "-virtfs", "local,id=fs1,path=/src,mount_tag=source_root,security_model=none,readonly"]
+    assert p9.guest_mount_command(0, SHARES[0], "/tmp/x") == "mount -t p9fs share1 '/tmp/x'"
+
+
+def test_virtiofs_share_args():
+    vfs = get_share_backend("virtiofs")
+    network, args = share_qemu_args([vfs], SHARES, memory_size="2048M", runtime_dir=Path("/run/x"))
+    assert network == ""
+    # guest memory must be shared with virtiofsd
+    assert args[:4] == ["-object", "memory-backend-memfd,id=mem,size=2048M,share=on", "-numa", "node,memdev=mem"]
+    assert args[4:8] == ["-chardev", "socket,id=vfs0,path=/run/x/virtiofsd-0.sock",
+                         "-device", "vhost-user-fs-pci,chardev=vfs0,tag=share1"]
+    assert vfs.guest_mount_command(1, SHARES[1]) == "mount -t virtiofs source_root '/source'"
+
+
+def test_multiple_backends():
+    # With --share-backend=auto all usable backends are configured at the same time
+    network, args = share_qemu_args([get_share_backend("smb"), get_share_backend("9p")], SHARES[:1],
+                                    memory_size="2048M")
+    assert network == ",smb=/build"
+    assert args == ["-virtfs", "local,id=fs0,path=/build,mount_tag=share1,security_model=none"]
+
+
+def test_virtiofs_requires_numa_machine():
+    vfs = get_share_backend("virtiofs")
+    # -numa node,memdev=mem is rejected by machines without NUMA support
+    assert not vfs.is_available("/does/not/exist/qemu-system-cheri", machine="malta")
+    assert get_share_backend("smb").is_available("/does/not/exist/qemu-system-cheri", machine="malta")
+
+
+def test_virtiofs_daemon_failure(monkeypatch):
+    vfs = get_share_backend("virtiofs")
+    # Use a "virtiofsd" that exits immediately without creating the socket
+    monkeypatch.setattr(VirtioFSShareBackend, "virtiofsd_binary", staticmethod(lambda: "false"))
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        with pytest.raises(HostShareDaemonError, match="exited with code 1"):
+            vfs.start_host_daemons(SHARES[:1], Path(runtime_dir))
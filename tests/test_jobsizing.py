@@ -0,0 +1,153 @@
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.jobsizing import (MIB, SystemResources, compute_job_counts, estimate_link_job_memory_mb,
+                                    load_link_memory_history, set_ninja_pool_depth)
+from pycheribuild.projects.llvm import BuildLLVMBase
+
+GIB = 1024 * MIB
+
+
+def _write(path: Path, contents: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(contents)
+
+
+def test_cgroup_v2_limits():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        _write(root / "proc/self/cgroup", "0::/builders/job1\n")
+        _write(root / "proc/meminfo", "MemTotal:       131072000 kB\nMemAvailable:   120000000 kB\n")
+        # The CPU limit is set on the parent and the memory limit on the leaf cgroup
+        _write(root / "cgroup/builders/cpu.max", "1600000 100000\n")
+        _write(root / "cgroup/builders/job1/cpu.max", "max 100000\n")
+        _write(root / "cgroup/builders/job1/memory.max", str(32 * GIB) + "\n")
+        _write(root / "cgroup/builders/job1/memory.current", str(2 * GIB) + "\n")
+        resources = SystemResources.detect(proc_root=root / "proc", cgroup_root=root / "cgroup")
+        assert resources.cpu_quota == 16.0
+        assert resources.memory_available == 30 * GIB
+
+
+def test_cgroup_v1_limits():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        _write(root / "proc/self/cgroup", "4:memory:/docker/abc\n3:cpu,cpuacct:/docker/abc\n")
+        _write(root / "proc/meminfo", "MemAvailable:   8000000 kB\n")
+        _write(root / "cgroup/cpu,cpuacct/docker/abc/cpu.cfs_quota_us", "-1\n")
+        _write(root / "cgroup/cpu,cpuacct/docker/abc/cpu.cfs_period_us", "100000\n")
+        _write(root / "cgroup/memory/docker/abc/memory.limit_in_bytes", "9223372036854771712\n")
+        resources = SystemResources.detect(proc_root=root / "proc", cgroup_root=root / "cgroup")
+        # no limits set -> use /proc/meminfo
+        assert resources.cpu_quota is None
+        assert resources.memory_available == 8000000 * 1024
+        _write(root / "cgroup/cpu,cpuacct/docker/abc/cpu.cfs_quota_us", "250000\n")
+        _write(root / "cgroup/memory/docker/abc/memory.limit_in_bytes", str(4 * GIB) + "\n")
+        _write(root / "cgroup/memory/docker/abc/memory.usage_in_bytes", str(1 * GIB) + "\n")
+        resources = SystemResources.detect(proc_root=root / "proc", cgroup_root=root / "cgroup")
+        assert resources.cpu_quota == 2.5
+        assert resources.memory_available == 3 * GIB
+
+
+def test_compute_job_counts():
+    big_machine = SystemResources(64, memory_available=128 * GIB, load_average=40)
+    # Small projects use the requested value
+    counts = compute_job_counts(64, big_machine, compile_job_memory_mb=512)
+    assert counts == (64, None, "using the requested number of jobs")
+    # LLVM-like project: 64GB are reserved for 8 links at 8GB each, the remaining 64GB allow 64 compile jobs
+    counts = compute_job_counts(64, big_machine, compile_job_memory_mb=1024, link_job_memory_mb=8192, max_link_jobs=8)
+    assert (counts.compile_jobs, counts.link_jobs) == (64, 8)
+    # With 12GB per link job only 5 links fit into half of the memory
+    counts = compute_job_counts(64, big_machine, compile_job_memory_mb=1024, link_job_memory_mb=12 * 1024,
+                                max_link_jobs=8)
+    assert (counts.compile_jobs, counts.link_jobs) == (64, 5)
+    assert "12288 MiB per link job" in counts.reason
+    counts = compute_job_counts(64, big_machine, compile_job_memory_mb=2048, link_job_memory_mb=12 * 1024,
+                                max_link_jobs=8)
+    assert (counts.compile_jobs, counts.link_jobs) == (34, 5)
+    # Load average and CPU quota
+    counts = compute_job_counts(64, big_machine, compile_job_memory_mb=512, consider_load=True)
+    assert counts.compile_jobs == 24
+    container = SystemResources(64, cpu_quota=7.5, memory_available=2 * GIB)
+    counts = compute_job_counts(64, container, compile_job_memory_mb=512, link_job_memory_mb=2048)
+    assert (counts.compile_jobs, counts.link_jobs) == (1, 1)
+    assert "CPU quota of 7.5 CPUs" in counts.reason
+    # Never less than one job
+    counts = compute_job_counts(8, SystemResources(8, memory_available=0), compile_job_memory_mb=512)
+    assert counts.compile_jobs == 1
+
+
+def test_link_memory_history():
+    with tempfile.TemporaryDirectory() as td:
+        stats = Path(td, "link-stats.jsonl")
+        # Run a fake "linker" through the wrapper to check that it records the peak RSS
+        wrapper = Path(__file__).parent.parent / "pycheribuild/files/link-rss-wrapper.py"
+        out = Path(td, "a.out")
+        env = dict(os.environ, CHERIBUILD_LINK_STATS=str(stats))
+        result = subprocess.run([sys.executable, str(wrapper), sys.executable, "-c",
+                                 "import sys; open(sys.argv[2], 'w').close(); sys.exit(0)", "-o", str(out)], env=env)
+        assert result.returncode == 0
+        history = load_link_memory_history(stats)
+        assert list(history.keys()) == [str(out)]
+        assert history[str(out)] > 1000  # at least the size of a python interpreter
+        # failing commands are not recorded but the exit code is preserved
+        assert subprocess.run([sys.executable, str(wrapper), "false", "-o", "x"], env=env).returncode == 1
+        assert len(load_link_memory_history(stats)) == 1
+
+        with stats.open("a") as f:
+            f.write('{"output": "/b/bin/clang", "maxrss_kb": 4194304}\n{"output": "/b/bin/llc", "maxrss_kb": 2097152}\n'
+                    '{"output": "/b/bin/clang", "maxrss_kb": 3145728}\n{"output": "/b/bin/opt", "ma')
+        history = load_link_memory_history(stats)
+        assert history["/b/bin/clang"] == 3145728  # the most recent value is used
+        assert estimate_link_job_memory_mb(history) == int(3072 * 1.1) + 1
+        assert estimate_link_job_memory_mb({"/b/bin/clang": 1024}) is None  # not enough samples
+
+
+def test_set_ninja_pool_depth():
+    with tempfile.TemporaryDirectory() as td:
+        build_ninja = Path(td, "build.ninja")
+        build_ninja.write_text("# Pools\n\npool compile_job_pool\n  depth = 8\n\npool link_job_pool\n  depth = 2\n\n"
+                               "build all: phony\n")
+        os.utime(str(build_ninja), (1000000, 1000000))
+        assert set_ninja_pool_depth(build_ninja, "link_job_pool", 5)
+        assert "pool link_job_pool\n  depth = 5\n" in build_ninja.read_text()
+        assert "pool compile_job_pool\n  depth = 8\n" in build_ninja.read_text()
+        assert build_ninja.stat().st_mtime == 1000000
+        assert not set_ninja_pool_depth(build_ninja, "link_job_pool", 5)
+        assert not set_ninja_pool_depth(build_ninja, "missing_pool", 5)
+
+
+class FakeLLVM(object):
+    """Provides the attributes of BuildLLVMBase that _can_record_link_stats uses"""
+    _can_record_link_stats = BuildLLVMBase._can_record_link_stats
+    _cached_can_record_link_stats = None
+    target = "llvm"
+
+    def __init__(self, cmake: Path):
+        self.configureCommand = cmake
+        self.messages = []
+
+    def info(self, *args):
+        self.messages.append(" ".join(map(str, args)))
+
+
+def test_link_stats_require_cmake_321():
+    with tempfile.TemporaryDirectory() as td:
+        for version, supported in (("3.20.5", False), ("3.21.0", True), ("3.25.1", True)):
+            cmake = Path(td, "cmake-" + version)
+            cmake.write_text("#!/bin/sh\necho 'cmake version " + version + "'\n")
+            cmake.chmod(0o755)
+            llvm = FakeLLVM(cmake)
+            assert llvm._can_record_link_stats == supported
+            assert llvm._can_record_link_stats == supported
+            # The missing support is only reported once
+            assert len(llvm.messages) == (0 if supported else 1)
+            if not supported:
+                assert "CMake 3.20.5 does not support" in llvm.messages[0]
+        llvm = FakeLLVM(Path(td, "does-not-exist"))
+        assert not llvm._can_record_link_stats
+        assert len(llvm.messages) == 1
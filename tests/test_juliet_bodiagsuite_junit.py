@@ -0,0 +1,91 @@
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent / "test-scripts"))
+
+import run_bodiagsuite
+import run_juliet_tests
+
+JULIET_GOOD_RUN = """==== GOOD RUN ====
+CWE121_good_01 0
+CWE121_good_02 1
+CWE121_good_03 124
+==== END ====
+"""
+
+JULIET_BAD_RUN = """==== BAD RUN ====
+CWE121_bad_01 162
+CWE121_bad_02 0
+"""
+
+
+def _testcases(root: ET.Element, suite_name: str) -> "dict":
+    suite = root.find("testsuite[@name='{}']".format(suite_name))
+    return {c.get("name"): [e.tag for e in c] for c in suite.iter("testcase")}
+
+
+@pytest.mark.parametrize("parse_jobs", [None, 1, 8])
+def test_juliet_junit_xml(parse_jobs):
+    with tempfile.TemporaryDirectory() as tmp:
+        build_dir = Path(tmp)
+        (build_dir / "bin").mkdir()
+        (build_dir / "bin/good.run").write_text(JULIET_GOOD_RUN)
+        (build_dir / "bin/bad.run").write_text(JULIET_BAD_RUN)
+        assert run_juliet_tests.create_junit_xml(build_dir, parse_jobs)
+        root = ET.parse(str(build_dir / "results.xml")).getroot()
+        assert (root.get("tests"), root.get("failures"), root.get("errors")) == ("5", "2", "1")
+        # The suites are written in the same order as the inputs even though they are parsed concurrently
+        assert [s.get("name") for s in root.findall("testsuite")] == ["good", "bad"]
+        assert _testcases(root, "good") == {"CWE121_good_01": [], "CWE121_good_02": ["failure"],
+                                            "CWE121_good_03": ["error"]}
+        assert _testcases(root, "bad") == {"CWE121_bad_01": [], "CWE121_bad_02": ["failure"]}
+
+
+def test_juliet_junit_xml_missing_output():
+    with tempfile.TemporaryDirectory() as tmp:
+        build_dir = Path(tmp)
+        (build_dir / "bin").mkdir()
+        (build_dir / "bin/good.run").write_text(JULIET_GOOD_RUN)
+        assert not run_juliet_tests.create_junit_xml(build_dir)
+        root = ET.parse(str(build_dir / "results.xml")).getroot()
+        assert _testcases(root, "bad") == {"parse-output": ["error"]}
+        assert root.get("tests") == "4"
+
+
+@pytest.mark.parametrize("parse_jobs", [1, 4])
+def test_bodiagsuite_junit_xml(parse_jobs):
+    with tempfile.TemporaryDirectory() as tmp:
+        build_dir = Path(tmp)
+        run_dir = build_dir / "run"
+        run_dir.mkdir()
+        (run_dir / "basic-00001-min.out").write_text("34\n")  # killed by signal 34 (CHERI)
+        (run_dir / "basic-00001-med.out").write_text("0\n")  # should have crashed
+        (run_dir / "basic-00001-large.out").write_text("garbage\n")
+        (run_dir / "basic-00001-ok.out").write_text("0\n")
+        (run_dir / "basic-00002-ok.out").write_text("256\n")  # exit(1) for an in-bounds test
+        (run_dir / "basic-00002-ok.stderr").write_bytes(b"error\x00message\n")
+        (run_dir / "basic-heap-00001-min.out").write_text("34\n")
+        assert run_bodiagsuite.create_junit_xml(build_dir, "cheri", ["cheri"], parse_jobs)
+        root = ET.parse(str(build_dir / "test-results.xml")).getroot()
+        assert root.get("name") == "cheri"
+        assert [s.get("name") for s in root.findall("testsuite")] == [
+            prefix + "-" + suffix for prefix in ("basic", "basic-heap")
+            for suffix in ("min-overflow", "med-overflow", "large-overflow", "in-bounds", "test-broken")]
+        # All 291 * 4 tests of both suites are reported, missing ones as errors
+        assert root.get("tests") == str(2 * 291 * 4)
+        assert root.get("errors") == str(2 * 291 * 4 - 6 + 2)
+        assert root.get("failures") == "1"
+        assert _testcases(root, "basic-min-overflow") == {"basic-00001-min": ["system-out"]}
+        assert _testcases(root, "basic-med-overflow") == {"basic-00001-med": ["failure", "system-out"]}
+        assert _testcases(root, "basic-in-bounds") == {"basic-00001-ok": ["system-out"],
+                                                      "basic-00002-ok": ["error", "system-err", "system-out"]}
+        in_bounds = root.find("testsuite[@name='basic-in-bounds']")
+        assert in_bounds.find("testcase[@name='basic-00002-ok']/system-err").text == "error\\0message"
+        broken = _testcases(root, "basic-test-broken")
+        assert broken["basic-00001-large"] == ["error", "system-out"]
+        assert broken["basic-00291-ok"] == ["error"]
+        assert _testcases(root, "basic-heap-min-overflow") == {"basic-heap-00001-min": ["system-out"]}
@@ -0,0 +1,48 @@
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "test-scripts"))
+
+from junit_merge import merge_junit_xml_files
+
+SHARD1 = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+<testsuite name="libc++">
+<testcase classname="libc++.std/re" name="regex.pass.cpp" time="1.5"/>
+<testcase classname="libc++.std/re" name="match.pass.cpp" time="0.5"><failure message="exit code 1"/></testcase>
+</testsuite>
+</testsuites>
+"""
+
+# A file with a <testsuite> root element and stale statistics that must be recomputed
+SHARD2 = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuite name="libc++" tests="99" failures="99">
+<testcase classname="libc++.std/algorithms" name="sort.pass.cpp" time="2.0"/>
+<testcase classname="libc++.std/algorithms" name="find.pass.cpp" time="0"><skipped message="UNSUPPORTED"/></testcase>
+<testcase classname="libc++.std/algorithms" name="copy.pass.cpp" time="0.25"><error message="timeout"/></testcase>
+</testsuite>
+"""
+
+
+def test_merge_shards():
+    with tempfile.TemporaryDirectory() as tmp:
+        shard1 = Path(tmp, "shard1.xml")
+        shard1.write_text(SHARD1)
+        shard2 = Path(tmp, "shard2.xml")
+        shard2.write_text(SHARD2)
+        output = Path(tmp, "merged.xml")
+        result = merge_junit_xml_files([shard1, shard2], output)
+        assert (result.tests, result.failures, result.errors, result.skipped) == (5, 1, 1, 1)
+        root = ET.parse(str(output)).getroot()
+        assert root.tag == "testsuites"
+        assert {k: root.get(k) for k in ("tests", "failures", "errors", "skipped", "time")} == {
+            "tests": "5", "failures": "1", "errors": "1", "skipped": "1", "time": "4.250"}
+        suites = root.findall("testsuite")
+        assert [(s.get("name"), s.get("tests"), s.get("failures")) for s in suites] == [("libc++", "2", "1"),
+                                                                                       ("libc++", "3", "0")]
+        assert [c.get("classname") + "::" + c.get("name") for c in root.iter("testcase")] == [
+            "libc++.std/re::regex.pass.cpp", "libc++.std/re::match.pass.cpp", "libc++.std/algorithms::sort.pass.cpp",
+            "libc++.std/algorithms::find.pass.cpp", "libc++.std/algorithms::copy.pass.cpp"]
+        assert root.find("testsuite/testcase[@name='match.pass.cpp']/failure").get("message") == "exit code 1"
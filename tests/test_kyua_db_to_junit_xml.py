@@ -0,0 +1,80 @@
+import sqlite3
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "test-scripts"))
+
+from kyua_db_to_junit_xml import convert_kyua_db_to_junit_xml
+
+# The subset of the kyua results store schema (store/schema_v3.sql) that is read by the converter
+KYUA_SCHEMA = """
+CREATE TABLE test_programs (test_program_id INTEGER PRIMARY KEY AUTOINCREMENT, absolute_path TEXT NOT NULL,
+    root TEXT NOT NULL, relative_path TEXT NOT NULL, test_suite_name TEXT NOT NULL, metadata_id INTEGER,
+    interface TEXT NOT NULL);
+CREATE TABLE test_cases (test_case_id INTEGER PRIMARY KEY AUTOINCREMENT, test_program_id INTEGER NOT NULL,
+    name TEXT NOT NULL, metadata_id INTEGER);
+CREATE TABLE test_results (test_case_id INTEGER PRIMARY KEY, result_type TEXT NOT NULL, result_reason TEXT,
+    start_time INTEGER NOT NULL, end_time INTEGER NOT NULL);
+CREATE TABLE files (file_id INTEGER PRIMARY KEY AUTOINCREMENT, contents BLOB NOT NULL);
+CREATE TABLE test_case_files (test_case_id INTEGER NOT NULL, file_name TEXT NOT NULL, file_id INTEGER NOT NULL,
+    PRIMARY KEY (test_case_id, file_name));
+"""
+
+
+def _create_kyua_db(path: Path):
+    db = sqlite3.connect(str(path))
+    db.executescript(KYUA_SCHEMA)
+
+    def add_program(relative_path):
+        return db.execute("INSERT INTO test_programs (absolute_path, root, relative_path, test_suite_name, interface) "
+                          "VALUES (?, '/usr/tests', ?, 'FreeBSD', 'atf')",
+                          ("/usr/tests/" + relative_path, relative_path)).lastrowid
+
+    def add_case(program_id, name, result=None, stdout=None, stderr=None):
+        case_id = db.execute("INSERT INTO test_cases (test_program_id, name) VALUES (?, ?)",
+                             (program_id, name)).lastrowid
+        if result:
+            db.execute("INSERT INTO test_results VALUES (?, ?, ?, ?, ?)", (case_id,) + result)
+        for file_name, contents in (("__STDOUT__", stdout), ("__STDERR__", stderr)):
+            if contents is not None:
+                file_id = db.execute("INSERT INTO files (contents) VALUES (?)", (contents,)).lastrowid
+                db.execute("INSERT INTO test_case_files VALUES (?, ?, ?)", (case_id, file_name, file_id))
+
+    libc = add_program("lib/libc/string/strlen_test")
+    add_case(libc, "strlen_basic", ("passed", None, 1000000, 2500000), stdout=b"ok\n")
+    add_case(libc, "strlen_huge", ("failed", "assertion \x01failed", 0, 1000000), stdout=b"out", stderr=b"err\x00")
+    add_case(libc, "strlen_xfail", ("expected_failure", "known bug", 0, 0), stderr=b"details")
+    kern = add_program("sys/kern/ptrace_test")
+    add_case(kern, "ptrace_skip", ("skipped", "requires root", 0, 0))
+    add_case(kern, "ptrace_crash")  # no result (e.g. the test program crashed)
+    db.commit()
+    db.close()
+
+
+def test_convert_kyua_db():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp, "results.db")
+        _create_kyua_db(db_file)
+        output = Path(tmp, "results.xml")
+        convert_kyua_db_to_junit_xml(db_file, output)
+        root = ET.parse(str(output)).getroot()
+        assert {k: root.get(k) for k in ("tests", "failures", "errors", "skipped", "time")} == {
+            "tests": "5", "failures": "1", "errors": "1", "skipped": "1", "time": "2.500"}
+        suites = root.findall("testsuite")
+        assert [s.get("name") for s in suites] == ["lib/libc/string/strlen_test", "sys/kern/ptrace_test"]
+        cases = {c.get("name"): c for c in root.iter("testcase")}
+        assert list(cases) == ["strlen_basic", "strlen_huge", "strlen_xfail", "ptrace_skip", "ptrace_crash"]
+        assert cases["strlen_basic"].get("classname") == "lib.libc.string.strlen_test"
+        assert cases["strlen_basic"].get("time") == "1.500"
+        assert cases["strlen_basic"].find("system-out").text == "ok\n"
+        assert not cases["strlen_basic"].find("system-err").text
+        # Characters that are not valid in XML are escaped
+        assert cases["strlen_huge"].find("failure").get("message") == "assertion \\x01;failed"
+        assert cases["strlen_huge"].find("system-out").text == "out"
+        assert cases["strlen_huge"].find("system-err").text == "err\\x00;"
+        assert cases["strlen_xfail"].find("system-err").text.startswith("Expected failure result details")
+        assert cases["strlen_xfail"].find("system-err").text.endswith("known bug\n\ndetails")
+        assert cases["ptrace_skip"].find("skipped") is not None
+        assert cases["ptrace_crash"].find("error").get("message") == "Test case has no result"
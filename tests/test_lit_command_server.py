@@ -0,0 +1,99 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "test-scripts"))
+
+from lit_command_executor import CommandServerClient, CommandServerExecutor
+
+SERVER_SCRIPT = Path(__file__).parent.parent / "test-scripts/lit_command_server.py"
+
+
+def _start_server(jobs):
+    server = subprocess.Popen([sys.executable, str(SERVER_SCRIPT), "--jobs", str(jobs)], stdout=subprocess.PIPE)
+    line = server.stdout.readline().decode("utf-8").split()
+    assert line[0] == "LISTENING"
+    return server, int(line[1])
+
+
+def test_command_server():
+    server, port = _start_server(jobs=2)
+    try:
+        client = CommandServerClient("127.0.0.1", port)
+        result = client.run(["sh", "-c", "echo out; echo err >&2; exit 3"])
+        assert (result.exit_code, "".join(result.stdout), "".join(result.stderr)) == (3, "out\n", "err\n")
+        assert not result.timed_out
+        result = client.run(["sh", "-c", "sleep 10"], timeout=0.5)
+        assert result.timed_out
+        result = client.run(["/this/does/not/exist"])
+        assert result.exit_code == 127 and result.error
+        # Requests from multiple threads are multiplexed over the same connection and run concurrently
+        results = [None, None]
+
+        def run(i):
+            results[i] = client.run(["sh", "-c", "sleep 1; echo " + str(i)])
+        start = time.time()
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert time.time() - start < 1.9
+        assert ["".join(r.stdout) for r in results] == ["0\n", "1\n"]
+        client.close()
+    finally:
+        server.kill()
+        server.wait()
+        server.stdout.close()
+
+
+def test_command_server_executor():
+    server, port = _start_server(jobs=1)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            exe = Path(tmp, "test.exe")
+            exe.write_text("#!/bin/sh\ncat input.txt\necho \"$FOO\" >&2\n")
+            exe.chmod(0o755)
+            data = Path(tmp, "input.txt")
+            data.write_text("data\n")
+            nfs_dir = Path(tmp, "nfs")
+            nfs_dir.mkdir()
+            # When running locally the "guest" path is the same as the host path
+            executor = CommandServerExecutor("127.0.0.1", port, nfs_dir=str(nfs_dir), path_in_target=str(nfs_dir))
+            cmd, out, err, exit_code = executor.run(str(exe), [str(exe)], file_deps=[str(data)], env={"FOO": "bar"})
+            assert (out, err, exit_code) == ("data\n", "bar\n", 0)
+            assert cmd[0].startswith(str(nfs_dir)) and cmd[0].endswith("test.exe")
+            assert os.listdir(str(nfs_dir)) == []  # temporary directory was removed
+    finally:
+        server.kill()
+        server.wait()
+        server.stdout.close()
+
+
+def test_garbled_response_fails_pending_requests():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def serve():
+        conn, _ = server.accept()
+        conn.makefile("rb").readline()  # wait for the request
+        # The connection is lost in the middle of a response
+        conn.sendall(b'{"id": 1, "stream": "stdout", "data": "partial"}\n{"id": 1, "str')
+        conn.close()
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        client = CommandServerClient("127.0.0.1", server.getsockname()[1])
+        result = client.run(["true"])
+        assert result.error == "connection to command server lost"
+        assert result.stdout == ["partial"]
+        thread.join(5)
+        client.close()
+    finally:
+        server.close()
@@ -266,3 +266,31 @@ def test_symlink_infer_mode(temp_symlink):
 """.format(target=temp_symlink[2], testfile=str(temp_symlink[1]), symlink_perms=symlink_perms)
     assert expected == _get_as_str(mtree)
 
+
+
+def test_entries_with_prefix():
+    file = """#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/cat type=file uname=root gname=wheel mode=0755
+./lib type=dir uname=root gname=wheel mode=0755
+./lib/libc.so.7 type=file uname=root gname=wheel mode=0444
+./usr type=dir uname=root gname=wheel mode=0755
+./usr/lib type=dir uname=root gname=wheel mode=0755
+./usr/lib/libc.so type=link uname=root gname=wheel mode=0755 link=/lib/libc.so.7
+./usr/lib/libfoo.so type=link uname=root gname=wheel mode=0755 link=libfoo.so.1
+./usr/libcheri type=dir uname=root gname=wheel mode=0755
+./usr/libdata type=dir uname=root gname=wheel mode=0755
+# END
+"""
+    mtree = MtreeFile(io.StringIO(file))
+    entries = mtree.entries_with_prefix("./lib/", "./usr/lib/")
+    assert [e.path for e in entries] == ["./lib", "./lib/libc.so.7", "./usr/lib", "./usr/lib/libc.so",
+                                         "./usr/lib/libfoo.so"]
+    # prefixes without a trailing slash also match other directories
+    assert [e.path for e in mtree.entries_with_prefix("./usr/lib")] == [
+        "./usr/lib", "./usr/lib/libc.so", "./usr/lib/libfoo.so", "./usr/libcheri", "./usr/libdata"]
+    # absolute symlinks are rewritten to be relative to the mtree root
+    assert entries[3].is_link()
+    assert entries[3].relative_link_target() == "../../lib/libc.so.7"
+    assert entries[4].relative_link_target() == "libfoo.so.1"
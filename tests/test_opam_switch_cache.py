@@ -0,0 +1,113 @@
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.opamswitchcache import OpamSwitchSnapshotCache
+from pycheribuild.projects.sail import BuildSailFromOpam, OpamMixin, REMS_OPAM_REPO
+
+
+def test_snapshot_key():
+    with tempfile.TemporaryDirectory() as tmp:
+        lockfile = Path(tmp, "sail.lock")
+        lockfile.write_text("installed: [\"zarith.1.7\"]\n")
+        root = Path("/sdk/opamroot")
+        key = OpamSwitchSnapshotCache.snapshot_key(root, "4.06.1", lockfile)
+        assert key.startswith("4.06.1-")
+        assert key == OpamSwitchSnapshotCache.snapshot_key(root, "4.06.1", lockfile)
+        assert key != OpamSwitchSnapshotCache.snapshot_key(root, "4.07.0", lockfile)
+        assert key != OpamSwitchSnapshotCache.snapshot_key(Path("/other/opamroot"), "4.06.1", lockfile)
+        assert key != OpamSwitchSnapshotCache.snapshot_key(root, "4.06.1", None)
+        lockfile.write_text("installed: [\"zarith.1.8\"]\n")
+        assert key != OpamSwitchSnapshotCache.snapshot_key(root, "4.06.1", lockfile)
+
+
+def test_save_and_restore():
+    with tempfile.TemporaryDirectory() as tmp:
+        opamroot = Path(tmp, "sdk/opamroot")
+        (opamroot / "4.06.1/bin").mkdir(parents=True)
+        (opamroot / "4.06.1/bin/ocaml").write_text("ocaml")
+        (opamroot / "4.06.1/.opam-switch/build/zarith").mkdir(parents=True)
+        (opamroot / "download-cache").mkdir()
+        (opamroot / "opam-init").mkdir()
+        cache = OpamSwitchSnapshotCache(Path(tmp, "cache"))
+        assert cache.find(opamroot, "4.06.1", None) is None
+        snapshot = cache.save(opamroot, "4.06.1", None)
+        assert cache.find(opamroot, "4.06.1", None) == snapshot
+        assert snapshot.with_name(snapshot.name[:-len(".tar.gz")] + ".json").exists()
+        assert cache.find(opamroot, "4.07.0", None) is None
+        # Restore into a fresh workspace at the same location
+        Path(tmp, "old-sdk").mkdir()
+        Path(tmp, "sdk").rename(Path(tmp, "old-sdk/sdk"))
+        OpamSwitchSnapshotCache.restore(snapshot, opamroot)
+        assert (opamroot / "4.06.1/bin/ocaml").read_text() == "ocaml"
+        assert (opamroot / "opam-init").is_dir()
+        # build directories and downloads are not archived
+        assert not (opamroot / "4.06.1/.opam-switch/build").exists()
+        assert not (opamroot / "download-cache").exists()
+
+
+class FakeCache(object):
+    def __init__(self):
+        self.snapshots = []  # (path, packages installed when the snapshot was saved)
+        self.installed = []
+
+    def find(self, opamroot, ocaml_version, lockfile):
+        return self.snapshots[-1][0] if self.snapshots else None
+
+    def save(self, opamroot, ocaml_version, lockfile):
+        self.snapshots.append((Path("/cache/snapshot.tar.gz"), list(self.installed)))
+
+
+class FakeConfig(object):
+    sdkDir = Path("/sdk")
+    skipUpdate = True
+    clean = False
+    opam_switch_lockfile = None
+
+
+class FakeRepositoryList(object):
+    stdout = REMS_OPAM_REPO.encode("utf-8")
+
+
+class FakeSailFromOpam(OpamMixin):
+    """Provides the attributes of BuildSailFromOpam that process() uses and records the installed packages"""
+    process = BuildSailFromOpam.process
+    use_git_version = False
+
+    def __init__(self, cache: FakeCache, switch_exists: bool):
+        self.config = FakeConfig()
+        self.required_ocaml_version = "4.06.1"
+        self.cache = cache
+        self.switch_exists = switch_exists
+        self._OpamMixin__created_switch = False
+
+    @property
+    def _switch_snapshot_cache(self):
+        return self.cache
+
+    def run_opam_cmd(self, command, *args, **kwargs):
+        if not self.switch_exists:
+            self.switch_exists = True
+            self._create_switch()
+        if command == "install":
+            self.cache.installed.append(args[-2])
+        return FakeRepositoryList()
+
+    def info(self, *args):
+        pass
+
+
+def test_snapshot_saved_after_installing_packages():
+    cache = FakeCache()
+    FakeSailFromOpam(cache, switch_exists=False).process()
+    # The snapshot must include the packages and not just the OCaml compiler
+    assert cache.snapshots == [(Path("/cache/snapshot.tar.gz"), ["sail"])]
+    # Existing snapshots are not overwritten when the switch already existed
+    FakeSailFromOpam(cache, switch_exists=True).process()
+    assert len(cache.snapshots) == 1
+    # But a snapshot is created if there is none for an existing switch
+    cache = FakeCache()
+    FakeSailFromOpam(cache, switch_exists=True).process()
+    assert cache.snapshots == [(Path("/cache/snapshot.tar.gz"), ["sail"])]
@@ -0,0 +1,77 @@
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.cross.cheribsd import BuildCHERIBSD
+
+
+class FakeConfig(object):
+    pretend = False
+
+
+class FakeCheriBSD(object):
+    """Provides the attributes of BuildCHERIBSD that _buildkernels() uses"""
+    _buildkernels = BuildCHERIBSD._buildkernels
+
+    def __init__(self, make_jobs: int, parallel_kernel_builds=True, debug_kernel=False, failures: dict = None):
+        self.config = FakeConfig()
+        self.make_jobs = make_jobs
+        self.parallel_kernel_builds = parallel_kernel_builds
+        self.debug_kernel = debug_kernel
+        self.failures = failures or dict()
+        self.built = []
+        self.questions = []
+        self._lock = threading.Lock()
+
+    def _build_kernel_toolchain_if_needed(self):
+        pass
+
+    def _buildkernel(self, kernconf: str, mfs_root_image: Path = None, make_jobs: int = None):
+        with self._lock:
+            self.built.append((kernconf, mfs_root_image, make_jobs))
+        if kernconf in self.failures:
+            raise self.failures[kernconf]
+
+    def queryYesNo(self, message: str):
+        self.questions.append(message)
+        return False
+
+    def fatal(self, *args):
+        raise SystemExit(" ".join(args))
+
+
+def test_kernel_job_split():
+    project = FakeCheriBSD(make_jobs=8)
+    project._buildkernels([("CHERI_MALTA64", None), ("CHERI_MALTA64_MFS_ROOT", Path("/mfs.img")),
+                           ("CHERI_MALTA64_NFS", None)])
+    assert sorted(project.built) == [("CHERI_MALTA64", None, 2), ("CHERI_MALTA64_MFS_ROOT", Path("/mfs.img"), 2),
+                                     ("CHERI_MALTA64_NFS", None, 2)]
+    # Kernels are built one after the other with the global -j value if there are not enough jobs
+    project = FakeCheriBSD(make_jobs=2)
+    project._buildkernels([("A", None), ("B", None), ("C", None)])
+    assert project.built == [("A", None, None), ("B", None, None), ("C", None, None)]
+    project = FakeCheriBSD(make_jobs=8, parallel_kernel_builds=False)
+    project._buildkernels([("A", None), ("B", None)])
+    assert project.built == [("A", None, None), ("B", None, None)]
+
+
+def test_kernel_failures_are_aggregated():
+    project = FakeCheriBSD(make_jobs=8, failures={"B": subprocess.CalledProcessError(1, ["make", "buildkernel"]),
+                                                  "D": RuntimeError("unexpected error")})
+    with pytest.raises(SystemExit, match="^Failed to build kernel configs: B D$"):
+        project._buildkernels([("A", None), ("B", None), ("C", None), ("D", None)])
+    # The other kernels are still built
+    assert sorted(k for k, _, _ in project.built) == ["A", "B", "C", "D"]
+
+
+def test_benchmark_kernel_question_asked_once():
+    project = FakeCheriBSD(make_jobs=8, debug_kernel=True)
+    project._buildkernels([("A_BENCHMARK", None), ("B_BENCHMARK", None), ("C", None)])
+    assert len(project.questions) == 1
+    # Declining skips the BENCHMARK kernels
+    assert project.built == [("C", None, None)]
@@ -0,0 +1,129 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.qemuinstances import QEMUInstance, QEMUInstanceManager, QMPClient, QMPError
+
+
+def _fake_qmp_server(path: Path, received: list):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen(1)
+
+    def serve():
+        conn, _ = server.accept()
+        f = conn.makefile("rw")
+        f.write(json.dumps({"QMP": {"version": {}, "capabilities": []}}) + "\n")
+        f.flush()
+        for line in f:
+            cmd = json.loads(line)["execute"]
+            received.append(cmd)
+            if cmd == "query-status":
+                f.write(json.dumps({"event": "RESET"}) + "\n")  # events must be skipped
+                f.write(json.dumps({"return": {"status": "running"}}) + "\n")
+            elif cmd == "bad":
+                f.write(json.dumps({"error": {"class": "GenericError", "desc": "unknown command"}}) + "\n")
+            else:
+                f.write(json.dumps({"return": {}}) + "\n")
+            f.flush()
+        conn.close()
+        server.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_qmp_client():
+    with tempfile.TemporaryDirectory() as tmp:
+        received = []
+        thread = _fake_qmp_server(Path(tmp, "qmp.sock"), received)
+        with QMPClient(Path(tmp, "qmp.sock")) as qmp:
+            assert qmp.execute("query-status") == {"status": "running"}
+            try:
+                qmp.execute("bad")
+                assert False, "should have raised"
+            except QMPError as e:
+                assert "unknown command" in str(e)
+        thread.join(5)
+        assert received == ["qmp_capabilities", "query-status", "bad"]
+
+
+def test_stale_instances_are_pruned():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = QEMUInstanceManager(Path(tmp, "state"), socket_dir=Path(tmp, "sockets"))
+        assert manager.list() == []
+        manager.state_dir.mkdir()
+        # A process that has exited must be removed from the state directory together with its sockets
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        serial = Path(tmp, "dead.serial")
+        serial.touch()
+        stale = QEMUInstance(name="dead", pid=dead.pid, command=["true"], serial_socket=str(serial))
+        Path(manager.state_dir, "dead.json").write_text(json.dumps(stale.to_json()))
+        alive = QEMUInstance(name="alive", pid=os.getpid(), command=[sys.executable])
+        Path(manager.state_dir, "alive.json").write_text(json.dumps(alive.to_json()))
+        assert [i.name for i in manager.list()] == ["alive"]
+        assert not Path(manager.state_dir, "dead.json").exists()
+        assert not serial.exists()
+
+
+# Emulates the QMP server of QEMU and writes a warning to stderr after the QMP connection from start()
+FAKE_QEMU = """
+import json, socket, sys
+qmp_path = sys.argv[sys.argv.index("-qmp") + 1][len("unix:"):].split(",")[0]
+if "--fail" in sys.argv:
+    sys.exit("qemu-system-mips64: -drive file=disk.img: Could not open 'disk.img'")
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(qmp_path)
+server.listen(1)
+while True:
+    conn, _ = server.accept()
+    f = conn.makefile("rw")
+    f.write(json.dumps({"QMP": {"version": {}, "capabilities": []}}) + "\\n")
+    f.flush()
+    for line in f:
+        cmd = json.loads(line)["execute"]
+        f.write(json.dumps({"return": {}}) + "\\n")
+        f.flush()
+        if cmd == "quit":
+            sys.exit(0)
+    conn.close()
+    print("qemu-system-mips64: warning: guest panicked", file=sys.stderr, flush=True)
+"""
+
+
+def test_qemu_stderr_is_logged():
+    with tempfile.TemporaryDirectory() as tmp:
+        fake_qemu = Path(tmp, "fake-qemu.py")
+        fake_qemu.write_text(FAKE_QEMU)
+        manager = QEMUInstanceManager(Path(tmp, "state"), socket_dir=Path(tmp, "sockets"))
+        try:
+            manager.start("broken", [sys.executable, fake_qemu, "--fail"])
+            assert False, "should have raised"
+        except QMPError as e:
+            assert "exited with code 1: qemu-system-mips64: -drive file=disk.img: Could not open" in str(e)
+        instance = manager.start("test", [sys.executable, fake_qemu])
+        try:
+            assert instance.stderr_logfile == str(manager.state_dir / "test.stderr.log")
+            # Output written after start() returned is not lost
+            deadline = time.time() + 10
+            while "guest panicked" not in Path(instance.stderr_logfile).read_text() and time.time() < deadline:
+                time.sleep(0.1)
+            assert Path(instance.stderr_logfile).read_text() == "qemu-system-mips64: warning: guest panicked\n"
+        finally:
+            manager.stop(instance)
+        # Errors from previous runs are not included in the error message
+        try:
+            manager.start("broken", [sys.executable, fake_qemu, "--fail"])
+            assert False, "should have raised"
+        except QMPError as e:
+            assert str(e).count("Could not open") == 1
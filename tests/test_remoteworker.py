@@ -0,0 +1,55 @@
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.remoteworker import remote_worker_connect, remote_worker_request
+
+_SERVER = """
+import os, sys
+sys.path.insert(0, {root!r})
+from pathlib import Path
+from pycheribuild.remoteworker import remote_worker_serve
+
+def fake_main():
+    print("pid", os.getpid(), "argv", sys.argv[1:], "cwd", os.getcwd(), "env", os.environ.get("WORKER_TEST"))
+    sys.exit(int(sys.argv[-1]))
+
+remote_worker_serve(Path({socket!r}), fake_main, idle_timeout=10)
+"""
+
+
+def test_remote_worker():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        socket_path = Path(tmpdir, "worker.sock")
+        code = _SERVER.format(root=str(Path(__file__).parent.parent), socket=str(socket_path))
+        server = subprocess.Popen([sys.executable, "-c", code])
+        try:
+            sock = None
+            for _ in range(100):
+                sock = remote_worker_connect(socket_path)
+                if sock:
+                    break
+                time.sleep(0.05)
+            assert sock is not None, "server did not start"
+            outputs = []
+            for exit_code in ("0", "3"):
+                if sock is None:
+                    sock = remote_worker_connect(socket_path)
+                with sock, tempfile.TemporaryFile() as out:
+                    result = remote_worker_request(sock, ["cheribuild.py", "--foo", exit_code],
+                                                   fds=(0, out.fileno(), out.fileno()), cwd=tmpdir,
+                                                   env={"WORKER_TEST": "yes"})
+                    assert result == int(exit_code)
+                    out.seek(0)
+                    outputs.append(out.read().decode("utf-8"))
+                sock = None
+            assert "argv ['--foo', '3'] cwd " + tmpdir + " env yes" in outputs[1]
+            # every request runs in a freshly forked process
+            assert outputs[0].split()[1] != outputs[1].split()[1]
+        finally:
+            server.kill()
+            server.wait()
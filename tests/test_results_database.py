@@ -0,0 +1,68 @@
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "test-scripts"))
+
+import results_database
+from results_database import balance_shards, lit_test_key, order_longest_first
+
+# The format written by `llvm-lit --xunit-xml-output` (lit 0.10)
+JUNIT_TEMPLATE = """<?xml version="1.0" encoding="UTF-8" ?>
+<testsuites>
+<testsuite name='libc++' tests='4' failures='0' skipped='1'>
+<testcase classname='libc++.std/algorithms/alg_sorting' name='sort.pass.cpp' time='{sort}'/>
+<testcase classname='libc++.std/algorithms/alg_nonmodifying' name='find.pass.cpp' time='1.0'>{find}</testcase>
+<testcase classname='libc++.std/re/re_alg' name='regex.pass.cpp' time='30.0'>
+	<skipped message='Skipping because of: c++98 || c++03' />
+</testcase>
+<testcase classname='libc++.libc++' name='nothing_to_do.pass.cpp' time='0.5'/>
+</testsuite>
+</testsuites>
+"""
+
+# The matching output of `llvm-lit --show-tests`
+LIT_SHOW_TESTS_OUTPUT = """-- Available Tests --
+  libc++ :: nothing_to_do.pass.cpp
+  libc++ :: std/algorithms/alg.nonmodifying/find.pass.cpp
+  libc++ :: std/algorithms/alg.sorting/sort.pass.cpp
+  libc++ :: std/re/re.alg/regex.pass.cpp
+"""
+
+
+def test_results_database():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with results_database.TestResultsDatabase(Path(tmpdir, "results.sqlite3")) as db:
+            for sort_time, find_result in ((10.0, ""), (20.0, "<failure message='x'/>"), (12.0, "")):
+                xml = Path(tmpdir, "results.xml")
+                xml.write_text(JUNIT_TEMPLATE.format(sort=sort_time, find=find_result))
+                db.ingest_junit(xml, "libcxx")
+            durations = db.predicted_durations("libcxx")
+            # Average of the recorded times, skipped tests are ignored
+            assert durations == {"libc++.std/algorithms/alg_sorting::sort.pass.cpp": 14.0,
+                                 "libc++.std/algorithms/alg_nonmodifying::find.pass.cpp": 1.0,
+                                 "libc++.libc++::nothing_to_do.pass.cpp": 0.5}
+            assert db.flaky_tests("libcxx") == [("libc++.std/algorithms/alg_nonmodifying::find.pass.cpp", 2, 1)]
+            # The keys computed for the `lit --show-tests` output must match the recorded ones
+            shown = [line.strip().split(" :: ") for line in LIT_SHOW_TESTS_OUTPUT.splitlines()[1:]]
+            keys = [lit_test_key(suite, path) for suite, path in shown]
+            assert [durations.get(k) for k in keys] == [0.5, 1.0, 14.0, None]
+            assert db.flaky_tests("libcxx", last_runs=1) == []
+            assert db.predicted_durations("other-suite") == {}
+
+
+def test_lit_test_key():
+    assert lit_test_key("libc++", "std/algorithms/sort.pass.cpp") == "libc++.std/algorithms::sort.pass.cpp"
+    assert lit_test_key("libc++", "std/re/re.alg/match.pass.cpp") == "libc++.std/re/re_alg::match.pass.cpp"
+    assert lit_test_key("libc++", "nothing_to_do.pass.cpp") == "libc++.libc++::nothing_to_do.pass.cpp"
+    assert lit_test_key("llvm.unit", "x/y.test") == "llvm-unit.x::y.test"
+
+
+def test_balance_shards():
+    durations = {"a": 10, "b": 7, "c": 5, "d": 4, "e": 2}
+    assert order_longest_first(["e", "unknown", "a", "c"], durations) == ["a", "c", "unknown", "e"]
+    shards = balance_shards(durations.keys(), 2, durations)
+    assert shards == [["a", "d"], ["b", "c", "e"]]
+    assert [sum(durations[t] for t in shard) for shard in shards] == [14, 14]
+    # Tests without history use the median duration
+    assert balance_shards(["x", "y", "a"], 2, durations) == [["a"], ["x", "y"]]
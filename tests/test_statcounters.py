@@ -0,0 +1,87 @@
+import io
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.statcounters import (CounterSummary, analyse_statcounters, compare_statcounters,
+                                       load_statcounters_csv, mann_whitney_u_test, statcounters_main)
+
+
+def _make_csv(rows: "dict") -> str:
+    # rows: progname -> list of (cycles, instructions)
+    lines = ["progname,archname,cycles,instructions,dcache_read_miss"]
+    for progname, values in rows.items():
+        for cycles, instructions in values:
+            lines.append("{},cheri128-hybrid,{},{},{}".format(progname, cycles, instructions, cycles // 100))
+    return "\n".join(lines) + "\n"
+
+
+BASELINE = _make_csv({
+    "qsort": [(1000 + i, 500) for i in (3, 1, 4, 1, 5, 9, 2, 6, 5, 3)],
+    "bitcount": [(2000 + i, 900 + i) for i in (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)],
+})
+# qsort is ~10% slower, bitcount is unchanged (same distribution shifted within the noise)
+CURRENT = _make_csv({
+    "qsort": [(1100 + i, 500) for i in (2, 7, 1, 8, 2, 8, 1, 8, 2, 8)],
+    "bitcount": [(2000 + i, 900 + i) for i in (9, 7, 5, 3, 1, 8, 6, 4, 2, 0)],
+})
+
+
+def test_load_csv():
+    data = load_statcounters_csv(io.StringIO(BASELINE))
+    assert list(data.keys()) == ["qsort", "bitcount"]
+    assert list(data["qsort"].keys()) == ["cycles", "instructions", "dcache_read_miss"]
+    assert len(data["qsort"]["cycles"]) == 10
+    assert data["bitcount"]["instructions"][:3] == [900.0, 902.0, 904.0]
+
+
+def test_summary():
+    s = CounterSummary([5, 1, 4, 2, 3])
+    assert s.median == 3
+    assert s.q1 == 2 and s.q3 == 4
+    assert s.iqr == 2
+    assert s.ci_low == 1 and s.ci_high == 5
+    s = CounterSummary(range(1, 101))
+    assert s.median == 50.5
+    assert s.ci_low < s.median < s.ci_high
+    assert (s.ci_low, s.ci_high) == (40, 61)
+
+
+def test_mann_whitney():
+    # identical samples -> not significant
+    assert mann_whitney_u_test([1, 1, 1], [1, 1, 1]) == 1.0
+    assert mann_whitney_u_test([1, 2, 3, 4], [1, 2, 3, 4]) > 0.5
+    # completely separated samples -> significant
+    assert mann_whitney_u_test(list(range(10)), list(range(100, 110))) < 0.001
+    # symmetric
+    assert mann_whitney_u_test([1, 5, 7], [2, 3, 9, 10]) == mann_whitney_u_test([2, 3, 9, 10], [1, 5, 7])
+
+
+def test_compare():
+    comparisons = compare_statcounters(load_statcounters_csv(io.StringIO(BASELINE)),
+                                       load_statcounters_csv(io.StringIO(CURRENT)))
+    by_name = {(c.benchmark, c.counter): c for c in comparisons}
+    qsort_cycles = by_name[("qsort", "cycles")]
+    assert 0.09 < qsort_cycles.relative_change < 0.11
+    assert qsort_cycles.is_regression(alpha=0.05, threshold=0.01)
+    # A 10% regression is not reported if the threshold is higher:
+    assert not qsort_cycles.is_regression(alpha=0.05, threshold=0.2)
+    assert not by_name[("qsort", "instructions")].is_significant(0.05)
+    assert not by_name[("bitcount", "cycles")].is_regression(alpha=0.05, threshold=0.01)
+    assert not by_name[("bitcount", "instructions")].is_regression(alpha=0.05, threshold=0.01)
+
+
+def test_exit_status():
+    with tempfile.TemporaryDirectory() as td:
+        baseline = Path(td, "baseline.csv")
+        baseline.write_text(BASELINE)
+        current = Path(td, "current.csv")
+        current.write_text(CURRENT)
+        assert analyse_statcounters(current, baseline)
+        assert not analyse_statcounters(baseline, baseline)
+        assert not analyse_statcounters(current)  # no baseline -> only a summary
+        assert statcounters_main([str(current), "--baseline", str(baseline)]) == 1
+        assert statcounters_main([str(current), "--baseline", str(baseline), "--counters", "instructions"]) == 0
+        assert statcounters_main([str(current), "--baseline", str(baseline), "--threshold", "50"]) == 0
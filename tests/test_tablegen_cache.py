@@ -0,0 +1,75 @@
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.llvm import BuildLLVMBase
+
+TABLEGEN_SOURCE_DIRS = ["llvm/cmake", "llvm/utils/TableGen", "llvm/lib/TableGen", "llvm/lib/Support",
+                        "llvm/lib/Demangle", "llvm/include/llvm/TableGen", "llvm/include/llvm/Support",
+                        "llvm/include/llvm/ADT", "llvm/include/llvm/Demangle", "llvm/include/llvm/Config",
+                        "llvm/include/llvm-c", "clang/utils/TableGen"]
+
+
+class FakeLLVM(object):
+    """Provides the attributes of BuildLLVMBase that _tablegen_cache_key() uses"""
+    _tablegen_cache_key = BuildLLVMBase._tablegen_cache_key
+
+    def __init__(self, source_dir: Path, included_projects):
+        self.llvm_source_dir = source_dir / "llvm"
+        self.clang_source_dir = source_dir / "clang"
+        self.included_projects = included_projects
+
+    def info(self, *args):
+        pass
+
+
+def _git(cwd: Path, *args):
+    subprocess.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+                          cwd=str(cwd), stdout=subprocess.DEVNULL)
+
+
+def _commit(repo: Path, path: str, contents: str):
+    Path(repo, path).write_text(contents)
+    _git(repo, "add", path)
+    _git(repo, "commit", "-q", "-m", "change " + path)
+
+
+def test_tablegen_cache_key():
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = Path(tmp)
+        for d in TABLEGEN_SOURCE_DIRS + ["llvm/lib/CodeGen"]:
+            Path(repo, d).mkdir(parents=True)
+            Path(repo, d, "file.txt").write_text(d)
+        _git(repo, "init", "-q")
+        _git(repo, "add", ".")
+        _git(repo, "commit", "-q", "-m", "initial")
+        llvm = FakeLLVM(repo, ["llvm", "clang"])
+        key = llvm._tablegen_cache_key()
+        assert key is not None and len(key) == 16
+        # Changes that don't affect the tablegen binaries keep the key
+        _commit(repo, "llvm/lib/CodeGen/file.txt", "changed")
+        assert llvm._tablegen_cache_key() == key
+        # The key changes for all directories that the tablegen binaries are built from
+        seen = {key}
+        for d in TABLEGEN_SOURCE_DIRS:
+            _commit(repo, d + "/file.txt", "changed")
+            new_key = llvm._tablegen_cache_key()
+            assert new_key not in seen, d
+            seen.add(new_key)
+        # clang-tblgen sources are only used if clang is built
+        llvm_only = FakeLLVM(repo, ["llvm"])
+        llvm_only_key = llvm_only._tablegen_cache_key()
+        _commit(repo, "clang/utils/TableGen/file.txt", "changed again")
+        assert llvm_only._tablegen_cache_key() == llvm_only_key
+        # Uncommitted changes can't be described by the tree hashes -> no caching
+        Path(repo, "llvm/include/llvm/Config/file.txt").write_text("uncommitted")
+        assert llvm._tablegen_cache_key() is None
+        # Neither can a checkout that is missing one of the directories
+        _git(repo, "checkout", "-q", "--", ".")
+        assert llvm._tablegen_cache_key() is not None
+        _git(repo, "rm", "-q", "-r", "llvm/include/llvm-c")
+        _git(repo, "commit", "-q", "-m", "remove llvm-c")
+        assert llvm._tablegen_cache_key() is None
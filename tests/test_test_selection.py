@@ -0,0 +1,102 @@
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.testselection import TestSelectionState as SelectionState
+from pycheribuild.testselection import (kyua_test_source_dirs, lit_test_dependencies, parse_lit_show_tests,
+                                        plan_test_run, select_affected_tests)
+
+LIT_OUTPUT = """-- Available Tests --
+  libc++ :: std/algorithms/sort.pass.cpp
+  libc++ :: std/algorithms/find.pass.cpp
+  libc++ :: std/re/regex.pass.cpp
+"""
+
+
+def test_select_lit_tests():
+    deps = lit_test_dependencies(parse_lit_show_tests(LIT_OUTPUT))
+    assert deps["std/re/regex.pass.cpp"] == ["test/std/re"]
+    assert select_affected_tests(deps, ["test/std/re/regex.pass.cpp"]) == ["std/re/regex.pass.cpp"]
+    assert select_affected_tests(deps, ["test/std/algorithms/sort.pass.cpp"]) == [
+        "std/algorithms/find.pass.cpp", "std/algorithms/sort.pass.cpp"]
+    assert select_affected_tests(deps, []) == []
+    # Changes to the library itself could affect every test
+    assert select_affected_tests(deps, ["test/std/re/regex.pass.cpp", "include/vector"]) is None
+
+
+def test_kyua_test_source_dirs():
+    with tempfile.TemporaryDirectory() as src:
+        for d in ("lib/libc/tests/string", "bin/ls/tests", "tests/sys/kern"):
+            Path(src, d).mkdir(parents=True)
+        assert kyua_test_source_dirs("lib/libc/string", Path(src)) == ["lib/libc/tests/string", "lib/libc"]
+        assert kyua_test_source_dirs("bin/ls", Path(src)) == ["bin/ls/tests", "bin/ls"]
+        assert kyua_test_source_dirs("sys/kern", Path(src)) == ["tests/sys/kern"]
+        assert kyua_test_source_dirs("usr.bin/missing", Path(src)) == []
+
+
+def _git(cwd, *args):
+    subprocess.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+                          cwd=str(cwd), stdout=subprocess.DEVNULL)
+
+
+def test_plan_test_run():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp, "src")
+        (src / "test/a").mkdir(parents=True)
+        (src / "test/b").mkdir(parents=True)
+        (src / "test/a/one.pass.cpp").write_text("1")
+        (src / "test/b/two.pass.cpp").write_text("2")
+        _git(src, "init", "-q")
+        _git(src, "add", ".")
+        _git(src, "commit", "-q", "-m", "initial")
+        deps = lit_test_dependencies(["a/one.pass.cpp", "b/two.pass.cpp"])
+        state = SelectionState(Path(tmp, "state.json"))
+        plan = plan_test_run(state, src, deps, full_run_interval=3)
+        assert plan.run_all and plan.reason == "no previous passing test run"
+        plan.record_success()
+        # No changes -> nothing to run
+        state = SelectionState(Path(tmp, "state.json"))
+        assert state.last_green_revision == plan.revision
+        plan = plan_test_run(state, src, deps, full_run_interval=3)
+        assert plan.tests == []
+        plan.record_success()
+        # Uncommitted and committed changes are both considered
+        (src / "test/b/two.pass.cpp").write_text("changed")
+        plan = plan_test_run(SelectionState(Path(tmp, "state.json")), src, deps, full_run_interval=3)
+        assert plan.tests == ["b/two.pass.cpp"]
+        # A failed run does not update the last passing revision
+        junit = Path(tmp, "results.xml")
+        junit.write_text('<testsuite><testcase name="two"><failure/></testcase></testsuite>')
+        plan.record_success(junit)
+        assert SelectionState(Path(tmp, "state.json")).runs_since_full_run == 1
+        # Every third run is a full run
+        junit.write_text('<testsuite><testcase name="two"/></testsuite>')
+        plan.record_success(junit)
+        plan = plan_test_run(SelectionState(Path(tmp, "state.json")), src, deps, full_run_interval=3)
+        assert plan.run_all and plan.reason.startswith("periodic full run")
+
+
+def test_plan_test_run_subdirectory():
+    # libc++ is a subdirectory of llvm-project: compiler changes must not be ignored
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = Path(tmp, "llvm-project")
+        src = repo / "libcxx"
+        (src / "test/a").mkdir(parents=True)
+        (repo / "clang").mkdir()
+        (src / "test/a/one.pass.cpp").write_text("1")
+        (repo / "clang/CodeGen.cpp").write_text("codegen")
+        _git(repo, "init", "-q")
+        _git(repo, "add", ".")
+        _git(repo, "commit", "-q", "-m", "initial")
+        deps = lit_test_dependencies(["a/one.pass.cpp"])
+        plan = plan_test_run(SelectionState(Path(tmp, "state.json")), src, deps, full_run_interval=0)
+        plan.record_success()
+        (src / "test/a/one.pass.cpp").write_text("changed")
+        plan = plan_test_run(SelectionState(Path(tmp, "state.json")), src, deps, full_run_interval=0)
+        assert plan.tests == ["a/one.pass.cpp"]
+        (repo / "clang/CodeGen.cpp").write_text("changed")
+        plan = plan_test_run(SelectionState(Path(tmp, "state.json")), src, deps, full_run_interval=0)
+        assert plan.run_all
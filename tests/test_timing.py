@@ -0,0 +1,88 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.timing import BuildTimeline, RusagePopen
+
+
+def _run(timeline: BuildTimeline, cmdline):
+    with timeline.measure_subprocess(cmdline) as timing_info:
+        with RusagePopen(cmdline) as process:
+            timing_info["process"] = process
+            process.wait()
+
+
+def test_disabled_timeline_records_nothing():
+    timeline = BuildTimeline()
+    with timeline.measure("foo", BuildTimeline.TARGET):
+        _run(timeline, [sys.executable, "-c", "pass"])
+    assert timeline.events == []
+    assert timeline.summary_table() == "No timing information was recorded."
+
+
+def test_subprocess_rusage():
+    timeline = BuildTimeline()
+    timeline.enabled = True
+    # allocate ~64MB in the child to check that we get the peak RSS of the child and not our own
+    with timeline.measure("foo", BuildTimeline.TARGET):
+        with timeline.measure("compile", BuildTimeline.PHASE, target="foo"):
+            _run(timeline, [sys.executable, "-c", "x = bytearray(64 * 1024 * 1024); x[::4096] = b'1' * len(x[::4096])"])
+    subprocess_event, phase, target = timeline.events
+    assert subprocess_event.category == BuildTimeline.SUBPROCESS
+    assert subprocess_event.name == Path(sys.executable).name
+    assert subprocess_event.args["returncode"] == 0
+    assert subprocess_event.max_rss >= 64 * 1024
+    assert subprocess_event.user + subprocess_event.sys > 0
+    assert target.contains(phase) and phase.contains(subprocess_event)
+    assert target.wall >= subprocess_event.wall
+
+    trace = timeline.chrome_trace()
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert [e["name"] for e in spans] == ["foo", "compile", subprocess_event.name]
+    assert spans[0]["ts"] <= spans[1]["ts"] <= spans[2]["ts"]
+    # the peak RSS of a span includes the subprocesses that ran inside it
+    assert spans[0]["args"]["max_rss_kib"] >= subprocess_event.max_rss
+    summary = timeline.summary_table()
+    assert "foo compile" in summary
+    assert "Slowest commands:" in summary
+
+
+def test_summary_orders_by_start_time():
+    timeline = BuildTimeline()
+    timeline.enabled = True
+    for name in ("llvm", "cheribsd", "disk-image"):
+        with timeline.measure(name, BuildTimeline.TARGET):
+            time.sleep(0.001)
+    lines = timeline.summary_table().splitlines()
+    assert [line.split()[0] for line in lines[1:]] == ["llvm", "cheribsd", "disk-image"]
+
+
+def test_rusage_popen_returncode():
+    with RusagePopen([sys.executable, "-c", "import sys; sys.exit(3)"]) as process:
+        assert process.wait() == 3
+    assert process.rusage is not None
+    with RusagePopen([sys.executable, "-c", "import os, signal; os.kill(os.getpid(), signal.SIGTERM)"]) as process:
+        assert process.wait() == -15
+    # communicate() also reaps the child through wait()
+    with RusagePopen([sys.executable, "-c", "print('hello')"], stdout=subprocess.PIPE) as process:
+        assert process.communicate()[0] == b"hello\n"
+    assert process.returncode == 0 and process.rusage is not None
+
+
+def test_rusage_popen_already_reaped():
+    # If the child was reaped by poll() the exact numbers are not available and the RUSAGE_CHILDREN delta is used
+    timeline = BuildTimeline()
+    timeline.enabled = True
+    cmdline = [sys.executable, "-c", "pass"]
+    with timeline.measure_subprocess(cmdline) as timing_info:
+        with RusagePopen(cmdline) as process:
+            timing_info["process"] = process
+            while process.poll() is None:
+                time.sleep(0.01)
+            assert process.wait() == 0
+    assert process.rusage is None
+    assert timeline.events[0].max_rss is None
+    assert timeline.events[0].args["returncode"] == 0